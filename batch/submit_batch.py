@@ -0,0 +1,225 @@
+"""
+# Purpose     : Submit Sentieon jobs with a Python scheduler
+# Descriptions:
+#  - Replaces the polling loop of submit_batch.sh
+#  - Each job JSON is the base JSON updated with one row of the TSV (column headers are used as keys)
+#  - Runner processes are started as soon as a slot is free and finished jobs are detected
+#    from their exit events (no fixed sleeps)
+#  - Jobs are run in priority order (optional PRIORITY column, higher first, then TSV order)
+#  - With --adaptive, the number of slots grows after successful jobs and shrinks after failures
+#    between --min and --max
+#  - Exit code, start/end time and duration of each job are written in the results file
+#
+# Start date  : Oct 17, 2026
+# Last update : Oct 17, 2026
+"""
+
+__author__ 		= "Jong Cheol Jeong"
+__copyright__ 	= "Copyright 2018, UK Cancer Research Informatics"
+__version__ 	= "1.0.0"
+__maintainer__ 	= "Jong Cheol Jeong"
+__email__ 		= "jjeong@kcr.uky.edu"
+
+
+import subprocess
+import threading
+import argparse
+import heapq
+import json
+import time
+import sys
+import csv
+from collections import OrderedDict
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+PRIORITY = 'PRIORITY'
+
+
+"""
+#------------------------------------------------------------------------------
+# Read base JSON and TSV and build the list of jobs
+# - returns [(priority, index, job)] where job is an OrderedDict
+#------------------------------------------------------------------------------
+"""
+def readJobs(baseJson, batchTsv, priorityColumn=PRIORITY):
+    with open(baseJson) as f:
+        base = json.load(f, object_pairs_hook=OrderedDict)
+
+    jobs = []
+    with open(batchTsv) as f:
+        reader = csv.reader(f, delimiter='\t')
+        header = next(reader)
+        for idx, line in enumerate(reader):
+            if len(line) == 0 or all([not col.strip() for col in line]):
+                continue
+
+            assert (len(line) <= len(header)), "Line {} of {} has more columns than its header\n".format(idx + 2, batchTsv)
+
+            job = OrderedDict(base)
+            priority = 0.0
+            for key, value in zip(header, line):
+                if key == priorityColumn:
+                    priority = float(value) if value.strip() else 0.0
+                else:
+                    job[key] = value
+            jobs.append((priority, idx, job))
+
+    return jobs
+
+
+"""
+#------------------------------------------------------------------------------
+# Number of slots adjusted by job results (additive increase, multiplicative decrease)
+#------------------------------------------------------------------------------
+"""
+class Slots(object):
+
+    def __init__(self, start=2, minimum=1, maximum=2, adaptive=False, step=2):
+        self.limit = max(minimum, min(start, maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.adaptive = adaptive
+        self.step = step
+        self.success = 0
+
+    def done(self, ok):
+        if not self.adaptive:
+            return self.limit
+
+        if ok:
+            self.success += 1
+            if self.success >= self.step:
+                self.success = 0
+                self.limit = min(self.maximum, self.limit + 1)
+        else:
+            self.success = 0
+            self.limit = max(self.minimum, self.limit // 2)
+
+        return self.limit
+
+
+"""
+#------------------------------------------------------------------------------
+# Scheduler
+# :: Example Code ::
+# sched = Scheduler(python='/usr/bin/python', runner='/sentieon-google-genomics/runner/sentieon_runner.py', slots=Slots(start=4, maximum=16, adaptive=True))
+# sched.run(readJobs('germline.json', 'germline_bam.tsv'), resultsPath='results.tsv')
+#------------------------------------------------------------------------------
+"""
+class Scheduler(object):
+
+    def __init__(self, python=None, runner=None, slots=None, command=None):
+        if slots is None:
+            slots = Slots()
+        if command is None:
+            command = [python, runner, '/dev/stdin']
+
+        self.command = command
+        self.slots = slots
+        self.events = queue.Queue()
+        self.running = {}
+
+    def start(self, idx, job):
+        proc = subprocess.Popen(self.command, stdin=subprocess.PIPE)
+        proc.stdin.write(json.dumps(job).encode('utf-8'))
+        proc.stdin.close()
+
+        started = time.time()
+        self.running[idx] = (proc, job, started)
+
+        def wait():
+            code = proc.wait()
+            self.events.put((idx, code, time.time()))
+
+        thread = threading.Thread(target=wait)
+        thread.daemon = True
+        thread.start()
+
+        print("[{}] started job {} (PID {}, {} running)".format(time.strftime('%H:%M:%S'), idx, proc.pid, len(self.running)))
+
+    def run(self, jobs, resultsPath=None):
+        heap = [(-priority, idx, job) for priority, idx, job in jobs]
+        heapq.heapify(heap)
+        priorities = dict([(idx, priority) for priority, idx, job in jobs])
+        results = []
+
+        out = None
+        if resultsPath is not None:
+            out = open(resultsPath, 'w')
+            out.write('JOB\tPRIORITY\tEXIT_CODE\tSTART\tEND\tDURATION_SEC\tJOB_JSON\n')
+
+        try:
+            while len(heap) > 0 or len(self.running) > 0:
+                #-- fill free slots
+                while len(heap) > 0 and len(self.running) < self.slots.limit:
+                    negPriority, idx, job = heapq.heappop(heap)
+                    try:
+                        self.start(idx, job)
+                    except OSError as err:
+                        now = time.time()
+                        self.events.put((idx, None, now))
+                        self.running[idx] = (None, job, now)
+                        print("[{}] cannot start job {}: {}".format(time.strftime('%H:%M:%S'), idx, err))
+
+                #-- block until a runner exits
+                idx, code, ended = self.events.get()
+                proc, job, started = self.running.pop(idx)
+                ok = (code == 0)
+                limit = self.slots.done(ok)
+
+                res = (idx, code, started, ended)
+                results.append(res)
+                print("[{}] finished job {} with exit code {} after {:.0f} sec (slots={})".format(time.strftime('%H:%M:%S'), idx, code, ended - started, limit))
+
+                if out is not None:
+                    cmt = "{}\t{}\t{}\t{}\t{}\t{:.1f}\t{}\n".format(idx, priorities[idx], code, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(started)),
+                                                                    time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ended)), ended - started, json.dumps(job))
+                    out.write(cmt)
+                    out.flush()
+        finally:
+            if out is not None:
+                out.close()
+
+        return results
+
+
+"""
+#------------------------------------------------------------------------------
+# :: USAGE ::
+# >> python submit_batch.py germline.json germline_bam.tsv --python /my/local/python/path/python \
+#    --runner /local/sentieon/template/sentieon-google-genomics/runner/sentieon_runner.py -n 4 --adaptive --max 16
+#------------------------------------------------------------------------------
+"""
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("base_json", help='base JSON of jobs (e.g., germline.json)')
+    parser.add_argument("batch_tsv", help='TSV of jobs - column headers are used as JSON keys (e.g., germline_bam.tsv)')
+    parser.add_argument("--python", help='python path to run the runner [Default=current python]', action='store', default=sys.executable)
+    parser.add_argument("--runner", help='sentieon_runner.py in sentieon-google-genomics', action='store', required=True)
+    parser.add_argument("-n", "--concurrent", help='number of runners at the same time [Default=2]', type=int, default=2)
+    parser.add_argument("--adaptive", help='grow slots after successful jobs and shrink after failures', action='store_true')
+    parser.add_argument("--min", help='minimum number of slots with --adaptive [Default=1]', type=int, default=1)
+    parser.add_argument("--max", help='maximum number of slots with --adaptive [Default=--concurrent]', type=int, default=None)
+    parser.add_argument("--priority", help='TSV column used as priority, higher first [Default={}]'.format(PRIORITY), action='store', default=PRIORITY)
+    parser.add_argument("-o", "--results", help='results file [Default=<batch_tsv>.results.tsv]', action='store', default=None)
+
+    args = parser.parse_args()
+
+    maximum = args.max if args.max is not None else args.concurrent
+    if not args.adaptive:
+        maximum = args.concurrent
+    resultsPath = args.results if args.results is not None else "{}.results.tsv".format(args.batch_tsv)
+
+    jobs = readJobs(args.base_json, args.batch_tsv, args.priority)
+    slots = Slots(start=args.concurrent, minimum=args.min, maximum=maximum, adaptive=args.adaptive)
+    sched = Scheduler(python=args.python, runner=args.runner, slots=slots)
+    results = sched.run(jobs, resultsPath=resultsPath)
+
+    nFail = len([res for res in results if res[1] != 0])
+    print("\n{} jobs finished, {} failed. Results are written in {}".format(len(results), nFail, resultsPath))
+    sys.exit(1 if nFail > 0 else 0)
@@ -0,0 +1,383 @@
+"""
+# Purpose     : Native BAI index builder for coordinate-sorted BAM files
+# Descriptions:
+#  - Replaces Picard BuildBamIndex (JVM with a 16 GB heap) by a single pass over the BAM
+#  - Blocks are decompressed in parallel (bgzf.BgzfReader) and only the fixed fields and CIGAR
+#    of each record are decoded
+#  - Writes a standard BAI (bins, 16 kb linear index, pseudo-bin 37450 with the offsets and
+#    mapped/unmapped counts of each reference, count of reads without coordinates) built the same
+#    way as htslib, so samtools/Picard/IGV read it
+#  - Stream mode: the BAM is read from stdin and can be copied to stdout as it is read
+#    (--tee), so a BAM is indexed while it is uploaded
+#  - Only depends on bgzf.py, so both files can be shipped to a small job (dsub stage 'NativeBamIndex')
+#
+# Start date  : Oct 17, 2026
+# Last update : Oct 17, 2026
+"""
+
+__author__ 		= "Jong Cheol Jeong"
+__copyright__ 	= "Copyright 2018, UK Cancer Research Informatics"
+__version__ 	= "1.0.0"
+__maintainer__ 	= "Jong Cheol Jeong"
+__email__ 		= "jjeong@kcr.uky.edu"
+
+
+import subprocess
+import argparse
+import tempfile
+import struct
+import sys
+import os
+import bgzf
+
+
+BAI_MAGIC = b'BAI\x01'
+PSEUDO_BIN = 37450
+MIN_SHIFT = 14
+N_LEVELS = 5
+#-- bins spanning less than this many compressed bytes are merged into their parent (as htslib)
+MIN_MARKER_DIST = 0x10000
+
+RECORD = struct.Struct('<iiBBHHHi')
+
+
+class BaiError(Exception):
+    pass
+
+
+"""
+#------------------------------------------------------------------------------
+# Bin of a 0-based [beg, end) region (SAM specification)
+#------------------------------------------------------------------------------
+"""
+def reg2bin(beg, end):
+    end -= 1
+    if beg >> 14 == end >> 14:
+        return ((1 << 15) - 1) // 7 + (beg >> 14)
+    if beg >> 17 == end >> 17:
+        return ((1 << 12) - 1) // 7 + (beg >> 17)
+    if beg >> 20 == end >> 20:
+        return ((1 << 9) - 1) // 7 + (beg >> 20)
+    if beg >> 23 == end >> 23:
+        return ((1 << 6) - 1) // 7 + (beg >> 23)
+    if beg >> 26 == end >> 26:
+        return ((1 << 3) - 1) // 7 + (beg >> 26)
+    return 0
+
+
+def binLevel(b):
+    level = 0
+    first = 0
+    while level < N_LEVELS:
+        nextFirst = first + (1 << (3 * level))
+        if b < nextFirst:
+            return level
+        first = nextFirst
+        level += 1
+    return N_LEVELS
+
+
+def binParent(b):
+    return (b - 1) >> 3
+
+
+"""
+#------------------------------------------------------------------------------
+# Read the BAM header from a BgzfReader; returns the number of references
+#------------------------------------------------------------------------------
+"""
+def readHeader(reader):
+    if reader.read(4) != b'BAM\x01':
+        raise bgzf.BgzfError("not a BAM file")
+
+    lText = struct.unpack('<i', reader.read(4))[0]
+    reader.read(lText)
+    nRef = struct.unpack('<i', reader.read(4))[0]
+    for i in range(nRef):
+        lName = struct.unpack('<i', reader.read(4))[0]
+        reader.read(lName + 4)
+    return nRef
+
+
+"""
+#------------------------------------------------------------------------------
+# BAI builder (same rules as hts_idx_push/hts_idx_finish of htslib)
+# :: Example Code ::
+# builder = BaiBuilder(nRef, reader.tell())
+# builder.push(refID, beg, end, reader.tell(), mapped)      # after each record
+# builder.finish()
+# builder.write(open('x.bam.bai', 'wb'))
+#------------------------------------------------------------------------------
+"""
+class BaiBuilder(object):
+
+    def __init__(self, nRef, offset):
+        self.bins = [dict() for i in range(nRef)]       # bin -> [[beg, end], ...] (virtual offsets)
+        self.linear = [[] for i in range(nRef)]
+        self.meta = [None] * nRef                       # [first offset, last offset, mapped, unmapped]
+        self.noCoor = 0
+
+        self.lastOff = offset
+        self.lastTid = -1
+        self.lastCoor = -1
+        self.saveTid = -1
+        self.saveBin = None
+        self.saveOff = offset
+        self.offBeg = offset
+        self.nMapped = 0
+        self.nUnmapped = 0
+        self.started = False
+
+    def addChunk(self, tid, b, beg, end):
+        self.bins[tid].setdefault(b, []).append([beg, end])
+
+    def closeRef(self):
+        if self.saveTid < 0:
+            return
+        if self.saveBin is not None:
+            self.addChunk(self.saveTid, self.saveBin, self.saveOff, self.lastOff)
+        self.meta[self.saveTid] = [self.offBeg, self.lastOff, self.nMapped, self.nUnmapped]
+
+    #-- offset: virtual offset just after the record
+    def push(self, tid, beg, end, offset, mapped):
+        if tid < 0:
+            beg, end = -1, 0
+
+        if tid >= 0 and mapped:
+            lin = self.linear[tid]
+            first = max(beg, 0) >> MIN_SHIFT
+            last = (max(end, 1) - 1) >> MIN_SHIFT
+            if len(lin) <= last:
+                lin.extend([None] * (last + 1 - len(lin)))
+            for i in range(first, last + 1):
+                if lin[i] is None:
+                    lin[i] = self.lastOff
+
+        if tid != self.lastTid or not self.started:
+            if tid >= 0 and (tid < self.lastTid or self.noCoor > 0):
+                raise BaiError("BAM is not sorted by coordinate (reference {} after {})".format(tid, self.lastTid))
+            if tid >= 0 and self.meta[tid] is not None:
+                raise BaiError("reads of reference {} are not contiguous".format(tid))
+            self.closeRef()
+            self.saveOff = self.offBeg = self.lastOff
+            self.saveTid = tid
+            self.saveBin = None
+            self.nMapped = self.nUnmapped = 0
+            self.lastTid = tid
+            self.lastCoor = -1
+            self.started = True
+        elif tid >= 0 and self.lastCoor > beg:
+            raise BaiError("BAM is not sorted by coordinate (position {} after {})".format(beg, self.lastCoor))
+
+        if tid >= 0:
+            b = reg2bin(beg, end)
+            if self.saveBin != b:
+                if self.saveBin is not None:
+                    self.addChunk(tid, self.saveBin, self.saveOff, self.lastOff)
+                self.saveOff = self.lastOff
+                self.saveBin = b
+            if mapped:
+                self.nMapped += 1
+            else:
+                self.nUnmapped += 1
+        else:
+            self.noCoor += 1
+
+        if offset < self.lastOff:
+            raise BaiError("virtual offsets are not increasing")
+        self.lastOff = offset
+        self.lastCoor = beg
+
+    def finish(self):
+        self.closeRef()
+        self.saveTid = -1
+
+        for tid in range(len(self.bins)):
+            self.compress(self.bins[tid])
+
+            #-- empty windows: offset of the reference start before the first read, else the previous window
+            lin = self.linear[tid]
+            prev = self.meta[tid][0] if self.meta[tid] is not None else 0
+            for i in range(len(lin)):
+                if lin[i] is None:
+                    lin[i] = prev
+                prev = lin[i]
+
+    def compress(self, bins):
+        #-- small bins are merged into their parent if it has chunks already, deepest level first
+        for level in range(N_LEVELS, 0, -1):
+            for b in sorted([b for b in bins if binLevel(b) == level]):
+                chunks = sorted(bins[b])
+                if binParent(b) in bins and (chunks[-1][1] >> 16) - (chunks[0][0] >> 16) < MIN_MARKER_DIST:
+                    bins[binParent(b)].extend(chunks)
+                    del bins[b]
+
+        #-- chunks starting in the block where the previous chunk ends are merged
+        for b in bins:
+            chunks = sorted(bins[b])
+            merged = [chunks[0]]
+            for beg, end in chunks[1:]:
+                if merged[-1][1] >> 16 >= beg >> 16:
+                    merged[-1][1] = max(merged[-1][1], end)
+                else:
+                    merged.append([beg, end])
+            bins[b] = merged
+
+    def write(self, f):
+        f.write(BAI_MAGIC)
+        f.write(struct.pack('<i', len(self.bins)))
+        for tid in range(len(self.bins)):
+            bins = self.bins[tid]
+            meta = self.meta[tid]
+            f.write(struct.pack('<i', len(bins) + (1 if meta is not None else 0)))
+            for b in sorted(bins):
+                f.write(struct.pack('<Ii', b, len(bins[b])))
+                for beg, end in bins[b]:
+                    f.write(struct.pack('<QQ', beg, end))
+            if meta is not None:
+                f.write(struct.pack('<IiQQQQ', PSEUDO_BIN, 2, meta[0], meta[1], meta[2], meta[3]))
+
+            lin = self.linear[tid]
+            f.write(struct.pack('<i', len(lin)))
+            if len(lin) > 0:
+                f.write(struct.pack('<{}Q'.format(len(lin)), *lin))
+        f.write(struct.pack('<Q', self.noCoor))
+
+
+"""
+#------------------------------------------------------------------------------
+# Reference, start, end (from the CIGAR) and mapped flag of a record without its block_size
+# - offset : start of the record in 'rec'
+#------------------------------------------------------------------------------
+"""
+def recordSpan(rec, offset=0):
+    refID, pos, lrn, mapq, bin_, nc, flag, lseq = RECORD.unpack_from(rec, offset)
+    mapped = not (flag & 0x4)
+    end = pos + 1
+    if mapped and nc > 0:
+        cigar = struct.unpack_from('<{}I'.format(nc), rec, offset + 32 + lrn)
+        refLen = sum([op >> 4 for op in cigar if (op & 0xf) in (0, 2, 3, 7, 8)])
+        if refLen > 0:
+            end = pos + refLen
+    return refID, pos, end, mapped
+
+
+"""
+#------------------------------------------------------------------------------
+# Index a BAM stream
+# :: Example Code ::
+# with open('x.bam', 'rb') as f, open('x.bam.bai', 'wb') as fo:
+#     res = indexBam(f, threads=8).write(fo)
+#
+# - threads : decompression threads
+# - tee     : stream receiving the BAM as it is read (raw blocks, unchanged)
+# Returns the finished BaiBuilder
+#------------------------------------------------------------------------------
+"""
+def indexBam(f, threads=bgzf.THREADS, tee=None):
+    reader = bgzf.BgzfReader(f, threads=threads, tee=tee, closeFile=False)
+    try:
+        nRef = readHeader(reader)
+        builder = BaiBuilder(nRef, reader.tell())
+
+        while True:
+            head = reader.read(4)
+            if len(head) == 0:
+                break
+            if len(head) < 4:
+                raise BaiError("truncated BAM record")
+            size = struct.unpack('<i', head)[0]
+            rec = reader.read(size)
+            if len(rec) < size:
+                raise BaiError("truncated BAM record")
+
+            refID, pos, end, mapped = recordSpan(rec)
+            builder.push(refID, pos, end, reader.tell(), mapped)
+
+        #-- copy what is left (nothing after the EOF block for a valid BAM)
+        if tee is not None:
+            while True:
+                raw = bgzf.readRaw(f)
+                if not raw:
+                    break
+                tee.write(raw)
+    finally:
+        reader.close()
+
+    builder.finish()
+    return builder
+
+
+"""
+#------------------------------------------------------------------------------
+# Index a local file, gs:// object or stdin ('-') and write the index (local or gs://)
+#------------------------------------------------------------------------------
+"""
+def buildIndex(inPath, outPath=None, threads=bgzf.THREADS, tee=None, gsutil='gsutil'):
+    if outPath is None:
+        assert (inPath != '-'), "Output index must be given when reading stdin!!\nExample) -o example1_DNA.bam.bai\n"
+        outPath = "{}.bai".format(inPath)
+
+    proc = None
+    if inPath == '-':
+        f = sys.stdin.buffer
+    elif inPath.startswith('gs://'):
+        proc = subprocess.Popen([gsutil, '-q', 'cat', inPath], stdout=subprocess.PIPE)
+        f = proc.stdout
+    else:
+        f = open(inPath, 'rb')
+
+    try:
+        builder = indexBam(f, threads=threads, tee=tee)
+    finally:
+        if proc is not None:
+            proc.stdout.close()
+            proc.wait()
+        elif f is not sys.stdin.buffer:
+            f.close()
+
+    if proc is not None and proc.returncode != 0:
+        raise BaiError("'gsutil cat {}' failed".format(inPath))
+
+    if outPath.startswith('gs://'):
+        with tempfile.NamedTemporaryFile(suffix='.bai', delete=False) as fo:
+            builder.write(fo)
+        try:
+            subprocess.check_call([gsutil, '-q', 'cp', fo.name, outPath])
+        finally:
+            os.remove(fo.name)
+    else:
+        with open(outPath, 'wb') as fo:
+            builder.write(fo)
+
+    return outPath, builder
+
+
+"""
+#------------------------------------------------------------------------------
+# :: USAGE ::
+# >> python bamIndex.py example1_DNA.bam                          # writes example1_DNA.bam.bai
+# >> python bamIndex.py gs://b1/example1_DNA.bam -o gs://b1/example1_DNA.bam.bai -t 8
+# >> gsutil cat gs://b1/x.bam | python bamIndex.py - -o x.bam.bai --tee | gsutil cp - gs://b2/x.bam
+#------------------------------------------------------------------------------
+"""
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", help='coordinate-sorted BAM (local, gs:// or "-" for stdin)')
+    parser.add_argument("-o", "--output", help='output index [Default=<input>.bai]', action='store', default=None)
+    parser.add_argument("-t", "--threads", help='decompression threads [Default={}]'.format(bgzf.THREADS), type=int, default=bgzf.THREADS)
+    parser.add_argument("--tee", help='copy the input BAM to stdout while indexing', action='store_true')
+    parser.add_argument("--gsutil", help='gsutil executable [Default=gsutil]', action='store', default='gsutil')
+
+    args = parser.parse_args()
+
+    tee = sys.stdout.buffer if args.tee else None
+    assert (not (args.tee and args.output is None)), "Output index must be given with --tee!!\nExample) -o example1_DNA.bam.bai\n"
+
+    outPath, builder = buildIndex(args.input, args.output, threads=args.threads, tee=tee, gsutil=args.gsutil)
+    if tee is not None:
+        tee.flush()
+
+    nMapped = sum([meta[2] for meta in builder.meta if meta is not None])
+    nUnmapped = sum([meta[3] for meta in builder.meta if meta is not None]) + builder.noCoor
+    sys.stderr.write("{}\t{} mapped\t{} unmapped\n".format(outPath, nMapped, nUnmapped))
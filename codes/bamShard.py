@@ -0,0 +1,397 @@
+"""
+# Purpose     : Scatter/gather of BAM files for sharded SortSam and FixMate
+# Descriptions:
+#  - scatter : splits a BAM into N shard BAMs with the same header
+#       coord - by coordinate range (the genome is cut in N equal lengths; reads without
+#               coordinates go to the last shard), for SortSam
+#       name  - by a hash of the read name (mates stay in the same shard, input order is kept), for FixMate
+#  - gather  : merges the processed shards into one BAM and its BAI (bamIndex.py)
+#       coord - shards are disjoint, ordered ranges: their compressed blocks are copied in shard order
+#               (only the header and EOF blocks are dropped) and the BAI is built in the same pass
+#       name  - k-way merge in the order of the SO header tag (coordinate or queryname, as Picard
+#               compares records; other orders are concatenated)
+#  - Records are copied byte-for-byte, so the merged BAM has the same records as a single-VM run
+#  - Only depends on bgzf.py and bamIndex.py, so the files can be shipped to small jobs
+#    (dsub stages 'ScatterBam'/'GatherBam', dsub.shardJobs)
+#
+# Start date  : Oct 17, 2026
+# Last update : Oct 17, 2026
+"""
+
+__author__ 		= "Jong Cheol Jeong"
+__copyright__ 	= "Copyright 2018, UK Cancer Research Informatics"
+__version__ 	= "1.0.0"
+__maintainer__ 	= "Jong Cheol Jeong"
+__email__ 		= "jjeong@kcr.uky.edu"
+
+
+import argparse
+import bisect
+import heapq
+import struct
+import zlib
+import os
+import bgzf
+import bamIndex
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+MODES = ['coord', 'name']
+PREFIX = 'shard'
+
+RECORD = struct.Struct('<iiiBBHHHiiii')
+
+
+"""
+#------------------------------------------------------------------------------
+# Read the BAM header from a BgzfReader
+# Returns (header bytes as stored, header text, [(reference name, length), ...])
+#------------------------------------------------------------------------------
+"""
+def readHeader(reader):
+    magic = reader.read(4)
+    if magic != b'BAM\x01':
+        raise bgzf.BgzfError("not a BAM file")
+
+    parts = [magic]
+    lText = reader.read(4)
+    text = reader.read(struct.unpack('<i', lText)[0])
+    nRef = reader.read(4)
+    parts.extend([lText, text, nRef])
+
+    refs = []
+    for i in range(struct.unpack('<i', nRef)[0]):
+        lName = reader.read(4)
+        name = reader.read(struct.unpack('<i', lName)[0])
+        length = reader.read(4)
+        parts.extend([lName, name, length])
+        refs.append((name.rstrip(b'\x00').decode('utf-8'), struct.unpack('<i', length)[0]))
+
+    return b''.join(parts), text.decode('utf-8', 'replace'), refs
+
+
+#-- raw records (with their block_size) of a BgzfReader positioned after the header
+def readRecords(reader):
+    while True:
+        head = reader.read(4)
+        if len(head) == 0:
+            return
+        size = struct.unpack('<i', head)[0]
+        rec = reader.read(size)
+        if len(rec) < size:
+            raise bgzf.BgzfError("truncated BAM record")
+        yield head + rec
+
+
+def sortOrder(text):
+    for line in text.split('\n'):
+        if line.startswith('@HD'):
+            for field in line.split('\t')[1:]:
+                if field.startswith('SO:'):
+                    return field[3:]
+    return 'unknown'
+
+
+def shardPath(outDir, i, prefix=PREFIX):
+    return "{}/{}.{}.bam".format(outDir, prefix, str(i).zfill(3))
+
+
+"""
+#------------------------------------------------------------------------------
+# Shard of a record
+#------------------------------------------------------------------------------
+"""
+def coordSharder(refs, n):
+    starts = [0]
+    for name, length in refs:
+        starts.append(starts[-1] + length)
+    step = starts[-1] / float(n)
+    bounds = [int(step * i) for i in range(1, n)]
+
+    def shard(rec):
+        refID, pos = struct.unpack_from('<ii', rec, 4)
+        if refID < 0:
+            return n - 1
+        return bisect.bisect_right(bounds, starts[refID] + max(pos, 0))
+
+    return shard
+
+
+def nameSharder(n):
+    def shard(rec):
+        lrn = rec[12]
+        return zlib.crc32(rec[36:36 + lrn - 1]) % n
+    return shard
+
+
+"""
+#------------------------------------------------------------------------------
+# Split a BAM into n shards
+# :: Example Code ::
+# paths = scatter('/local/x.bam', '/local/shards', n=16, mode='coord')
+#
+# - all n shards are written (header only when empty), named '<prefix>.000.bam', ...
+# Returns the shard paths and the number of records of each shard
+#------------------------------------------------------------------------------
+"""
+def scatter(inPath=None, outDir=None, n=None, mode='coord', prefix=PREFIX, threads=bgzf.THREADS, level=bgzf.LEVEL):
+    assert (not (inPath is None)), "Input BAM must be given!!\nExample) /local/x.bam\n"
+    assert (not (outDir is None)), "Output directory must be given!!\nExample) /local/shards\n"
+    assert (not (n is None) and n > 0), "The number of shards must be given!!\nExample) 16\n"
+    assert (mode in MODES), "Unknown mode '{}'!!\nAvailable modes) {}\n".format(mode, ', '.join(MODES))
+
+    try:
+        os.makedirs(outDir)
+    except OSError:
+        pass
+
+    reader = bgzf.BgzfReader(open(inPath, 'rb'), threads=threads)
+    header, text, refs = readHeader(reader)
+    shard = coordSharder(refs, n) if mode == 'coord' else nameSharder(n)
+
+    paths = [shardPath(outDir, i, prefix) for i in range(n)]
+    writers = [bgzf.BgzfWriter(open(path, 'wb'), level=level) for path in paths]
+    counts = [0] * n
+    for writer in writers:
+        writer.write(header)
+        writer.flush()
+
+    try:
+        for rec in readRecords(reader):
+            i = shard(rec)
+            writers[i].write(rec)
+            counts[i] += 1
+    finally:
+        reader.close()
+        for writer in writers:
+            writer.close()
+
+    return paths, counts
+
+
+"""
+#------------------------------------------------------------------------------
+# Merge keys (htsjdk SAMRecordCoordinateComparator / SAMRecordQueryNameComparator)
+#------------------------------------------------------------------------------
+"""
+def coordKey(rec):
+    size, refID, pos, lrn, mapq, bin_, nc, flag, lseq, nref, npos, tlen = RECORD.unpack_from(rec, 0)
+    name = rec[36:36 + lrn - 1]
+    return (refID if refID >= 0 else 0x7fffffff, pos, bool(flag & 0x10), name, flag, mapq, nref, npos, tlen)
+
+
+def nameKey(rec):
+    size, refID, pos, lrn, mapq, bin_, nc, flag, lseq, nref, npos, tlen = RECORD.unpack_from(rec, 0)
+    name = rec[36:36 + lrn - 1]
+    #-- first of pair before second, primary before secondary/supplementary
+    return (name, 0 if flag & 0x40 else 1, bool(flag & 0x10), bool(flag & 0x100), bool(flag & 0x800))
+
+
+def keyed(records, key):
+    for rec in records:
+        yield key(rec), rec
+
+
+"""
+#------------------------------------------------------------------------------
+# Length of the BAM header at the start of 'data', None if 'data' ends within the header
+#------------------------------------------------------------------------------
+"""
+def headerLength(data):
+    if len(data) < 8:
+        return None
+    pos = 8 + struct.unpack_from('<i', data, 4)[0]
+    if len(data) < pos + 4:
+        return None
+    nRef = struct.unpack_from('<i', data, pos)[0]
+    pos += 4
+    for i in range(nRef):
+        if len(data) < pos + 4:
+            return None
+        pos += 8 + struct.unpack_from('<i', data, pos)[0]
+    return pos if pos <= len(data) else None
+
+
+#-- (raw block, data) of a BGZF file; blocks are decompressed by 'pool' ahead of the caller
+def inflated(f, pool, readahead):
+    queue = deque()
+    for raw in bgzf.rawBlocks(f):
+        queue.append((raw, pool.submit(bgzf.inflate, raw)))
+        if len(queue) >= readahead:
+            raw, data = queue.popleft()
+            yield raw, data.result()
+    while len(queue) > 0:
+        raw, data = queue.popleft()
+        yield raw, data.result()
+
+
+#-- blocks of a shard after its header: the rest of the last header block is compressed again,
+#-- the following blocks are returned unchanged and empty (EOF) blocks are dropped
+def shardBlocks(f, pool, readahead, level):
+    head = b''
+    size = None
+    for raw, data in inflated(f, pool, readahead):
+        if size is None:
+            head += data
+            size = headerLength(head)
+            if size is None:
+                continue
+            for i in range(size, len(head), bgzf.BLOCK_DATA):
+                yield bgzf.deflate(head[i:i + bgzf.BLOCK_DATA], level), head[i:i + bgzf.BLOCK_DATA]
+        elif len(data) > 0:
+            yield raw, data
+    if size is None:
+        raise bgzf.BgzfError("truncated BAM header")
+
+
+"""
+#------------------------------------------------------------------------------
+# Concatenate coordinate range shards in shard order
+# - records are not decoded except the fields the BAI needs (reference, start, CIGAR, flag)
+# - the BAI is built from the offsets of the records in the output file
+# Returns (number of records, finished bamIndex.BaiBuilder or None)
+#------------------------------------------------------------------------------
+"""
+def concat(inPaths, outPath, header, nRef, index=True, threads=bgzf.THREADS, level=bgzf.LEVEL):
+    nRec = 0
+    builder = None
+    with open(outPath, 'wb') as out, ThreadPoolExecutor(max_workers=max(1, threads)) as pool:
+        for i in range(0, len(header), bgzf.BLOCK_DATA):
+            out.write(bgzf.deflate(header[i:i + bgzf.BLOCK_DATA], level))
+        coffset = out.tell()
+        if index:
+            builder = bamIndex.BaiBuilder(nRef, bgzf.makeVoffset(coffset, 0))
+
+        pending = b''
+        for path in inPaths:
+            with open(path, 'rb') as f:
+                for raw, data in shardBlocks(f, pool, 4 * max(1, threads), level):
+                    out.write(raw)
+                    after = coffset + len(raw)
+
+                    #-- records ending in this block; a record ending at the end of the block is
+                    #-- followed by the next block (virtual offset as BgzfReader.tell())
+                    buf = pending + data if pending else data
+                    base = len(pending)
+                    pos = 0
+                    while pos + 4 <= len(buf):
+                        end = pos + 4 + struct.unpack_from('<i', buf, pos)[0]
+                        if end > len(buf):
+                            break
+                        if builder is not None:
+                            refID, beg, stop, mapped = bamIndex.recordSpan(buf, pos + 4)
+                            voffset = bgzf.makeVoffset(after, 0) if end == len(buf) else bgzf.makeVoffset(coffset, end - base)
+                            builder.push(refID, beg, stop, voffset, mapped)
+                        nRec += 1
+                        pos = end
+                    pending = buf[pos:]
+                    coffset = after
+
+        if len(pending) > 0:
+            raise bgzf.BgzfError("truncated BAM record")
+        out.write(bgzf.EOF_BLOCK)
+
+    if builder is not None:
+        builder.finish()
+    return nRec, builder
+
+
+"""
+#------------------------------------------------------------------------------
+# Merge processed shards into one BAM and write its index
+# :: Example Code ::
+# gather(['/local/s.000.bam', '/local/s.001.bam'], '/local/x.sort.bam', indexPath='/local/x.sort.bam.bai', mode='coord')
+#
+# - the header of the first shard is used
+# - mode      : 'coord' concatenates the shards in the order of their names, 'name' merges them
+# - indexPath : written for coordinate sorted output when given
+# Returns the number of records
+#------------------------------------------------------------------------------
+"""
+def gather(inPaths=None, outPath=None, indexPath=None, mode='coord', threads=bgzf.THREADS, level=bgzf.LEVEL):
+    assert (not (inPaths is None) and len(inPaths) > 0), "List of shard BAMs must be given!!\nExample) ['/local/s.000.bam', '/local/s.001.bam']\n"
+    assert (not (outPath is None)), "Output BAM must be given!!\nExample) /local/x.sort.bam\n"
+    assert (mode in MODES), "Unknown mode '{}'!!\nAvailable modes) {}\n".format(mode, ', '.join(MODES))
+
+    inPaths = sorted(inPaths)
+    readers = [bgzf.BgzfReader(open(path, 'rb'), threads=1) for path in inPaths]
+    headers = [readHeader(reader) for reader in readers]
+    header, text, refs = headers[0]
+    for other in headers[1:]:
+        assert (other[2] == refs), "Shards have different references!!\n"
+
+    order = sortOrder(text)
+    if mode == 'coord':
+        for reader in readers:
+            reader.close()
+        nRec, builder = concat(inPaths, outPath, header, len(refs), index=(indexPath is not None and order == 'coordinate'), threads=threads, level=level)
+        if builder is not None:
+            with open(indexPath, 'wb') as f:
+                builder.write(f)
+        return nRec
+
+    if order == 'coordinate':
+        merged = heapq.merge(*[keyed(readRecords(reader), coordKey) for reader in readers])
+    elif order == 'queryname':
+        merged = heapq.merge(*[keyed(readRecords(reader), nameKey) for reader in readers])
+    else:
+        merged = ((None, rec) for reader in readers for rec in readRecords(reader))
+
+    nRec = 0
+    writer = bgzf.BgzfWriter(open(outPath, 'wb'), level=level, threads=threads)
+    try:
+        writer.write(header)
+        writer.flush()
+        for key, rec in merged:
+            writer.write(rec)
+            nRec += 1
+    finally:
+        writer.close()
+        for reader in readers:
+            reader.close()
+
+    if indexPath is not None and order == 'coordinate':
+        bamIndex.buildIndex(outPath, indexPath, threads=threads)
+
+    return nRec
+
+
+"""
+#------------------------------------------------------------------------------
+# :: USAGE ::
+# >> python bamShard.py scatter example1_DNA.bam /local/shards -n 16 -m coord
+# >> python bamShard.py gather example1_DNA.sort.bam /local/sorted/shard.*.bam --index example1_DNA.sort.bam.bai -m coord
+# >> python bamShard.py gather example1_DNA.fixmate.bam /local/fixed/shard.*.bam -m name
+#------------------------------------------------------------------------------
+"""
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    sp = commands.add_parser('scatter', help='split a BAM into shards')
+    sp.add_argument("input", help='input BAM')
+    sp.add_argument("outdir", help='output directory of the shards')
+    sp.add_argument("-n", "--shards", help='number of shards', type=int, required=True)
+    sp.add_argument("-m", "--mode", help='coord (SortSam) or name (FixMate) [Default=coord]', choices=MODES, default='coord')
+    sp.add_argument("--prefix", help='shard file prefix [Default={}]'.format(PREFIX), action='store', default=PREFIX)
+    sp.add_argument("-L", "--level", help='compression level [Default={}]'.format(bgzf.LEVEL), type=int, default=bgzf.LEVEL)
+
+    gp = commands.add_parser('gather', help='merge processed shards')
+    gp.add_argument("output", help='output BAM')
+    gp.add_argument("inputs", help='shard BAMs', nargs='+')
+    gp.add_argument("--index", help='output BAI (coordinate sorted shards)', action='store', default=None)
+    gp.add_argument("-m", "--mode", help='coord (shards of coordinate ranges, concatenated) or name (merged) [Default=coord]', choices=MODES, default='coord')
+    gp.add_argument("-t", "--threads", help='compression threads [Default={}]'.format(bgzf.THREADS), type=int, default=bgzf.THREADS)
+    gp.add_argument("-L", "--level", help='compression level [Default={}]'.format(bgzf.LEVEL), type=int, default=bgzf.LEVEL)
+
+    args = parser.parse_args()
+
+    if args.command == 'scatter':
+        paths, counts = scatter(args.input, args.outdir, n=args.shards, mode=args.mode, prefix=args.prefix, level=args.level)
+        for path, count in zip(paths, counts):
+            print("{}\t{}".format(path, count))
+    else:
+        nRec = gather(args.inputs, args.output, indexPath=args.index, mode=args.mode, threads=args.threads, level=args.level)
+        print("{}\t{}".format(args.output, nRec))
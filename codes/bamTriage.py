@@ -0,0 +1,371 @@
+"""
+# Purpose     : Header-only triage of BAM files
+# Descriptions:
+#  - Reads only the first BGZF blocks of each BAM (ranged reads, a few KB per object)
+#  - Parses @HD SO, @RG ID/PL/SM and the reference sequences (names and lengths),
+#    and checks if an index (.bai) exists
+#  - Reference build verdict from the chr1 length and naming (hg19, b37, hg38, GRCh38),
+#    and comparison of the sequences with the reference .fai (e.g., REF of germline.json)
+#  - Writes a per-sample stage plan: headAddPL only without PL, SortSam only when not
+#    coordinate sorted, BuildBamIndex only without index
+#    CleanSam and FixMate cannot be decided from the header (see validateBam.py)
+#  - BAMs are read in parallel
+#  - samplesOf() reads the SM of the read groups (used to group uBAMs by sample in runGenPipe.py)
+#
+# Start date  : Oct 17, 2026
+# Last update : Oct 17, 2026
+"""
+
+__author__ 		= "Jong Cheol Jeong"
+__copyright__ 	= "Copyright 2018, UK Cancer Research Informatics"
+__version__ 	= "1.0.0"
+__maintainer__ 	= "Jong Cheol Jeong"
+__email__ 		= "jjeong@kcr.uky.edu"
+
+
+import subprocess
+import argparse
+import json
+import os
+import bgzf
+import gsList
+import cmpFiles
+import reheader
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+NPROC = 32
+CHUNK = 16 * 1024
+
+#-- (name of the first sequence, its length) -> build
+BUILDS = OrderedDict([
+    (('chr1', 249250621), 'hg19'),
+    (('1', 249250621), 'b37'),
+    (('chr1', 248956422), 'hg38'),
+    (('1', 248956422), 'GRCh38'),
+])
+
+STAGE_ORDER = ['headAddPL', 'SortSam', 'BuildBamIndex']
+
+
+"""
+#------------------------------------------------------------------------------
+# File-like reader fetching a file in ranges as they are needed
+# - gs:// objects are read with 'gsutil cat -r <start>-<end>'
+#------------------------------------------------------------------------------
+"""
+class RangeReader(object):
+
+    def __init__(self, path, chunk=CHUNK, gsutil='gsutil'):
+        self.path = path
+        self.chunk = chunk
+        self.gsutil = gsutil
+        self.buf = b''
+        self.pos = 0
+        self.fetched = 0
+        self.eof = False
+
+    def fetch(self, n):
+        if self.path.startswith('gs://'):
+            end = self.fetched + n - 1
+            data = subprocess.check_output([self.gsutil, '-q', 'cat', '-r', '{}-{}'.format(self.fetched, end), self.path], stderr=subprocess.PIPE)
+        else:
+            with open(self.path, 'rb') as f:
+                f.seek(self.fetched)
+                data = f.read(n)
+        if len(data) < n:
+            self.eof = True
+        self.fetched += len(data)
+        return data
+
+    def read(self, n):
+        while len(self.buf) - self.pos < n and not self.eof:
+            self.buf = self.buf[self.pos:] + self.fetch(max(self.chunk, n))
+            self.pos = 0
+            #-- a header larger than the first chunk is read with growing ranges
+            self.chunk *= 2
+        data = self.buf[self.pos:self.pos + n]
+        self.pos += len(data)
+        return data
+
+
+"""
+#------------------------------------------------------------------------------
+# Parse the header text and references of a BAM
+#------------------------------------------------------------------------------
+"""
+def parseHeader(text, refs):
+    info = OrderedDict()
+    info['SO'] = None
+    info['RG'] = []
+
+    for line in text.split('\n'):
+        fields = line.rstrip('\r').split('\t')
+        tags = dict([(field[:2], field[3:]) for field in fields[1:] if len(field) > 3 and field[2] == ':'])
+        if fields[0] == '@HD':
+            info['SO'] = tags.get('SO')
+        elif fields[0] == '@RG':
+            info['RG'].append(OrderedDict([('ID', tags.get('ID')), ('PL', tags.get('PL')), ('SM', tags.get('SM'))]))
+
+    info['SQ'] = parseRefs(refs)
+    return info
+
+
+def parseRefs(refs):
+    nRef = int.from_bytes(refs[0:4], 'little', signed=True)
+    seqs = []
+    pos = 4
+    for i in range(nRef):
+        lName = int.from_bytes(refs[pos:pos + 4], 'little', signed=True)
+        name = refs[pos + 4:pos + 4 + lName - 1].decode('utf-8')
+        length = int.from_bytes(refs[pos + 4 + lName:pos + 8 + lName], 'little', signed=True)
+        seqs.append((name, length))
+        pos += 8 + lName
+    return seqs
+
+
+"""
+#------------------------------------------------------------------------------
+# Reference build of a sequence list
+#------------------------------------------------------------------------------
+"""
+def buildOf(seqs):
+    lengths = dict(seqs)
+    for (name, length), build in BUILDS.items():
+        if lengths.get(name) == length:
+            return build
+    return 'unknown'
+
+
+"""
+#------------------------------------------------------------------------------
+# Read a .fai file (local or gs://) as [(name, length)]
+# :: Example Code ::
+# readFai('gs://jc-references/hg19/hg19_ucsc/hg19_ucsc.fa.fai')
+#------------------------------------------------------------------------------
+"""
+def readFai(path, gsutil='gsutil'):
+    if path.startswith('gs://'):
+        text = subprocess.check_output([gsutil, '-q', 'cat', path]).decode('utf-8')
+    else:
+        with open(path) as f:
+            text = f.read()
+
+    seqs = []
+    for line in text.split('\n'):
+        cols = line.split('\t')
+        if len(cols) >= 2 and cols[0]:
+            seqs.append((cols[0], int(cols[1])))
+    return seqs
+
+
+"""
+#------------------------------------------------------------------------------
+# Compare BAM sequences with the reference
+# Returns 'MATCH', 'REORDERED' (same sequences, different order) or 'MISMATCH(...)'
+#------------------------------------------------------------------------------
+"""
+def compareRef(seqs, fai):
+    faiLen = dict(fai)
+    missing = [name for name, length in seqs if name not in faiLen]
+    different = [name for name, length in seqs if name in faiLen and faiLen[name] != length]
+
+    if len(missing) > 0 or len(different) > 0:
+        return 'MISMATCH(missing={},length={})'.format(len(missing), len(different))
+
+    order = [name for name, length in fai if name in dict(seqs)]
+    if order != [name for name, length in seqs]:
+        return 'REORDERED'
+    return 'MATCH'
+
+
+"""
+#------------------------------------------------------------------------------
+# Triage of one BAM
+# :: Example Code ::
+# triage('gs://cloud-storage-01/example1_DNA.bam', bais=set(['gs://cloud-storage-01/example1_DNA.bam.bai']))
+#
+# - bais : set of existing index names; local files are checked on disk if not given
+# - fai  : reference sequences [(name, length)] to compare with
+#------------------------------------------------------------------------------
+"""
+def triage(path, bais=None, fai=None, gsutil='gsutil'):
+    res = OrderedDict()
+    res['BAM'] = path
+    res['SAMPLE'] = path.split('/')[-1].split('.')[0]
+
+    reader = RangeReader(path, gsutil=gsutil)
+    try:
+        text, refs, rest = reheader.readHeader(reader)
+    except (bgzf.BgzfError, subprocess.CalledProcessError, IOError, OSError) as err:
+        res['ERROR'] = str(err).strip() or type(err).__name__
+        res['BYTES_READ'] = reader.fetched
+        return res
+
+    info = parseHeader(text.decode('utf-8', 'replace'), refs)
+
+    candidates = [path + '.bai', path[:-4] + '.bai' if path.endswith('.bam') else None]
+    if bais is None:
+        hasIndex = any([name is not None and os.path.exists(name) for name in candidates])
+    else:
+        hasIndex = any([name in bais for name in candidates])
+
+    noPL = len(info['RG']) == 0 or any([not rg['PL'] for rg in info['RG']])
+    isSorted = info['SO'] == 'coordinate'
+
+    stages = []
+    if noPL:
+        stages.append('headAddPL')
+    if not isSorted:
+        stages.append('SortSam')
+    if not isSorted or not hasIndex:
+        stages.append('BuildBamIndex')
+
+    res['SO'] = info['SO'] or ''
+    res['RG'] = len(info['RG'])
+    res['PL'] = ','.join(sorted(set([rg['PL'] or '-' for rg in info['RG']])))
+    res['SM'] = ','.join(sorted(set([rg['SM'] or '-' for rg in info['RG']])))
+    res['N_SQ'] = len(info['SQ'])
+    res['INDEX'] = 'yes' if hasIndex else 'no'
+    res['BUILD'] = buildOf(info['SQ'])
+    res['REF'] = compareRef(info['SQ'], fai) if fai is not None else ''
+    res['STAGES'] = ','.join(stages)
+    res['BYTES_READ'] = reader.fetched
+    res['ERROR'] = ''
+    return res
+
+
+"""
+#------------------------------------------------------------------------------
+# Index files next to the BAMs (one cached listing per directory)
+#------------------------------------------------------------------------------
+"""
+def listIndexes(paths, listing=None, gsutil='gsutil'):
+    dirs = sorted(set([path.rsplit('/', 1)[0] for path in paths if path.startswith('gs://')]))
+    if len(dirs) == 0:
+        return None
+
+    if listing is None:
+        listing = gsList.Listing(gsutil=gsutil)
+
+    bais = set()
+    for dirPath in dirs:
+        bais.update(listing.names(dirPath, suffix='.bai'))
+    return bais
+
+
+"""
+#------------------------------------------------------------------------------
+# Triage of many BAMs in parallel and the stage plan
+# - writes '<outPath>/plan.tsv' and '<outPath>/<stage>.txt' (BAMs needing the stage)
+#------------------------------------------------------------------------------
+"""
+def triageAll(paths, outPath=None, fai=None, nProc=NPROC, listing=None, gsutil='gsutil'):
+    bais = listIndexes(paths, listing, gsutil)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(nProc, len(paths)))) as pool:
+        results = list(pool.map(lambda path: triage(path, bais=bais, fai=fai, gsutil=gsutil), paths))
+
+    if outPath is not None:
+        try:
+            os.makedirs(outPath)
+        except OSError:
+            pass
+
+        columns = ['BAM', 'SAMPLE', 'SO', 'RG', 'PL', 'SM', 'N_SQ', 'INDEX', 'BUILD', 'REF', 'STAGES', 'BYTES_READ', 'ERROR']
+        with open('{}/plan.tsv'.format(outPath), 'w') as f:
+            f.write('\t'.join(columns) + '\n')
+            for res in results:
+                f.write('\t'.join([str(res.get(col, '')) for col in columns]) + '\n')
+
+        for stage in STAGE_ORDER:
+            with open('{}/{}.txt'.format(outPath, stage), 'w') as f:
+                for res in results:
+                    if stage in res.get('STAGES', '').split(','):
+                        f.write('{}\n'.format(res['BAM']))
+
+        with open('{}/error.txt'.format(outPath), 'w') as f:
+            for res in results:
+                if res.get('ERROR'):
+                    f.write('{}\t{}\n'.format(res['BAM'], res['ERROR']))
+
+    return results
+
+
+"""
+#------------------------------------------------------------------------------
+# Sample names (SM of the @RG lines) of BAMs, read from their headers in parallel
+# :: Example Code ::
+# samplesOf(['gs://b1/S1_L001.unmapped.bam', 'gs://b1/S1_L002.unmapped.bam'])   -> {path: 'S1', ...}
+#
+# - BAMs with several samples have them joined with ','; unreadable BAMs or BAMs without SM have ''
+#------------------------------------------------------------------------------
+"""
+def sampleOf(path, gsutil='gsutil'):
+    try:
+        text, refs, rest = reheader.readHeader(RangeReader(path, gsutil=gsutil))
+    except (bgzf.BgzfError, subprocess.CalledProcessError, IOError, OSError):
+        return ''
+    info = parseHeader(text.decode('utf-8', 'replace'), refs)
+    return ','.join(sorted(set([rg['SM'] for rg in info['RG'] if rg['SM']])))
+
+
+def samplesOf(paths, nProc=NPROC, gsutil='gsutil'):
+    with ThreadPoolExecutor(max_workers=max(1, min(nProc, len(paths)))) as pool:
+        samples = list(pool.map(lambda path: sampleOf(path, gsutil), paths))
+    return OrderedDict(zip(paths, samples))
+
+
+"""
+#------------------------------------------------------------------------------
+# Reference .fai from a Sentieon batch JSON (REF + '.fai')
+#------------------------------------------------------------------------------
+"""
+def faiFromJson(jsonPath):
+    with open(jsonPath) as f:
+        return json.load(f)['REF'] + '.fai'
+
+
+"""
+#------------------------------------------------------------------------------
+# :: USAGE ::
+# >> python bamTriage.py -i bamList.txt -o /output_dir/triage --json /batch/germline.json
+# >> python bamTriage.py -i gs://vcf-to-bam-bam -o /output_dir/triage --fai /ref/hg19_ucsc.fa.fai
+# >> python addPL.py -p my-project-id -i /output_dir/triage/headAddPL.txt -o gs://vcf-to-bam-bam -s /output_dir/addPL
+#------------------------------------------------------------------------------
+"""
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--input", help='list of BAM files, or a bucket/directory to list', action='store', required=True)
+    parser.add_argument("-o", "--output", help='output directory of plan.tsv and per-stage lists', action='store', required=True)
+    parser.add_argument("-f", "--fai", help='reference .fai file (local or gs://) to compare with', action='store', default=None)
+    parser.add_argument("-j", "--json", help='Sentieon batch JSON whose REF + ".fai" is used as --fai (e.g., germline.json)', action='store', default=None)
+    parser.add_argument("-n", "--nproc", help='number of BAMs read at the same time [Default={}]'.format(NPROC), type=int, default=NPROC)
+    parser.add_argument("--gsutil", help='gsutil executable [Default=gsutil]', action='store', default='gsutil')
+
+    args = parser.parse_args()
+
+    faiPath = args.fai
+    if faiPath is None and args.json is not None:
+        faiPath = faiFromJson(args.json)
+    fai = readFai(faiPath, args.gsutil) if faiPath is not None else None
+
+    paths = list(cmpFiles.readNames(args.input, suffix='.bam'))
+    results = triageAll(paths, args.output, fai=fai, nProc=args.nproc, gsutil=args.gsutil)
+
+    counts = OrderedDict([(stage, 0) for stage in STAGE_ORDER])
+    builds = OrderedDict()
+    for res in results:
+        for stage in res.get('STAGES', '').split(','):
+            if stage in counts:
+                counts[stage] += 1
+        builds[res.get('BUILD', 'error')] = builds.get(res.get('BUILD', 'error'), 0) + 1
+
+    print("BAMs       : {}".format(len(results)))
+    print("Bytes read : {}".format(sum([res['BYTES_READ'] for res in results])))
+    for stage in counts:
+        print("{:<14}: {} BAMs".format(stage, counts[stage]))
+    for build in builds:
+        print("Build {:<8}: {} BAMs".format(build, builds[build]))
+    print("Plan is written in {}/plan.tsv".format(args.output))
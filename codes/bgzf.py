@@ -0,0 +1,395 @@
+"""
+# Purpose     : BGZF block I/O
+# Descriptions:
+#  - BGZF (blocked gzip used by BAM, tabix'ed VCF) is a series of gzip members of at most 64 KB
+#    with the compressed block size in the 'BC' extra field
+#  - Blocks can be read and written raw (compressed bytes copied as they are) or decompressed
+#  - BgzfWriter packs data into blocks and ends the file with the standard EOF block;
+#    with threads > 1 blocks are compressed in parallel and written in order
+#  - BgzfReader decompresses the next blocks in parallel (readahead), reports virtual offsets
+#    (block offset << 16 | offset in block) and seeks to them; raw blocks can be copied to
+#    another stream as they are read (tee)
+#  - blockIndex lists (block offset, data offset) of all blocks from the block headers only,
+#    and is saved/loaded in the bgzip '.gzi' format
+#  - Benchmarks: python bgzfBench.py
+#
+# Start date  : Oct 17, 2026
+# Last update : Oct 17, 2026
+"""
+
+__author__ 		= "Jong Cheol Jeong"
+__copyright__ 	= "Copyright 2018, UK Cancer Research Informatics"
+__version__ 	= "1.0.0"
+__maintainer__ 	= "Jong Cheol Jeong"
+__email__ 		= "jjeong@kcr.uky.edu"
+
+
+import struct
+import zlib
+import bisect
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+#-- empty block marking the end of a BGZF file
+EOF_BLOCK = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+HEADER_SIZE = 18
+MAX_BLOCK = 65536
+#-- uncompressed bytes per block (same as htslib, leaves room for incompressible data)
+BLOCK_DATA = 0xff00
+LEVEL = 6
+#-- zlib releases the GIL, so threads compress/decompress blocks in parallel
+THREADS = min(8, os.cpu_count() or 1)
+
+
+class BgzfError(Exception):
+    pass
+
+
+"""
+#------------------------------------------------------------------------------
+# Read exactly n bytes from a file or stream (returns less only at the end)
+#------------------------------------------------------------------------------
+"""
+def readFully(f, n):
+    buf = f.read(n)
+    if buf is None:
+        buf = b''
+    while len(buf) < n:
+        more = f.read(n - len(buf))
+        if not more:
+            break
+        buf += more
+    return buf
+
+
+"""
+#------------------------------------------------------------------------------
+# Read the next raw (compressed) block
+# Returns the whole block including gzip header and footer, or b'' at the end of the file
+#------------------------------------------------------------------------------
+"""
+def readRaw(f):
+    head = readFully(f, HEADER_SIZE)
+    if len(head) == 0:
+        return b''
+    if len(head) < HEADER_SIZE:
+        raise BgzfError("truncated BGZF block header")
+
+    return head + readFully(f, blockSize(head) - HEADER_SIZE)
+
+
+def blockSize(head):
+    if head[0:4] != b'\x1f\x8b\x08\x04':
+        raise BgzfError("not a BGZF block")
+
+    xlen = struct.unpack('<H', head[10:12])[0]
+    if xlen != 6 or head[12:14] != b'BC':
+        raise BgzfError("BGZF block without the BC extra field")
+
+    return struct.unpack('<H', head[16:18])[0] + 1
+
+
+"""
+#------------------------------------------------------------------------------
+# Decompress a raw block
+#------------------------------------------------------------------------------
+"""
+def inflate(raw):
+    size = blockSize(raw)
+    if len(raw) != size:
+        raise BgzfError("truncated BGZF block ({} of {} bytes)".format(len(raw), size))
+
+    data = zlib.decompress(raw[HEADER_SIZE:-8], -15)
+    crc, isize = struct.unpack('<II', raw[-8:])
+    if isize != len(data) or crc != (zlib.crc32(data) & 0xffffffff):
+        raise BgzfError("BGZF block CRC or size mismatch")
+    return data
+
+
+"""
+#------------------------------------------------------------------------------
+# Compress at most BLOCK_DATA bytes into one raw block
+#------------------------------------------------------------------------------
+"""
+def deflate(data, level=LEVEL):
+    comp = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = comp.compress(data) + comp.flush()
+
+    #-- incompressible data is stored without compression to fit in one block
+    if len(cdata) + HEADER_SIZE + 8 > MAX_BLOCK:
+        comp = zlib.compressobj(0, zlib.DEFLATED, -15)
+        cdata = comp.compress(data) + comp.flush()
+
+    bsize = len(cdata) + HEADER_SIZE + 8
+    head = struct.pack('<4BIBBHBBHH', 0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6, ord('B'), ord('C'), 2, bsize - 1)
+    return head + cdata + struct.pack('<II', zlib.crc32(data) & 0xffffffff, len(data))
+
+
+"""
+#------------------------------------------------------------------------------
+# Iterate over raw blocks / decompressed blocks of a file or stream
+#------------------------------------------------------------------------------
+"""
+def rawBlocks(f):
+    while True:
+        raw = readRaw(f)
+        if not raw:
+            return
+        yield raw
+
+
+def dataBlocks(f):
+    for raw in rawBlocks(f):
+        yield inflate(raw)
+
+
+"""
+#------------------------------------------------------------------------------
+# Virtual offsets (block offset in the file << 16 | offset in the decompressed block)
+#------------------------------------------------------------------------------
+"""
+def makeVoffset(coffset, uoffset):
+    return (coffset << 16) | uoffset
+
+
+def splitVoffset(voffset):
+    return voffset >> 16, voffset & 0xffff
+
+
+"""
+#------------------------------------------------------------------------------
+# Block index of a seekable file without decompressing: [(block offset, data offset), ...]
+# - only the header and the ISIZE field of each block are read
+# - saved/loaded in the bgzip '.gzi' format (the first block, always (0, 0), is not stored)
+#------------------------------------------------------------------------------
+"""
+def blockIndex(f):
+    index = []
+    coffset = 0
+    uoffset = 0
+    f.seek(0)
+    while True:
+        head = readFully(f, HEADER_SIZE)
+        if len(head) == 0:
+            break
+        if len(head) < HEADER_SIZE:
+            raise BgzfError("truncated BGZF block header")
+        size = blockSize(head)
+        f.seek(coffset + size - 4)
+        isize = struct.unpack('<I', readFully(f, 4))[0]
+        index.append((coffset, uoffset))
+        coffset += size
+        uoffset += isize
+    return index
+
+
+def writeGzi(index, path):
+    entries = [entry for entry in index if entry != (0, 0)]
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<Q', len(entries)))
+        for coffset, uoffset in entries:
+            f.write(struct.pack('<QQ', coffset, uoffset))
+
+
+def readGzi(path):
+    with open(path, 'rb') as f:
+        n = struct.unpack('<Q', f.read(8))[0]
+        data = f.read(16 * n)
+    return [(0, 0)] + [struct.unpack_from('<QQ', data, 16 * i) for i in range(n)]
+
+
+"""
+#------------------------------------------------------------------------------
+# BgzfWriter
+# :: Example Code ::
+# w = BgzfWriter(open('/tmp/out.bam', 'wb'))
+# w = BgzfWriter(open('/tmp/out.bam', 'wb'), level=1, threads=8)   # parallel compression
+# w.write(data)                 # compressed in blocks of BLOCK_DATA bytes
+# w.flush()                     # ends the current block
+# w.writeRaw(raw)               # raw block copied as it is
+# w.close()                     # adds the EOF block unless it was written with writeRaw
+#------------------------------------------------------------------------------
+"""
+class BgzfWriter(object):
+
+    def __init__(self, f, level=LEVEL, closeFile=True, threads=1):
+        self.f = f
+        self.level = level
+        self.closeFile = closeFile
+        self.buf = bytearray()
+        self.lastRaw = None
+        self.pool = ThreadPoolExecutor(max_workers=threads) if threads > 1 else None
+        self.queue = deque()
+        self.maxQueue = 4 * threads
+
+    def write(self, data):
+        self.buf.extend(data)
+        while len(self.buf) >= BLOCK_DATA:
+            self.writeBlock(bytes(self.buf[:BLOCK_DATA]))
+            del self.buf[:BLOCK_DATA]
+
+    def flush(self):
+        if len(self.buf) > 0:
+            self.writeBlock(bytes(self.buf))
+            self.buf = bytearray()
+
+    def writeBlock(self, data):
+        self.lastRaw = None
+        if self.pool is None:
+            self.f.write(deflate(data, self.level))
+            return
+
+        #-- blocks are written in submission order, at most maxQueue blocks in flight
+        self.queue.append(self.pool.submit(deflate, data, self.level))
+        while len(self.queue) > self.maxQueue or (len(self.queue) > 0 and self.queue[0].done()):
+            self.f.write(self.queue.popleft().result())
+
+    def drain(self):
+        while len(self.queue) > 0:
+            self.f.write(self.queue.popleft().result())
+
+    def writeRaw(self, raw):
+        self.flush()
+        self.drain()
+        self.f.write(raw)
+        self.lastRaw = raw
+
+    def close(self):
+        self.flush()
+        self.drain()
+        if self.lastRaw != EOF_BLOCK:
+            self.f.write(EOF_BLOCK)
+        self.f.flush()
+        if self.pool is not None:
+            self.pool.shutdown()
+        if self.closeFile:
+            self.f.close()
+
+
+"""
+#------------------------------------------------------------------------------
+# BgzfReader
+# :: Example Code ::
+# r = BgzfReader(open('/tmp/x.bam', 'rb'), threads=8)
+# data = r.read(4)              # decompressed bytes
+# voffset = r.tell()            # virtual offset of the next byte
+# r.seek(voffset)               # back to a virtual offset (seekable files)
+# r.seekData(1000000)           # to a decompressed position with a block index
+# for coffset, data in r.blocks(): ...
+#
+# - readahead : blocks decompressed ahead of the reader [Default=4 x threads]
+# - tee       : stream receiving every raw block read (e.g., copy while indexing)
+#------------------------------------------------------------------------------
+"""
+class BgzfReader(object):
+
+    def __init__(self, f, threads=THREADS, readahead=None, tee=None, index=None, closeFile=True):
+        self.f = f
+        self.tee = tee
+        self.index = index
+        self.dataStarts = [uoffset for coffset, uoffset in index] if index is not None else None
+        self.closeFile = closeFile
+        self.pool = ThreadPoolExecutor(max_workers=threads) if threads > 1 else None
+        self.readahead = readahead if readahead is not None else 4 * max(1, threads)
+        self.queue = deque()
+        try:
+            self.next = f.tell()
+        except (AttributeError, OSError):
+            self.next = 0
+        self.atEnd = False
+        self.block = b''
+        self.blockOffset = self.next
+        self.blockSize = 0
+        self.pos = 0
+
+    def fill(self):
+        while len(self.queue) < self.readahead and not self.atEnd:
+            raw = readRaw(self.f)
+            if not raw:
+                self.atEnd = True
+                break
+            if self.tee is not None:
+                self.tee.write(raw)
+            if self.pool is None:
+                self.queue.append((self.next, len(raw), inflate(raw)))
+            else:
+                self.queue.append((self.next, len(raw), self.pool.submit(inflate, raw)))
+            self.next += len(raw)
+
+    #-- move to the next block; False at the end of the file
+    def nextBlock(self):
+        self.fill()
+        if len(self.queue) == 0:
+            self.blockOffset += self.blockSize
+            self.block = b''
+            self.blockSize = 0
+            self.pos = 0
+            return False
+        self.blockOffset, self.blockSize, data = self.queue.popleft()
+        self.block = data if self.pool is None else data.result()
+        self.pos = 0
+        return True
+
+    def read(self, n=-1):
+        #-- within the current block (most reads of small records)
+        if 0 < n <= len(self.block) - self.pos:
+            self.pos += n
+            return self.block[self.pos - n:self.pos]
+
+        out = []
+        while n != 0:
+            if self.pos >= len(self.block) and not self.nextBlock():
+                break
+            end = len(self.block) if n < 0 else min(len(self.block), self.pos + n)
+            out.append(self.block[self.pos:end])
+            if n > 0:
+                n -= end - self.pos
+            self.pos = end
+        return b''.join(out)
+
+    def blocks(self):
+        if self.pos < len(self.block):
+            yield self.blockOffset, self.block[self.pos:]
+        while self.nextBlock():
+            yield self.blockOffset, self.block
+        self.pos = len(self.block)
+
+    #-- at the end of a block, the next byte is at the start of the next block (as htslib)
+    def tell(self):
+        if self.pos >= len(self.block) and self.blockSize > 0:
+            return makeVoffset(self.blockOffset + self.blockSize, 0)
+        return makeVoffset(self.blockOffset, self.pos)
+
+    def seek(self, voffset):
+        coffset, uoffset = splitVoffset(voffset)
+        for entry in self.queue:
+            if self.pool is not None:
+                entry[2].cancel()
+        self.queue.clear()
+        self.f.seek(coffset)
+        self.next = coffset
+        self.atEnd = False
+        self.blockOffset = coffset
+        self.blockSize = 0
+        self.block = b''
+        self.pos = 0
+        if uoffset > 0:
+            if not self.nextBlock() or uoffset > len(self.block):
+                raise BgzfError("virtual offset {} out of the block".format(voffset))
+            self.pos = uoffset
+
+    def seekData(self, upos):
+        assert (not (self.index is None)), "Block index must be given!!\nExample) BgzfReader(f, index=blockIndex(f))\n"
+        i = bisect.bisect_right(self.dataStarts, upos) - 1
+        coffset, uoffset = self.index[i]
+        self.seek(makeVoffset(coffset, 0))
+        self.read(upos - uoffset)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+        if self.closeFile:
+            self.f.close()
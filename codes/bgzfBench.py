@@ -0,0 +1,122 @@
+"""
+# Purpose     : Throughput benchmark of bgzf.py
+# Descriptions:
+#  - Compresses the same data with gzip (single thread, not BGZF) and BgzfWriter with 1..N threads
+#  - Decompresses the BGZF output with BgzfReader with 1..N threads, and copies it as raw blocks
+#  - Reports MB/s of uncompressed data; the input is a file (e.g., SAM/VCF text) or generated
+#
+# Start date  : Oct 17, 2026
+# Last update : Oct 17, 2026
+"""
+
+__author__ 		= "Jong Cheol Jeong"
+__copyright__ 	= "Copyright 2018, UK Cancer Research Informatics"
+__version__ 	= "1.0.0"
+__maintainer__ 	= "Jong Cheol Jeong"
+__email__ 		= "jjeong@kcr.uky.edu"
+
+
+import argparse
+import random
+import gzip
+import time
+import io
+import bgzf
+
+
+"""
+#------------------------------------------------------------------------------
+# SAM-like text, compressible about as well as real alignments
+#------------------------------------------------------------------------------
+"""
+def sampleData(size, seed=1):
+    random.seed(seed)
+    lines = []
+    total = 0
+    pos = 0
+    while total < size:
+        pos += random.randint(0, 300)
+        seq = ''.join(random.choice('ACGT') for i in range(100))
+        qual = ''.join(random.choice('?@ABCDEFGHI') for i in range(100))
+        line = "read{}\t99\tchr1\t{}\t60\t100M\t=\t{}\t350\t{}\t{}\tRG:Z:rg1\n".format(len(lines), pos, pos + 250, seq, qual)
+        lines.append(line)
+        total += len(line)
+    return ''.join(lines).encode('utf-8')[:size]
+
+
+def rate(nBytes, seconds):
+    return nBytes / (1024.0 * 1024.0) / max(seconds, 1e-9)
+
+
+def timeWrite(data, level, threads):
+    out = io.BytesIO()
+    start = time.time()
+    w = bgzf.BgzfWriter(out, level=level, closeFile=False, threads=threads)
+    w.write(data)
+    w.close()
+    return time.time() - start, out.getvalue()
+
+
+def timeRead(comp, threads):
+    start = time.time()
+    r = bgzf.BgzfReader(io.BytesIO(comp), threads=threads, closeFile=False)
+    n = sum([len(data) for coffset, data in r.blocks()])
+    r.close()
+    return time.time() - start, n
+
+
+"""
+#------------------------------------------------------------------------------
+# :: USAGE ::
+# >> python bgzfBench.py                        # 64 MB of generated SAM text
+# >> python bgzfBench.py -i example1_DNA.sam -t 1 2 4 8 -l 1 6
+#------------------------------------------------------------------------------
+"""
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--input", help='uncompressed input file [Default=generated SAM text]', action='store', default=None)
+    parser.add_argument("-m", "--size", help='size of generated data in MB [Default=64]', type=int, default=64)
+    parser.add_argument("-t", "--threads", help='thread counts to compare [Default=1 2 4 {}]'.format(bgzf.THREADS), type=int, nargs='+', default=None)
+    parser.add_argument("-l", "--level", help='compression levels [Default={}]'.format(bgzf.LEVEL), type=int, nargs='+', default=[bgzf.LEVEL])
+
+    args = parser.parse_args()
+
+    if args.input is not None:
+        with open(args.input, 'rb') as f:
+            data = f.read()
+    else:
+        data = sampleData(args.size * 1024 * 1024)
+
+    threadList = args.threads if args.threads is not None else sorted(set([1, 2, 4, bgzf.THREADS]))
+    print("input\t{:.1f} MB".format(len(data) / (1024.0 * 1024.0)))
+    print("TASK\tLEVEL\tTHREADS\tSECONDS\tMB/s\tRATIO")
+
+    for level in args.level:
+        start = time.time()
+        gz = gzip.compress(data, compresslevel=level)
+        seconds = time.time() - start
+        print("gzip\t{}\t1\t{:.2f}\t{:.1f}\t{:.3f}".format(level, seconds, rate(len(data), seconds), len(gz) / float(len(data))))
+
+        comp = None
+        for threads in threadList:
+            seconds, comp = timeWrite(data, level, threads)
+            print("bgzf-write\t{}\t{}\t{:.2f}\t{:.1f}\t{:.3f}".format(level, threads, seconds, rate(len(data), seconds), len(comp) / float(len(data))))
+
+        start = time.time()
+        gzip.decompress(gz)
+        seconds = time.time() - start
+        print("gzip-read\t{}\t1\t{:.2f}\t{:.1f}\t".format(level, seconds, rate(len(data), seconds)))
+
+        for threads in threadList:
+            seconds, n = timeRead(comp, threads)
+            assert (n == len(data)), "BGZF round trip lost data!!\n"
+            print("bgzf-read\t{}\t{}\t{:.2f}\t{:.1f}\t".format(level, threads, seconds, rate(len(data), seconds)))
+
+        start = time.time()
+        out = io.BytesIO()
+        w = bgzf.BgzfWriter(out, closeFile=False)
+        for raw in bgzf.rawBlocks(io.BytesIO(comp)):
+            w.writeRaw(raw)
+        w.close()
+        seconds = time.time() - start
+        print("bgzf-raw-copy\t{}\t1\t{:.2f}\t{:.1f}\t".format(level, seconds, rate(len(data), seconds)))
@@ -3,8 +3,9 @@
 # Descriptions:
 #  - Codes contain functions to submit jobs via Google Cloud 'dsub'
 #  - This codes must be run after running 'addPL.py' that correct known issue of PL absence
+#  - --native builds the index with bamIndex.py in a small python job instead of Picard
 # Start date  : July 2, 2018
-# Last update : Aug 21, 2018
+# Last update : Oct 17, 2026
 """
 
 __author__ 		= "Jong Cheol Jeong"
@@ -15,6 +16,7 @@ __email__ 		= "jjeong@kcr.uky.edu"
 
 
 import dsub
+import submitPool
 import os
 import argparse
 
@@ -32,6 +34,8 @@ parser.add_argument("-i", "--input", help='list of file names in cloud storage t
 parser.add_argument("-o", "--output", help='output google storage directory i.e., GS Path (gs://your-bucket', action='store', required=True)
 parser.add_argument("-s", "--script", help='local directory to store dsub scripts', action='store', required=True)
 parser.add_argument("-p", "--project", help='Google project ID (e.g., my-project-name)', action='store', required=True)
+parser.add_argument("--native", help='build the index with bamIndex.py (no JVM, 2 GB RAM) instead of Picard BuildBamIndex', action='store_true')
+submitPool.addSubmitArgs(parser)
 
 args = parser.parse_args()
 
@@ -39,7 +43,7 @@ listBAM = args.input
 tgPath  = args.output
 logPath = "{}/log".format(tgPath)
 scPath = args.script
-prjName = arg.project
+prjName = args.project
 
 try:
     os.makedirs(scPath)
@@ -79,11 +83,22 @@ with open(mapBAM, 'w') as f:
 # Submit jobs
 #------------------------------------------------------------------------------
 """
-for i in range(len(inBAM)):
-    ibam = inBAM[i]
-    obam = outBAM[i]
-    oScr = "{}/dsub_{}.sh".format(scPath, str(i).zfill(3))
-    cmt = "[{}/{}] {} is processing...".format(i + 1, len(inBAM), ibam)
-    print(cmt)
-    dsub.BuildBamIndex(prjName=prjName, inFile=ibam, outFile=obam, scriptPath=oScr, Logs=logPath)
-    print('\n')
+stage = 'NativeBamIndex' if args.native else 'BuildBamIndex'
+func = dsub.NativeBamIndex if args.native else dsub.BuildBamIndex
+
+options = submitPool.stageOptions(args)
+db = submitPool.openLedger(args, scPath)
+submitPool.configureLimits(args)
+place = submitPool.openPlacement(args, db)
+
+if args.batch:
+    oScr = "{}/dsub_{}.sh".format(scPath, stage)
+    submitPool.runTasks(stage=stage, prjName=prjName, inFiles=inBAM, outFiles=outBAM, scriptPath=oScr, Logs=logPath, **options, db=db, resume=args.resume, placement=place)
+else:
+    jobs = []
+    for i in range(len(inBAM)):
+        oScr = "{}/dsub_{}.sh".format(scPath, str(i).zfill(3))
+        jobs.append(dict(prjName=prjName, inFile=inBAM[i], outFile=outBAM[i], scriptPath=oScr, Logs=logPath, **options))
+
+    summary = submitPool.runPool(func=func, jobs=jobs, nProc=args.nproc, outPath=scPath, db=db, stage=stage, resume=args.resume, placement=place)
+    submitPool.printSummary(summary)
@@ -15,6 +15,8 @@ __email__ 		= "jjeong@kcr.uky.edu"
 
 
 import dsub
+import submitPool
+import os
 import argparse
 
 """
@@ -31,6 +33,7 @@ parser.add_argument("-i", "--input", help='list of file names in cloud storage t
 parser.add_argument("-o", "--output", help='output google storage directory i.e., GS Path (gs://your-bucket', action='store', required=True)
 parser.add_argument("-s", "--script", help='local directory to store dsub scripts', action='store', required=True)
 parser.add_argument("-p", "--project", help='Google project ID (e.g., my-project-name)', action='store', required=True)
+submitPool.addSubmitArgs(parser)
 
 args = parser.parse_args()
 
@@ -38,7 +41,12 @@ listBAM = args.input
 tgPath  = args.output
 logPath = "{}/log".format(tgPath)
 scPath = args.script
-prjName = arg.project
+prjName = args.project
+
+try:
+    os.makedirs(scPath)
+except OSError:
+    pass
 
 
 # Read input files and preparing for output name by adding '.head'
@@ -73,11 +81,19 @@ with open(mapBAM, 'w') as f:
 # Submit jobs
 #------------------------------------------------------------------------------
 """
-for i in range(len(inBAM)):
-    ibam = inBAM[i]
-    obam = outBAM[i]
-    oScr = "{}/dsub_{}.sh".format(scPath, str(i).zfill(3))
-    cmt = "[{}/{}] {} is processing...".format(i + 1, len(inBAM), ibam)
-    print(cmt)
-    dsub.CleanSam(prjName=prjName, inFile=ibam, outFile=obam, scriptPath=oScr, Logs=logPath)
-    print('\n')
+options = submitPool.stageOptions(args)
+db = submitPool.openLedger(args, scPath)
+submitPool.configureLimits(args)
+place = submitPool.openPlacement(args, db)
+
+if args.batch:
+    oScr = "{}/dsub_CleanSam.sh".format(scPath)
+    submitPool.runTasks(stage='CleanSam', prjName=prjName, inFiles=inBAM, outFiles=outBAM, scriptPath=oScr, Logs=logPath, **options, db=db, resume=args.resume, placement=place)
+else:
+    jobs = []
+    for i in range(len(inBAM)):
+        oScr = "{}/dsub_{}.sh".format(scPath, str(i).zfill(3))
+        jobs.append(dict(prjName=prjName, inFile=inBAM[i], outFile=outBAM[i], scriptPath=oScr, Logs=logPath, **options))
+
+    summary = submitPool.runPool(func=dsub.CleanSam, jobs=jobs, nProc=args.nproc, outPath=scPath, db=db, stage='CleanSam', resume=args.resume, placement=place)
+    submitPool.printSummary(summary)
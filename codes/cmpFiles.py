@@ -2,9 +2,18 @@
 # Purpose     : To check if outputs are well produced
 # Descriptions:
 #  - This codes compares two files and find same and differences
+#  - A sample key is extracted from every name (stem, basename or regex) and the target list
+#    is indexed by key, so each reference name is looked up in constant time
+#  - Both lists are streamed line by line; only the keys of the target list are kept in memory
+#  - exact  : reference key == target key (e.g., 'S1' does not match 'S10')
+#    prefix : reference key is the target key or a prefix of it ending at a '.'
+#             (e.g., 'xxx.bam' matches 'xxx.bam.bai' but not 'xxx.bam2')
+#  - matched.txt / missing.txt : reference names found / not found in the target
+#    extra.txt                 : target names not matched by any reference
+#  - a list can also be a gs://bucket[/dir] or a local directory, listed with gsList.py ('--suffix' filters it)
 #
 # Start date  : Jun 28, 2018
-# Last update : Jun 28, 2018
+# Last update : Oct 17, 2026
 """
 
 __author__ 		= "Jong Cheol Jeong"
@@ -13,9 +22,178 @@ __version__ 	= "1.0.0"
 __maintainer__ 	= "Jong Cheol Jeong"
 __email__ 		= "jjeong@kcr.uky.edu"
 
-import pandas as pd
 import os
+import re
 import argparse
+import gsList
+
+
+EXACT = 'exact'
+PREFIX = 'prefix'
+KEYS = ['stem', 'basename', 'regex']
+
+
+"""
+#------------------------------------------------------------------------------
+# Key extractors
+# :: Example Code ::
+# keyFunc = keyExtractor('stem')
+# keyFunc('gs://cloud-storage-01/example1_DNA.head.bam')   -> 'example1_DNA'
+# keyFunc = keyExtractor('regex', pattern=r'^(S\d+)_')
+# keyFunc('gs://cloud-storage-01/S10_L001.bam')           -> 'S10'
+#
+# - stem     : file name up to the first '.' (same as the dsub job name)
+# - basename : file name
+# - regex    : first group (or the whole match) of 'pattern' searched in the file name
+#              names without a match have no key
+#------------------------------------------------------------------------------
+"""
+def keyExtractor(name='stem', pattern=None):
+    assert (name in KEYS), "Unknown key '{}'!!\nAvailable keys) {}\n".format(name, ', '.join(KEYS))
+
+    if name == 'stem':
+        return lambda path: path.strip().split('/')[-1].split('.')[0]
+
+    if name == 'basename':
+        return lambda path: path.strip().split('/')[-1]
+
+    assert (not (pattern is None)), "Pattern must be given with the regex key!!\nExample) '^(S\\d+)_'\n"
+    regex = re.compile(pattern)
+
+    def regexKey(path):
+        m = regex.search(path.strip().split('/')[-1])
+        if m is None:
+            return None
+        return m.group(1) if regex.groups > 0 else m.group(0)
+
+    return regexKey
+
+
+"""
+#------------------------------------------------------------------------------
+# Keys under which a target name is indexed
+# - exact  : the key itself
+# - prefix : the key and each of its prefixes ending at a '.'
+#            e.g., 'xxx.bam.bai' -> ['xxx', 'xxx.bam', 'xxx.bam.bai']
+#------------------------------------------------------------------------------
+"""
+def indexKeys(key, mode=EXACT):
+    if key is None:
+        return []
+
+    if mode == EXACT:
+        return [key]
+
+    parts = key.split('.')
+    return ['.'.join(parts[:i]) for i in range(1, len(parts) + 1)]
+
+
+"""
+#------------------------------------------------------------------------------
+# Read the names in column 'idx' of a tab separated list, line by line
+# - gs://bucket[/dir] or a directory is listed with gsList.py instead (names ending with 'suffix')
+#------------------------------------------------------------------------------
+"""
+def readNames(path, idx=0, suffix=None):
+    if path.startswith('gs://') or os.path.isdir(path):
+        for name in gsList.listNames(path, suffix=suffix):
+            yield name
+        return
+
+    with open(path, 'r') as f:
+        for line in f:
+            cols = line.rstrip('\r\n').split('\t')
+            if len(cols) <= idx or not cols[idx].strip():
+                continue
+            yield cols[idx].strip()
+
+
+"""
+#------------------------------------------------------------------------------
+# Compare reference names against target names
+# :: Example Code ::
+# missing = []
+# counts = compare(readNames('bamList.txt'), lambda: readNames('outList.txt'), missing=missing.append)
+#
+# - tgNames : iterable of target names, or a function returning a new iterable; with a function
+#             the target is streamed again to find extra names instead of being kept in memory
+# - matched, missing, extra : functions called with each matched/missing reference name and
+#                             each extra target name
+# Returns {'matched': n, 'missing': n, 'extra': n}
+#------------------------------------------------------------------------------
+"""
+def compare(refNames, tgNames, keyFunc=None, mode=EXACT, matched=None, missing=None, extra=None):
+    assert (mode in (EXACT, PREFIX)), "Unknown mode '{}'!!\nAvailable modes) {}, {}\n".format(mode, EXACT, PREFIX)
+
+    if keyFunc is None:
+        keyFunc = keyExtractor('stem')
+
+    #-- keep target names only when they cannot be read again
+    tgKept = None
+    if callable(tgNames):
+        targets = tgNames()
+    else:
+        targets = tgNames
+        if extra is not None:
+            tgKept = []
+
+    index = set()
+    for name in targets:
+        index.update(indexKeys(keyFunc(name), mode))
+        if tgKept is not None:
+            tgKept.append(name)
+
+    counts = {'matched': 0, 'missing': 0, 'extra': 0}
+    hits = set()
+    for name in refNames:
+        key = keyFunc(name)
+        if key is not None and key in index:
+            hits.add(key)
+            counts['matched'] += 1
+            if matched is not None:
+                matched(name)
+        else:
+            counts['missing'] += 1
+            if missing is not None:
+                missing(name)
+
+    if extra is None:
+        return counts
+
+    targets = tgNames() if callable(tgNames) else tgKept
+    for name in targets:
+        if not any([key in hits for key in indexKeys(keyFunc(name), mode)]):
+            counts['extra'] += 1
+            extra(name)
+
+    return counts
+
+
+"""
+#------------------------------------------------------------------------------
+# Compare two list files and write 'matched.txt', 'missing.txt' and 'extra.txt' in outPath
+# :: Example Code ::
+# compareFiles('bamList.txt', 'outList.txt', '/output_dir/cmp', key='basename', mode='prefix')
+#------------------------------------------------------------------------------
+"""
+def compareFiles(refFile, tgFile, outPath, ridx=0, tidx=0, key='stem', pattern=None, mode=EXACT, suffix=None):
+    try:
+        os.makedirs(outPath)
+    except OSError:
+        pass
+
+    outMatch = '{}/matched.txt'.format(outPath)
+    outNone  = '{}/missing.txt'.format(outPath)
+    outExtra = '{}/extra.txt'.format(outPath)
+
+    with open(outMatch, 'w') as fm, open(outNone, 'w') as fn, open(outExtra, 'w') as fe:
+        counts = compare(readNames(refFile, ridx, suffix), lambda: readNames(tgFile, tidx, suffix), keyFunc=keyExtractor(key, pattern), mode=mode,
+                         matched=lambda name: fm.write('{}\n'.format(name)),
+                         missing=lambda name: fn.write('{}\n'.format(name)),
+                         extra=lambda name: fe.write('{}\n'.format(name)))
+
+    return counts
+
 
 """
 #------------------------------------------------------------------------------
@@ -25,6 +203,10 @@ import argparse
 #                   xxxx.bam is refFiles
 #                   xxxx.bam.bai is TgFiles
 #                   Therefore, it searches 'xxx.bam' in Target name 'xxx.bam.bai'
+#                   (python cmpFiles.py -r bamList.txt -t baiList.txt -o /output_dir -k basename -m prefix)
+#
+# - a bucket can be given instead of a list file, e.g.,)
+#       python cmpFiles.py -r gs://vcf-to-bam-bam -t gs://vcf-to-bam-bam2 -o /output_dir -s bam
 #
 # - tgFile : list of output files can be produced by following:
 #       gsutil ls gs://my-bam |grep 'bam$' > bamList.txt
@@ -32,48 +214,19 @@ import argparse
 #       gsutil ls gs://my-bam |grep -H '.*bam$' |sed -e "s|.*\(gs.*$\)|\1|"  > bamList.txt
 #------------------------------------------------------------------------------
 """
-parser = argparse.ArgumentParser()
-parser.add_argument("-r", "--ref", help='list of file names used for reference and compared to a target file', action='store', required=True)
-parser.add_argument("-t", "--target", help='list of file names and compared to a target file', action='store', required=True)
-parser.add_argument("-o", "--out", help='output path to store the results', action='store', required=True)
-parser.add_argument("-i", "--refidx", help='the column index of reference file to be used DEFAULT=0', action='store', type=int, default=0)
-parser.add_argument("-j", "--tgidx", help='the column index of target file to be used DEFAULT=0', action='store', type=int, default=0)
-
-
-args = parser.parse_args()
-
-refFile = args.ref
-tgFile  = args.target
-outPath = args.out
-ridx    = args.refidx
-tidx    = args.tgidx
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-r", "--ref", help='list of file names used for reference and compared to a target file', action='store', required=True)
+    parser.add_argument("-t", "--target", help='list of file names and compared to a target file', action='store', required=True)
+    parser.add_argument("-o", "--out", help='output path to store the results', action='store', required=True)
+    parser.add_argument("-i", "--refidx", help='the column index of reference file to be used DEFAULT=0', action='store', type=int, default=0)
+    parser.add_argument("-j", "--tgidx", help='the column index of target file to be used DEFAULT=0', action='store', type=int, default=0)
+    parser.add_argument("-k", "--key", help='key extracted from each name: stem, basename or regex DEFAULT=stem', action='store', choices=KEYS, default='stem')
+    parser.add_argument("-e", "--pattern", help='regular expression used with "--key regex" - the first group is the key', action='store', default=None)
+    parser.add_argument("-s", "--suffix", help='suffix of names kept when a bucket or directory is given instead of a list (e.g., bam)', action='store', default=None)
+    parser.add_argument("-m", "--mode", help='exact or prefix (reference key is a prefix of the target key at a ".") DEFAULT=exact', action='store', choices=[EXACT, PREFIX], default=EXACT)
 
-try:
-    os.makedirs(outPath)
-except OSError:
-    pass
-
-
-# Read files and search matched ones
-#------------------------------------------------------------------------------
+    args = parser.parse_args()
 
-dfRef = pd.read_table(refFile, sep='\t', header=None)
-dfTg  = pd.read_table(tgFile, sep='\t', header=None)
-
-outMatch = '{}/matched.txt'.format(outPath)
-outNone  = '{}/missing.txt'.format(outPath)
-
-with open(outMatch, 'w') as fm:
-    with open(outNone, 'w') as fn:
-        for refname in dfRef.loc[:,ridx]:
-            refnameShort=refname.split('/')[-1].split('.')[0]
-            tmp = dfTg.index[dfTg.iloc[:,tidx].str.contains(refnameShort) == True].tolist()
-            if len(tmp) > 0:
-                #m = 'MATCH >> Ref={}\tTg={}'.format(refname, dfTg.iloc[tmp[0],0])
-                fname = '{}\n'.format(refname.strip())
-                fm.write(fname)
-
-            else:
-                #m = 'NONE >> Ref={} cannot found'.format(refname)
-                fname = '{}\n'.format(refname.strip())
-                fn.write(fname)
+    counts = compareFiles(args.ref, args.target, args.out, ridx=args.refidx, tidx=args.tgidx, key=args.key, pattern=args.pattern, mode=args.mode, suffix=args.suffix)
+    print("Matched : {}\nMissing : {}\nExtra   : {}".format(counts['matched'], counts['missing'], counts['extra']))
@@ -0,0 +1,273 @@
+"""
+# Purpose     : Copy final results files into local disk
+# Descriptions:
+#  - Lists the result bucket once (gsList.py) and downloads all files of all samples
+#    with one worker pool
+#  - The listing (gsList.py, cache '-c') is refreshed on every run; only changed prefixes and objects
+#    are listed again
+#  - A file is skipped when the local copy has the same size and checksum (MD5, or CRC32C of
+#    composite objects)
+#  - Downloads are written in '<file>.part' and resumed from its size with ranged reads
+#    ('gsutil cat -r <start>-'), then verified and renamed; a part of an object whose checksum cannot
+#    be checked (large composite object without google_crc32c) is downloaded again from the start
+#  - Files are selected with include/exclude glob patterns on the path relative to the bucket
+#    (default excludes: aligned_reads and worker_logs directories)
+#  - Total bandwidth can be capped (--bwlimit)
+#  - A local directory can stand in for the bucket to run offline
+#
+# Start date  : Oct 17, 2026
+# Last update : Oct 17, 2026
+"""
+
+__author__ 		= "Jong Cheol Jeong"
+__copyright__ 	= "Copyright 2018, UK Cancer Research Informatics"
+__version__ 	= "1.0.0"
+__maintainer__ 	= "Jong Cheol Jeong"
+__email__ 		= "jjeong@kcr.uky.edu"
+
+
+import subprocess
+import threading
+import argparse
+import fnmatch
+import time
+import sys
+import os
+import gsList
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+NPROC = 16
+CHUNK = 4 * 1024 * 1024
+RETRIES = 3
+
+#-- directories that will be ignored to be copied (same as 'ignorDir' of copyResults.sh)
+EXCLUDES = ['*/aligned_reads/*', '*/worker_logs/*']
+
+
+"""
+#------------------------------------------------------------------------------
+# Token bucket shared by all downloads
+# - consume() blocks until the transfer of n bytes is allowed at 'rate' bytes/sec
+#------------------------------------------------------------------------------
+"""
+class Bandwidth(object):
+
+    def __init__(self, rate=None):
+        self.rate = rate
+        self.tokens = rate or 0
+        self.last = time.time()
+        self.lock = threading.Lock()
+
+    def consume(self, n):
+        if not self.rate:
+            return
+
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= n
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+
+        if wait > 0:
+            time.sleep(wait)
+
+
+"""
+#------------------------------------------------------------------------------
+# Select files with include/exclude patterns on the path relative to the bucket
+#------------------------------------------------------------------------------
+"""
+def selected(relPath, includes=None, excludes=None):
+    if includes and not any([fnmatch.fnmatchcase(relPath, pat) for pat in includes]):
+        return False
+    if excludes and any([fnmatch.fnmatchcase(relPath, pat) for pat in excludes]):
+        return False
+    return True
+
+
+"""
+#------------------------------------------------------------------------------
+# Open a stream of an object from byte 'start'
+#------------------------------------------------------------------------------
+"""
+def openRange(src, start=0, gsutil='gsutil'):
+    if not src.startswith('gs://'):
+        f = open(src, 'rb')
+        f.seek(start)
+        return f, None
+
+    proc = subprocess.Popen([gsutil, '-q', 'cat', '-r', '{}-'.format(start), src], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return proc.stdout, proc
+
+
+"""
+#------------------------------------------------------------------------------
+# Local copy of an object is complete
+#------------------------------------------------------------------------------
+"""
+def isSame(obj, dst, checksum=True):
+    if not os.path.isfile(dst) or os.path.getsize(dst) != obj['size']:
+        return False
+    if checksum and gsList.canVerify(obj['checksum'], obj['size']):
+        return gsList.fileChecksum(dst, obj['checksum'].split(':')[0]) == obj['checksum']
+    return True
+
+
+"""
+#------------------------------------------------------------------------------
+# Download one object into dst, resuming '<dst>.part'
+# Returns the number of bytes transferred
+#------------------------------------------------------------------------------
+"""
+def download(obj, dst, bandwidth=None, checksum=True, gsutil='gsutil'):
+    part = '{}.part'.format(dst)
+    dstDir = os.path.dirname(dst)
+    if dstDir and not os.path.isdir(dstDir):
+        try:
+            os.makedirs(dstDir)
+        except OSError:
+            pass
+
+    verify = checksum and gsList.canVerify(obj['checksum'], obj['size'])
+    start = os.path.getsize(part) if os.path.isfile(part) else 0
+    if start > obj['size'] or (start > 0 and checksum and obj['checksum'] and not verify):
+        os.remove(part)
+        start = 0
+
+    nBytes = 0
+    if start < obj['size']:
+        stream, proc = openRange(obj['name'], start, gsutil)
+        try:
+            with open(part, 'ab') as f:
+                for chunk in iter(lambda: stream.read(CHUNK), b''):
+                    if bandwidth is not None:
+                        bandwidth.consume(len(chunk))
+                    f.write(chunk)
+                    nBytes += len(chunk)
+        finally:
+            stream.close()
+            if proc is not None:
+                err = proc.stderr.read().decode('utf-8', 'replace').strip()
+                if proc.wait() != 0:
+                    raise IOError("gsutil cat exited with {}: {}".format(proc.returncode, err))
+
+    size = os.path.getsize(part)
+    if size != obj['size']:
+        raise IOError("incomplete download ({} of {} bytes)".format(size, obj['size']))
+
+    if verify:
+        if gsList.fileChecksum(part, obj['checksum'].split(':')[0]) != obj['checksum']:
+            os.remove(part)
+            raise IOError("checksum mismatch")
+
+    os.rename(part, dst)
+    return nBytes
+
+
+"""
+#------------------------------------------------------------------------------
+# Copy the results of a bucket into homeDir
+# :: Example Code ::
+# summary = copyResults('gs://my-results', '/my/local/dir', includes=['*.vcf.gz', '*.tbi'], nProc=16, bwLimit=100 * 1024 * 1024)
+#
+# Returns dictionary with 'copied', 'skipped', 'failed' [(relPath, message)], 'bytes' and 'elapsed'
+#------------------------------------------------------------------------------
+"""
+def copyResults(gsdir=None, homeDir=None, includes=None, excludes=None, nProc=NPROC, bwLimit=None, checksum=True,
+                retries=RETRIES, listing=None, gsutil='gsutil'):
+
+    assert (not (gsdir is None)), "Result bucket must be given!!\nExample) gs://my-results\n"
+    assert (not (homeDir is None)), "Local directory must be given!!\nExample) /my/local/dir\n"
+
+    if excludes is None:
+        excludes = EXCLUDES
+
+    if listing is None:
+        listing = gsList.Listing(gsutil=gsutil)
+
+    start = time.time()
+    root = listing.normRoot(gsdir)
+    objects = []
+    for obj in listing.select(root):
+        relPath = obj['name'][len(root) + 1:]
+        if relPath and not relPath.endswith('/') and selected(relPath, includes, excludes):
+            objects.append((relPath, obj))
+
+    bandwidth = Bandwidth(bwLimit)
+    summary = {'copied': [], 'skipped': [], 'failed': [], 'bytes': 0}
+    lock = threading.Lock()
+
+    def copy(relPath, obj):
+        dst = os.path.join(homeDir, relPath)
+        if isSame(obj, dst, checksum):
+            return ('skipped', 0)
+
+        for attempt in range(retries + 1):
+            try:
+                return ('copied', download(obj, dst, bandwidth, checksum, gsutil))
+            except (IOError, OSError):
+                if attempt == retries:
+                    raise
+                time.sleep(2 ** attempt)
+
+    nObj = len(objects)
+    count = 0
+    with ThreadPoolExecutor(max_workers=max(1, min(nProc, nObj))) as pool:
+        futures = dict([(pool.submit(copy, relPath, obj), relPath) for relPath, obj in objects])
+        for future in as_completed(futures):
+            relPath = futures[future]
+            count += 1
+            try:
+                state, nBytes = future.result()
+                with lock:
+                    summary[state].append(relPath)
+                    summary['bytes'] += nBytes
+                msg = state
+            except Exception as err:
+                summary['failed'].append((relPath, str(err)))
+                msg = 'FAILED ({})'.format(err)
+            print("[{}/{}] {} {}".format(count, nObj, relPath, msg))
+
+    summary['elapsed'] = time.time() - start
+    return summary
+
+
+"""
+#------------------------------------------------------------------------------
+# :: USAGE ::
+# >> python copyResults.py gs://my-results /my/local/dir
+# >> python copyResults.py gs://my-results /my/local/dir --include '*.vcf.gz' --include '*.tbi' -n 32 --bwlimit 200
+#------------------------------------------------------------------------------
+"""
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("gsdir", help='result bucket (e.g., gs://my-results) or a local directory')
+    parser.add_argument("homeDir", help='local directory where results are copied')
+    parser.add_argument("-n", "--nproc", help='number of files copied at the same time [Default={}]'.format(NPROC), type=int, default=NPROC)
+    parser.add_argument("-I", "--include", help='copy only files matching this glob (repeatable, e.g., "*.vcf.gz")', action='append', default=None)
+    parser.add_argument("-x", "--exclude", help='skip files matching this glob (repeatable) [Default={}]'.format(' '.join(EXCLUDES)), action='append', default=None)
+    parser.add_argument("--bwlimit", help='total bandwidth in MB/sec [Default=no limit]', type=float, default=None)
+    parser.add_argument("--no-md5", help='compare sizes only (skip MD5/CRC32C of local files)', action='store_true')
+    parser.add_argument("--retries", help='number of retries of a failed file [Default={}]'.format(RETRIES), type=int, default=RETRIES)
+    parser.add_argument("-c", "--cache", help='listing cache file (gsList.py)', action='store', default=None)
+    parser.add_argument("--gsutil", help='gsutil executable [Default=gsutil]', action='store', default='gsutil')
+
+    args = parser.parse_args()
+
+    bwLimit = args.bwlimit * 1024 * 1024 if args.bwlimit else None
+    listing = gsList.Listing(args.cache, gsutil=args.gsutil)
+
+    summary = copyResults(args.gsdir, args.homeDir, includes=args.include, excludes=args.exclude, nProc=args.nproc, bwLimit=bwLimit,
+                          checksum=not args.no_md5, retries=args.retries, listing=listing, gsutil=args.gsutil)
+
+    print('\n')
+    print("Copied  : {} ({:.1f} MB)".format(len(summary['copied']), summary['bytes'] / 1024.0 / 1024.0))
+    print("Skipped : {}".format(len(summary['skipped'])))
+    print("Failed  : {}".format(len(summary['failed'])))
+    print("Elapsed : {:.1f} sec".format(summary['elapsed']))
+    for relPath, msg in summary['failed']:
+        print("\t - {} : {}".format(relPath, msg))
+
+    sys.exit(1 if len(summary['failed']) > 0 else 0)
@@ -2,9 +2,18 @@
 # Purpose     : To submit multiple jobs via dsub
 # Descriptions:
 #  - Codes contain functions to submit jobs via Google Cloud 'dsub'
+#  - submitTasks() submits a whole list of BAM files with a single 'dsub --tasks' call
+#  - autoSize=True sizes CPU, RAM, JVM heap and disk of a job from its input size (sizing.py)
+#  - cache=StageCache(...) reuses outputs already computed for the same input bytes (stageCache.py)
+#  - NativeBamIndex builds the BAI with bamIndex.py in a small python job instead of Picard
+#  - shardJobs() splits SortSam/FixMate into scatter -> N shard jobs -> gather (submitted by pipeDag.py)
+#  - groupUnmapped() groups flowcell/read group uBAMs by sample for one GATK workflow per sample
+#  - UnmapBamByRG() writes one uBAM per read group and a manifest ('<sample>.unmapped_bams.list')
+#    that groupUnmapped() expands into the flowcell_unmapped_bams of the sample
+#  - dsub and gcloud submissions are rate limited per project and region (rateLimit.py)
 #
 # Start date  : May 17, 2018
-# Last update : Aug 3, 2018
+# Last update : Oct 17, 2026
 """
 
 __author__ 		= "Jong Cheol Jeong"
@@ -15,90 +24,220 @@ __email__ 		= "jjeong@kcr.uky.edu"
 
 
 import subprocess
-import shutil
-import glob
+import threading
+import time
 import re
 import os
 import json
+import sizing
+from concurrent.futures import ThreadPoolExecutor
+import cmpFiles
+import bamTriage
+import rateLimit
 from collections import OrderedDict
 
+
 """
 #------------------------------------------------------------------------------
-# Add PL: variable in BAM file
-# :: Example Code ::
-# headAddPL(inFile='gs://cloud-storage-01/example1_DNA.bam', outFile='gs://cloud-storage-02/example1_DNA.head.bam', scriptPath='/local/full/path/script.sh')
-# 
-# :: TIP ::
-# gsutil ls gs://jc-gatk-bam |grep 'bam$' > bamList.txt
-# OR
-# gsutil ls gs://jc-gatk-bam |grep -H '.*bam$' |sed -e "s|.*\(gs.*$\)|\1|"  > bamList.txt
+# Default docker image, minimum RAM (GB), JVM heap (GB) and command of each dsub stage
+# - commands are format strings: ${{INFILE}} and ${{OUTFILE}} are dsub variables
 #------------------------------------------------------------------------------
 """
-def headAddPL(prjName=None, Zones=None, Logs=None, Image=None, inFile=None, outFile=None, scriptPath=None, cmd=None):
+STAGES = OrderedDict()
+
+STAGES['headAddPL'] = {
+    'Image'  : 'zlskidmore/samtools:1.4.1',
+    'minRam' : None,
+    'cmd'    : "samtools view -H ${{INFILE}} | sed -e 's/SM:\\(.*\\)/SM:\\1\\tPL:illumina/' |samtools reheader -P - ${{INFILE}} > ${{OUTFILE}}",
+}
+
+STAGES['CleanSam'] = {
+    'Image'  : 'maxulysse/picard',
+    'minRam' : '9',
+    'heap'   : '8',
+    'cmd'    : "java -Xmx{heap}G -jar /opt/picard/picard.jar CleanSam I=${{INFILE}} O=${{OUTFILE}}",
+}
+
+STAGES['FixMate'] = {
+    'Image'  : 'maxulysse/picard',
+    'minRam' : '17',
+    'heap'   : '16',
+    'cmd'    : "java -Xmx{heap}G -Djava.io.tmpdir=`pwd`/tmp -jar /opt/picard/picard.jar FixMateInformation I=${{INFILE}} O=${{OUTFILE}}",
+}
+
+STAGES['SortSam'] = {
+    'Image'  : 'maxulysse/picard',
+    'minRam' : '17',
+    'heap'   : '16',
+    'cmd'    : "java -Xmx{heap}G -Djava.io.tmpdir=`pwd`/tmp -jar /opt/picard/picard.jar SortSam I=${{INFILE}} O=${{OUTFILE}} SORT_ORDER={sorder}",
+}
+
+STAGES['BuildBamIndex'] = {
+    'Image'  : 'maxulysse/picard',
+    'minRam' : '17',
+    'heap'   : '16',
+    'cmd'    : "java -Xmx{heap}G -Djava.io.tmpdir=`pwd`/tmp -jar /opt/picard/picard.jar BuildBamIndex I=${{INFILE}} O=${{OUTFILE}}",
+}
+
+#-- python modules in 'modules' are written into the job script (no image with the code needed)
+STAGES['NativeBamIndex'] = {
+    'Image'  : 'python:3.11-slim',
+    'minRam' : '2',
+    'modules': ['bgzf.py', 'bamIndex.py'],
+    'cmd'    : "{modules}python3 bamIndex.py ${{INFILE}} -o ${{OUTFILE}} -t $(nproc)",
+}
+
+#-- scatter/gather of sharded SortSam and FixMate (bamShard.py); ${{OUTFILE}} of ScatterBam is a wildcard output
+STAGES['ScatterBam'] = {
+    'Image'  : 'python:3.11-slim',
+    'minRam' : '4',
+    'modules': ['bgzf.py', 'bamIndex.py', 'bamShard.py'],
+    'cmd'    : "{modules}python3 bamShard.py scatter ${{INFILE}} $(dirname ${{OUTFILE}}) -n {shards} -m {mode}",
+}
+
+STAGES['GatherBam'] = {
+    'Image'  : 'python:3.11-slim',
+    'minRam' : '4',
+    'modules': ['bgzf.py', 'bamIndex.py', 'bamShard.py'],
+    'cmd'    : "{modules}python3 bamShard.py gather ${{OUTFILE}} ${{INFILE}} --index ${{OUTBAI}} -m {mode} -t $(nproc)",
+}
+
+REVERT_ARGS = ' '.join(("SANITIZE=true MAX_DISCARD_FRACTION=0.005 ATTRIBUTE_TO_CLEAR=XT ATTRIBUTE_TO_CLEAR=XN ATTRIBUTE_TO_CLEAR=X0",
+                         "ATTRIBUTE_TO_CLEAR=MD ATTRIBUTE_TO_CLEAR=XG ATTRIBUTE_TO_CLEAR=XG ATTRIBUTE_TO_CLEAR=AM ATTRIBUTE_TO_CLEAR=NM",
+                         "ATTRIBUTE_TO_CLEAR=SM ATTRIBUTE_TO_CLEAR=XM ATTRIBUTE_TO_CLEAR=XG ATTRIBUTE_TO_CLEAR=XO ATTRIBUTE_TO_CLEAR=X1",
+                         "ATTRIBUTE_TO_CLEAR=XA SORT_ORDER=queryname RESTORE_ORIGINAL_QUALITIES=true REMOVE_DUPLICATE_INFORMATION=true REMOVE_ALIGNMENT_INFORMATION=true"))
+
+STAGES['UnmapBam'] = {
+    'Image'  : 'maxulysse/picard',
+    'minRam' : '17',
+    'heap'   : '16',
+    'cmd'    : "java -Xmx{heap}G -Djava.io.tmpdir=`pwd`/tmp -jar /opt/picard/picard.jar RevertSam I=${{INFILE}} O=${{OUTFILE}} " + REVERT_ARGS,
+}
+
+#-- one uBAM per read group ('<RG ID>.bam'); ${{OUTFILE}} is a wildcard output ('<outDir>/*.bam') and
+#   ${{MANIFEST}} lists the uBAMs as they are published in {outDir}
+STAGES['UnmapBamByRG'] = {
+    'Image'  : 'maxulysse/picard',
+    'minRam' : '17',
+    'heap'   : '16',
+    'cmd'    : ' '.join(("mkdir -p $(dirname ${{OUTFILE}}) &&",
+                         "java -Xmx{heap}G -Djava.io.tmpdir=`pwd`/tmp -jar /opt/picard/picard.jar RevertSam I=${{INFILE}} O=$(dirname ${{OUTFILE}})",
+                         "OUTPUT_BY_READGROUP=true OUTPUT_BY_READGROUP_FILE_FORMAT=bam " + REVERT_ARGS + " &&",
+                         "for f in $(dirname ${{OUTFILE}})/*.bam; do echo {outDir}/$(basename $f); done > ${{MANIFEST}}")),
+}
 
-    #if prjName is None:
-    #    prjName = 'my-project-id'
 
-    if Zones is None:
-        Zones = 'us-*'
+"""
+#------------------------------------------------------------------------------
+# Command of a stage with its parameters filled in
+# :: Example Code ::
+# stageCmd('SortSam', sorder='coordinate', heap=16)
+#------------------------------------------------------------------------------
+"""
+def stageCmd(stage, **params):
+    assert (stage in STAGES), "Unknown stage '{}'!!\nAvailable stages) {}\n".format(stage, ', '.join(STAGES.keys()))
 
-    #if Logs is None:
-    #    Logs = 'gs://my-log'
+    if params.get('heap') is None:
+        params['heap'] = STAGES[stage].get('heap')
 
-    if Image is None:
-        Image = 'zlskidmore/samtools:1.4.1'
+    if 'modules' in STAGES[stage] and params.get('modules') is None:
+        params['modules'] = embedModules(STAGES[stage]['modules'])
 
-    assert(not (prjName is None)), "Project ID must be given!!\nExample) my-project-id\n"
-    assert(not (inFile is None)), "Input file must be given!!\nExample) gs://<bucket>/xxxx.bam\n"
-    assert (not (outFile is None)), "Output file must be given!!\nExample) gs://<bucket>/yyyy.bam\n"
-    assert (not (scriptPath is None)), "The path of script file to be written. This will be used for submitting jobs (Required!)\nExample) /local/full/path/script.sh\n"
+    return STAGES[stage]['cmd'].format(**params)
 
-    if cmd is None:
-        cmd = "samtools view -H ${INFILE} | sed -e 's/SM:\\(.*\\)/SM:\\1\\tPL:illumina/' |samtools reheader -P - ${INFILE} > ${OUTFILE}"
+
+"""
+#------------------------------------------------------------------------------
+# Shell lines writing python modules of this directory into the working directory of a job
+# :: Example Code ::
+# embedModules(['bgzf.py', 'bamIndex.py'])
+#------------------------------------------------------------------------------
+"""
+def embedModules(names):
+    lines = []
+    for name in names:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), name)) as f:
+            source = f.read()
+        marker = "__{}__".format(name.replace('.', '_').upper())
+        lines.append("cat > {} <<'{}'\n{}{}\n".format(name, marker, source if source.endswith('\n') else source + '\n', marker))
+    return ''.join(lines)
 
 
-    #-- Writing Script
+"""
+#------------------------------------------------------------------------------
+# Write the bash script given to 'dsub --script'
+#------------------------------------------------------------------------------
+"""
+def writeScript(scriptPath, cmd):
     with open(scriptPath, 'w') as f:
         f.write("#!/bin/bash\n")
         f.write(cmd)
 
 
-    pgExec = 'dsub'
+"""
+#------------------------------------------------------------------------------
+# dsub options shared by all stages (without --input/--output/--tasks)
+#------------------------------------------------------------------------------
+"""
+def dsubArgs(name=None, prjName=None, Zones=None, Logs=None, Image=None, minRam=None, scriptPath=None, minCores=None, diskSize=None):
     Args = []
 
-    #-- job name is same as inFile name
     Args.append('--name')
-    Args.append(inFile.split('/')[len(inFile.split('/')) - 1].split('.')[0])
+    Args.append(name)
 
     Args.append('--project')
     Args.append(prjName)
 
+    #-- one zone, a wildcard ('us-*') or a list of zones given as separate values
     Args.append('--zones')
-    Args.append(Zones)
+    Args.extend(Zones if isinstance(Zones, list) else [Zones])
 
     Args.append('--logging')
     Args.append(Logs)
 
-    Args.append('--input')
-    tmp = 'INFILE={}'.format(inFile)
-    Args.append(tmp)
-
-    Args.append('--output')
-    tmp = 'OUTFILE={}'.format(outFile)
-    Args.append(tmp)
-
     Args.append('--image')
     Args.append(Image)
 
+    if minRam is not None:
+        Args.append('--min-ram')
+        Args.append(str(minRam))
+
+    if minCores is not None:
+        Args.append('--min-cores')
+        Args.append(str(minCores))
+
+    if diskSize is not None:
+        Args.append('--disk-size')
+        Args.append(str(diskSize))
+
     Args.append('--script')
-    tmp = "{}".format(scriptPath)
-    Args.append(tmp)
+    Args.append(scriptPath)
+
+    return Args
+
 
+"""
+#------------------------------------------------------------------------------
+# Run dsub and write its output into '<scriptPath>.proc.txt'
+# - submissions share the limits of rateLimit.limiter(); quota errors and requests the server did
+#   not process are retried with backoff, other errors raise subprocess.CalledProcessError
+# - errors after which the job may already exist (timeouts, resets, HTTP 500/502/504) are not
+#   retried, so a submission never launches the same job twice
+# - rateLimit.SubmitError is raised if dsub returns no job ID
+#------------------------------------------------------------------------------
+"""
+def runDsub(Args, scriptPath):
+    pgExec = 'dsub'
 
     command = [pgExec]
     command.extend(Args)
 
-    process = subprocess.check_output(command)
+    #-- quota of the project and region of the job
+    project = Args[Args.index('--project') + 1] if '--project' in Args else None
+    region = rateLimit.regionOf(Args[Args.index('--zones') + 1]) if '--zones' in Args else None
+    process = rateLimit.limiter().run(command, project=project, region=region, idempotent=False)
+    if parseJobID(process) == '':
+        raise rateLimit.SubmitError("dsub returned no job ID: {}".format(scriptPath))
 
     #-- Writing process information
     procOut = "{}.proc.txt".format(scriptPath)
@@ -108,35 +247,39 @@ def headAddPL(prjName=None, Zones=None, Logs=None, Image=None, inFile=None, outF
     return process
 
 
-
 """
 #------------------------------------------------------------------------------
-# Add Cleaning SAM file
-# :: Example Code ::
-# CleanSam(inFile='gs://cloud-storage-01/example1_DNA.bam', outFile='gs://cloud-storage-02/example1_DNA.head.bam', scriptPath='/local/full/path/script.sh')
-# 
-# :: TIP ::
-# gsutil ls gs://cloud-storage-01 |grep 'bam$' > bamList.txt
-# OR
-# gsutil ls gs://cloud-storage-01 |grep -H '.*bam$' |sed -e "s|.*\(gs.*$\)|\1|"  > bamList.txt
+# Submit one BAM file to a stage
+# - shared body of headAddPL, CleanSam, FixMate, BuildBamIndex, NativeBamIndex, SortSam, UnmapBam and UnmapBamByRG
+# - extraOutputs : additional dsub outputs e.g., {'OUTBAI': 'gs://<bucket>/yyyy.bam.bai'}
+# - autoSize     : size minRam, minCores, diskSize and heap from the input size with sizeRules
+#                  (values given explicitly are kept); 'size' can be given if already computed
+# - the resources of the job are written in '<scriptPath>.size.json'
+# - cache        : stageCache.StageCache checked before submitting; on a hit the cached outputs are
+#                  copied to outFile/extraOutputs and a stageCache.CacheHit is returned instead of the dsub output
+# - name         : job name [Default=name of inFile without extensions]
 #------------------------------------------------------------------------------
 """
-def CleanSam(prjName=None, Zones=None, Logs=None, Image=None, inFile=None, outFile=None, scriptPath=None, minRam=None, cmd=None):
-
-    #if prjName is None:
-    #    prjName = 'my-project-id'
+def submitStage(stage=None, prjName=None, Zones=None, Logs=None, Image=None, inFile=None, outFile=None, scriptPath=None, minRam=None, cmd=None, extraOutputs=None,
+                minCores=None, diskSize=None, heap=None, autoSize=False, sizeRules=None, size=None, cache=None, name=None, **params):
 
     if Zones is None:
         Zones = 'us-*'
 
-    #if Logs is None:
-    #    Logs = 'gs://my-log'
-
     if Image is None:
-        Image = 'maxulysse/picard'
+        Image = STAGES[stage]['Image']
+
+    if autoSize and size is None:
+        size = sizing.sizeStage(stage, sizing.objectSize(inFile), sizeRules)
+
+    if size is not None:
+        minRam = size['ram'] if minRam is None else minRam
+        minCores = size['cpu'] if minCores is None else minCores
+        diskSize = size['disk'] if diskSize is None else diskSize
+        heap = size['heap'] if heap is None else heap
 
     if minRam is None:
-        minRam = '9'
+        minRam = STAGES[stage]['minRam']
 
     assert(not (prjName is None)), "Project ID must be given!!\nExample) my-project-id\n"
     assert(not (inFile is None)), "Input file must be given!!\nExample) gs://<bucket>/xxxx.bam\n"
@@ -144,245 +287,264 @@ def CleanSam(prjName=None, Zones=None, Logs=None, Image=None, inFile=None, outFi
     assert (not (scriptPath is None)), "The path of script file that will be used for submitting job must be given!!\nExample) /local/full/path/script.sh\n"
 
     if cmd is None:
-        cmd = "java -Xmx8G -jar /opt/picard/picard.jar CleanSam I=${INFILE} O=${OUTFILE}"
+        cmd = stageCmd(stage, heap=heap, **params)
 
-    #-- Writing Script
-    with open(scriptPath, 'w') as f:
-        f.write("#!/bin/bash\n")
-        f.write(cmd)
+    #-- Outputs of the same input, image and command are already computed
+    if cache is not None:
+        hit = cache.check(stage, Image, cmd, inFile, outFile, extraOutputs)
+        if hit is not None:
+            return hit
 
+    #-- Writing Script
+    writeScript(scriptPath, cmd)
 
-    pgExec = 'dsub'
-    Args = []
+    #-- Writing resources of the job
+    writeResources(scriptPath, inFile, stage, size, minRam, minCores, diskSize, heap)
 
     #-- job name is same as inFile name
-    Args.append('--name')
-    Args.append(inFile.split('/')[len(inFile.split('/')) - 1].split('.')[0])
-
-    Args.append('--project')
-    Args.append(prjName)
-
-    Args.append('--zones')
-    Args.append(Zones)
+    if name is None:
+        name = inFile.split('/')[-1].split('.')[0]
 
-    Args.append('--logging')
-    Args.append(Logs)
+    Args = dsubArgs(name=name, prjName=prjName, Zones=Zones, Logs=Logs, Image=Image, minRam=minRam, scriptPath=scriptPath, minCores=minCores, diskSize=diskSize)
 
     Args.append('--input')
-    tmp = 'INFILE={}'.format(inFile)
-    Args.append(tmp)
+    Args.append('INFILE={}'.format(inFile))
 
     Args.append('--output')
-    tmp = 'OUTFILE={}'.format(outFile)
-    Args.append(tmp)
+    Args.append('OUTFILE={}'.format(outFile))
 
-    Args.append('--image')
-    Args.append(Image)
-
-    Args.append('--min-ram')
-    Args.append(minRam)
-
-    Args.append('--script')
-    tmp = "{}".format(scriptPath)
-    Args.append(tmp)
-
-
-    command = [pgExec]
-    command.extend(Args)
-
-    process = subprocess.check_output(command)
-
-    #-- Writing process information
-    procOut = "{}.proc.txt".format(scriptPath)
-    with open(procOut, 'w') as f:
-        f.write(str(process).strip())
-
-    return process
+    if extraOutputs is not None:
+        for key in extraOutputs:
+            Args.append('--output')
+            Args.append('{}={}'.format(key, extraOutputs[key]))
 
+    return runDsub(Args, scriptPath)
 
 
 """
 #------------------------------------------------------------------------------
-# FixMateInformation
+# Submit a list of BAM files to a stage with a single 'dsub --tasks' call
 # :: Example Code ::
-# FixMate(inFile='gs://cloud-storage-01/example1_DNA.bam', outFile='gs://cloud-storage-02/example1_DNA.head.bam', scriptPath='/local/full/path/script.sh')
-# 
-# :: TIP ::
-# gsutil ls gs://cloud-storage-01 |grep 'bam$' > bamList.txt
-# OR
-# gsutil ls gs://cloud-storage-01 |grep -H '.*bam$' |sed -e "s|.*\(gs.*$\)|\1|"  > bamList.txt
+# submitTasks(stage='CleanSam', prjName='my-project-id', inFiles=['gs://b1/x.bam', 'gs://b1/y.bam'],
+#             outFiles=['gs://b2/x.clean.bam', 'gs://b2/y.clean.bam'], scriptPath='/local/full/path/CleanSam.sh')
+#
+# - all tasks share one script (scriptPath)
+# - the task file is written in '<scriptPath>.tasks.tsv' with INFILE/OUTFILE columns
+# - job ID and task ID of each row are written in '<scriptPath>.jobs.txt'
+# - extraOutputs : additional output columns e.g., {'OUTBAI': ['gs://b2/x.bam.bai', 'gs://b2/y.bam.bai']}
+# - autoSize     : resources are job-level in dsub, so all tasks are sized for the largest input
 #------------------------------------------------------------------------------
 """
-def FixMate(prjName=None, Zones=None, Logs=None, Image=None, inFile=None, outFile=None, scriptPath=None, minRam=None, cmd=None):
-
-    #if prjName is None:
-    #    prjName = 'my-project-id'
-
+def submitTasks(stage=None, prjName=None, Zones=None, Logs=None, Image=None, inFiles=None, outFiles=None, scriptPath=None, minRam=None, cmd=None, name=None, extraOutputs=None,
+                minCores=None, diskSize=None, heap=None, autoSize=False, sizeRules=None, size=None, **params):
 
     if Zones is None:
         Zones = 'us-*'
 
-    #if Logs is None:
-    #    Logs = 'gs://my-log'
-
     if Image is None:
-        Image = 'maxulysse/picard'
+        Image = STAGES[stage]['Image']
+
+    if autoSize and size is None:
+        size = sizing.sizeStage(stage, max(sizing.objectSizes(inFiles).values()), sizeRules)
+
+    if size is not None:
+        minRam = size['ram'] if minRam is None else minRam
+        minCores = size['cpu'] if minCores is None else minCores
+        diskSize = size['disk'] if diskSize is None else diskSize
+        heap = size['heap'] if heap is None else heap
 
     if minRam is None:
-        minRam = '17'
+        minRam = STAGES[stage]['minRam']
+
+    if name is None:
+        name = stage.lower()
+
+    if extraOutputs is None:
+        extraOutputs = OrderedDict()
 
     assert(not (prjName is None)), "Project ID must be given!!\nExample) my-project-id\n"
-    assert(not (inFile is None)), "Input file must be given!!\nExample) gs://<bucket>/xxxx.bam\n"
-    assert (not (outFile is None)), "Output file must be given!!\nExample) gs://<bucket>/yyyy.bam\n"
+    assert(not (inFiles is None)), "List of input files must be given!!\nExample) ['gs://<bucket>/xxxx.bam']\n"
+    assert (not (outFiles is None)), "List of output files must be given!!\nExample) ['gs://<bucket>/yyyy.bam']\n"
+    assert (len(inFiles) == len(outFiles)), "The number of inputs and outputs are different\n"
+    assert (len(inFiles) > 0), "List of input files is empty\n"
+    for key in extraOutputs:
+        assert (len(extraOutputs[key]) == len(inFiles)), "The number of inputs and '{}' outputs are different\n".format(key)
     assert (not (scriptPath is None)), "The path of script file that will be used for submitting job must be given!!\nExample) /local/full/path/script.sh\n"
 
     if cmd is None:
-        cmd = "java -Xmx16G -Djava.io.tmpdir=`pwd`/tmp -jar /opt/picard/picard.jar FixMateInformation I=${INFILE} O=${OUTFILE}"
-
-    #-- Writing Script
-    with open(scriptPath, 'w') as f:
-        f.write("#!/bin/bash\n")
-        f.write(cmd)
+        cmd = stageCmd(stage, heap=heap, **params)
 
+    #-- Writing one script shared by all tasks
+    writeScript(scriptPath, cmd)
 
-    pgExec = 'dsub'
-    Args = []
+    #-- Writing resources of the job
+    writeResources(scriptPath, ','.join(inFiles), stage, size, minRam, minCores, diskSize, heap)
 
-    #-- job name is same as inFile name
-    Args.append('--name')
-    Args.append(inFile.split('/')[len(inFile.split('/')) - 1].split('.')[0])
-
-    Args.append('--project')
-    Args.append(prjName)
+    #-- Writing task file
+    tasksPath = "{}.tasks.tsv".format(scriptPath)
+    with open(tasksPath, 'w') as f:
+        header = ["--input INFILE", "--output OUTFILE"] + ["--output {}".format(key) for key in extraOutputs]
+        f.write("{}\n".format('\t'.join(header)))
+        for i in range(len(inFiles)):
+            row = [inFiles[i], outFiles[i]] + [extraOutputs[key][i] for key in extraOutputs]
+            f.write("{}\n".format('\t'.join(row)))
 
-    Args.append('--zones')
-    Args.append(Zones)
+    Args = dsubArgs(name=name, prjName=prjName, Zones=Zones, Logs=Logs, Image=Image, minRam=minRam, scriptPath=scriptPath, minCores=minCores, diskSize=diskSize)
 
-    Args.append('--logging')
-    Args.append(Logs)
+    Args.append('--tasks')
+    Args.append(tasksPath)
 
-    Args.append('--input')
-    tmp = 'INFILE={}'.format(inFile)
-    Args.append(tmp)
+    process = runDsub(Args, scriptPath)
+    jobID = parseJobID(process)
 
-    Args.append('--output')
-    tmp = 'OUTFILE={}'.format(outFile)
-    Args.append(tmp)
+    #-- Writing job and task ID of each row - dsub numbers tasks from 1 in the order of the task file
+    jobsPath = "{}.jobs.txt".format(scriptPath)
+    with open(jobsPath, 'w') as f:
+        header = ["INFILE", "OUTFILE"] + [key for key in extraOutputs] + ["JOB_ID", "TASK_ID"]
+        f.write("{}\n".format('\t'.join(header)))
+        for i in range(len(inFiles)):
+            row = [inFiles[i], outFiles[i]] + [extraOutputs[key][i] for key in extraOutputs] + [jobID, str(i + 1)]
+            f.write("{}\n".format('\t'.join(row)))
 
-    Args.append('--image')
-    Args.append(Image)
+    return jobID
 
-    Args.append('--min-ram')
-    Args.append(minRam)
 
-    Args.append('--script')
-    tmp = "{}".format(scriptPath)
-    Args.append(tmp)
+"""
+#------------------------------------------------------------------------------
+# Write the resources given to dsub into '<scriptPath>.size.json'
+#------------------------------------------------------------------------------
+"""
+def writeResources(scriptPath, inFile, stage, size, minRam, minCores, diskSize, heap):
+    res = OrderedDict()
+    res['stage'] = stage
+    res['inputGB'] = size['inputGB'] if size is not None else None
+    res['cpu'] = minCores
+    res['ram'] = minRam
+    res['heap'] = heap if heap is not None else STAGES.get(stage, {}).get('heap')
+    res['disk'] = diskSize
+    return sizing.writeSize(scriptPath, inFile, res)
 
 
-    command = [pgExec]
-    command.extend(Args)
+"""
+#------------------------------------------------------------------------------
+# Extract job ID from the output of dsub
+#------------------------------------------------------------------------------
+"""
+def parseJobID(process):
+    if isinstance(process, bytes):
+        process = process.decode('utf-8', 'replace')
 
-    process = subprocess.check_output(command)
+    lines = [line.strip() for line in process.strip().split('\n') if line.strip()]
+    if len(lines) == 0:
+        return ''
 
-    #-- Writing process information
-    procOut = "{}.proc.txt".format(scriptPath)
-    with open(procOut, 'w') as f:
-        f.write(str(process).strip())
+    return lines[-1]
 
-    return process
 
 
 """
 #------------------------------------------------------------------------------
-# Building BAM file index
+# Add PL: variable in BAM file
 # :: Example Code ::
-# BuildBamIndex(inFile='gs://cloud-storage-01/example1_DNA.bam', outFile='gs://cloud-storage-02/example1_DNA.head.bam', scriptPath='/local/full/path/script.sh')
-# 
+# headAddPL(inFile='gs://cloud-storage-01/example1_DNA.bam', outFile='gs://cloud-storage-02/example1_DNA.head.bam', scriptPath='/local/full/path/script.sh')
+#
 # :: TIP ::
-# gsutil ls gs://cloud-storage-01 |grep 'bam$' > bamList.txt
+# gsutil ls gs://jc-gatk-bam |grep 'bam$' > bamList.txt
 # OR
-# gsutil ls gs://cloud-storage-01 |grep -H '.*bam$' |sed -e "s|.*\(gs.*$\)|\1|"  > bamList.txt
+# gsutil ls gs://jc-gatk-bam |grep -H '.*bam$' |sed -e "s|.*\(gs.*$\)|\1|"  > bamList.txt
 #------------------------------------------------------------------------------
 """
-def BuildBamIndex(prjName=None, Zones=None, Logs=None, Image=None, inFile=None, outFile=None, scriptPath=None, minRam=None, cmd=None):
+def headAddPL(prjName=None, Zones=None, Logs=None, Image=None, inFile=None, outFile=None, scriptPath=None, cmd=None, **options):
 
     #if prjName is None:
     #    prjName = 'my-project-id'
 
-
-    if Zones is None:
-        Zones = 'us-*'
-
     #if Logs is None:
     #    Logs = 'gs://my-log'
 
-    if Image is None:
-        Image = 'maxulysse/picard'
+    return submitStage(stage='headAddPL', prjName=prjName, Zones=Zones, Logs=Logs, Image=Image, inFile=inFile, outFile=outFile, scriptPath=scriptPath, cmd=cmd, **options)
 
-    if minRam is None:
-        minRam = '17'
 
-    assert(not (prjName is None)), "Project ID must be given!!\nExample) my-project-id\n"
-    assert(not (inFile is None)), "Input file must be given!!\nExample) gs://<bucket>/xxxx.bam\n"
-    assert (not (outFile is None)), "Output file must be given!!\nExample) gs://<bucket>/yyyy.bam\n"
-    assert (not (scriptPath is None)), "The path of script file that will be used for submitting job must be given!!\nExample) /local/full/path/script.sh\n"
-
-    if cmd is None:
-        cmd = "java -Xmx16G -Djava.io.tmpdir=`pwd`/tmp -jar /opt/picard/picard.jar BuildBamIndex I=${INFILE} O=${OUTFILE}"
 
-    #-- Writing Script
-    with open(scriptPath, 'w') as f:
-        f.write("#!/bin/bash\n")
-        f.write(cmd)
+"""
+#------------------------------------------------------------------------------
+# Add Cleaning SAM file
+# :: Example Code ::
+# CleanSam(inFile='gs://cloud-storage-01/example1_DNA.bam', outFile='gs://cloud-storage-02/example1_DNA.head.bam', scriptPath='/local/full/path/script.sh')
+#
+# :: TIP ::
+# gsutil ls gs://cloud-storage-01 |grep 'bam$' > bamList.txt
+# OR
+# gsutil ls gs://cloud-storage-01 |grep -H '.*bam$' |sed -e "s|.*\(gs.*$\)|\1|"  > bamList.txt
+#------------------------------------------------------------------------------
+"""
+def CleanSam(prjName=None, Zones=None, Logs=None, Image=None, inFile=None, outFile=None, scriptPath=None, minRam=None, cmd=None, **options):
 
+    #if prjName is None:
+    #    prjName = 'my-project-id'
 
-    pgExec = 'dsub'
-    Args = []
+    #if Logs is None:
+    #    Logs = 'gs://my-log'
 
-    #-- job name is same as inFile name
-    Args.append('--name')
-    Args.append(inFile.split('/')[len(inFile.split('/')) - 1].split('.')[0])
+    return submitStage(stage='CleanSam', prjName=prjName, Zones=Zones, Logs=Logs, Image=Image, inFile=inFile, outFile=outFile, scriptPath=scriptPath, minRam=minRam, cmd=cmd, **options)
 
-    Args.append('--project')
-    Args.append(prjName)
 
-    Args.append('--zones')
-    Args.append(Zones)
 
-    Args.append('--logging')
-    Args.append(Logs)
+"""
+#------------------------------------------------------------------------------
+# FixMateInformation
+# :: Example Code ::
+# FixMate(inFile='gs://cloud-storage-01/example1_DNA.bam', outFile='gs://cloud-storage-02/example1_DNA.head.bam', scriptPath='/local/full/path/script.sh')
+#
+# :: TIP ::
+# gsutil ls gs://cloud-storage-01 |grep 'bam$' > bamList.txt
+# OR
+# gsutil ls gs://cloud-storage-01 |grep -H '.*bam$' |sed -e "s|.*\(gs.*$\)|\1|"  > bamList.txt
+#------------------------------------------------------------------------------
+"""
+def FixMate(prjName=None, Zones=None, Logs=None, Image=None, inFile=None, outFile=None, scriptPath=None, minRam=None, cmd=None, **options):
 
-    Args.append('--input')
-    tmp = 'INFILE={}'.format(inFile)
-    Args.append(tmp)
+    #if prjName is None:
+    #    prjName = 'my-project-id'
 
-    Args.append('--output')
-    tmp = 'OUTFILE={}'.format(outFile)
-    Args.append(tmp)
+    #if Logs is None:
+    #    Logs = 'gs://my-log'
 
-    Args.append('--image')
-    Args.append(Image)
+    return submitStage(stage='FixMate', prjName=prjName, Zones=Zones, Logs=Logs, Image=Image, inFile=inFile, outFile=outFile, scriptPath=scriptPath, minRam=minRam, cmd=cmd, **options)
 
-    Args.append('--min-ram')
-    Args.append(minRam)
 
-    Args.append('--script')
-    tmp = "{}".format(scriptPath)
-    Args.append(tmp)
+"""
+#------------------------------------------------------------------------------
+# Building BAM file index
+# :: Example Code ::
+# BuildBamIndex(inFile='gs://cloud-storage-01/example1_DNA.bam', outFile='gs://cloud-storage-02/example1_DNA.head.bam', scriptPath='/local/full/path/script.sh')
+#
+# :: TIP ::
+# gsutil ls gs://cloud-storage-01 |grep 'bam$' > bamList.txt
+# OR
+# gsutil ls gs://cloud-storage-01 |grep -H '.*bam$' |sed -e "s|.*\(gs.*$\)|\1|"  > bamList.txt
+#------------------------------------------------------------------------------
+"""
+def BuildBamIndex(prjName=None, Zones=None, Logs=None, Image=None, inFile=None, outFile=None, scriptPath=None, minRam=None, cmd=None, **options):
 
+    #if prjName is None:
+    #    prjName = 'my-project-id'
 
-    command = [pgExec]
-    command.extend(Args)
+    #if Logs is None:
+    #    Logs = 'gs://my-log'
 
-    process = subprocess.check_output(command)
+    return submitStage(stage='BuildBamIndex', prjName=prjName, Zones=Zones, Logs=Logs, Image=Image, inFile=inFile, outFile=outFile, scriptPath=scriptPath, minRam=minRam, cmd=cmd, **options)
 
-    #-- Writing process information
-    procOut = "{}.proc.txt".format(scriptPath)
-    with open(procOut, 'w') as f:
-        f.write(str(process).strip())
 
-    return process
+"""
+#------------------------------------------------------------------------------
+# Building BAM file index with bamIndex.py (native, no JVM)
+# :: Example Code ::
+# NativeBamIndex(inFile='gs://cloud-storage-01/example1_DNA.bam', outFile='gs://cloud-storage-01/example1_DNA.bam.bai', scriptPath='/local/full/path/script.sh')
+#------------------------------------------------------------------------------
+"""
+def NativeBamIndex(prjName=None, Zones=None, Logs=None, Image=None, inFile=None, outFile=None, scriptPath=None, minRam=None, cmd=None, **options):
+    return submitStage(stage='NativeBamIndex', prjName=prjName, Zones=Zones, Logs=Logs, Image=Image, inFile=inFile, outFile=outFile, scriptPath=scriptPath, minRam=minRam, cmd=cmd, **options)
 
 
 
@@ -391,188 +553,410 @@ def BuildBamIndex(prjName=None, Zones=None, Logs=None, Image=None, inFile=None,
 # Sorting BAM file
 # :: Example Code ::
 # SortSam(inFile='gs://cloud-storage-01/example1_DNA.bam', outFile='gs://cloud-storage-02/example1_DNA.head.bam', scriptPath='/local/full/path/script.sh')
-# 
+#
 # :: TIP ::
 # gsutil ls gs://cloud-storage-01 |grep 'bam$' > bamList.txt
 # OR
 # gsutil ls gs://cloud-storage-01 |grep -H '.*bam$' |sed -e "s|.*\(gs.*$\)|\1|"  > bamList.txt
 #------------------------------------------------------------------------------
 """
-def SortSam(prjName=None, Zones=None, Logs=None, Image=None, inFile=None, outFile=None, scriptPath=None, minRam=None, cmd=None, sorder='coordinate'):
+def SortSam(prjName=None, Zones=None, Logs=None, Image=None, inFile=None, outFile=None, scriptPath=None, minRam=None, cmd=None, sorder='coordinate', **options):
 
     #if prjName is None:
     #    prjName = 'my-project-id'
 
-    if Zones is None:
-        Zones = 'us-*'
+    #if Logs is None:
+    #    Logs = 'gs://my-log'
+
+    return submitStage(stage='SortSam', prjName=prjName, Zones=Zones, Logs=Logs, Image=Image, inFile=inFile, outFile=outFile, scriptPath=scriptPath, minRam=minRam, cmd=cmd, sorder=sorder, **options)
+
+
+"""
+#------------------------------------------------------------------------------
+# Convert mapped BAM to unmapped BAM file
+# :: Example Code ::
+# UnmapBam(inFile='gs://cloud-storage-01/example1_DNA.bam', outFile='gs://cloud-storage-02/example1_DNA.head.bam', scriptPath='/local/full/path/script.sh')
+#
+# :: TIP ::
+# gsutil ls gs://cloud-storage-01 |grep 'bam$' > bamList.txt
+# OR
+# gsutil ls gs://cloud-storage-01 |grep -H '.*bam$' |sed -e "s|.*\(gs.*$\)|\1|"  > bamList.txt
+#------------------------------------------------------------------------------
+"""
+
+def UnmapBam(prjName=None, Zones=None, Logs=None, Image=None, inFile=None, outFile=None, scriptPath=None, minRam=None, cmd=None, **options):
+
+    #if prjName is None:
+    #    prjName = 'my-project-id'
 
     #if Logs is None:
     #    Logs = 'gs://my-log'
 
-    if Image is None:
-        Image = 'maxulysse/picard'
+    return submitStage(stage='UnmapBam', prjName=prjName, Zones=Zones, Logs=Logs, Image=Image, inFile=inFile, outFile=outFile, scriptPath=scriptPath, minRam=minRam, cmd=cmd, **options)
 
-    if minRam is None:
-        minRam = '17'
 
-    assert(not (prjName is None)), "Project ID must be given!!\nExample) my-project-id\n"
-    assert(not (inFile is None)), "Input file must be given!!\nExample) gs://<bucket>/xxxx.bam\n"
+"""
+#------------------------------------------------------------------------------
+# Convert mapped BAM to one unmapped BAM per read group
+# :: Example Code ::
+# UnmapBamByRG(inFile='gs://cloud-storage-01/example1_DNA.bam', outDir='gs://cloud-storage-02', scriptPath='/local/full/path/script.sh')
+#   -> gs://cloud-storage-02/example1_DNA/<RG ID>.bam, ...
+#      gs://cloud-storage-02/example1_DNA.unmapped_bams.list (one uBAM per line)
+#
+# - the manifest can be given to runGenPipe.py in place of the uBAMs of the sample
+#------------------------------------------------------------------------------
+"""
+MANIFEST_EXT = '.unmapped_bams.list'
+
+
+def manifestPath(outDir, sample):
+    return "{}/{}{}".format(outDir, sample, MANIFEST_EXT)
+
+
+def UnmapBamByRG(prjName=None, Zones=None, Logs=None, Image=None, inFile=None, outDir=None, scriptPath=None, minRam=None, cmd=None, **options):
+    assert (not (inFile is None)), "Input file must be given!!\nExample) gs://<bucket>/xxxx.bam\n"
+    assert (not (outDir is None)), "Output directory must be given!!\nExample) gs://<bucket>/unmapped\n"
+
+    sample = inFile.split('/')[-1].split('.')[0]
+    sampleDir = "{}/{}".format(outDir, sample)
+
+    #-- outputs are only known after the job, so they are not cached
+    options.pop('cache', None)
+
+    return submitStage(stage='UnmapBamByRG', prjName=prjName, Zones=Zones, Logs=Logs, Image=Image, inFile=inFile, outFile="{}/*.bam".format(sampleDir),
+                       extraOutputs={'MANIFEST': manifestPath(outDir, sample)}, scriptPath=scriptPath, minRam=minRam, cmd=cmd, outDir=sampleDir, **options)
+
+
+#-- uBAMs listed in a manifest of UnmapBamByRG
+def readManifest(path, gsutil='gsutil'):
+    if path.startswith('gs://'):
+        text = subprocess.check_output([gsutil, '-q', 'cat', path]).decode('utf-8')
+    else:
+        with open(path) as f:
+            text = f.read()
+    return [line.strip() for line in text.split('\n') if len(line.strip()) > 0]
+
+
+"""
+#------------------------------------------------------------------------------
+# Sharded SortSam/FixMate: scatter -> N shard jobs -> gather (merged BAM and BAI)
+# :: Example Code ::
+# phases = shardJobs(stage='SortSam', prjName='my-project-id', inFile='gs://b1/example1_DNA.bam', outFile='gs://b2/example1_DNA.sort.bam',
+#                    scriptPath='/local/full/path/dsub_000.sh', shards=16)
+# submitStage(**phases['scatter'])      # then each of phases['shards'], then phases['gather']
+#
+# - SortSam shards are coordinate ranges, FixMate shards are read name hashes (bamShard.py)
+# - workDir : bucket directory of the shards, '<workDir>/<sample>/in|out' [Default=<outFile directory>/shards]
+# - returns the submitStage() arguments of each phase: {'scatter': job, 'shards': [job], 'gather': job};
+#   a phase is submitted once the jobs of the previous phase succeeded (pipeDag.PipeDag with shards=),
+#   so no client waits on 'dsub --after'; the gather job also writes <outFile>.bai
+# - autoSize sizes each shard job for 1/N of the input; cache is not used in sharded mode
+#------------------------------------------------------------------------------
+"""
+SHARD_MODES = {'SortSam': 'coord', 'FixMate': 'name'}
+
+
+def shardWorkDir(inFile, outFile, workDir=None):
+    if workDir is None:
+        workDir = "{}/shards".format(os.path.dirname(outFile))
+    return "{}/{}".format(workDir.rstrip('/'), inFile.split('/')[-1].split('.')[0])
+
+
+def shardName(i):
+    return "shard.{}.bam".format(str(i).zfill(3))
+
+
+def shardJobs(stage=None, prjName=None, Zones=None, Logs=None, inFile=None, outFile=None, scriptPath=None, shards=None, workDir=None,
+              autoSize=False, sizeRules=None, cache=None, **options):
+    assert (stage in SHARD_MODES), "Stage '{}' cannot be sharded!!\nAvailable stages) {}\n".format(stage, ', '.join(SHARD_MODES.keys()))
+    assert (not (inFile is None)), "Input file must be given!!\nExample) gs://<bucket>/xxxx.bam\n"
     assert (not (outFile is None)), "Output file must be given!!\nExample) gs://<bucket>/yyyy.bam\n"
     assert (not (scriptPath is None)), "The path of script file that will be used for submitting job must be given!!\nExample) /local/full/path/script.sh\n"
+    assert (not (shards is None) and shards > 1), "The number of shards must be larger than 1!!\nExample) 16\n"
+
+    sample = inFile.split('/')[-1].split('.')[0]
+    workDir = shardWorkDir(inFile, outFile, workDir)
+
+    sizes = {}
+    if autoSize:
+        inBytes = sizing.objectSize(inFile)
+        sizes['ScatterBam'] = sizing.sizeStage('ScatterBam', inBytes, sizeRules)
+        sizes[stage] = sizing.sizeStage(stage, inBytes / float(shards), sizeRules)
+        sizes['GatherBam'] = sizing.sizeStage('GatherBam', inBytes, sizeRules)
+
+    #-- coordinate shards are only merged correctly if each of them is sorted by coordinate
+    if stage == 'SortSam':
+        options['sorder'] = 'coordinate'
+
+    common = dict(prjName=prjName, Zones=Zones, Logs=Logs)
+    phases = OrderedDict()
+    phases['scatter'] = dict(stage='ScatterBam', inFile=inFile, outFile="{}/in/shard.*.bam".format(workDir), scriptPath="{}.scatter.sh".format(scriptPath),
+                             name="{}-scatter".format(sample), size=sizes.get('ScatterBam'), shards=shards, mode=SHARD_MODES[stage], **common)
+    phases['shards'] = []
+    for i in range(shards):
+        phases['shards'].append(dict(stage=stage, inFile="{}/in/{}".format(workDir, shardName(i)), outFile="{}/out/{}".format(workDir, shardName(i)),
+                                     scriptPath="{}.shard{}.sh".format(scriptPath, str(i).zfill(3)), name="{}-{}".format(sample, str(i).zfill(3)),
+                                     size=sizes.get(stage), **dict(common, **options)))
+    phases['gather'] = dict(stage='GatherBam', inFile="{}/out/shard.*.bam".format(workDir), outFile=outFile, scriptPath="{}.gather.sh".format(scriptPath),
+                            extraOutputs={'OUTBAI': "{}.bai".format(outFile)}, name="{}-gather".format(sample), size=sizes.get('GatherBam'), mode=SHARD_MODES[stage], **common)
+    return phases
 
-    if cmd is None:
-        cmd = "java -Xmx16G -Djava.io.tmpdir=`pwd`/tmp -jar /opt/picard/picard.jar SortSam I=${{INFILE}} O=${{OUTFILE}} SORT_ORDER={}".format(sorder)
-
-    #-- Writing Script
-    with open(scriptPath, 'w') as f:
-        f.write("#!/bin/bash\n")
-        f.write(cmd)
 
+"""
+#------------------------------------------------------------------------------
+# Fused preprocessing - run a contiguous chain of FUSED_ORDER in one dsub job
+# :: Example Code ::
+# fusedCmd(steps=['CleanSam', 'FixMate', 'SortSam', 'BuildBamIndex'])
+#
+# - Picard steps are connected with pipes (I=/dev/stdin, O=/dev/stdout) and
+#   intermediate BAMs are written uncompressed (COMPRESSION_LEVEL=0)
+# - SortSam followed by BuildBamIndex writes the index with CREATE_INDEX=true
+# - BuildBamIndex after any other step indexes the final BAM on local disk
+# - only ${OUTFILE} (and ${OUTBAI} if BuildBamIndex is in the chain) are uploaded
+# - heaps : JVM heap (GB) of each step e.g., {'SortSam': 24} - stage defaults otherwise
+#------------------------------------------------------------------------------
+"""
+FUSED_ORDER = ['CleanSam', 'FixMate', 'SortSam', 'BuildBamIndex']
 
-    pgExec = 'dsub'
-    Args = []
 
-    #-- job name is same as inFile name
-    Args.append('--name')
-    Args.append(inFile.split('/')[len(inFile.split('/')) - 1].split('.')[0])
+def checkSteps(steps):
+    assert (len(steps) > 0), "At least one step must be given!!\nExample) {}\n".format(','.join(FUSED_ORDER))
+    for step in steps:
+        assert (step in FUSED_ORDER), "Unknown step '{}'!!\nAvailable steps) {}\n".format(step, ','.join(FUSED_ORDER))
 
-    Args.append('--project')
-    Args.append(prjName)
+    first = FUSED_ORDER.index(steps[0])
+    assert (steps == FUSED_ORDER[first:first + len(steps)]), "Steps must be a contiguous chain of {}\n".format(' -> '.join(FUSED_ORDER))
+    assert (steps != ['BuildBamIndex']), "Use BuildBamIndex() to build an index only\n"
 
-    Args.append('--zones')
-    Args.append(Zones)
 
-    Args.append('--logging')
-    Args.append(Logs)
+def fusedCmd(steps=None, sorder='coordinate', heaps=None):
+    checkSteps(steps)
 
-    Args.append('--input')
-    tmp = 'INFILE={}'.format(inFile)
-    Args.append(tmp)
+    if heaps is None:
+        heaps = {}
 
-    Args.append('--output')
-    tmp = 'OUTFILE={}'.format(outFile)
-    Args.append(tmp)
+    bamSteps = [step for step in steps if step != 'BuildBamIndex']
+    index = 'BuildBamIndex' in steps
 
-    Args.append('--image')
-    Args.append(Image)
+    pipes = []
+    for i, step in enumerate(bamSteps):
+        cmd = stageCmd(step, sorder=sorder, heap=heaps.get(step))
 
-    Args.append('--min-ram')
-    Args.append(minRam)
+        if i > 0:
+            cmd = cmd.replace('I=${INFILE}', 'I=/dev/stdin')
 
-    Args.append('--script')
-    tmp = "{}".format(scriptPath)
-    Args.append(tmp)
+        if i < len(bamSteps) - 1:
+            cmd = cmd.replace('O=${OUTFILE}', 'O=/dev/stdout COMPRESSION_LEVEL=0 QUIET=true')
+        elif step == 'SortSam' and index:
+            cmd = "{} CREATE_INDEX=true".format(cmd)
 
+        pipes.append(cmd)
 
-    command = [pgExec]
-    command.extend(Args)
+    lines = ["set -eo pipefail", "mkdir -p tmp"]
 
-    process = subprocess.check_output(command)
+    if len(pipes) > 0:
+        lines.append(' \\\n  | '.join(pipes))
 
-    #-- Writing process information
-    procOut = "{}.proc.txt".format(scriptPath)
-    with open(procOut, 'w') as f:
-        f.write(str(process).strip())
+    if index and bamSteps[-1:] == ['SortSam']:
+        #-- Picard names the index '<name>.bai'
+        lines.append("mv ${OUTFILE%.bam}.bai ${OUTBAI}")
+    elif index:
+        lines.append(stageCmd('BuildBamIndex', heap=heaps.get('BuildBamIndex')).replace('I=${INFILE}', 'I=${OUTFILE}').replace('O=${OUTFILE}', 'O=${OUTBAI}'))
 
-    return process
+    return '\n'.join(lines) + '\n'
 
 
 """
 #------------------------------------------------------------------------------
-# Convert mapped BAM to unmapped BAM file
-# :: Example Code ::
-# UnmapBam(inFile='gs://cloud-storage-01/example1_DNA.bam', outFile='gs://cloud-storage-02/example1_DNA.head.bam', scriptPath='/local/full/path/script.sh')
-# 
-# :: TIP ::
-# gsutil ls gs://cloud-storage-01 |grep 'bam$' > bamList.txt
-# OR
-# gsutil ls gs://cloud-storage-01 |grep -H '.*bam$' |sed -e "s|.*\(gs.*$\)|\1|"  > bamList.txt
+# Minimum RAM of a fused job - piped JVMs run at the same time
 #------------------------------------------------------------------------------
 """
+def fusedRam(steps=None):
+    checkSteps(steps)
 
-def UnmapBam(prjName=None, Zones=None, Logs=None, Image=None, inFile=None, outFile=None, scriptPath=None, minRam=None, cmd=None):
+    bamSteps = [step for step in steps if step != 'BuildBamIndex']
+    ram = sum([int(STAGES[step]['minRam']) for step in bamSteps])
 
-    #if prjName is None:
-    #    prjName = 'my-project-id'
+    if 'BuildBamIndex' in steps:
+        ram = max(ram, int(STAGES['BuildBamIndex']['minRam']))
 
+    return str(ram)
 
-    if Zones is None:
-        Zones = 'us-*'
 
-    #if Logs is None:
-    #    Logs = 'gs://my-log'
+"""
+#------------------------------------------------------------------------------
+# Run CleanSam, FixMate, SortSam and BuildBamIndex (or a contiguous part of them) in one job
+# :: Example Code ::
+# FusedPrep(inFile='gs://cloud-storage-01/example1_DNA.bam', outFile='gs://cloud-storage-02/example1_DNA.prep.bam',
+#           outBai='gs://cloud-storage-02/example1_DNA.prep.bam.bai', scriptPath='/local/full/path/script.sh',
+#           steps=['CleanSam', 'FixMate', 'SortSam', 'BuildBamIndex'])
+#
+# - autoSize : size the job with sizing.sizeFused() from the input size
+#------------------------------------------------------------------------------
+"""
+def FusedPrep(prjName=None, Zones=None, Logs=None, Image=None, inFile=None, outFile=None, outBai=None, scriptPath=None, minRam=None, cmd=None, steps=None, sorder='coordinate',
+              autoSize=False, sizeRules=None, size=None, **options):
+
+    if steps is None:
+        steps = list(FUSED_ORDER)
 
     if Image is None:
-        Image = 'maxulysse/picard'
+        Image = STAGES[steps[0]]['Image']
 
-    if minRam is None:
-        minRam = '17'
+    if autoSize and size is None:
+        size = sizing.sizeFused(steps, sizing.objectSize(inFile), sizeRules)
 
-    assert(not (prjName is None)), "Project ID must be given!!\nExample) my-project-id\n"
-    assert(not (inFile is None)), "Input file must be given!!\nExample) gs://<bucket>/xxxx.bam\n"
-    assert (not (outFile is None)), "Output file must be given!!\nExample) gs://<bucket>/yyyy.bam\n"
-    assert (not (scriptPath is None)), "The path of script file that will be used for submitting job must be given!!\nExample) /local/full/path/script.sh\n"
+    heaps = None
+    if size is not None:
+        heaps = size['heap']
+    elif minRam is None:
+        minRam = fusedRam(steps)
 
     if cmd is None:
-        cmd = ' '.join(("java -Xmx16G -Djava.io.tmpdir=`pwd`/tmp -jar /opt/picard/picard.jar RevertSam I=${INFILE} O=${OUTFILE}",
-                        "SANITIZE=true MAX_DISCARD_FRACTION=0.005 ATTRIBUTE_TO_CLEAR=XT ATTRIBUTE_TO_CLEAR=XN ATTRIBUTE_TO_CLEAR=X0",
-                        "ATTRIBUTE_TO_CLEAR=MD ATTRIBUTE_TO_CLEAR=XG ATTRIBUTE_TO_CLEAR=XG ATTRIBUTE_TO_CLEAR=AM ATTRIBUTE_TO_CLEAR=NM",
-                        "ATTRIBUTE_TO_CLEAR=SM ATTRIBUTE_TO_CLEAR=XM ATTRIBUTE_TO_CLEAR=XG ATTRIBUTE_TO_CLEAR=XO ATTRIBUTE_TO_CLEAR=X1",
-                        "ATTRIBUTE_TO_CLEAR=XA SORT_ORDER=queryname RESTORE_ORIGINAL_QUALITIES=true REMOVE_DUPLICATE_INFORMATION=true REMOVE_ALIGNMENT_INFORMATION=true"))
+        cmd = fusedCmd(steps=steps, sorder=sorder, heaps=heaps)
 
+    extraOutputs = None
+    if 'BuildBamIndex' in steps:
+        assert (not (outBai is None)), "Output index file must be given when BuildBamIndex is in the steps!!\nExample) gs://<bucket>/yyyy.bam.bai\n"
+        extraOutputs = OrderedDict([('OUTBAI', outBai)])
 
-    #-- Writing Script
-    with open(scriptPath, 'w') as f:
-        f.write("#!/bin/bash\n")
-        f.write(cmd)
+    return submitStage(stage='FusedPrep', prjName=prjName, Zones=Zones, Logs=Logs, Image=Image, inFile=inFile, outFile=outFile, scriptPath=scriptPath, minRam=minRam, cmd=cmd, extraOutputs=extraOutputs,
+                       size=size, **options)
 
 
-    pgExec = 'dsub'
-    Args = []
+"""
+#------------------------------------------------------------------------------
+# Templates of the GATK Best Practice Pipeline, loaded once per run
+# :: Example Code ::
+# templates = genPipeTemplates('/usr/local/broad-prod-wgs-germline-snps-indels', '/usr/local/wdl')
+# inputsJson = templates.render(['gs://b1/example1_DNA.L001.unmapped.bam', 'gs://b1/example1_DNA.L002.unmapped.bam'], '/local/full/path/scripts')
+#
+# - the inputs JSON is parsed once and rendered for each sample in memory; '<sample>.hg38.inputs.json'
+#   is written only when its content changes
+# - the WDL and options JSON are shared by all samples and given to gcloud as they are
+# - render/submit seconds of each sample are kept in 'timings' (see writeTimings)
+#------------------------------------------------------------------------------
+"""
+class GenPipeTemplates(object):
 
-    #-- job name is same as inFile name
-    Args.append('--name')
-    Args.append(inFile.split('/')[len(inFile.split('/')) - 1].split('.')[0])
+    def __init__(self, GATK_GOOGLE_DIR, WDL_DIR, plPrefix='PairedEndSingleSampleWf'):
+        self.wdl = '{}/{}.gatk4.0.wdl'.format(GATK_GOOGLE_DIR, plPrefix)
+        self.options = '{}/{}.gatk4.0.options.json'.format(GATK_GOOGLE_DIR, plPrefix)
+        self.yml = '{}/runners/cromwell_on_google/wdl_runner/wdl_pipeline.yaml'.format(WDL_DIR)
 
-    Args.append('--project')
-    Args.append(prjName)
+        with open('{}/{}.hg38.inputs.json'.format(GATK_GOOGLE_DIR, plPrefix)) as f:
+            self.inputs = json.load(f, object_pairs_hook=OrderedDict)
 
-    Args.append('--zones')
-    Args.append(Zones)
+        self.lock = threading.Lock()
+        self.timings = OrderedDict()
 
-    Args.append('--logging')
-    Args.append(Logs)
+    def sampleInputs(self, sampleName, inFiles):
+        data = OrderedDict(self.inputs)
+        data['PairedEndSingleSampleWorkflow.base_file_name'] = sampleName
+        data['PairedEndSingleSampleWorkflow.final_gvcf_base_name'] = sampleName
+        data['PairedEndSingleSampleWorkflow.sample_name'] = sampleName
+        data['PairedEndSingleSampleWorkflow.fingerprint_genotypes_file'] = ''
+        data['PairedEndSingleSampleWorkflow.flowcell_unmapped_bams'] = list(inFiles)
+        return data
 
-    Args.append('--input')
-    tmp = 'INFILE={}'.format(inFile)
-    Args.append(tmp)
+    def render(self, inFiles, scriptPath, sampleName=None):
+        if sampleName is None:
+            sampleName = inFiles[0].split('/')[-1].split('.')[0]
 
-    Args.append('--output')
-    tmp = 'OUTFILE={}'.format(outFile)
-    Args.append(tmp)
+        text = json.dumps(self.sampleInputs(sampleName, inFiles))
+        outPath = '{}/{}.hg38.inputs.json'.format(scriptPath, sampleName)
 
-    Args.append('--image')
-    Args.append(Image)
+        #-- unchanged inputs (e.g., resubmission) are not written again
+        try:
+            with open(outPath) as f:
+                if f.read() == text:
+                    return outPath
+        except IOError:
+            pass
 
-    Args.append('--min-ram')
-    Args.append(minRam)
+        with open(outPath, 'w') as f:
+            f.write(text)
+        return outPath
 
-    Args.append('--script')
-    tmp = "{}".format(scriptPath)
-    Args.append(tmp)
+    def addTiming(self, sampleName, render, submit):
+        with self.lock:
+            self.timings[sampleName] = (render, submit)
 
+    def writeTimings(self, outPath):
+        with self.lock:
+            rows = list(self.timings.items())
+        with open(outPath, 'w') as f:
+            f.write("SAMPLE\tRENDER_SEC\tSUBMIT_SEC\n")
+            for sampleName, (render, submit) in rows:
+                f.write("{}\t{:.4f}\t{:.3f}\n".format(sampleName, render, submit))
+        return rows
 
-    command = [pgExec]
-    command.extend(Args)
 
-    process = subprocess.check_output(command)
+TEMPLATES = {}
+TEMPLATES_LOCK = threading.Lock()
 
-    #-- Writing process information
-    procOut = "{}.proc.txt".format(scriptPath)
-    with open(procOut, 'w') as f:
-        f.write(str(process).strip())
 
-    return process
+def genPipeTemplates(GATK_GOOGLE_DIR, WDL_DIR, plPrefix='PairedEndSingleSampleWf'):
+    key = (GATK_GOOGLE_DIR, WDL_DIR, plPrefix)
+    with TEMPLATES_LOCK:
+        if key not in TEMPLATES:
+            TEMPLATES[key] = GenPipeTemplates(GATK_GOOGLE_DIR, WDL_DIR, plPrefix)
+        return TEMPLATES[key]
+
+
+"""
+#------------------------------------------------------------------------------
+# Group unmapped BAMs (one per flowcell/read group) by sample
+# :: Example Code ::
+# groups = groupUnmapped(['gs://b1/S1.L001.unmapped.bam', 'gs://b1/S1.L002.unmapped.bam', 'gs://b1/S2.L001.unmapped.bam'])
+#   -> OrderedDict([('S1', [...L001, ...L002]), ('S2', [...])])
+#
+# - key     : stem, regex (first group of 'pattern' in the file name), sm (SM of the @RG lines
+#             read from each header) or none (one group per uBAM, named by its file name without '.bam';
+#             file names must be unique)
+# - BAMs without a key (no regex match, no SM) are grouped by their stem
+# - manifests of UnmapBamByRG ('<sample>.unmapped_bams.list') are read (in parallel) and all of their
+#   uBAMs are given to '<sample>'
+#------------------------------------------------------------------------------
+"""
+GROUP_KEYS = ['stem', 'regex', 'sm', 'none']
+
+
+def groupUnmapped(inFiles, key='stem', pattern=None, nProc=bamTriage.NPROC, gsutil='gsutil'):
+    assert (key in GROUP_KEYS), "Unknown key '{}'!!\nAvailable keys) {}\n".format(key, ', '.join(GROUP_KEYS))
+
+    stemOf = cmpFiles.keyExtractor('stem')
+
+    manifests = [path for path in inFiles if path.endswith(MANIFEST_EXT)]
+    inFiles = [path for path in inFiles if not path.endswith(MANIFEST_EXT)]
+    listed = OrderedDict()
+    if len(manifests) > 0:
+        with ThreadPoolExecutor(max_workers=max(1, min(nProc, len(manifests)))) as pool:
+            for path, files in zip(manifests, pool.map(lambda path: readManifest(path, gsutil), manifests)):
+                listed[stemOf(path)] = files
+
+    if key == 'sm':
+        samples = bamTriage.samplesOf(inFiles, nProc=nProc, gsutil=gsutil)
+        keyOf = lambda path: samples[path]
+    elif key == 'none':
+        keyOf = lambda path: re.sub(r'\.bam$', '', path.split('/')[-1])
+        names = [keyOf(path) for path in inFiles]
+        dups = sorted(set([name for name in names if names.count(name) > 1]))
+        assert (len(dups) == 0), "uBAMs with the same file name cannot be grouped with key 'none'!!\nExample) {}\n".format(', '.join(dups))
+    else:
+        keyOf = cmpFiles.keyExtractor(key, pattern)
+
+    groups = OrderedDict()
+    for path in inFiles:
+        name = keyOf(path)
+        if not name:
+            print("No sample key for {} - grouped by its file name".format(path))
+            name = stemOf(path)
+        groups.setdefault(name, []).append(path)
+
+    for name, files in listed.items():
+        groups.setdefault(name, []).extend(files)
+    return groups
 
 
 """
@@ -581,13 +965,18 @@ def UnmapBam(prjName=None, Zones=None, Logs=None, Image=None, inFile=None, outFi
 # :: Example Code ::
 # subGenPipe(inFile='gs://cloud-storage-01/example1_DNA.bam', outFile='gs://cloud-storage-02/example1_DNA.head.bam', scriptPath='/local/full/path/script.sh')
 # 
+# - templates : GenPipeTemplates shared by the samples [Default=genPipeTemplates(GATK_GOOGLE_DIR, WDL_DIR, plPrefix)]
+# - inFiles    : all uBAMs of the sample (flowcell_unmapped_bams) [Default=[inFile]]
+# - sampleName : [Default=name of the first uBAM without extensions]
+#
 # :: TIP ::
 # gsutil ls gs://cloud-storage-01 |grep 'bam$' > bamList.txt
 # OR
 # gsutil ls gs://cloud-storage-01 |grep -H '.*bam$' |sed -e "s|.*\(gs.*$\)|\1|"  > bamList.txt
 #------------------------------------------------------------------------------
 """
-def subGenPipe(Zones=None, Logs=None, inFile=None, scriptPath=None, GATK_GOOGLE_DIR=None, GATK_OUT_DIR=None, WDL_DIR=None, plPrefix=None):
+def subGenPipe(Zones=None, Logs=None, inFile=None, scriptPath=None, GATK_GOOGLE_DIR=None, GATK_OUT_DIR=None, WDL_DIR=None, plPrefix=None, templates=None,
+               inFiles=None, sampleName=None):
     if Zones is None:
         Zones = 'us-central1-f'
 
@@ -595,67 +984,29 @@ def subGenPipe(Zones=None, Logs=None, inFile=None, scriptPath=None, GATK_GOOGLE_
     #    Logs = 'gs://my-log'
     
     if plPrefix is None:
-        plPrefix = 'PairedEndSingleSampleWf' # pipeline prefix in GATK_GOOGLE_DIR - keep original and may copy to rewrite Json files
+        plPrefix = 'PairedEndSingleSampleWf' # pipeline prefix in GATK_GOOGLE_DIR
         
-    assert(not (inFile is None)), "Input file must be given!!\nExample) gs://<bucket>/xxxx.bam\n"
+    if inFiles is None and inFile is not None:
+        inFiles = [inFile]
+
+    assert(not (inFiles is None) and len(inFiles) > 0), "Input file must be given!!\nExample) gs://<bucket>/xxxx.bam\n"
     assert (not (scriptPath is None)), "The path of script file that will be used for submitting jobs must be given!!\nExample) /local/full/path/script.sh\n"
     assert(not (GATK_GOOGLE_DIR is None)), "The path of GATK Best Practices Pipeline templates e.g., /usr/local/broad-prod-wgs-germline-snps-indels\nThis can be downloaded from https://cloud.google.com/genomics/docs/tutorials/gatk"
     assert(not (GATK_OUT_DIR is None)), "Google Cloud Storage to store outputs e.g., gs://my-cloud-storage"
     assert(not (WDL_DIR is None)), "WDL directory found in GATK Best Practices Pipeline examples. e.g., /usr/local/wdl\nThis can be downloaded from https://cloud.google.com/genomics/docs/tutorials/gatk"
     
-    sample_json = '{}/PairedEndSingleSampleWf.hg38.inputs.json'.format(GATK_GOOGLE_DIR)
-    gatk_json   = '{}/PairedEndSingleSampleWf.gatk4.0.options.json'.format(GATK_GOOGLE_DIR)
-    yml_file = '{}/runners/cromwell_on_google/wdl_runner/wdl_pipeline.yaml'.format(WDL_DIR)
-    sampleName = inFile.split('/')[-1].split('.')[0]
-    
-    
-    out_json = '{}/{}'.format(scriptPath, sampleName)
-    
-    
-    #try:
-    #    os.makedirs(scPath)
-    #except OSError:
-    #    pass
-    
+    if templates is None:
+        templates = genPipeTemplates(GATK_GOOGLE_DIR, WDL_DIR, plPrefix)
 
-    try:
-        os.makedirs(out_json)
-    except OSError:
-        pass
-    
-    
-    """
-    #------------------------------------------------------------------------------
-    # Define environment 
-    #------------------------------------------------------------------------------
-    """
-    src = '{}/{}.*'.format(GATK_GOOGLE_DIR, plPrefix)
-    for fname in glob.glob(src):
-        tmp = fname.split('/')[-1].split('.')
-        tmp[0] = sampleName
-        dst = '.'.join(tmp)
-        dst = '{}/{}'.format(out_json, dst)
-        print(dst)
-        shutil.copyfile(fname, dst)
-    
-    
-    # Read and update Json for samples
+    if sampleName is None:
+        sampleName = inFiles[0].split('/')[-1].split('.')[0]
+
+
+    # Render the inputs of the sample
     #------------------------------------------------------------------------------
-    with open(sample_json) as f:
-        data = json.load(f, object_pairs_hook=OrderedDict)
-    
-    data['PairedEndSingleSampleWorkflow.base_file_name'] = sampleName
-    data['PairedEndSingleSampleWorkflow.final_gvcf_base_name'] = sampleName
-    data['PairedEndSingleSampleWorkflow.sample_name'] = sampleName
-    data['PairedEndSingleSampleWorkflow.fingerprint_genotypes_file'] = ''
-    data['PairedEndSingleSampleWorkflow.flowcell_unmapped_bams'] = [inFile]
-        
-    out_sJson = '{}/{}.hg38.inputs.json'.format(out_json, sampleName)
-    
-    with open(out_sJson, 'w') as f:
-        json.dump(data, f)
-    
-    out_gJson = '{}/{}.gatk4.0.options.json'.format(out_json, sampleName)
+    start = time.time()
+    out_sJson = templates.render(inFiles, scriptPath, sampleName)
+    renderTime = time.time() - start
 
 
     # Submit Job
@@ -670,7 +1021,7 @@ def subGenPipe(Zones=None, Logs=None, inFile=None, scriptPath=None, GATK_GOOGLE_
     Args.append('run')
     
     Args.append('--pipeline-file')
-    Args.append(yml_file)
+    Args.append(templates.yml)
     
     Args.append('--zones')
     Args.append(Zones)
@@ -682,7 +1033,7 @@ def subGenPipe(Zones=None, Logs=None, inFile=None, scriptPath=None, GATK_GOOGLE_
     Args.append(Logs)
     
     Args.append('--inputs-from-file')
-    tmp = 'WDL={}/PairedEndSingleSampleWf.gatk4.0.wdl'.format(GATK_GOOGLE_DIR)
+    tmp = 'WDL={}'.format(templates.wdl)
     Args.append(tmp)
     
     Args.append('--inputs-from-file')
@@ -690,7 +1041,7 @@ def subGenPipe(Zones=None, Logs=None, inFile=None, scriptPath=None, GATK_GOOGLE_
     Args.append(tmp)
     
     Args.append('--inputs-from-file')
-    tmp = 'WORKFLOW_OPTIONS={}'.format(out_gJson)
+    tmp = 'WORKFLOW_OPTIONS={}'.format(templates.options)
     Args.append(tmp)
     
     Args.append('--inputs')
@@ -705,12 +1056,16 @@ def subGenPipe(Zones=None, Logs=None, inFile=None, scriptPath=None, GATK_GOOGLE_
     command.extend(Args)
     
     #process = subprocess.check_output(command)
-    process = subprocess.check_output(command, stderr=subprocess.STDOUT)
+    start = time.time()
+    try:
+        process = rateLimit.limiter().run(command, region=rateLimit.regionOf(Zones), mergeErr=True, idempotent=False)
+    finally:
+        templates.addTiming(sampleName, renderTime, time.time() - start)
     
     try:
         jobID = re.search('operations/(.+?)]', str(process)).group(1)
     except AttributeError:
-        jobID = ''
+        raise rateLimit.SubmitError("gcloud returned no operation ID for {}: {}".format(sampleName, process.decode('utf-8', 'replace').strip()))
         
     #-- Writing process information
     scriptPath = '{}/{}'.format(scriptPath, sampleName)
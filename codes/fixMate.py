@@ -3,9 +3,10 @@
 # Descriptions:
 #  - Codes contain functions to submit jobs via Google Cloud 'dsub'
 #  - This codes must be run after running 'cleanSam.py' that correct known issue of BAM files for GATK downstream anaysis
+#  - --shards N runs FixMate on N read-name shards on N VMs and merges them (pipeDag.PipeDag)
 #
 # Start date  : May 17, 2018
-# Last update : Jun 27, 2018
+# Last update : Oct 17, 2026
 """
 
 __author__ 		= "Jong Cheol Jeong"
@@ -16,6 +17,8 @@ __email__ 		= "jjeong@kcr.uky.edu"
 
 
 import dsub
+import submitPool
+import pipeDag
 import os
 import argparse
 
@@ -33,6 +36,10 @@ parser.add_argument("-i", "--input", help='list of file names in cloud storage t
 parser.add_argument("-o", "--output", help='output google storage directory i.e., GS Path (gs://your-bucket', action='store', required=True)
 parser.add_argument("-s", "--script", help='local directory to store dsub scripts', action='store', required=True)
 parser.add_argument("-p", "--project", help='Google project ID (e.g., my-project-name)', action='store', required=True)
+parser.add_argument("--shards", help='split each BAM into N shards processed by N jobs and merged into the output BAM and its .bai [Default=1]', type=int, default=1)
+parser.add_argument("--workdir", help='bucket directory of the shards [Default=<output>/shards]', action='store', default=None)
+parser.add_argument("--interval", help='seconds between polls of the sharded jobs [Default={}]'.format(pipeDag.INTERVAL), type=float, default=pipeDag.INTERVAL)
+submitPool.addSubmitArgs(parser)
 
 args = parser.parse_args()
 
@@ -40,7 +47,7 @@ listBAM = args.input
 tgPath  = args.output
 logPath = "{}/log".format(tgPath)
 scPath = args.script
-prjName = arg.project
+prjName = args.project
 
 try:
     os.makedirs(scPath)
@@ -79,11 +86,26 @@ with open(mapBAM, 'w') as f:
 # Submit jobs
 #------------------------------------------------------------------------------
 """
-for i in range(len(inBAM)):
-    ibam = inBAM[i]
-    obam = outBAM[i]
-    oScr = "{}/dsub_{}.sh".format(scPath, str(i).zfill(3))
-    cmt = "[{}/{}] {} is processing...".format(i + 1, len(inBAM), ibam)
-    print(cmt)
-    dsub.FixMate(prjName=prjName, inFile=ibam, outFile=obam, scriptPath=oScr, Logs=logPath)
-    print('\n')
+options = submitPool.stageOptions(args)
+db = submitPool.openLedger(args, scPath)
+submitPool.configureLimits(args)
+place = submitPool.openPlacement(args, db)
+
+assert (not (args.batch and args.shards > 1)), "--batch and --shards cannot be used together\n"
+
+if args.shards > 1:
+    #-- scatter, shard and gather jobs are submitted as the previous phase succeeds (polling the ledger, pipeDag.py)
+    dag = pipeDag.PipeDag(db, inBAM, tgPath.rstrip('/'), scPath, prjName=prjName, steps=['FixMate'], Logs=logPath, nProc=args.nproc, placement=place,
+                          shards={'FixMate': args.shards}, workDir=args.workdir, **options)
+    pipeDag.printSummary(dag.run(interval=args.interval), dag.poller)
+elif args.batch:
+    oScr = "{}/dsub_FixMate.sh".format(scPath)
+    submitPool.runTasks(stage='FixMate', prjName=prjName, inFiles=inBAM, outFiles=outBAM, scriptPath=oScr, Logs=logPath, **options, db=db, resume=args.resume, placement=place)
+else:
+    jobs = []
+    for i in range(len(inBAM)):
+        oScr = "{}/dsub_{}.sh".format(scPath, str(i).zfill(3))
+        jobs.append(dict(prjName=prjName, inFile=inBAM[i], outFile=outBAM[i], scriptPath=oScr, Logs=logPath, **options))
+
+    summary = submitPool.runPool(func=dsub.FixMate, jobs=jobs, nProc=args.nproc, outPath=scPath, db=db, stage='FixMate', resume=args.resume, placement=place)
+    submitPool.printSummary(summary)
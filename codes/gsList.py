@@ -0,0 +1,503 @@
+"""
+# Purpose     : Cached, incremental listing of cloud storage
+# Descriptions:
+#  - Replaces repeated 'gsutil ls gs://bucket | grep bam$' calls
+#  - A root (gs://bucket[/dir] or a local directory) is split into its first level prefixes,
+#    which are listed in parallel ('gsutil ls -L <prefix>**')
+#  - Name, size, generation and checksum of each object are kept in a local SQLite cache
+#  - Refresh re-lists only changed prefixes:
+#       local directories : a prefix is changed when the mtime of one of its directories or files changed
+#       cloud storage     : each prefix is checked with one paged 'gsutil ls -l <prefix>**' (name, size,
+#                           time); checksums ('gsutil ls -L') are fetched only for names added or changed
+#                           since the cache, and names removed are dropped
+#  - Objects at the first level (flat buckets) come from one 'gsutil ls -l <root>/'; changed names are
+#    listed by name, or with one 'gsutil ls -L <root>/*' when more than CHUNK changed
+#  - Names can be filtered with a suffix and/or glob pattern (select())
+#  - Local files can be checked against the MD5 or CRC32C of the listing (fileChecksum()); CRC32C uses
+#    google_crc32c if it is installed, pure Python otherwise
+#  - A local directory can stand in for a bucket to run offline
+#
+# Start date  : Oct 17, 2026
+# Last update : Oct 17, 2026
+"""
+
+__author__ 		= "Jong Cheol Jeong"
+__copyright__ 	= "Copyright 2018, UK Cancer Research Informatics"
+__version__ 	= "1.0.0"
+__maintainer__ 	= "Jong Cheol Jeong"
+__email__ 		= "jjeong@kcr.uky.edu"
+
+
+import subprocess
+import threading
+import argparse
+import fnmatch
+import hashlib
+import sqlite3
+import base64
+import time
+import re
+import struct
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import google_crc32c
+except ImportError:
+    google_crc32c = None
+
+
+NPROC = 16
+CHUNK = 500                 # changed objects given to one 'gsutil ls -L' call; more are listed with a wildcard
+CACHE = os.path.join(os.path.expanduser('~'), '.gsList.db')
+
+#-- prefix holding the objects at the first level of a root
+TOP = ''
+
+
+"""
+#------------------------------------------------------------------------------
+# Parse the output of 'gsutil ls -L'
+# Returns [{'name', 'size', 'generation', 'checksum'}] - checksum is 'md5:<base64>',
+# or 'crc32c:<base64>' for composite objects without MD5
+#------------------------------------------------------------------------------
+"""
+def parseLong(text):
+    objects = []
+    obj = None
+    hashes = {}
+
+    def close():
+        if obj is not None:
+            if 'md5' in hashes:
+                obj['checksum'] = 'md5:{}'.format(hashes['md5'])
+            elif 'crc32c' in hashes:
+                obj['checksum'] = 'crc32c:{}'.format(hashes['crc32c'])
+            objects.append(obj)
+
+    for line in text.split('\n'):
+        if line.startswith('gs://') and line.rstrip().endswith(':'):
+            close()
+            obj = {'name': line.rstrip()[:-1], 'size': None, 'generation': None, 'checksum': None}
+            hashes = {}
+            continue
+
+        if obj is None:
+            continue
+
+        line = line.strip()
+        m = re.match(r'Hash \((\w+)\):\s*(\S+)', line)
+        if m:
+            hashes[m.group(1).lower()] = m.group(2)
+        elif line.startswith('Content-Length:'):
+            obj['size'] = int(line.split(':', 1)[1].strip())
+        elif line.startswith('Generation:'):
+            obj['generation'] = line.split(':', 1)[1].strip()
+
+    close()
+    return objects
+
+
+"""
+#------------------------------------------------------------------------------
+# CRC32C (Castagnoli) of composite objects
+# - the pure Python version reads ~8 MB/sec; PURE_CRC32C_MAX is the largest file it is used for
+#------------------------------------------------------------------------------
+"""
+PURE_CRC32C_MAX = 64 * 1024 * 1024
+
+
+def crc32cTable():
+    table = []
+    for i in range(256):
+        crc = i
+        for j in range(8):
+            crc = (crc >> 1) ^ 0x82F63B78 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+CRC32C_TABLE = crc32cTable()
+
+
+def crc32c(data, crc=0):
+    if google_crc32c is not None:
+        return google_crc32c.extend(crc, data)
+
+    table = CRC32C_TABLE
+    crc ^= 0xffffffff
+    for byte in data:
+        crc = table[(crc ^ byte) & 0xff] ^ (crc >> 8)
+    return crc ^ 0xffffffff
+
+
+#-- checksum of the listing that can be checked on a local copy of 'size' bytes
+def canVerify(checksum, size):
+    if not checksum:
+        return False
+    if checksum.startswith('md5:'):
+        return True
+    return checksum.startswith('crc32c:') and (google_crc32c is not None or size <= PURE_CRC32C_MAX)
+
+
+"""
+#------------------------------------------------------------------------------
+# Checksum of a local file in the format of parseLong() ('md5:<base64>' or 'crc32c:<base64>')
+#------------------------------------------------------------------------------
+"""
+def fileChecksum(path, kind='md5'):
+    md5 = hashlib.md5() if kind == 'md5' else None
+    crc = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            if md5 is not None:
+                md5.update(chunk)
+            else:
+                crc = crc32c(chunk, crc)
+    if md5 is not None:
+        return 'md5:{}'.format(base64.b64encode(md5.digest()).decode('ascii'))
+    return 'crc32c:{}'.format(base64.b64encode(struct.pack('>I', crc)).decode('ascii'))
+
+
+"""
+#------------------------------------------------------------------------------
+# Names of a listing whose stamp (size and time) differs from the cache
+# - stamps : {name: stamp} of the current listing
+# - cached : {name: object} of the cache
+# Returns the changed names, or None when nothing was added, changed or removed
+#------------------------------------------------------------------------------
+"""
+def changedNames(stamps, cached, force=False):
+    changed = [name for name in stamps if force or name not in cached or cached[name].get('stamp') != stamps[name]]
+    if len(changed) == 0 and len(cached) == len(stamps):
+        return None
+    return changed
+
+
+#-- unchanged objects of the cache with the objects listed again, in the order of the listing
+def mergeListed(stamps, cached, changed, listed):
+    objects = dict([(name, cached[name]) for name in stamps if name in cached])
+    for obj in listed:
+        if obj['name'] in stamps:
+            obj['stamp'] = stamps[obj['name']]
+            objects[obj['name']] = obj
+    return [objects[name] for name in stamps if name in objects]
+
+
+"""
+#------------------------------------------------------------------------------
+# Cloud storage backend
+# - changes are found with one paged 'gsutil ls -l' (name, size, time) per prefix; MD5/CRC32C
+#   ('gsutil ls -L') are fetched only for names added or changed since the cache
+#------------------------------------------------------------------------------
+"""
+class GSBackend(object):
+
+    def __init__(self, gsutil='gsutil'):
+        self.gsutil = gsutil
+
+    def run(self, args):
+        process = subprocess.check_output([self.gsutil] + args, stderr=subprocess.PIPE)
+        return process.decode('utf-8', 'replace')
+
+    #-- 'gsutil ls -l': ([prefixes], {name: 'size:time'}); the TOTAL line is skipped
+    def scan(self, pattern):
+        prefixes = []
+        stamps = OrderedDict()
+        for line in self.run(['ls', '-l', pattern]).split('\n'):
+            fields = line.strip().split(None, 2)
+            if len(fields) == 3 and fields[0].isdigit() and fields[2].startswith('gs://'):
+                stamps[fields[2]] = "{}:{}".format(fields[0], fields[1])
+            elif len(fields) == 1 and fields[0].startswith('gs://') and fields[0].endswith('/'):
+                prefixes.append(fields[0])
+        return prefixes, stamps
+
+    #-- first level prefixes and stamps of the first level objects of a root
+    def partitions(self, root):
+        return self.scan(root.rstrip('/') + '/')
+
+    def listPrefix(self, prefix):
+        return parseLong(self.run(['ls', '-L', prefix + '**']))
+
+    #-- objects of a list of names; long lists are split into chunks to stay below the argument limit
+    def listObjects(self, names):
+        objects = []
+        for i in range(0, len(names), CHUNK):
+            objects.extend(parseLong(self.run(['ls', '-L'] + list(names[i:i + CHUNK]))))
+        return objects
+
+    #-- a new prefix or more than CHUNK changed names are listed with one wildcard call instead of name by name
+    def fetch(self, pattern, stamps, cached, force=False):
+        changed = changedNames(stamps, cached, force)
+        if changed is None:
+            return None
+        if len(cached) == 0 or len(changed) > CHUNK:
+            listed = parseLong(self.run(['ls', '-L', pattern]))
+        else:
+            listed = self.listObjects(changed)
+        return mergeListed(stamps, cached, changed, listed)
+
+    #-- objects of a prefix, or None when it did not change; cloud storage keeps no signature
+    def update(self, prefix, cached, known=None, force=False):
+        return self.fetch(prefix + '**', self.scan(prefix + '**')[1], cached, force), None
+
+    def updateTop(self, root, stamps, cached, force=False):
+        return self.fetch(root.rstrip('/') + '/*', stamps, cached, force)
+
+
+"""
+#------------------------------------------------------------------------------
+# Local directory backend - stand-in of a bucket
+# - generation is the modification time (ns); MD5 is computed only if 'checksum' is True
+#   and reused from the cache while size and generation are unchanged
+#------------------------------------------------------------------------------
+"""
+class LocalBackend(object):
+
+    def __init__(self, checksum=False):
+        self.checksum = checksum
+        self.known = {}
+
+    def partitions(self, root):
+        root = root.rstrip('/')
+        prefixes = []
+        stamps = OrderedDict()
+        for name in sorted(os.listdir(root)):
+            path = os.path.join(root, name)
+            if os.path.isdir(path):
+                prefixes.append(path + '/')
+            elif os.path.isfile(path):
+                st = os.stat(path)
+                stamps[path] = "{}:{}".format(st.st_size, st.st_mtime_ns)
+        return prefixes, stamps
+
+    def stat(self, path):
+        st = os.stat(path)
+        obj = {'name': path, 'size': st.st_size, 'generation': str(st.st_mtime_ns), 'checksum': None,
+               'stamp': "{}:{}".format(st.st_size, st.st_mtime_ns)}
+        if self.checksum:
+            old = self.known.get(path)
+            if old is not None and old['size'] == obj['size'] and old['generation'] == obj['generation'] and old['checksum']:
+                obj['checksum'] = old['checksum']
+            else:
+                obj['checksum'] = fileChecksum(path)
+        return obj
+
+    def listPrefix(self, prefix):
+        objects = []
+        for dirPath, dirNames, fileNames in os.walk(prefix):
+            dirNames.sort()
+            for name in sorted(fileNames):
+                objects.append(self.stat(os.path.join(dirPath, name)))
+        return objects
+
+    def listObjects(self, names):
+        return [self.stat(name) for name in names if os.path.isfile(name)]
+
+    #-- directories change their mtime when entries are added, removed or renamed
+    #-- listings without MD5 are not reused when MD5 is asked
+    def signature(self, prefix):
+        latest = 0
+        for dirPath, dirNames, fileNames in os.walk(prefix):
+            latest = max(latest, os.stat(dirPath).st_mtime_ns)
+            for name in fileNames:
+                latest = max(latest, os.stat(os.path.join(dirPath, name)).st_mtime_ns)
+        return "{}{}".format(latest, ':md5' if self.checksum else '')
+
+    def update(self, prefix, cached, known=None, force=False):
+        sig = self.signature(prefix)
+        if not force and known is not None and known['signature'] == sig:
+            return None, sig
+        return self.listPrefix(prefix), sig
+
+    def updateTop(self, root, stamps, cached, force=False):
+        if self.checksum:
+            force = force or any([not obj['checksum'] for obj in cached.values()])
+        changed = changedNames(stamps, cached, force)
+        if changed is None:
+            return None
+        return mergeListed(stamps, cached, changed, self.listObjects(changed))
+
+
+"""
+#------------------------------------------------------------------------------
+# Listing
+# :: Example Code ::
+# listing = Listing()
+# bams = listing.select('gs://vcf-to-bam-bam', suffix='bam')
+# listing.select('/local/stand-in/bucket', pattern='*/results/*.vcf.gz')
+#------------------------------------------------------------------------------
+"""
+class Listing(object):
+
+    def __init__(self, cachePath=None, nProc=NPROC, gsutil='gsutil', checksum=False):
+        if cachePath is None:
+            cachePath = CACHE
+
+        self.nProc = nProc
+        self.gs = GSBackend(gsutil)
+        self.local = LocalBackend(checksum)
+        self.lock = threading.Lock()
+
+        self.conn = sqlite3.connect(cachePath, timeout=60, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS objects (
+                                root TEXT NOT NULL, prefix TEXT NOT NULL, name TEXT NOT NULL,
+                                size INTEGER, generation TEXT, checksum TEXT, stamp TEXT, PRIMARY KEY (root, name))''')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS prefixes (
+                                root TEXT NOT NULL, prefix TEXT NOT NULL, listed REAL, signature TEXT, PRIMARY KEY (root, prefix))''')
+        #-- caches written before 'stamp' was kept are listed again once
+        if 'stamp' not in [row['name'] for row in self.conn.execute('PRAGMA table_info(objects)')]:
+            self.conn.execute('ALTER TABLE objects ADD COLUMN stamp TEXT')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS objects_prefix ON objects (root, prefix)')
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def backend(self, root):
+        return self.gs if root.startswith('gs://') else self.local
+
+    def normRoot(self, root):
+        if root.startswith('gs://'):
+            return root.rstrip('/')
+        return os.path.abspath(root).rstrip('/')
+
+    def cached(self, root, prefix):
+        with self.lock:
+            rows = self.conn.execute('SELECT name, size, generation, checksum, stamp FROM objects WHERE root = ? AND prefix = ?', (root, prefix))
+            return dict([(row['name'], dict(row)) for row in rows])
+
+    """
+    #--------------------------------------------------------------------------
+    # Bring the cache of a root up to date and return the number of prefixes listed again
+    # - every prefix is checked (local: mtime signature, cloud storage: 'gsutil ls -l') and only
+    #   changed prefixes and objects are listed again
+    # - force : list every prefix and object again
+    #--------------------------------------------------------------------------
+    """
+    def refresh(self, root, force=False):
+        root = self.normRoot(root)
+        backend = self.backend(root)
+        prefixes, topStamps = backend.partitions(root)
+
+        with self.lock:
+            known = dict([(row['prefix'], dict(row)) for row in self.conn.execute('SELECT * FROM prefixes WHERE root = ?', (root,))])
+            if backend is self.local and backend.checksum:
+                rows = self.conn.execute('SELECT name, size, generation, checksum FROM objects WHERE root = ?', (root,))
+                backend.known = dict([(row['name'], dict(row)) for row in rows])
+
+        #-- prefixes removed from the root
+        removed = [prefix for prefix in known if prefix != TOP and prefix not in prefixes]
+        with self.lock:
+            for prefix in removed:
+                self.conn.execute('DELETE FROM objects WHERE root = ? AND prefix = ?', (root, prefix))
+                self.conn.execute('DELETE FROM prefixes WHERE root = ? AND prefix = ?', (root, prefix))
+            self.conn.commit()
+
+        def update(prefix):
+            return backend.update(prefix, self.cached(root, prefix), known.get(prefix), force)
+
+        with ThreadPoolExecutor(max_workers=self.nProc) as pool:
+            updates = list(pool.map(update, prefixes))
+
+        nListed = 0
+        for prefix, (objects, signature) in zip(prefixes, updates):
+            if objects is not None:
+                self.store(root, prefix, objects, signature)
+                nListed += 1
+
+        #-- objects at the first level of a root, cached as the prefix TOP
+        objects = backend.updateTop(root, topStamps, self.cached(root, TOP), force)
+        if objects is not None or TOP not in known:
+            self.store(root, TOP, objects or [], None)
+            nListed += 1
+        return nListed
+
+    def store(self, root, prefix, objects, signature, listed=None):
+        if listed is None:
+            listed = time.time()
+        rows = [(root, prefix, obj['name'], obj['size'], obj['generation'], obj['checksum'], obj.get('stamp')) for obj in objects]
+        with self.lock:
+            self.conn.execute('DELETE FROM objects WHERE root = ? AND prefix = ?', (root, prefix))
+            self.conn.executemany('INSERT OR REPLACE INTO objects (root, prefix, name, size, generation, checksum, stamp) VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+            self.conn.execute('INSERT OR REPLACE INTO prefixes (root, prefix, listed, signature) VALUES (?, ?, ?, ?)', (root, prefix, listed, signature))
+            self.conn.commit()
+
+    """
+    #--------------------------------------------------------------------------
+    # Objects of a root, refreshed first unless refresh=False
+    # - suffix  : keep names ending with it (e.g., 'bam', '.vcf.gz')
+    # - pattern : keep names matching a glob, relative to the root (e.g., '*/results/*.vcf.gz')
+    # Returns [{'name', 'size', 'generation', 'checksum'}] sorted by name
+    #--------------------------------------------------------------------------
+    """
+    def select(self, root, suffix=None, pattern=None, refresh=True, force=False):
+        root = self.normRoot(root)
+        if refresh:
+            self.refresh(root, force=force)
+
+        sql = 'SELECT name, size, generation, checksum FROM objects WHERE root = ?'
+        args = [root]
+        if suffix is not None:
+            sql += ' AND substr(name, -?) = ?'
+            args.extend([len(suffix), suffix])
+
+        with self.lock:
+            rows = [dict(row) for row in self.conn.execute(sql + ' ORDER BY name', args)]
+
+        if pattern is not None:
+            rows = [row for row in rows if fnmatch.fnmatchcase(row['name'][len(root) + 1:], pattern)]
+
+        return rows
+
+    def names(self, root, suffix=None, pattern=None, refresh=True, force=False):
+        return [row['name'] for row in self.select(root, suffix, pattern, refresh, force)]
+
+
+"""
+#------------------------------------------------------------------------------
+# Names of a root with the default cache
+# :: Example Code ::
+# listNames('gs://vcf-to-bam-bam', suffix='bam')
+#------------------------------------------------------------------------------
+"""
+def listNames(root, suffix=None, pattern=None, cachePath=None, **options):
+    listing = Listing(cachePath, **options)
+    try:
+        return listing.names(root, suffix=suffix, pattern=pattern)
+    finally:
+        listing.close()
+
+
+"""
+#------------------------------------------------------------------------------
+# :: USAGE ::
+# >> python gsList.py gs://vcf-to-bam-bam --suffix bam > /output_dir/vcf-to-bam-bam_new.txt
+# >> python gsList.py gs://my-results --glob '*/*.vcf.gz' -l
+# >> python gsList.py /local/stand-in/bucket --suffix bam --refresh
+#------------------------------------------------------------------------------
+"""
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("root", help='gs://bucket[/dir] or a local directory')
+    parser.add_argument("-s", "--suffix", help='keep names ending with this suffix (e.g., bam)', action='store', default=None)
+    parser.add_argument("-g", "--glob", help='keep names matching this glob relative to the root (e.g., "*/*.vcf.gz")', action='store', default=None)
+    parser.add_argument("-l", "--long", help='print size, generation and checksum', action='store_true')
+    parser.add_argument("-c", "--cache", help='listing cache file [Default={}]'.format(CACHE), action='store', default=None)
+    parser.add_argument("-n", "--nproc", help='number of prefixes listed at the same time [Default={}]'.format(NPROC), type=int, default=NPROC)
+    parser.add_argument("--refresh", help='list every prefix and object again (checksums included)', action='store_true')
+    parser.add_argument("--md5", help='compute MD5 of local files (reused while unchanged)', action='store_true')
+    parser.add_argument("--gsutil", help='gsutil executable [Default=gsutil]', action='store', default='gsutil')
+
+    args = parser.parse_args()
+
+    listing = Listing(args.cache, nProc=args.nproc, gsutil=args.gsutil, checksum=args.md5)
+    for row in listing.select(args.root, suffix=args.suffix, pattern=args.glob, force=args.refresh):
+        if args.long:
+            print("{}\t{}\t{}\t{}".format(row['size'], row['generation'], row['checksum'] or '', row['name']))
+        else:
+            print(row['name'])
@@ -0,0 +1,335 @@
+"""
+# Purpose     : Persistent job ledger of batch runs
+# Descriptions:
+#  - SQLite table of (sample, stage) submissions with job ID, parameters, timestamps and last known state
+#  - Used by the driver scripts to resume a run ('--resume'): items already submitted or finished are
+#    skipped and only failed ones are submitted again
+#  - '--zones' compares jobs, failures and run time of each zone given by placement.py
+#  - Every output of a row (outFile and the 'extraOutputs' of its params) is kept in the indexed
+#    'outputs' table, so a finished file is matched to its row without scanning the ledger
+#
+# Start date  : Oct 17, 2026
+# Last update : Oct 17, 2026
+"""
+
+__author__ 		= "Jong Cheol Jeong"
+__copyright__ 	= "Copyright 2018, UK Cancer Research Informatics"
+__version__ 	= "1.0.0"
+__maintainer__ 	= "Jong Cheol Jeong"
+__email__ 		= "jjeong@kcr.uky.edu"
+
+
+import sqlite3
+import json
+import time
+import argparse
+from collections import OrderedDict
+
+
+"""
+#------------------------------------------------------------------------------
+# Job states
+# - SUBMITTED / RUNNING : job is alive, not submitted again on resume
+# - SUCCESS             : job is done, not submitted again on resume
+# - FAILURE / CANCELED / SUBMIT_FAILED : submitted again on resume
+#------------------------------------------------------------------------------
+"""
+SUBMITTED = 'SUBMITTED'
+RUNNING = 'RUNNING'
+SUCCESS = 'SUCCESS'
+FAILURE = 'FAILURE'
+CANCELED = 'CANCELED'
+SUBMIT_FAILED = 'SUBMIT_FAILED'
+
+ACTIVE_STATES = (SUBMITTED, RUNNING)
+SKIP_STATES = (SUBMITTED, RUNNING, SUCCESS)
+RETRY_STATES = (FAILURE, CANCELED, SUBMIT_FAILED)
+
+#-- columns of the 'jobs' table; columns added here are added to existing ledgers when opened
+COLUMNS = OrderedDict([
+    ('sample', 'TEXT NOT NULL'),
+    ('stage', 'TEXT NOT NULL'),
+    ('inFile', 'TEXT'),
+    ('outFile', 'TEXT'),
+    ('runner', 'TEXT'),
+    ('jobID', 'TEXT'),
+    ('taskID', 'TEXT'),
+    ('params', 'TEXT'),
+    ('state', 'TEXT'),
+    ('message', 'TEXT'),
+    ('attempts', 'INTEGER'),
+    ('zone', 'TEXT'),
+    ('submitted', 'REAL'),
+    ('updated', 'REAL'),
+])
+
+
+"""
+#------------------------------------------------------------------------------
+# Sample name of a file - same as the dsub job name
+# :: Example Code ::
+# sampleName('gs://cloud-storage-01/example1_DNA.head.clean.bam') -> 'example1_DNA'
+#------------------------------------------------------------------------------
+"""
+def sampleName(path):
+    return path.strip().split('/')[-1].split('.')[0]
+
+
+"""
+#------------------------------------------------------------------------------
+# All outputs of a ledger row: outFile and the 'extraOutputs' of its params
+# :: Example Code ::
+# rowOutputs(db.get('example1_DNA', 'FusedPrep'))   -> ['gs://b2/example1_DNA.prep.bam', 'gs://b2/example1_DNA.prep.bam.bai']
+#------------------------------------------------------------------------------
+"""
+def rowOutputs(row):
+    params = row.get('params') or {}
+    if not isinstance(params, dict):
+        try:
+            params = json.loads(params)
+        except ValueError:
+            params = {}
+    outputs = [row['outFile']] if row.get('outFile') else []
+    return outputs + [path for path in (params.get('extraOutputs') or {}).values() if path not in outputs]
+
+
+"""
+#------------------------------------------------------------------------------
+# Ledger
+# :: Example Code ::
+# db = Ledger('/local/full/path/ledger.db')
+# db.record(sample='example1_DNA', stage='CleanSam', inFile='gs://b1/example1_DNA.bam', jobID='cleansam--jjeong--180517')
+# db.states('CleanSam')   -> {'example1_DNA': 'SUBMITTED'}
+#------------------------------------------------------------------------------
+"""
+class Ledger(object):
+
+    def __init__(self, dbPath):
+        self.dbPath = dbPath
+        self.conn = sqlite3.connect(dbPath, timeout=60)
+        self.conn.row_factory = sqlite3.Row
+
+        #-- WAL keeps commits cheap and lets pollers read while a driver writes
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+
+        cols = ', '.join(['{} {}'.format(key, COLUMNS[key]) for key in COLUMNS])
+        self.conn.execute('CREATE TABLE IF NOT EXISTS jobs ({}, PRIMARY KEY (sample, stage))'.format(cols))
+
+        existing = [row['name'] for row in self.conn.execute('PRAGMA table_info(jobs)')]
+        for key in COLUMNS:
+            if key not in existing:
+                self.conn.execute('ALTER TABLE jobs ADD COLUMN {} {}'.format(key, COLUMNS[key].replace(' NOT NULL', '')))
+
+        self.conn.execute('CREATE INDEX IF NOT EXISTS jobs_state ON jobs (stage, state)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS jobs_job ON jobs (jobID, taskID)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS jobs_out ON jobs (outFile)')
+
+        #-- one row per output file of a job; filled from the jobs of ledgers written before it existed
+        exists = self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'outputs'").fetchone()
+        self.conn.execute('CREATE TABLE IF NOT EXISTS outputs (path TEXT NOT NULL, sample TEXT NOT NULL, stage TEXT NOT NULL, '
+                          'PRIMARY KEY (path, sample, stage))')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS outputs_job ON outputs (sample, stage)')
+        if exists is None:
+            self.indexOutputs([dict(row) for row in self.conn.execute('SELECT sample, stage, outFile, params FROM jobs')])
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    """
+    #--------------------------------------------------------------------------
+    # Insert or replace a (sample, stage) row
+    # - params is a dictionary and stored as JSON
+    #--------------------------------------------------------------------------
+    """
+    def record(self, sample=None, stage=None, commit=True, **values):
+        self.recordMany([dict(sample=sample, stage=stage, **values)], commit=commit)
+
+    def recordMany(self, rows, commit=True):
+        now = time.time()
+        keys = list(COLUMNS.keys())
+        data = []
+        for row in rows:
+            assert (row.get('sample') is not None and row.get('stage') is not None), "sample and stage must be given!!\n"
+            row = dict(row)
+            if isinstance(row.get('params'), dict):
+                row['params'] = json.dumps(row['params'], default=str)
+            row.setdefault('state', SUBMITTED)
+            row.setdefault('submitted', now)
+            row.setdefault('updated', now)
+            data.append([row.get(key) for key in keys])
+
+        sql = 'INSERT OR REPLACE INTO jobs ({}) VALUES ({})'.format(', '.join(keys), ', '.join(['?'] * len(keys)))
+        self.conn.executemany(sql, data)
+        self.indexOutputs(rows)
+        if commit:
+            self.conn.commit()
+
+    #-- replace the 'outputs' rows of each (sample, stage) with its outFile and extraOutputs
+    def indexOutputs(self, rows):
+        self.conn.executemany('DELETE FROM outputs WHERE sample = ? AND stage = ?', [(row['sample'], row['stage']) for row in rows])
+        self.conn.executemany('INSERT OR IGNORE INTO outputs (path, sample, stage) VALUES (?, ?, ?)',
+                              [(path, row['sample'], row['stage']) for row in rows for path in rowOutputs(row)])
+
+    """
+    #--------------------------------------------------------------------------
+    # Update the state of jobs
+    # - by (sample, stage) or by (jobID, taskID); taskID=None matches every task of a job
+    #--------------------------------------------------------------------------
+    """
+    def setState(self, state, sample=None, stage=None, jobID=None, taskID=None, message=None, commit=True, **values):
+        sets = ['state = ?', 'updated = ?']
+        args = [state, time.time()]
+
+        if message is not None:
+            sets.append('message = ?')
+            args.append(message)
+
+        for key in values:
+            assert (key in COLUMNS), "Unknown column '{}'\n".format(key)
+            sets.append('{} = ?'.format(key))
+            args.append(values[key])
+
+        if sample is not None:
+            where = 'sample = ? AND stage = ?'
+            whereArgs = [sample, stage]
+        else:
+            assert (jobID is not None), "sample/stage or jobID must be given!!\n"
+            where = 'jobID = ?'
+            whereArgs = [jobID]
+            if taskID is not None:
+                where += ' AND taskID = ?'
+                whereArgs.append(str(taskID))
+
+        cur = self.conn.execute('UPDATE jobs SET {} WHERE {}'.format(', '.join(sets), where), args + whereArgs)
+        if 'outFile' in values or 'params' in values:
+            sql = 'SELECT sample, stage, outFile, params FROM jobs WHERE {}'.format(where)
+            self.indexOutputs([dict(row) for row in self.conn.execute(sql, whereArgs)])
+        if commit:
+            self.conn.commit()
+        return cur.rowcount
+
+    def commit(self):
+        self.conn.commit()
+
+    """
+    #--------------------------------------------------------------------------
+    # Queries
+    #--------------------------------------------------------------------------
+    """
+    def get(self, sample, stage):
+        row = self.conn.execute('SELECT * FROM jobs WHERE sample = ? AND stage = ?', (sample, stage)).fetchone()
+        return None if row is None else dict(row)
+
+    def states(self, stage):
+        cur = self.conn.execute('SELECT sample, state FROM jobs WHERE stage = ?', (stage,))
+        return dict([(row['sample'], row['state']) for row in cur])
+
+    def rows(self, stage=None, states=None, since=None):
+        sql = 'SELECT * FROM jobs'
+        where = []
+        args = []
+        if stage is not None:
+            where.append('stage = ?')
+            args.append(stage)
+        if states is not None:
+            where.append('state IN ({})'.format(', '.join(['?'] * len(states))))
+            args.extend(states)
+        if since is not None:
+            where.append('updated >= ?')
+            args.append(since)
+        if len(where) > 0:
+            sql += ' WHERE ' + ' AND '.join(where)
+        return [dict(row) for row in self.conn.execute(sql, args)]
+
+    def outstanding(self, stage=None):
+        return self.rows(stage=stage, states=ACTIVE_STATES)
+
+    def byOutput(self, outFile, states=None):
+        sql = 'SELECT * FROM jobs WHERE outFile = ?'
+        args = [outFile]
+        if states is not None:
+            sql += ' AND state IN ({})'.format(', '.join(['?'] * len(states)))
+            args.extend(states)
+        return [dict(row) for row in self.conn.execute(sql, args)]
+
+    #-- rows with 'path' as outFile or as one of the extraOutputs of their params
+    def byAnyOutput(self, path, states=None):
+        sql = 'SELECT jobs.* FROM outputs JOIN jobs ON jobs.sample = outputs.sample AND jobs.stage = outputs.stage WHERE outputs.path = ?'
+        args = [path]
+        if states is not None:
+            sql += ' AND jobs.state IN ({})'.format(', '.join(['?'] * len(states)))
+            args.extend(states)
+        return [dict(row) for row in self.conn.execute(sql, args)]
+
+    def counts(self, stage=None):
+        sql = 'SELECT stage, state, COUNT(*) AS n FROM jobs'
+        args = []
+        if stage is not None:
+            sql += ' WHERE stage = ?'
+            args.append(stage)
+        sql += ' GROUP BY stage, state ORDER BY stage, state'
+        return [(row['stage'], row['state'], row['n']) for row in self.conn.execute(sql, args)]
+
+    """
+    #--------------------------------------------------------------------------
+    # Jobs of each zone: [(zone, jobs, success, failed, mean hours from submission to SUCCESS)]
+    # - the hours are measured until the poller saw SUCCESS
+    #--------------------------------------------------------------------------
+    """
+    def zoneStats(self, stage=None):
+        sql = ('SELECT zone, COUNT(*) AS n, SUM(state = ?) AS ok, SUM(state IN (?, ?, ?)) AS failed, '
+               'AVG(CASE WHEN state = ? THEN updated - submitted END) AS secs FROM jobs WHERE zone IS NOT NULL')
+        args = [SUCCESS] + list(RETRY_STATES) + [SUCCESS]
+        if stage is not None:
+            sql += ' AND stage = ?'
+            args.append(stage)
+        sql += ' GROUP BY zone ORDER BY zone'
+        return [(row['zone'], row['n'], row['ok'], row['failed'], None if row['secs'] is None else row['secs'] / 3600.0)
+                for row in self.conn.execute(sql, args)]
+
+    """
+    #--------------------------------------------------------------------------
+    # Indices of items to be submitted when resuming a stage
+    # - items whose sample is SUBMITTED, RUNNING or SUCCESS are skipped
+    #--------------------------------------------------------------------------
+    """
+    def resumeFilter(self, stage, inFiles):
+        states = self.states(stage)
+        keep = []
+        for i, inFile in enumerate(inFiles):
+            if states.get(sampleName(inFile)) not in SKIP_STATES:
+                keep.append(i)
+        return keep
+
+
+"""
+#------------------------------------------------------------------------------
+# Print the number of jobs in each state
+# :: USAGE ::
+# >> python ledger.py -l /output_dir/cleanSAM/ledger.db
+# >> python ledger.py -l /output_dir/cleanSAM/ledger.db --stage CleanSam --state FAILURE
+# >> python ledger.py -l /output_dir/pipe/ledger.db --zones
+#------------------------------------------------------------------------------
+"""
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-l", "--ledger", help='ledger file (e.g., /output_dir/cleanSAM/ledger.db)', action='store', required=True)
+    parser.add_argument("--stage", help='stage name (e.g., CleanSam)', action='store', default=None)
+    parser.add_argument("--state", help='list samples in this state (e.g., FAILURE)', action='store', default=None)
+    parser.add_argument("--zones", help='print jobs, successes, failures and mean hours to SUCCESS of each zone', action='store_true')
+
+    args = parser.parse_args()
+    db = Ledger(args.ledger)
+
+    if args.zones:
+        print("ZONE\tJOBS\tSUCCESS\tFAILED\tHOURS")
+        for zone, n, ok, failed, hours in db.zoneStats(args.stage):
+            print("{}\t{}\t{}\t{}\t{}".format(zone, n, ok, failed, '-' if hours is None else '{:.2f}'.format(hours)))
+    elif args.state is None:
+        for stage, state, n in db.counts(args.stage):
+            print("{}\t{}\t{}".format(stage, state, n))
+    else:
+        for row in db.rows(stage=args.stage, states=[args.state]):
+            print("{}\t{}\t{}\t{}\t{}".format(row['sample'], row['stage'], row['inFile'], row['jobID'], row['message'] or ''))
@@ -0,0 +1,445 @@
+"""
+# Purpose     : Per-sample pipeline of the BAM preparation stages
+# Descriptions:
+#  - Each sample is a chain of dsub stages (default: headAddPL -> CleanSam -> FixMate -> SortSam -> BuildBamIndex)
+#  - Stage k+1 of a sample is submitted as soon as its stage k finished with SUCCESS and its output
+#    exists, without waiting for the other samples (no barrier between the driver scripts)
+#  - Jobs are limited globally (--max-active) and per stage (--limit SortSam=20); later stages are
+#    submitted first so started samples finish first
+#  - State is kept in the job ledger (ledger.py): a restarted run continues where it stopped and
+#    failed stages are submitted again up to --retries times
+#  - '--shards SortSam=16' runs a stage as scatter -> N shard jobs -> gather (dsub.shardJobs); each
+#    phase is submitted when the previous one succeeded, so no client waits on 'dsub --after'
+#  - Job states are polled with pollStatus.Poller ('--dstat'/'--gcloud' can be local fakes)
+#  - '--once' runs a single poll/submit round, e.g., from cron
+#
+# Start date  : Oct 17, 2026
+# Last update : Oct 17, 2026
+"""
+
+__author__ 		= "Jong Cheol Jeong"
+__copyright__ 	= "Copyright 2018, UK Cancer Research Informatics"
+__version__ 	= "1.0.0"
+__maintainer__ 	= "Jong Cheol Jeong"
+__email__ 		= "jjeong@kcr.uky.edu"
+
+
+import subprocess
+import argparse
+import time
+import os
+import dsub
+import ledger
+import sizing
+import submitPool
+import rateLimit
+import pollStatus
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+"""
+#------------------------------------------------------------------------------
+# Stages that can be chained
+# - func   : submission function in dsub.py
+# - suffix : output BAM '<name>.<suffix>.bam' (same names as the driver scripts)
+# - index  : the stage writes '<input>.bai' and the next stage reads the same BAM
+#------------------------------------------------------------------------------
+"""
+STEPS = OrderedDict()
+STEPS['headAddPL'] = {'func': dsub.headAddPL, 'suffix': 'head'}
+STEPS['CleanSam'] = {'func': dsub.CleanSam, 'suffix': 'clean'}
+STEPS['FixMate'] = {'func': dsub.FixMate, 'suffix': 'fixmate'}
+STEPS['SortSam'] = {'func': dsub.SortSam, 'suffix': 'sort'}
+STEPS['BuildBamIndex'] = {'func': dsub.BuildBamIndex, 'index': True}
+STEPS['NativeBamIndex'] = {'func': dsub.NativeBamIndex, 'index': True}
+STEPS['UnmapBam'] = {'func': dsub.UnmapBam, 'suffix': 'unmap'}
+
+DEFAULT_STEPS = ['headAddPL', 'CleanSam', 'FixMate', 'SortSam', 'BuildBamIndex']
+
+MAX_ACTIVE = 200
+RETRIES = 2
+INTERVAL = 60
+
+
+"""
+#------------------------------------------------------------------------------
+# Input and output of each stage of a sample
+# :: Example Code ::
+# samplePlan('gs://b1/x.bam', ['headAddPL', 'CleanSam', 'BuildBamIndex'], 'gs://b2')
+#   -> [('headAddPL', 'gs://b1/x.bam', 'gs://b2/x.head.bam'), ('CleanSam', 'gs://b2/x.head.bam', 'gs://b2/x.head.clean.bam'),
+#       ('BuildBamIndex', 'gs://b2/x.head.clean.bam', 'gs://b2/x.head.clean.bam.bai')]
+#------------------------------------------------------------------------------
+"""
+def samplePlan(inFile, steps, outDir):
+    plan = []
+    bam = inFile
+    for stage in steps:
+        nameList = bam.split('/')[-1].split('.')
+        if STEPS[stage].get('index'):
+            plan.append((stage, bam, "{}/{}.bai".format(outDir, '.'.join(nameList))))
+            continue
+
+        outFile = "{}/{}.{}.{}".format(outDir, '.'.join(nameList[:-1]), STEPS[stage]['suffix'], nameList[-1])
+        plan.append((stage, bam, outFile))
+        bam = outFile
+    return plan
+
+
+def checkSteps(steps):
+    for stage in steps:
+        assert (stage in STEPS), "Unknown stage '{}'!!\nAvailable stages) {}\n".format(stage, ', '.join(STEPS.keys()))
+    assert (len(steps) == len(set(steps))), "A stage can be used only once!!\n"
+
+
+#-- output of a finished job exists and is not empty
+def outputExists(path, gsutil='gsutil'):
+    try:
+        return sizing.objectSize(path, gsutil) > 0
+    except (subprocess.CalledProcessError, OSError, ValueError, IndexError):
+        return False
+
+
+"""
+#------------------------------------------------------------------------------
+# Per-sample DAG executor
+# :: Example Code ::
+# db = ledger.Ledger('/output_dir/pipe/ledger.db')
+# dag = PipeDag(db, inBAM, 'gs://vcf-to-bam-prep', '/output_dir/pipe', prjName='my-project-id', limits={'SortSam': 20})
+# dag.run(interval=60)
+#
+# - options : keyword arguments given to every submission (e.g., autoSize, sizeRules, cache, Zones)
+# - poller  : pollStatus.Poller updating the ledger [Default=Poller(db, project=prjName)]
+# - placement : placement.Placement choosing the zone of each stage next to its input; a stage that
+#               failed for lack of capacity is submitted again in another zone
+# - shards  : {stage: N} stages run on N shards (SortSam, FixMate); the scatter and shard jobs are
+#             recorded as '<stage>.scatter' and '<stage>.000', ... and the gather job as '<stage>'
+# - workDir : bucket directory of the shards [Default=<outDir>/shards]
+# - gsutil  : gsutil executable checking the outputs of finished stages
+#------------------------------------------------------------------------------
+"""
+class PipeDag(object):
+
+    def __init__(self, db, inFiles, outDir, scPath, prjName=None, steps=None, Logs=None, maxActive=MAX_ACTIVE, limits=None, retries=RETRIES,
+                 nProc=submitPool.NPROC, poller=None, placement=None, shards=None, workDir=None, gsutil='gsutil', **options):
+
+        assert (not (prjName is None)), "Project ID must be given!!\nExample) my-project-id\n"
+
+        self.db = db
+        self.outDir = outDir
+        self.scPath = scPath
+        self.prjName = prjName
+        self.steps = DEFAULT_STEPS if steps is None else steps
+        self.Logs = "{}/log".format(outDir) if Logs is None else Logs
+        self.maxActive = maxActive
+        self.limits = {} if limits is None else limits
+        self.retries = retries
+        self.nProc = nProc
+        self.options = options
+        self.poller = pollStatus.Poller(db, project=prjName) if poller is None else poller
+        self.placement = placement
+        self.shards = {} if shards is None else shards
+        self.workDir = workDir
+        self.gsutil = gsutil
+        checkSteps(self.steps)
+        for stage in self.shards:
+            assert (stage in dsub.SHARD_MODES), "Stage '{}' cannot be sharded!!\nAvailable stages) {}\n".format(stage, ', '.join(dsub.SHARD_MODES.keys()))
+
+        self.plans = OrderedDict()
+        self.units = OrderedDict()
+        self.checks = {}
+        self.phases = {}
+        for inFile in inFiles:
+            sample = ledger.sampleName(inFile)
+            assert (sample not in self.plans), "Sample '{}' is given more than once!!\n".format(sample)
+            self.plans[sample] = samplePlan(inFile, self.steps, outDir)
+            self.units[sample] = self.expand(sample)
+        self.stages = set([unit[0] for units in self.units.values() for step in units for unit in step])
+
+    """
+    #--------------------------------------------------------------------------
+    # Steps of a sample: [[(ledger stage, index in the plan, shard phase)]]
+    # - a sharded stage is three steps: scatter, the N shard jobs and gather; the jobs of a step
+    #   are submitted together and the next step starts when all of them succeeded
+    # - the scatter job is checked with its last shard instead of its wildcard output
+    #--------------------------------------------------------------------------
+    """
+    def expand(self, sample):
+        steps = []
+        for idx, (stage, inFile, outFile) in enumerate(self.plans[sample]):
+            shards = self.shards.get(stage, 1)
+            if shards < 2:
+                steps.append([(stage, idx, None)])
+                continue
+            workDir = dsub.shardWorkDir(inFile, outFile, self.workDir)
+            self.checks[(sample, "{}.scatter".format(stage))] = "{}/in/{}".format(workDir, dsub.shardName(shards - 1))
+            steps.append([("{}.scatter".format(stage), idx, 'scatter')])
+            steps.append([("{}.{}".format(stage, str(i).zfill(3)), idx, i) for i in range(shards)])
+            steps.append([(stage, idx, 'gather')])
+        return steps
+
+    def stageOf(self, sample, idx):
+        return self.plans[sample][self.units[sample][idx][0][1]][0]
+
+    """
+    #--------------------------------------------------------------------------
+    # Ledger rows of the samples and stages of this DAG: {(sample, stage): row}
+    #--------------------------------------------------------------------------
+    """
+    def rows(self):
+        rows = {}
+        for row in self.db.rows():
+            if row['sample'] in self.plans and row['stage'] in self.stages:
+                rows[(row['sample'], row['stage'])] = row
+        return rows
+
+    """
+    #--------------------------------------------------------------------------
+    # Position of a sample in its chain
+    # Returns (status, idx) - status is 'done', 'active', 'ready' (step idx can be submitted)
+    # or 'failed' (a job of step idx failed more than 'retries' times)
+    #--------------------------------------------------------------------------
+    """
+    def status(self, sample, rows):
+        for idx, step in enumerate(self.units[sample]):
+            states = [rows.get((sample, unit[0])) for unit in step]
+            if all([not (row is None) and row['state'] == ledger.SUCCESS for row in states]):
+                continue
+            if any([not (row is None) and row['state'] in ledger.ACTIVE_STATES for row in states]):
+                return 'active', idx
+            if len(self.exhausted(states)) > 0:
+                return 'failed', idx
+            return 'ready', idx
+        return 'done', len(self.units[sample])
+
+    #-- rows that failed more than 'retries' times
+    def exhausted(self, states):
+        return [row for row in states if not (row is None) and row['state'] != ledger.SUCCESS and (row['attempts'] or 1) > self.retries]
+
+    """
+    #--------------------------------------------------------------------------
+    # Steps to be submitted within the global and per-stage limits (a shard step counts its N jobs)
+    # Returns [(sample, idx)]; later steps first, then in the input order
+    #--------------------------------------------------------------------------
+    """
+    def ready(self, rows):
+        active = {}
+        nActive = 0
+        candidates = []
+        for sample in self.plans:
+            status, idx = self.status(sample, rows)
+            if status == 'active':
+                stage = self.stageOf(sample, idx)
+                active[stage] = active.get(stage, 0) + len(self.units[sample][idx])
+                nActive += len(self.units[sample][idx])
+            elif status == 'ready':
+                candidates.append((-idx, len(candidates), sample, idx))
+
+        selected = []
+        for key, order, sample, idx in sorted(candidates):
+            stage = self.stageOf(sample, idx)
+            if nActive >= self.maxActive:
+                break
+            if stage in self.limits and active.get(stage, 0) >= self.limits[stage]:
+                continue
+            active[stage] = active.get(stage, 0) + len(self.units[sample][idx])
+            nActive += len(self.units[sample][idx])
+            selected.append((sample, idx))
+
+        return selected
+
+    #-- (submission function, arguments) of a job; the phases of a sharded stage are built once per sample
+    def job(self, sample, unit):
+        rowStage, idx, phase = unit
+        stage, inFile, outFile = self.plans[sample][idx]
+        scriptPath = "{}/{}/dsub_{}.sh".format(self.scPath, stage, sample)
+        job = dict(prjName=self.prjName, Logs=self.Logs, inFile=inFile, outFile=outFile, scriptPath=scriptPath, **self.options)
+        if phase is None:
+            return STEPS[stage]['func'], job
+
+        if (sample, idx) not in self.phases:
+            self.phases[(sample, idx)] = dsub.shardJobs(stage=stage, shards=self.shards[stage], workDir=self.workDir, **job)
+        phases = self.phases[(sample, idx)]
+        return dsub.submitStage, dict(phases['shards'][phase] if isinstance(phase, int) else phases[phase])
+
+    """
+    #--------------------------------------------------------------------------
+    # Submit stages of samples concurrently and record them in the ledger
+    # - only the jobs of a step that are not done or running are submitted again
+    #--------------------------------------------------------------------------
+    """
+    def submit(self, selected, rows):
+        def call(sample, unit):
+            func, job = self.job(sample, unit)
+            try:
+                os.makedirs(os.path.dirname(job['scriptPath']))
+            except OSError:
+                pass
+            try:
+                if self.placement is not None:
+                    job = self.placement.place(job)
+                return job, (True, func(**job))
+            except Exception as err:
+                msg = submitPool.errorMessage(err)
+                if self.placement is not None:
+                    self.placement.fail(job.get('Zones'), msg)
+                return job, (False, msg)
+
+        units = []
+        for sample, idx in selected:
+            for unit in self.units[sample][idx]:
+                row = rows.get((sample, unit[0]))
+                if row is None or not (row['state'] == ledger.SUCCESS or row['state'] in ledger.ACTIVE_STATES):
+                    units.append((sample, unit))
+
+        results = []
+        with ThreadPoolExecutor(max_workers=max(1, min(self.nProc, len(units)))) as pool:
+            futures = dict([(pool.submit(call, sample, unit), (sample, unit)) for sample, unit in units])
+            for future in as_completed(futures):
+                sample, unit = futures[future]
+                stage = unit[0]
+                job, (ok, res) = future.result()
+
+                old = rows.get((sample, stage))
+                attempts = 1 if old is None else (old['attempts'] or 1) + 1
+                submitPool.record(self.db, stage, job, ok, res, sample=sample, attempts=attempts)
+
+                state = 'submitted' if ok else 'FAILED ({})'.format(res)
+                print("{}\t{}\t{}\t{} (attempt {})".format(time.strftime('%Y-%m-%d %H:%M:%S'), sample, stage, state, attempts))
+                results.append((sample, stage, ok, res))
+
+        return results
+
+    """
+    #--------------------------------------------------------------------------
+    # One round: poll outstanding jobs, check the outputs of finished stages and submit next stages
+    # Returns (transitions, submissions)
+    #--------------------------------------------------------------------------
+    """
+    def tick(self):
+        transitions = self.poller.sweep()
+        for row, old, new, message in transitions:
+            if new == ledger.SUCCESS and row['sample'] in self.plans and row['stage'] in self.stages:
+                path = self.checks.get((row['sample'], row['stage']), row['outFile'])
+                if not outputExists(path, self.gsutil):
+                    msg = "output not found: {}".format(path)
+                    self.db.setState(ledger.FAILURE, sample=row['sample'], stage=row['stage'], message=msg)
+                    new, message = ledger.FAILURE, msg
+            pollStatus.printTransition(row, old, new, message)
+
+        rows = self.rows()
+        selected = self.ready(rows)
+        submissions = self.submit(selected, rows) if len(selected) > 0 else []
+        return transitions, submissions
+
+    """
+    #--------------------------------------------------------------------------
+    # Samples in each status: {'done': [...], 'active': [...], 'ready': [...], 'failed': [...]}
+    #--------------------------------------------------------------------------
+    """
+    def summary(self):
+        rows = self.rows()
+        summary = OrderedDict([('done', []), ('active', []), ('ready', []), ('failed', [])])
+        for sample in self.plans:
+            status, idx = self.status(sample, rows)
+            if status == 'failed':
+                row = self.exhausted([rows.get((sample, unit[0])) for unit in self.units[sample][idx]])[0]
+                summary[status].append((sample, row['stage'], row['message']))
+            else:
+                summary[status].append(sample)
+        return summary
+
+    """
+    #--------------------------------------------------------------------------
+    # Rounds every 'interval' seconds until every sample is done or failed
+    #--------------------------------------------------------------------------
+    """
+    def run(self, interval=INTERVAL):
+        while True:
+            self.tick()
+            summary = self.summary()
+            if len(summary['active']) == 0 and len(summary['ready']) == 0:
+                return summary
+            time.sleep(interval)
+
+
+def parseLimits(limits):
+    values = OrderedDict()
+    for limit in limits:
+        stage, n = limit.split('=', 1)
+        assert (stage in STEPS), "Unknown stage '{}'!!\nAvailable stages) {}\n".format(stage, ', '.join(STEPS.keys()))
+        values[stage] = int(n)
+    return values
+
+
+def printSummary(summary, poller=None):
+    print('\n')
+    for status in summary:
+        print("{:10}: {}".format(status.capitalize(), len(summary[status])))
+    rateLimit.printStats()
+    for sample, stage, msg in summary['failed']:
+        print("\t - {} {} : {}".format(sample, stage, msg))
+
+    for err in ([] if poller is None else poller.errors):
+        print("ERROR\t{}".format(err))
+
+
+"""
+#------------------------------------------------------------------------------
+# :: USAGE ::
+# >> python pipeDag.py -p <my-project-id> -i /output_dir/missing.txt -o gs://vcf-to-bam-prep -s /output_dir/pipe
+# >> python pipeDag.py -p <my-project-id> -i bams.txt -o gs://vcf-to-bam-prep -s /output_dir/pipe --limit SortSam=20 --max-active 300 -a
+# >> python pipeDag.py -p <my-project-id> -i bams.txt -o gs://vcf-to-bam-prep -s /output_dir/pipe --steps CleanSam,SortSam,NativeBamIndex --once
+# >> python pipeDag.py -p <my-project-id> -i bams.txt -o gs://vcf-to-bam-prep -s /output_dir/pipe --shards SortSam=16 --shards FixMate=8
+#------------------------------------------------------------------------------
+"""
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--input", help='list of BAM files in cloud storage to be run', action='store', required=True)
+    parser.add_argument("-o", "--output", help='output google storage directory of all stages i.e., GS Path (gs://your-bucket)', action='store', required=True)
+    parser.add_argument("-s", "--script", help='local directory to store dsub scripts and the ledger', action='store', required=True)
+    parser.add_argument("-p", "--project", help='Google project ID (e.g., my-project-name)', action='store', required=True)
+    parser.add_argument("--steps", help='comma separated stages of each sample [Default={}]\nAvailable stages) {}'.format(','.join(DEFAULT_STEPS), ', '.join(STEPS.keys())),
+                        type=str, default=','.join(DEFAULT_STEPS))
+    parser.add_argument("--max-active", help='maximum number of jobs submitted or running at the same time [Default={}]'.format(MAX_ACTIVE), type=int, default=MAX_ACTIVE)
+    parser.add_argument("--limit", help='maximum number of jobs of a stage, STAGE=N (repeatable, e.g., SortSam=20)', action='append', default=[])
+    parser.add_argument("--shards", help='run a stage on N shards merged into its output, STAGE=N (repeatable, SortSam or FixMate, e.g., SortSam=16)', action='append', default=[])
+    parser.add_argument("--workdir", help='bucket directory of the shards [Default=<output>/shards]', action='store', default=None)
+    parser.add_argument("--retries", help='number of times a failed stage is submitted again [Default={}]'.format(RETRIES), type=int, default=RETRIES)
+    parser.add_argument("--interval", help='seconds between rounds [Default={}]'.format(INTERVAL), type=float, default=INTERVAL)
+    parser.add_argument("--once", help='run a single round and exit', action='store_true')
+    parser.add_argument("-n", "--nproc", help='number of jobs submitted concurrently [Default={}]'.format(submitPool.NPROC), type=int, default=submitPool.NPROC)
+    parser.add_argument("-l", "--ledger", help='job ledger file [Default=<script directory>/ledger.db]', action='store', default=None)
+    parser.add_argument("-a", "--autosize", help='size CPU, RAM, JVM heap and disk of each job from its input size', action='store_true')
+    parser.add_argument("-c", "--sizeconf", help='JSON file overriding the sizing rules in sizing.py', action='store', default=None)
+    parser.add_argument("--cache", help='stage output cache file (e.g., /output_dir/cache.db)', action='store', default=None)
+    parser.add_argument("--dstat", help='dstat executable [Default=dstat]', action='store', default='dstat')
+    parser.add_argument("--gcloud", help='gcloud executable [Default=gcloud]', action='store', default='gcloud')
+    parser.add_argument("--gsutil", help='gsutil executable [Default=gsutil]', action='store', default='gsutil')
+    submitPool.addLimitArgs(parser)
+    submitPool.addPlaceArgs(parser)
+
+    args = parser.parse_args()
+
+    try:
+        os.makedirs(args.script)
+    except OSError:
+        pass
+
+    with open(args.input) as f:
+        inBAM = [line.strip() for line in f if len(line.strip()) > 0]
+
+    db = submitPool.openLedger(args, args.script)
+    submitPool.configureLimits(args)
+    poller = pollStatus.Poller(db, project=args.project, dstat=args.dstat, gcloud=args.gcloud)
+    dag = PipeDag(db, inBAM, args.output.rstrip('/'), args.script, prjName=args.project, steps=args.steps.split(','), maxActive=args.max_active,
+                  limits=parseLimits(args.limit), retries=args.retries, nProc=args.nproc, poller=poller, shards=parseLimits(args.shards), workDir=args.workdir,
+                  gsutil=args.gsutil, placement=submitPool.openPlacement(args, db), **submitPool.stageOptions(args))
+
+    if args.once:
+        dag.tick()
+        summary = dag.summary()
+    else:
+        summary = dag.run(interval=args.interval)
+
+    printSummary(summary, poller)
@@ -0,0 +1,354 @@
+"""
+# Purpose     : Zone and region placement of jobs next to their input data
+# Descriptions:
+#  - The location of each input bucket is looked up once ('gsutil ls -L -b') and mapped to the
+#    compute zones of its region(s): a regional bucket gives the zones of its region, a dual-region
+#    bucket (NAM4, EUR4, ASIA1, 'US-CENTRAL1+US-EAST1') the zones of both regions and a multi-region
+#    bucket (US, EU, ASIA) the zones of the regions on that continent
+#  - Jobs are spread over the compatible zones; zones with recent capacity failures in the job ledger
+#    (ZONE_RESOURCE_POOL_EXHAUSTED, 'does not have enough resources', ...) are used last
+#  - regions   : compute regions allowed for the jobs (e.g., to keep them inside the project quota);
+#                inputs stored outside these regions run in an allowed region and, if a regional cache
+#                bucket is given, are copied there first ('gsutil cp -n') so jobs read them locally
+#  - The chosen zone of each job is recorded in the ledger ('zone') - 'python ledger.py --zones'
+#    compares jobs, failures and run time of each zone
+#
+# Start date  : Oct 17, 2026
+# Last update : Oct 17, 2026
+"""
+
+__author__ 		= "Jong Cheol Jeong"
+__copyright__ 	= "Copyright 2018, UK Cancer Research Informatics"
+__version__ 	= "1.0.0"
+__maintainer__ 	= "Jong Cheol Jeong"
+__email__ 		= "jjeong@kcr.uky.edu"
+
+
+import subprocess
+import threading
+import argparse
+import time
+import csv
+import re
+import ledger
+from collections import OrderedDict
+
+
+"""
+#------------------------------------------------------------------------------
+# Compute zones of each region
+# - regions not listed here are given as '<region>-*'
+#------------------------------------------------------------------------------
+"""
+ZONES = OrderedDict([
+    ('us-central1', ['us-central1-a', 'us-central1-b', 'us-central1-c', 'us-central1-f']),
+    ('us-east1', ['us-east1-b', 'us-east1-c', 'us-east1-d']),
+    ('us-east4', ['us-east4-a', 'us-east4-b', 'us-east4-c']),
+    ('us-west1', ['us-west1-a', 'us-west1-b', 'us-west1-c']),
+    ('us-west2', ['us-west2-a', 'us-west2-b', 'us-west2-c']),
+    ('northamerica-northeast1', ['northamerica-northeast1-a', 'northamerica-northeast1-b', 'northamerica-northeast1-c']),
+    ('europe-north1', ['europe-north1-a', 'europe-north1-b', 'europe-north1-c']),
+    ('europe-west1', ['europe-west1-b', 'europe-west1-c', 'europe-west1-d']),
+    ('europe-west2', ['europe-west2-a', 'europe-west2-b', 'europe-west2-c']),
+    ('europe-west3', ['europe-west3-a', 'europe-west3-b', 'europe-west3-c']),
+    ('europe-west4', ['europe-west4-a', 'europe-west4-b', 'europe-west4-c']),
+    ('asia-east1', ['asia-east1-a', 'asia-east1-b', 'asia-east1-c']),
+    ('asia-northeast1', ['asia-northeast1-a', 'asia-northeast1-b', 'asia-northeast1-c']),
+    ('asia-northeast2', ['asia-northeast2-a', 'asia-northeast2-b', 'asia-northeast2-c']),
+    ('asia-southeast1', ['asia-southeast1-a', 'asia-southeast1-b', 'asia-southeast1-c']),
+    ('australia-southeast1', ['australia-southeast1-a', 'australia-southeast1-b', 'australia-southeast1-c']),
+])
+
+#-- regions of dual-region and multi-region bucket locations
+LOCATIONS = {
+    'NAM4'  : ['us-central1', 'us-east1'],
+    'EUR4'  : ['europe-north1', 'europe-west4'],
+    'ASIA1' : ['asia-northeast1', 'asia-northeast2'],
+    'US'    : [region for region in ZONES if region.startswith('us-')],
+    'EU'    : [region for region in ZONES if region.startswith('europe-')],
+    'ASIA'  : [region for region in ZONES if region.startswith('asia-')],
+}
+
+#-- zones of jobs whose input location is unknown (e.g., local files)
+DEFAULT_ZONES = ['us-*']
+
+#-- messages of jobs that could not get a VM in their zone
+CAPACITY_ERRORS = re.compile(r'ZONE_RESOURCE_POOL_EXHAUSTED|does not have enough resources|resource pool exhausted|STOCKOUT|'
+                             r'ZONE_RESOURCE_POOL|Insufficient capacity|currently unavailable in zone', re.IGNORECASE)
+
+#-- capacity failures older than this (sec) are forgotten
+WINDOW = 3600
+
+#-- seconds between two reads of the ledger
+REFRESH = 60
+
+
+def isCapacityError(message):
+    return message is not None and CAPACITY_ERRORS.search(message) is not None
+
+
+def bucketOf(path):
+    if not path.startswith('gs://'):
+        return None
+    return 'gs://{}'.format(path[5:].split('/')[0])
+
+
+def regionOfZone(zone):
+    return zone.rsplit('-', 1)[0]
+
+
+"""
+#------------------------------------------------------------------------------
+# Location of a bucket ('US-CENTRAL1', 'NAM4', 'US', ...) or None if it cannot be read
+#------------------------------------------------------------------------------
+"""
+def bucketLocation(bucket, gsutil='gsutil'):
+    try:
+        text = subprocess.check_output([gsutil, 'ls', '-L', '-b', bucket], stderr=subprocess.DEVNULL).decode('utf-8', 'replace')
+    except (subprocess.CalledProcessError, OSError):
+        return None
+
+    match = re.search(r'Location constraint:\s*(\S+)', text)
+    return None if match is None else match.group(1).upper()
+
+
+def locationRegions(location):
+    if location is None:
+        return []
+    if location in LOCATIONS:
+        return list(LOCATIONS[location])
+    #-- regional ('US-CENTRAL1') or configurable dual-region ('US-CENTRAL1+US-EAST1')
+    return [region.lower() for region in location.split('+')]
+
+
+def regionZones(region):
+    return list(ZONES.get(region, ['{}-*'.format(region)]))
+
+
+"""
+#------------------------------------------------------------------------------
+# Placement
+# :: Example Code ::
+# place = Placement(db=ledger.Ledger('/output_dir/clean/ledger.db'), regions=['us-central1', 'us-east1'],
+#                   cacheBuckets={'us-central1': 'gs://my-cache-usc1'})
+# job = place.place(dict(prjName='my-project-id', inFile='gs://b1/x.bam', ...))
+# dsub.CleanSam(**job)                      # job['Zones'] is one zone next to the input
+#
+# - db           : ledger.Ledger read for recent capacity failures of each zone
+# - regions      : compute regions allowed for the jobs [Default=any region]
+# - cacheBuckets : {region: 'gs://bucket'} - inputs stored outside the allowed regions are copied
+#                  to the cache bucket of the chosen region ('<cache>/<input bucket>/<path>')
+# - window       : seconds a capacity failure counts against its zone
+#------------------------------------------------------------------------------
+"""
+class Placement(object):
+
+    def __init__(self, db=None, regions=None, cacheBuckets=None, window=WINDOW, gsutil='gsutil', defaultZones=None):
+        #-- sqlite connections belong to their thread, so failures are read with a connection of their own
+        self.dbPath = None if db is None else db.dbPath
+        self.regions = None if not regions else list(regions)
+        self.cacheBuckets = {} if cacheBuckets is None else dict(cacheBuckets)
+        self.window = window
+        self.gsutil = gsutil
+        self.defaultZones = DEFAULT_ZONES if defaultZones is None else defaultZones
+
+        self.lock = threading.Lock()
+        self.locations = {}
+        self.assigned = {}
+        self.local = []
+        self.failed = {}
+        self.loaded = 0
+
+    def location(self, path):
+        bucket = bucketOf(path)
+        if bucket is None:
+            return None
+        with self.lock:
+            if bucket in self.locations:
+                return self.locations[bucket]
+        location = bucketLocation(bucket, self.gsutil)
+        with self.lock:
+            self.locations[bucket] = location
+        return location
+
+    """
+    #--------------------------------------------------------------------------
+    # Regions where a job of 'path' can run
+    # Returns (regions, local) - local is False if the input is stored outside these regions
+    #--------------------------------------------------------------------------
+    """
+    def regionsFor(self, path):
+        regions = locationRegions(self.location(path))
+        if self.regions is None:
+            return regions, True
+
+        common = [region for region in regions if region in self.regions]
+        if len(common) > 0:
+            return common, True
+        return list(self.regions), len(regions) == 0
+
+    """
+    #--------------------------------------------------------------------------
+    # Capacity failures of each zone within the window: {zone: count}
+    # - ledger rows are read every REFRESH seconds; failures given with fail() are added
+    #--------------------------------------------------------------------------
+    """
+    def failures(self):
+        now = time.time()
+        with self.lock:
+            if self.dbPath is not None and now - self.loaded > REFRESH:
+                db = ledger.Ledger(self.dbPath)
+                failed = {}
+                for row in db.rows(states=ledger.RETRY_STATES, since=now - self.window):
+                    if row['zone'] and isCapacityError(row['message']):
+                        failed[row['zone']] = failed.get(row['zone'], 0) + 1
+                db.close()
+                self.failed = failed
+                self.loaded = now
+
+            self.local = [(zone, when) for zone, when in self.local if now - when <= self.window]
+            counts = dict(self.failed)
+            for zone, when in self.local:
+                counts[zone] = counts.get(zone, 0) + 1
+            return counts
+
+    def fail(self, zone, message=None):
+        if zone and (message is None or isCapacityError(message)):
+            with self.lock:
+                self.local.append((zone, time.time()))
+
+    """
+    #--------------------------------------------------------------------------
+    # Zones of 'regions' ordered by recent capacity failures, then by the jobs already placed
+    #--------------------------------------------------------------------------
+    """
+    def rank(self, regions):
+        zones = []
+        for region in regions:
+            zones.extend(regionZones(region))
+        if len(zones) == 0:
+            zones = list(self.defaultZones)
+
+        failed = self.failures()
+        with self.lock:
+            order = sorted(range(len(zones)), key=lambda i: (failed.get(zones[i], 0), self.assigned.get(zones[i], 0), i))
+        return [zones[i] for i in order]
+
+    def pick(self, regions):
+        zone = self.rank(regions)[0]
+        with self.lock:
+            self.assigned[zone] = self.assigned.get(zone, 0) + 1
+        return zone
+
+    """
+    #--------------------------------------------------------------------------
+    # Copy 'path' into the cache bucket of 'region'
+    # Returns the cached path, or 'path' if no cache bucket is given for the region
+    #--------------------------------------------------------------------------
+    """
+    def prefetch(self, path, region):
+        cache = self.cacheBuckets.get(region)
+        if cache is None:
+            return path
+
+        cached = "{}/{}".format(cache.rstrip('/'), path[5:])
+        #-- '-n' skips objects already copied by an earlier job or run
+        subprocess.check_output([self.gsutil, '-q', 'cp', '-n', path, cached], stderr=subprocess.STDOUT)
+        return cached
+
+    """
+    #--------------------------------------------------------------------------
+    # Place a job - returns a copy of the job with 'Zones' and, if prefetched, new input paths
+    # - the location is taken from job['inFile'] or the first of job['inFiles']
+    # - a 'Zones' given in the job is kept
+    #--------------------------------------------------------------------------
+    """
+    def place(self, job):
+        if job.get('Zones') is not None:
+            return job
+
+        job = dict(job)
+        inFiles = job.get('inFiles') or [job.get('inFile')]
+        regions, local = self.regionsFor(inFiles[0])
+        zone = self.pick(regions)
+        job['Zones'] = zone
+
+        if not local:
+            region = regionOfZone(zone)
+            if 'inFiles' in job and job['inFiles']:
+                job['inFiles'] = [self.prefetch(path, region) for path in job['inFiles']]
+            if job.get('inFile') is not None:
+                job['inFile'] = self.prefetch(job['inFile'], region)
+        return job
+
+    """
+    #--------------------------------------------------------------------------
+    # Zones of a list submitted with one 'dsub --tasks' call
+    # Returns (Zones, inFiles) - list of the zones of the region of the first input, ordered by recent failures,
+    # and the inputs, prefetched if they are stored outside that region
+    #--------------------------------------------------------------------------
+    """
+    def placeMany(self, inFiles):
+        regions, local = self.regionsFor(inFiles[0])
+        zones = self.rank(regions)
+        region = regionOfZone(zones[0])
+
+        placed = []
+        for path in inFiles:
+            pathRegions, pathLocal = self.regionsFor(path)
+            if region in pathRegions and pathLocal:
+                placed.append(path)
+            else:
+                placed.append(self.prefetch(path, region))
+
+        zones = [zone for zone in zones if regionOfZone(zone) == region]
+        return zones, placed
+
+
+def parseCacheBuckets(values):
+    buckets = {}
+    for value in values or []:
+        assert ('=' in value), "Cache bucket must be given as REGION=gs://bucket!!\nExample) us-central1=gs://my-cache-usc1\n"
+        region, bucket = value.split('=', 1)
+        buckets[region.strip()] = bucket.strip()
+    return buckets
+
+
+"""
+#------------------------------------------------------------------------------
+# :: USAGE ::
+# >> python placement.py -i bams.txt                                      # location and zones of each input
+# >> python placement.py --tsv germline_bam.tsv --column BAM > germline_bam.zones.tsv
+#    (adds a ZONES column to a batch TSV of submit_batch.py; the column overrides "ZONES" of germline.json)
+#------------------------------------------------------------------------------
+"""
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--input", help='list of files in cloud storage', action='store', default=None)
+    parser.add_argument("--tsv", help='batch TSV of submit_batch.py to which a ZONES column is added', action='store', default=None)
+    parser.add_argument("--column", help='input column of --tsv [Default=BAM]', action='store', default='BAM')
+    parser.add_argument("--regions", help='comma separated compute regions allowed for the jobs (e.g., us-central1,us-east1)', action='store', default=None)
+    parser.add_argument("--gsutil", help='gsutil executable [Default=gsutil]', action='store', default='gsutil')
+
+    args = parser.parse_args()
+    assert (args.input is not None or args.tsv is not None), "Input list or TSV must be given!!\nExample) -i bams.txt\n"
+
+    place = Placement(regions=None if args.regions is None else args.regions.split(','), gsutil=args.gsutil)
+
+    if args.tsv is None:
+        with open(args.input) as f:
+            paths = [line.strip() for line in f if len(line.strip()) > 0]
+        for path in paths:
+            regions, local = place.regionsFor(path)
+            print("{}\t{}\t{}".format(path, place.location(path) or '-', ','.join(place.rank(regions))))
+    else:
+        with open(args.tsv) as f:
+            rows = list(csv.DictReader(f, delimiter='\t'))
+        fields = list(rows[0].keys()) if len(rows) > 0 else [args.column]
+        if 'ZONES' not in fields:
+            fields.append('ZONES')
+        print('\t'.join(fields))
+        for row in rows:
+            regions, local = place.regionsFor(row[args.column])
+            row['ZONES'] = ','.join(place.rank(regions))
+            print('\t'.join([row.get(key) or '' for key in fields]))
@@ -0,0 +1,289 @@
+"""
+# Purpose     : Bulk status poller of dsub jobs and Genomics operations
+# Descriptions:
+#  - Reads outstanding (SUBMITTED/RUNNING) jobs from the job ledger (ledger.py)
+#  - dsub jobs are queried in batches with one 'dstat --jobs <id> <id> ...' call per batch
+#  - Genomics operations are queried with 'gcloud alpha genomics operations describe'
+#  - Queries run concurrently with asyncio (bounded by --concurrency) and are retried
+#    with exponential backoff
+#  - States are written back to the ledger; '--watch' repeats sweeps and prints state transitions only
+#  - '--dstat' and '--gcloud' can point to local fake executables to run offline
+#  - '--cache' adds the outputs of jobs finished with SUCCESS to the stage output cache (stageCache.py)
+#
+# Start date  : Oct 17, 2026
+# Last update : Oct 17, 2026
+"""
+
+__author__ 		= "Jong Cheol Jeong"
+__copyright__ 	= "Copyright 2018, UK Cancer Research Informatics"
+__version__ 	= "1.0.0"
+__maintainer__ 	= "Jong Cheol Jeong"
+__email__ 		= "jjeong@kcr.uky.edu"
+
+
+import asyncio
+import argparse
+import random
+import json
+import time
+import ledger
+import stageCache
+from collections import OrderedDict
+
+
+#-- dstat status -> ledger state
+DSTAT_STATES = {
+    'RUNNING': ledger.RUNNING,
+    'SUCCESS': ledger.SUCCESS,
+    'FAILURE': ledger.FAILURE,
+    'CANCELED': ledger.CANCELED,
+}
+
+
+class PollError(Exception):
+    pass
+
+
+"""
+#------------------------------------------------------------------------------
+# Run a command and return its stdout
+# - non-zero exit codes are retried up to 'retries' times with exponential backoff + jitter
+#------------------------------------------------------------------------------
+"""
+async def runCommand(command, sem, retries=4, backoff=2.0, maxBackoff=60.0):
+    attempt = 0
+    while True:
+        async with sem:
+            proc = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+            out, err = await proc.communicate()
+
+        if proc.returncode == 0:
+            return out.decode('utf-8', 'replace')
+
+        attempt += 1
+        if attempt > retries:
+            raise PollError("{} exited with {}: {}".format(command[0], proc.returncode, err.decode('utf-8', 'replace').strip()))
+
+        delay = min(maxBackoff, backoff * (2 ** (attempt - 1)))
+        await asyncio.sleep(delay * (0.5 + random.random() / 2))
+
+
+"""
+#------------------------------------------------------------------------------
+# Query a batch of dsub jobs of one project
+# Returns {(jobID, taskID): (state, message)} - taskID is '' for jobs without tasks
+#------------------------------------------------------------------------------
+"""
+async def pollDsub(jobIDs, project, sem, dstat='dstat', **retry):
+    command = [dstat, '--project', project, '--jobs'] + list(jobIDs) + ['--status', '*', '--full', '--format', 'json']
+    out = await runCommand(command, sem, **retry)
+
+    try:
+        records = json.loads(out) if out.strip() else []
+    except ValueError:
+        raise PollError("cannot parse dstat output: {}".format(out[:200]))
+
+    states = {}
+    for rec in records:
+        taskID = rec.get('task-id')
+        taskID = '' if taskID is None else str(taskID)
+        state = DSTAT_STATES.get(str(rec.get('status', '')).upper(), ledger.RUNNING)
+        states[(rec.get('job-id'), taskID)] = (state, rec.get('status-message') or rec.get('status-detail'))
+
+    return states
+
+
+"""
+#------------------------------------------------------------------------------
+# Query one Genomics operation
+# Returns {(operationID, ''): (state, message)}
+#------------------------------------------------------------------------------
+"""
+async def pollOperation(opID, sem, gcloud='gcloud', **retry):
+    command = [gcloud, 'alpha', 'genomics', 'operations', 'describe', opID, '--format=json']
+    out = await runCommand(command, sem, **retry)
+
+    try:
+        op = json.loads(out)
+    except ValueError:
+        raise PollError("cannot parse gcloud output: {}".format(out[:200]))
+
+    if not op.get('done', False):
+        return {(opID, ''): (ledger.RUNNING, None)}
+
+    if op.get('error'):
+        return {(opID, ''): (ledger.FAILURE, op['error'].get('message', str(op['error'])))}
+
+    return {(opID, ''): (ledger.SUCCESS, None)}
+
+
+"""
+#------------------------------------------------------------------------------
+# Project of a ledger row - taken from the submission parameters unless given
+#------------------------------------------------------------------------------
+"""
+def rowProject(row, project=None):
+    if project is not None:
+        return project
+    try:
+        return json.loads(row['params'] or '{}').get('prjName')
+    except ValueError:
+        return None
+
+
+"""
+#------------------------------------------------------------------------------
+# Poller
+# :: Example Code ::
+# poller = Poller(ledger.Ledger('/output_dir/cleanSAM/ledger.db'), batchSize=100, concurrency=8)
+# transitions = poller.sweep()
+#------------------------------------------------------------------------------
+"""
+class Poller(object):
+
+    def __init__(self, db, stage=None, project=None, batchSize=100, concurrency=8, dstat='dstat', gcloud='gcloud', retries=4, backoff=2.0):
+        self.db = db
+        self.stage = stage
+        self.project = project
+        self.batchSize = batchSize
+        self.concurrency = concurrency
+        self.dstat = dstat
+        self.gcloud = gcloud
+        self.retry = dict(retries=retries, backoff=backoff)
+        self.table = OrderedDict()      # (sample, stage) -> state
+        self.errors = []
+
+    """
+    #--------------------------------------------------------------------------
+    # Query all outstanding jobs once, update the ledger and return the transitions
+    # [(row, oldState, newState, message)]
+    #--------------------------------------------------------------------------
+    """
+    def sweep(self):
+        rows = self.db.outstanding(self.stage)
+        for row in rows:
+            self.table[(row['sample'], row['stage'])] = row['state']
+
+        if len(rows) == 0:
+            return []
+
+        results = asyncio.run(self.query(rows))
+        return self.apply(rows, results)
+
+    async def query(self, rows):
+        sem = asyncio.Semaphore(self.concurrency)
+        tasks = []
+
+        #-- dsub jobs grouped by project and sent in batches of unique job IDs
+        byProject = OrderedDict()
+        for row in rows:
+            if row['runner'] == 'genomics' or not row['jobID']:
+                continue
+            project = rowProject(row, self.project)
+            byProject.setdefault(project, OrderedDict())[row['jobID']] = True
+
+        for project in byProject:
+            jobIDs = list(byProject[project].keys())
+            for i in range(0, len(jobIDs), self.batchSize):
+                tasks.append(pollDsub(jobIDs[i:i + self.batchSize], project, sem, dstat=self.dstat, **self.retry))
+
+        opIDs = OrderedDict([(row['jobID'], True) for row in rows if row['runner'] == 'genomics' and row['jobID']])
+        for opID in opIDs:
+            tasks.append(pollOperation(opID, sem, gcloud=self.gcloud, **self.retry))
+
+        results = {}
+        for res in await asyncio.gather(*tasks, return_exceptions=True):
+            if isinstance(res, Exception):
+                self.errors.append(str(res))
+            else:
+                results.update(res)
+
+        return results
+
+    def apply(self, rows, results):
+        transitions = []
+        for row in rows:
+            key = (row['jobID'], row['taskID'] or '')
+            if key not in results:
+                continue
+
+            state, message = results[key]
+            old = row['state']
+            if state == old:
+                continue
+
+            self.db.setState(state, sample=row['sample'], stage=row['stage'], message=message, commit=False)
+            self.table[(row['sample'], row['stage'])] = state
+            transitions.append((row, old, state, message))
+
+        self.db.commit()
+        return transitions
+
+    """
+    #--------------------------------------------------------------------------
+    # Sweep every 'interval' seconds until no job is outstanding
+    #--------------------------------------------------------------------------
+    """
+    def watch(self, interval=60, callback=None):
+        while True:
+            for transition in self.sweep():
+                if callback is not None:
+                    callback(*transition)
+
+            if len(self.db.outstanding(self.stage)) == 0:
+                return self.table
+
+            time.sleep(interval)
+
+
+def printTransition(row, old, new, message):
+    cmt = "{}\t{}\t{}\t{} -> {}".format(time.strftime('%Y-%m-%d %H:%M:%S'), row['sample'], row['stage'], old, new)
+    if message:
+        cmt = "{}\t{}".format(cmt, message)
+    print(cmt)
+
+
+"""
+#------------------------------------------------------------------------------
+# :: USAGE ::
+# >> python pollStatus.py -l /output_dir/cleanSAM/ledger.db
+# >> python pollStatus.py -l /output_dir/cleanSAM/ledger.db --watch --interval 120
+# >> python pollStatus.py -l ledger.db --dstat /local/fake/dstat --gcloud /local/fake/gcloud
+# >> python pollStatus.py -l /output_dir/cleanSAM/ledger.db --watch --cache /output_dir/cache.db
+#------------------------------------------------------------------------------
+"""
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-l", "--ledger", help='ledger file written by the driver scripts', action='store', required=True)
+    parser.add_argument("--stage", help='poll only this stage (e.g., CleanSam)', action='store', default=None)
+    parser.add_argument("-p", "--project", help='Google project ID [Default=project recorded in the ledger]', action='store', default=None)
+    parser.add_argument("--batch-size", help='number of dsub jobs per dstat call [Default=100]', type=int, default=100)
+    parser.add_argument("--concurrency", help='number of status queries run at the same time [Default=8]', type=int, default=8)
+    parser.add_argument("--retries", help='number of retries of a failed query [Default=4]', type=int, default=4)
+    parser.add_argument("--watch", help='repeat sweeps until all jobs are finished and print state transitions only', action='store_true')
+    parser.add_argument("--interval", help='seconds between sweeps in --watch mode [Default=60]', type=float, default=60)
+    parser.add_argument("--dstat", help='dstat executable [Default=dstat]', action='store', default='dstat')
+    parser.add_argument("--gcloud", help='gcloud executable [Default=gcloud]', action='store', default='gcloud')
+    parser.add_argument("--cache", help='stage output cache file - outputs of finished jobs are added to it', action='store', default=None)
+
+    args = parser.parse_args()
+
+    db = ledger.Ledger(args.ledger)
+    poller = Poller(db, stage=args.stage, project=args.project, batchSize=args.batch_size, concurrency=args.concurrency,
+                    dstat=args.dstat, gcloud=args.gcloud, retries=args.retries)
+
+    if args.watch:
+        poller.watch(interval=args.interval, callback=printTransition)
+    else:
+        poller.sweep()
+        for key in poller.table:
+            print("{}\t{}\t{}".format(key[0], key[1], poller.table[key]))
+
+    if args.cache is not None:
+        print("{} entries are added to the cache".format(stageCache.StageCache(args.cache).collect(db)))
+
+    for err in poller.errors:
+        print("ERROR\t{}".format(err))
+
+    for stage, state, n in db.counts(args.stage):
+        print("{}\t{}\t{}".format(stage, state, n))
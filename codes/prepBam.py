@@ -0,0 +1,127 @@
+"""
+# Purpose     : Fused BAM preprocessing
+# Descriptions:
+#  - Runs CleanSam, FixMate, SortSam and BuildBamIndex (or a contiguous part of them) in one dsub job per BAM
+#  - Only the final BAM and its index are written to the output bucket
+#  - This codes must be run after running 'addPL.py' that correct known issue of PL absence
+#
+# Start date  : Oct 17, 2026
+# Last update : Oct 17, 2026
+"""
+
+__author__ 		= "Jong Cheol Jeong"
+__copyright__ 	= "Copyright 2018, UK Cancer Research Informatics"
+__version__ 	= "1.0.0"
+__maintainer__ 	= "Jong Cheol Jeong"
+__email__ 		= "jjeong@kcr.uky.edu"
+
+
+import dsub
+import sizing
+import submitPool
+import os
+import argparse
+
+"""
+#------------------------------------------------------------------------------
+# Define parameters
+# list of BAM can be obtained with gsutil (https://cloud.google.com/storage/docs/gsutil_install)
+# gsutil ls gs://my-bam |grep 'bam$' > bamList.txt
+# OR
+# gsutil ls gs://my-bam |grep -H '.*bam$' |sed -e "s|.*\(gs.*$\)|\1|"  > bamList.txt
+#
+# < Example running command >
+# python prepBam.py -p my-project-id -i bamList.txt -o gs://vcf-to-bam-bam4 -s /output_dir/prepBam \
+# --steps CleanSam,FixMate,SortSam,BuildBamIndex
+#------------------------------------------------------------------------------
+"""
+parser = argparse.ArgumentParser()
+parser.add_argument("-i", "--input", help='list of file names in cloud storage to be run', action='store', required=True)
+parser.add_argument("-o", "--output", help='output google storage directory i.e., GS Path (gs://your-bucket', action='store', required=True)
+parser.add_argument("-s", "--script", help='local directory to store dsub scripts', action='store', required=True)
+parser.add_argument("-p", "--project", help='Google project ID (e.g., my-project-name)', action='store', required=True)
+parser.add_argument("-t", "--steps", help='comma separated contiguous steps to be run in one job [Default="{}"]'.format(','.join(dsub.FUSED_ORDER)), type=str, default=','.join(dsub.FUSED_ORDER))
+submitPool.addSubmitArgs(parser)
+
+args = parser.parse_args()
+
+listBAM = args.input
+tgPath  = args.output
+logPath = "{}/log".format(tgPath)
+scPath = args.script
+prjName = args.project
+steps = [step.strip() for step in args.steps.split(',') if step.strip()]
+
+dsub.checkSteps(steps)
+index = 'BuildBamIndex' in steps
+
+try:
+    os.makedirs(scPath)
+except OSError:
+    pass
+
+
+# Read input files and preparing for output name by adding '.prep'
+# in front of the file extention 'bam'
+#------------------------------------------------------------------------------
+inBAM = []
+outBAM = []
+outBAI = []
+
+with open(listBAM, 'r') as f:
+    for line in f:
+        inBAM.append(line.strip())
+        pathList = line.strip().split('/')
+        nameList = pathList[len(pathList)-1].split('.')
+        newName = "{}/{}.prep.{}".format(tgPath, '.'.join(nameList[:(len(nameList)-1)]), nameList[len(nameList)-1])
+        outBAM.append(newName)
+        outBAI.append("{}.bai".format(newName))
+
+#-- check if the number of inputs and outputs are same
+assert(len(inBAM) == len(outBAM)), "The number of inputs and outputs are different\nPlease check the {}\n".format(listBAM)
+
+#-- Write input & output mapping file and store them into the same location with listBAM
+mapBAM = listBAM.split('/')
+mapBAM = "{}/mapBAM-prep.txt".format('/'.join(mapBAM[:len(mapBAM)-1]))
+with open(mapBAM, 'w') as f:
+    for i in range(len(inBAM)):
+        cmt = "{}\t{}\n".format(inBAM[i], outBAM[i])
+        f.writelines(cmt)
+
+
+"""
+#------------------------------------------------------------------------------
+# Submit jobs
+#------------------------------------------------------------------------------
+"""
+options = submitPool.stageOptions(args)
+db = submitPool.openLedger(args, scPath)
+submitPool.configureLimits(args)
+place = submitPool.openPlacement(args, db)
+
+if args.batch:
+    oScr = "{}/dsub_FusedPrep.sh".format(scPath)
+    extraOutputs = {'OUTBAI': outBAI} if index else None
+
+    #-- all tasks are sized for the largest input
+    size = None
+    if options.get('autoSize'):
+        size = sizing.sizeFused(steps, max(sizing.objectSizes(inBAM).values()), options['sizeRules'])
+
+    if size is None:
+        cmd = dsub.fusedCmd(steps=steps)
+        minRam = dsub.fusedRam(steps)
+    else:
+        cmd = dsub.fusedCmd(steps=steps, heaps=size['heap'])
+        minRam = None
+
+    submitPool.runTasks(stage='FusedPrep', prjName=prjName, inFiles=inBAM, outFiles=outBAM, scriptPath=oScr, Logs=logPath,
+                        Image=dsub.STAGES[steps[0]]['Image'], minRam=minRam, cmd=cmd, extraOutputs=extraOutputs, size=size, cache=options.get('cache'), db=db, resume=args.resume, placement=place)
+else:
+    jobs = []
+    for i in range(len(inBAM)):
+        oScr = "{}/dsub_{}.sh".format(scPath, str(i).zfill(3))
+        jobs.append(dict(prjName=prjName, inFile=inBAM[i], outFile=outBAM[i], outBai=outBAI[i] if index else None, scriptPath=oScr, Logs=logPath, steps=steps, **options))
+
+    summary = submitPool.runPool(func=dsub.FusedPrep, jobs=jobs, nProc=args.nproc, outPath=scPath, db=db, stage='FusedPrep', resume=args.resume, placement=place)
+    submitPool.printSummary(summary)
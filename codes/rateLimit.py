@@ -0,0 +1,306 @@
+"""
+# Purpose     : Quota-aware rate limiting of dsub and gcloud submissions
+# Descriptions:
+#  - One token bucket (requests/sec with a burst) and one concurrency limit per (project, region)
+#    shared by all submission threads of a run
+#  - Failed commands are classified:
+#       quota     : quota/rate errors (HTTP 429, RESOURCE_EXHAUSTED, rateLimitExceeded)
+#       rejected  : the request was not processed (HTTP 503, UNAVAILABLE, connection refused, DNS errors)
+#       ambiguous : the request may have been processed (HTTP 500/502/504, DEADLINE_EXCEEDED, INTERNAL,
+#                   timeouts and connections reset or broken after the request was sent)
+#       permanent : everything else (bad arguments, permissions, missing files, ...)
+#    Retryable errors are retried with jittered exponential backoff; a quota error also pauses the
+#    bucket of its (project, region) so the other threads back off as well
+#  - Submissions (dsub, gcloud pipelines run) are not idempotent: ambiguous errors are not retried,
+#    since the job may already be running and a second call would launch a duplicate VM
+#  - HTTP status codes are matched only after 'HTTP', 'HttpError', '"code":' or 'code=', not in file
+#    names such as 'x-500.bam'
+#  - Counters per (project, region): requests, retries, permanent errors, and the time spent waiting
+#    for tokens, for a free slot and in backoff
+#  - Limits are given with '--rate/--burst/--concurrency' or a JSON file ('--quota') e.g.,
+#       {"default": {"rate": 5, "burst": 10, "concurrency": 16},
+#        "my-project-id/us-central1": {"rate": 2, "concurrency": 8}}
+#
+# Start date  : Oct 17, 2026
+# Last update : Oct 17, 2026
+"""
+
+__author__ 		= "Jong Cheol Jeong"
+__copyright__ 	= "Copyright 2018, UK Cancer Research Informatics"
+__version__ 	= "1.0.0"
+__maintainer__ 	= "Jong Cheol Jeong"
+__email__ 		= "jjeong@kcr.uky.edu"
+
+
+import subprocess
+import threading
+import random
+import json
+import time
+import re
+from collections import OrderedDict
+
+
+DEFAULTS = OrderedDict([
+    ('rate', 5.0),              # requests per second
+    ('burst', 10),              # requests that can be sent at once after an idle period
+    ('concurrency', 16),        # commands running at the same time
+])
+
+RETRIES = 6
+BACKOFF = 2.0
+MAX_BACKOFF = 120.0
+
+#-- patterns of the command output; HTTP status codes only in a status context
+STATUS = r'(?:HTTP/\d(?:\.\d)?\s+|HTTP(?:Error)?\s*|HttpError\s+|"code":\s*|code=)'
+QUOTA_ERRORS = re.compile(STATUS + r'429\b|RESOURCE_EXHAUSTED|rateLimitExceeded|userRateLimitExceeded|[Qq]uota exceeded|Too Many Requests')
+REJECTED_ERRORS = re.compile(STATUS + r'503\b|\bUNAVAILABLE\b|ServiceUnavailable|Temporary failure in name resolution|Name or service not known|'
+                             r'Connection refused|Failed to establish a new connection')
+AMBIGUOUS_ERRORS = re.compile(STATUS + r'50[024]\b|\bDEADLINE_EXCEEDED\b|"status":\s*"INTERNAL"|backendError|Connection reset|'
+                              r'Connection aborted|timed out|TransportError|BrokenPipe')
+
+RETRYABLE = 'retryable'
+PERMANENT = 'permanent'
+
+
+class SubmitError(Exception):
+    pass
+
+
+"""
+#------------------------------------------------------------------------------
+# Classify the output of a failed command
+# Returns ('retryable', 'quota'), ('retryable', 'rejected'), ('retryable', 'ambiguous') or ('permanent', None)
+# :: Example Code ::
+# classify('HttpError 503 when requesting ...')            -> ('retryable', 'rejected')
+# classify('Read timed out. (read timeout=60)')            -> ('retryable', 'ambiguous')
+# classify('No such object: gs://b1/x-500.bam')            -> ('permanent', None)
+#------------------------------------------------------------------------------
+"""
+def classify(output):
+    if isinstance(output, bytes):
+        output = output.decode('utf-8', 'replace')
+    output = output or ''
+
+    if QUOTA_ERRORS.search(output):
+        return RETRYABLE, 'quota'
+    if REJECTED_ERRORS.search(output):
+        return RETRYABLE, 'rejected'
+    if AMBIGUOUS_ERRORS.search(output):
+        return RETRYABLE, 'ambiguous'
+    return PERMANENT, None
+
+
+#-- region of a zone or of the first zone of a list: us-central1-f -> us-central1, 'us-*' is kept
+def regionOf(Zones):
+    if not Zones:
+        return 'default'
+    zone = Zones[0] if isinstance(Zones, list) else Zones.strip()
+    if re.match(r'^[a-z]+-[a-z]+\d+-[a-z]$', zone):
+        return zone.rsplit('-', 1)[0]
+    return zone
+
+
+"""
+#------------------------------------------------------------------------------
+# Token bucket
+# - acquire() blocks until a token is available and returns the seconds it waited
+# - pause(seconds) makes the next token available only after 'seconds'
+#------------------------------------------------------------------------------
+"""
+class TokenBucket(object):
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+        self.tokens = self.burst
+        self.last = time.time()
+        self.until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.time()
+                if now >= self.until:
+                    self.tokens = min(self.burst, self.tokens + (now - max(self.last, self.until)) * self.rate)
+                    self.last = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return waited
+                    delay = (1 - self.tokens) / self.rate
+                else:
+                    delay = self.until - now
+            time.sleep(delay)
+            waited += delay
+
+    def pause(self, seconds):
+        with self.lock:
+            self.until = max(self.until, time.time() + seconds)
+            self.tokens = 0
+
+
+"""
+#------------------------------------------------------------------------------
+# Limits and counters of one (project, region)
+#------------------------------------------------------------------------------
+"""
+COUNTERS = ['requests', 'throttled', 'throttleTime', 'slotTime', 'retries', 'quotaErrors', 'backoffTime', 'permanent', 'ambiguous', 'exhausted']
+
+
+class Quota(object):
+
+    def __init__(self, rate, burst, concurrency):
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate, burst)
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.lock = threading.Lock()
+        self.counts = OrderedDict([(key, 0) for key in COUNTERS])
+
+    def add(self, key, value=1):
+        with self.lock:
+            self.counts[key] += value
+
+
+"""
+#------------------------------------------------------------------------------
+# Rate limiter
+# :: Example Code ::
+# limiter = RateLimiter(rate=5, burst=10, concurrency=16, quotas={'my-project-id/us-central1': {'rate': 2}})
+# out = limiter.run(['dsub', '--project', 'my-project-id', ...], project='my-project-id', region='us-central1')
+#
+# - run() returns the stdout of the command (stderr included with mergeErr=True) or raises
+#   subprocess.CalledProcessError after a permanent error or 'retries' retryable errors
+# - idempotent=False (job submissions) raises after an ambiguous error instead of running the
+#   command again
+#------------------------------------------------------------------------------
+"""
+class RateLimiter(object):
+
+    def __init__(self, rate=None, burst=None, concurrency=None, quotas=None, retries=RETRIES, backoff=BACKOFF, maxBackoff=MAX_BACKOFF):
+        #-- limits given explicitly are kept over the 'default' of quotas
+        self.overrides = {} if quotas is None else dict(quotas)
+        self.defaults = OrderedDict(DEFAULTS)
+        self.defaults.update(self.overrides.pop('default', {}))
+        for key, value in (('rate', rate), ('burst', burst), ('concurrency', concurrency)):
+            if value is not None:
+                self.defaults[key] = value
+
+        self.retries = retries
+        self.backoff = backoff
+        self.maxBackoff = maxBackoff
+        self.quotas = OrderedDict()
+        self.lock = threading.Lock()
+
+    def quota(self, project=None, region=None):
+        key = "{}/{}".format(project or 'default', region or 'default')
+        with self.lock:
+            if key not in self.quotas:
+                limits = OrderedDict(self.defaults)
+                limits.update(self.overrides.get(project or 'default', {}))
+                limits.update(self.overrides.get(key, {}))
+                self.quotas[key] = Quota(limits['rate'], limits['burst'], limits['concurrency'])
+            return self.quotas[key]
+
+    def delay(self, attempt):
+        #-- full jitter
+        return random.uniform(0, min(self.maxBackoff, self.backoff * (2 ** attempt)))
+
+    def run(self, command, project=None, region=None, mergeErr=False, idempotent=True):
+        quota = self.quota(project, region)
+        attempt = 0
+        while True:
+            waited = quota.bucket.acquire()
+            if waited > 0:
+                quota.add('throttled')
+                quota.add('throttleTime', waited)
+
+            start = time.time()
+            quota.slots.acquire()
+            try:
+                quota.add('slotTime', time.time() - start)
+                quota.add('requests')
+                try:
+                    proc = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT if mergeErr else subprocess.PIPE)
+                except OSError:
+                    quota.add('permanent')
+                    raise
+            finally:
+                quota.slots.release()
+
+            if proc.returncode == 0:
+                return proc.stdout
+            error = subprocess.CalledProcessError(proc.returncode, command, output=proc.stdout, stderr=proc.stderr)
+            kind, reason = classify((proc.stdout or b'') + (proc.stderr or b''))
+
+            if kind == PERMANENT:
+                quota.add('permanent')
+                raise error
+
+            if reason == 'ambiguous' and not idempotent:
+                quota.add('ambiguous')
+                raise error
+
+            if attempt >= self.retries:
+                quota.add('exhausted')
+                raise error
+
+            delay = self.delay(attempt)
+            if reason == 'quota':
+                quota.add('quotaErrors')
+                quota.bucket.pause(delay)
+            quota.add('retries')
+            quota.add('backoffTime', delay)
+            time.sleep(delay)
+            attempt += 1
+
+    """
+    #--------------------------------------------------------------------------
+    # Counters: [(project/region, counters)]
+    #--------------------------------------------------------------------------
+    """
+    def stats(self):
+        with self.lock:
+            return [(key, OrderedDict(quota.counts)) for key, quota in self.quotas.items()]
+
+
+def loadQuotas(confPath=None):
+    if confPath is None:
+        return None
+    with open(confPath) as f:
+        return json.load(f)
+
+
+"""
+#------------------------------------------------------------------------------
+# Limiter shared by the submissions of a process
+# :: Example Code ::
+# configure(rate=2, concurrency=8)      # once, before the submissions
+# limiter().run(command, project, region)
+#------------------------------------------------------------------------------
+"""
+LIMITER = [None]
+
+
+def configure(**options):
+    LIMITER[0] = RateLimiter(**options)
+    return LIMITER[0]
+
+
+def limiter():
+    if LIMITER[0] is None:
+        configure()
+    return LIMITER[0]
+
+
+def printStats(limiter=None):
+    limiter = LIMITER[0] if limiter is None else limiter
+    if limiter is None:
+        return
+    for key, counts in limiter.stats():
+        print("Quota     : {} - {} requests, throttled {} times ({:.1f} sec), waited {:.1f} sec for a slot, {} retries ({} quota errors, {:.1f} sec backoff), {} permanent errors, {} not retried after an ambiguous error".format(
+              key, counts['requests'], counts['throttled'], counts['throttleTime'], counts['slotTime'], counts['retries'], counts['quotaErrors'],
+              counts['backoffTime'], counts['permanent'] + counts['exhausted'], counts['ambiguous']))
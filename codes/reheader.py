@@ -0,0 +1,216 @@
+"""
+# Purpose     : Rewrite the header of a BAM file without recompressing its records
+# Descriptions:
+#  - Only the BGZF blocks holding the BAM header are decompressed
+#  - The header text is edited by rules (e.g., add PL:illumina to @RG lines) or a function
+#  - The new header is written in new blocks; records sharing the last header block are
+#    written in a block of their own, and all remaining blocks are copied byte-for-byte
+#    (same layout as 'samtools reheader')
+#  - Works on files and streams ('-' = stdin/stdout), e.g.,
+#       gsutil cat gs://b1/x.bam | python reheader.py - - --pl illumina | gsutil cp - gs://b2/x.head.bam
+#  - Replaces 'samtools view -H | sed | samtools reheader' of headAddPL
+#
+# Start date  : Oct 17, 2026
+# Last update : Oct 17, 2026
+"""
+
+__author__ 		= "Jong Cheol Jeong"
+__copyright__ 	= "Copyright 2018, UK Cancer Research Informatics"
+__version__ 	= "1.0.0"
+__maintainer__ 	= "Jong Cheol Jeong"
+__email__ 		= "jjeong@kcr.uky.edu"
+
+
+import argparse
+import struct
+import sys
+import bgzf
+
+
+BAM_MAGIC = b'BAM\x01'
+
+
+"""
+#------------------------------------------------------------------------------
+# Read the BAM header from the first blocks of a BAM stream
+# Returns (text, refs, rest) where
+#  - text : header text (SAM header lines)
+#  - refs : binary reference list (n_ref and the references) as stored in the BAM
+#  - rest : decompressed bytes following the header in its last block (start of the records)
+#------------------------------------------------------------------------------
+"""
+def readHeader(f):
+    data = bytearray()
+    blocks = bgzf.dataBlocks(f)
+
+    def need(n):
+        while len(data) < n:
+            try:
+                data.extend(next(blocks))
+            except StopIteration:
+                raise bgzf.BgzfError("truncated BAM header")
+
+    need(8)
+    if bytes(data[:4]) != BAM_MAGIC:
+        raise bgzf.BgzfError("not a BAM file")
+
+    lText = struct.unpack('<i', data[4:8])[0]
+    need(8 + lText + 4)
+    text = bytes(data[8:8 + lText])
+
+    pos = 8 + lText
+    nRef = struct.unpack('<i', data[pos:pos + 4])[0]
+    end = pos + 4
+    for i in range(nRef):
+        need(end + 4)
+        lName = struct.unpack('<i', data[end:end + 4])[0]
+        end += 4 + lName + 4
+        need(end)
+
+    return text, bytes(data[pos:end]), bytes(data[end:])
+
+
+def headerBytes(text, refs):
+    return BAM_MAGIC + struct.pack('<i', len(text)) + text + refs
+
+
+"""
+#------------------------------------------------------------------------------
+# Header edit rules
+# :: Example Code ::
+# edit = tagRule('RG', 'PL', 'illumina')                   # add PL:illumina where missing
+# edit = tagRule('RG', 'SM', 'example1_DNA', overwrite=True)
+# newText = edit(text)
+#
+# - record    : header record type (HD, SQ, RG, PG, CO)
+# - overwrite : replace the value of an existing tag; otherwise only records without the tag change
+#------------------------------------------------------------------------------
+"""
+def tagRule(record='RG', tag='PL', value='illumina', overwrite=False):
+    prefix = '@{}\t'.format(record)
+    tagPrefix = '{}:'.format(tag)
+
+    def edit(text):
+        lines = text.split('\n')
+        for i, line in enumerate(lines):
+            if not line.startswith(prefix):
+                continue
+            fields = line.split('\t')
+            idx = [j for j in range(1, len(fields)) if fields[j].startswith(tagPrefix)]
+            if len(idx) == 0:
+                fields.append('{}{}'.format(tagPrefix, value))
+            elif overwrite:
+                fields[idx[0]] = '{}{}'.format(tagPrefix, value)
+            lines[i] = '\t'.join(fields)
+        return '\n'.join(lines)
+
+    return edit
+
+
+def chainRules(rules):
+    def edit(text):
+        for rule in rules:
+            text = rule(text)
+        return text
+    return edit
+
+
+"""
+#------------------------------------------------------------------------------
+# Header edit options shared by the command lines (reheader.py, transferBam.py)
+# :: Example Code ::
+# addRuleArgs(parser)
+# args = parser.parse_args()
+# edit = chainRules(rulesOf(args))
+#------------------------------------------------------------------------------
+"""
+def addRuleArgs(parser, pl=None):
+    default = '' if pl is None else ' [Default={}]'.format(pl)
+    parser.add_argument("--pl", help='add PL:<value> to @RG lines without PL (e.g., illumina){}'.format(default), action='store', default=pl)
+    parser.add_argument("--sm", help='set SM:<value> of @RG lines', action='store', default=None)
+    parser.add_argument("--tag", help='set a tag of a record type, RECORD:TAG:VALUE (repeatable, e.g., RG:LB:lib1)', action='append', default=[])
+    parser.add_argument("--overwrite", help='replace existing values of --pl/--tag', action='store_true')
+    parser.add_argument("--header", help='SAM header file replacing the header text', action='store', default=None)
+
+
+def rulesOf(args):
+    rules = []
+    if args.header is not None:
+        with open(args.header) as f:
+            newHeader = f.read()
+        rules.append(lambda text: newHeader)
+    if args.pl is not None:
+        rules.append(tagRule('RG', 'PL', args.pl, overwrite=args.overwrite))
+    if args.sm is not None:
+        rules.append(tagRule('RG', 'SM', args.sm, overwrite=True))
+    for tag in args.tag:
+        record, key, value = tag.split(':', 2)
+        rules.append(tagRule(record, key, value, overwrite=args.overwrite))
+    return rules
+
+
+"""
+#------------------------------------------------------------------------------
+# Rewrite the header of a BAM stream
+# :: Example Code ::
+# with open('x.bam', 'rb') as fin, open('x.head.bam', 'wb') as fout:
+#     reheader(fin, fout, edit=tagRule('RG', 'PL', 'illumina'))
+#
+# - edit  : function taking and returning the header text (str)
+# - level : compression level of the new header blocks
+# Returns (old header text, new header text)
+#------------------------------------------------------------------------------
+"""
+def reheader(fin, fout, edit=None, level=bgzf.LEVEL):
+    assert (not (edit is None)), "Header edit must be given!!\nExample) tagRule('RG', 'PL', 'illumina')\n"
+
+    text, refs, rest = readHeader(fin)
+    oldText = text.decode('utf-8')
+    newText = edit(oldText)
+
+    writer = bgzf.BgzfWriter(fout, level=level, closeFile=False)
+    writer.write(headerBytes(newText.encode('utf-8'), refs))
+    writer.flush()
+
+    #-- records that shared the last header block
+    if len(rest) > 0:
+        writer.write(rest)
+        writer.flush()
+
+    for raw in bgzf.rawBlocks(fin):
+        writer.writeRaw(raw)
+
+    writer.close()
+    return oldText, newText
+
+
+"""
+#------------------------------------------------------------------------------
+# :: USAGE ::
+# >> python reheader.py example1_DNA.bam example1_DNA.head.bam --pl illumina
+# >> gsutil cat gs://b1/x.bam | python reheader.py - - --pl illumina | gsutil cp - gs://b2/x.head.bam
+# >> python reheader.py x.bam y.bam --tag RG:SM:example1_DNA --overwrite
+# >> python reheader.py x.bam - --header new_header.sam > y.bam
+#------------------------------------------------------------------------------
+"""
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", help='input BAM file or "-" for stdin')
+    parser.add_argument("output", help='output BAM file or "-" for stdout')
+    addRuleArgs(parser)
+    parser.add_argument("-L", "--level", help='compression level of the header blocks [Default={}]'.format(bgzf.LEVEL), type=int, default=bgzf.LEVEL)
+
+    args = parser.parse_args()
+    rules = rulesOf(args)
+
+    assert (len(rules) > 0), "Nothing to change!!\nExample) --pl illumina\n"
+
+    fin = sys.stdin.buffer if args.input == '-' else open(args.input, 'rb')
+    fout = sys.stdout.buffer if args.output == '-' else open(args.output, 'wb')
+
+    reheader(fin, fout, edit=chainRules(rules), level=args.level)
+
+    if fout is not sys.stdout.buffer:
+        fout.close()
+    if fin is not sys.stdin.buffer:
+        fin.close()
@@ -3,9 +3,13 @@
 # Descriptions:
 #  - Codes contain functions to submit jobs through GCP Genomic Pipelines
 #  - current GATK 4.0 pipeline only supports Human genome reference GRCh38/hg38
+#  - templates are loaded once; render/submit seconds of each sample are written in 'genpipe_timings.tsv'
+#  - uBAMs are grouped by sample ('--key': file name stem, regex or SM of the read groups) and each sample
+#    is one workflow with all of its uBAMs (flowcell_unmapped_bams); '--key none' runs one workflow per uBAM
+#  - manifests of 'unmapBam.py --readgroup' ('<sample>.unmapped_bams.list') can be listed in place of uBAMs
 #
 # Start date  : July 23, 2018
-# Last update : Aug 21, 2018
+# Last update : Oct 17, 2026
 """
 
 __author__ 		= "Jong Cheol Jeong"
@@ -15,6 +19,8 @@ __maintainer__ 	= "Jong Cheol Jeong"
 __email__ 		= "jjeong@kcr.uky.edu"
 
 import dsub
+import submitPool
+import bamTriage
 import os
 import argparse
 
@@ -46,6 +52,9 @@ python runGenPipe.py -i /sentieon/dsub/inputs/short_listUnmappedBam.txt \
 -s /sentieon/dsub/inputs/Scripts/test \
 -g /sentieon/gcgp/broad-prod-wgs-germline-snps-indels \
 -w /sentieon/gcgp/wdl 
+
+# uBAMs named like 'S1_L001.unmapped.bam', grouped by the read group SM
+python runGenPipe.py -i listUnmappedBam.txt -o gs://jc-gatk-out -s Scripts/test -g broad-prod-wgs-germline-snps-indels -w wdl -k sm
 #------------------------------------------------------------------------------
 """
 
@@ -54,9 +63,13 @@ parser.add_argument("-i", "--input", help='list of unmapped BAM files in cloud s
 parser.add_argument("-o", "--output", help='output google storage directory i.e., GS Path (gs://your-bucket)', action='store', required=True)
 parser.add_argument("-s", "--script", help='local directory to store working scripts', action='store', required=True)
 parser.add_argument("-g", "--gatkdir", help='The path of GATK Best Practices Pipeline templates e.g., /usr/local/broad-prod-wgs-germline-snps-indels\nThis can be downloaded from https://cloud.google.com/genomics/docs/tutorials/gatk', action='store', required=True)
-parser.add_argument("-z", "--zone", help='List of Google Compute Engine availability zones to which resource creation will restricted. [Default="us-central1-f"]', type=str, default='us-central1-f')
+parser.add_argument("-z", "--zone", help='List of Google Compute Engine availability zones to which resource creation will restricted. [Default="us-central1-f", or zones next to the uBAMs with --place]', type=str, default=None)
 parser.add_argument("-w", "--wdl", help='WDL directory found in GATK Best Practices Pipeline examples. e.g., /usr/local/wdl\nThis can be downloaded from https://cloud.google.com/genomics/docs/tutorials/gatk', action='store', required=True)
 parser.add_argument("-x", "--prefix", help='Prefix template e.g., "PairedEndSingleSampleWf" /usr/local/wdl\nThis can be downloaded from https://cloud.google.com/genomics/docs/tutorials/gatk [Default = "PairedEndSingleSampleWf"] ', type=str, default='PairedEndSingleSampleWf')
+parser.add_argument("-k", "--key", help='How uBAMs are grouped into samples: stem (file name without extensions), regex (see --pattern), sm (SM of the @RG header lines) or none (one workflow per uBAM) [Default=stem]', choices=dsub.GROUP_KEYS, default='stem')
+parser.add_argument("-e", "--pattern", help='Regular expression for "--key regex"; its first group (or the whole match) is the sample name e.g., "^(.+?)_L\\d+"', type=str, default=None)
+parser.add_argument("--gsutil", help='gsutil command used to read the headers with "--key sm" [Default=gsutil]', type=str, default='gsutil')
+submitPool.addSubmitArgs(parser, dsub=False)
 
 args = parser.parse_args()
 
@@ -68,37 +81,37 @@ WDL_DIR         = args.wdl
 plPrefix        = args.prefix
 Zones           = args.zone
 
+#-- without --place, the workflows run in the zone used so far
+if Zones is None and not args.place:
+    Zones = 'us-central1-f'
+
 try:
     os.makedirs(scPath)
 except OSError:
     pass
 
-# Read input files and preparing for output name by adding '.head'
-# in front of the file extention 'bam'
+# Read input files and group them by sample; each sample is written in
+# 'GATK_OUT_DIR/<sample>'
 #------------------------------------------------------------------------------
 inBAM = []
-outGS = []
-tgPath = listBAM.split('/')
-tgPath = '/'.join(tgPath[0:len(tgPath)-1])
 with open(listBAM, 'r') as f:
     for line in f:
-        inBAM.append(line.strip())
-        pathList = line.strip().split('/')
-        preFix = pathList[-1].split('.')[0]
-        newName = "{}/{}".format(GATK_OUT_DIR, preFix)
-        outGS.append(newName)
+        if len(line.strip()) > 0:
+            inBAM.append(line.strip())
 
+groups = dsub.groupUnmapped(inBAM, key=args.key, pattern=args.pattern, nProc=max(args.nproc, bamTriage.NPROC), gsutil=args.gsutil)
+samples = list(groups.keys())
+outGS = ["{}/{}".format(GATK_OUT_DIR, sample) for sample in samples]
+print("{} uBAMs in {} samples".format(sum([len(files) for files in groups.values()]), len(samples)))
 
-#-- check if the number of inputs and outputs are same
-assert(len(inBAM) == len(outGS)), "The number of inputs and outputs are different\nPlease check the {}\n".format(listBAM)
-
-#-- Write input & output mapping file and store them into the same location with listBAM
+#-- Write input, sample & output mapping file and store them into the same location with listBAM
 mapBAM = listBAM.split('/')
 mapBAM = "{}/mapBAM-GS.txt".format('/'.join(mapBAM[:len(mapBAM)-1]))
 with open(mapBAM, 'w') as f:
-    for i in range(len(inBAM)):
-        cmt = "{}\t{}\n".format(inBAM[i], outGS[i])
-        f.writelines(cmt)
+    for i in range(len(samples)):
+        for inFile in groups[samples[i]]:
+            cmt = "{}\t{}\t{}\n".format(inFile, samples[i], outGS[i])
+            f.writelines(cmt)
 
 
 """
@@ -107,12 +120,24 @@ with open(mapBAM, 'w') as f:
 #------------------------------------------------------------------------------
 """
 
-
-for i in range(len(inBAM)):
-    ibam = inBAM[i]
-    obam = outGS[i]
-    cmt = "[{}/{}] {} is processing...".format(i + 1, len(inBAM), ibam)
-    print(cmt)
-    LogGS = '{}/logs'.format(obam)
-    dsub.subGenPipe(Zones=Zones, Logs=LogGS, inFile=ibam, scriptPath=scPath, GATK_GOOGLE_DIR=GATK_GOOGLE_DIR, GATK_OUT_DIR=obam, WDL_DIR=WDL_DIR, plPrefix=plPrefix)
-    print('\n')
+db = submitPool.openLedger(args, scPath)
+submitPool.configureLimits(args)
+place = submitPool.openPlacement(args, db)
+templates = dsub.genPipeTemplates(GATK_GOOGLE_DIR, WDL_DIR, plPrefix)
+
+jobs = []
+for i in range(len(samples)):
+    LogGS = '{}/logs'.format(outGS[i])
+    jobs.append(dict(Zones=Zones, Logs=LogGS, inFiles=groups[samples[i]], sampleName=samples[i], scriptPath=scPath, GATK_GOOGLE_DIR=GATK_GOOGLE_DIR, GATK_OUT_DIR=outGS[i], WDL_DIR=WDL_DIR, plPrefix=plPrefix, templates=templates))
+
+#-- one ledger row per sample
+summary = submitPool.runPool(func=dsub.subGenPipe, jobs=jobs, nProc=args.nproc, label='sampleName', outPath=scPath, db=db, stage='GenPipe', resume=args.resume, runner='genomics', placement=place)
+submitPool.printSummary(summary, label='sampleName')
+
+#-- render/submit time of each sample
+timings = templates.writeTimings('{}/genpipe_timings.tsv'.format(scPath))
+if len(timings) > 0:
+    renders = [render for name, (render, submit) in timings]
+    submits = [submit for name, (render, submit) in timings]
+    print("Render    : {:.4f} sec/sample (max {:.4f})".format(sum(renders) / len(renders), max(renders)))
+    print("Submit    : {:.3f} sec/sample (max {:.3f})".format(sum(submits) / len(submits), max(submits)))
@@ -0,0 +1,211 @@
+"""
+# Purpose     : Input-size-aware resources for dsub stages
+# Descriptions:
+#  - Reads the size of each input object and returns CPU, RAM, JVM heap and disk
+#    of a stage from per-stage rules
+#  - Rules can be overridden with a JSON file, e.g., sizing.json
+#       {
+#         "SortSam": {"diskMult": 3.5, "ramMax": 64},
+#         "CleanSam": {"ramBase": 6}
+#       }
+#
+# Start date  : Oct 17, 2026
+# Last update : Oct 17, 2026
+"""
+
+__author__ 		= "Jong Cheol Jeong"
+__copyright__ 	= "Copyright 2018, UK Cancer Research Informatics"
+__version__ 	= "1.0.0"
+__maintainer__ 	= "Jong Cheol Jeong"
+__email__ 		= "jjeong@kcr.uky.edu"
+
+
+import subprocess
+import json
+import math
+import copy
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+GB = 1024.0 ** 3
+#-- objects listed by one 'gsutil du' call and calls running at the same time
+DU_CHUNK = 200
+DU_PROC = 8
+
+"""
+#------------------------------------------------------------------------------
+# Default rules of each stage (sizes in GB)
+# - ram  = ramBase + ramPerGB * input size, limited to [ramMin, ramMax]
+# - heap = ram - heapMargin (JVM stages only)
+# - disk = diskBase + diskMult * input size, at least diskMin
+#   diskMult counts input + output + temporary files (e.g., ~3x for SortSam spill)
+#------------------------------------------------------------------------------
+"""
+RULES = OrderedDict()
+
+RULES['headAddPL'] = {'cpu': 1, 'ramBase': 2, 'ramPerGB': 0.0, 'ramMin': 2, 'ramMax': 4, 'heapMargin': None, 'diskBase': 10, 'diskMult': 2.2, 'diskMin': 20}
+RULES['CleanSam'] = {'cpu': 1, 'ramBase': 5, 'ramPerGB': 0.04, 'ramMin': 5, 'ramMax': 17, 'heapMargin': 1, 'diskBase': 10, 'diskMult': 2.2, 'diskMin': 20}
+RULES['FixMate'] = {'cpu': 2, 'ramBase': 7, 'ramPerGB': 0.1, 'ramMin': 7, 'ramMax': 33, 'heapMargin': 1, 'diskBase': 10, 'diskMult': 3.2, 'diskMin': 30}
+RULES['SortSam'] = {'cpu': 2, 'ramBase': 7, 'ramPerGB': 0.1, 'ramMin': 7, 'ramMax': 33, 'heapMargin': 1, 'diskBase': 10, 'diskMult': 3.2, 'diskMin': 30}
+RULES['BuildBamIndex'] = {'cpu': 1, 'ramBase': 3, 'ramPerGB': 0.0, 'ramMin': 3, 'ramMax': 5, 'heapMargin': 1, 'diskBase': 10, 'diskMult': 1.1, 'diskMin': 20}
+RULES['NativeBamIndex'] = {'cpu': 4, 'ramBase': 2, 'ramPerGB': 0.0, 'ramMin': 2, 'ramMax': 2, 'heapMargin': None, 'diskBase': 10, 'diskMult': 1.1, 'diskMin': 20}
+RULES['ScatterBam'] = {'cpu': 4, 'ramBase': 4, 'ramPerGB': 0.0, 'ramMin': 4, 'ramMax': 4, 'heapMargin': None, 'diskBase': 10, 'diskMult': 2.2, 'diskMin': 20}
+RULES['GatherBam'] = {'cpu': 4, 'ramBase': 4, 'ramPerGB': 0.0, 'ramMin': 4, 'ramMax': 4, 'heapMargin': None, 'diskBase': 10, 'diskMult': 2.2, 'diskMin': 20}
+RULES['UnmapBam'] = {'cpu': 2, 'ramBase': 7, 'ramPerGB': 0.1, 'ramMin': 7, 'ramMax': 33, 'heapMargin': 1, 'diskBase': 10, 'diskMult': 3.2, 'diskMin': 30}
+RULES['UnmapBamByRG'] = RULES['UnmapBam']
+
+
+"""
+#------------------------------------------------------------------------------
+# Read rules, overriding the defaults with a JSON file
+# :: Example Code ::
+# rules = loadRules('/local/full/path/sizing.json')
+#------------------------------------------------------------------------------
+"""
+def loadRules(confPath=None):
+    rules = copy.deepcopy(RULES)
+
+    if confPath is None:
+        return rules
+
+    with open(confPath) as f:
+        conf = json.load(f, object_pairs_hook=OrderedDict)
+
+    for stage in conf:
+        assert (stage in rules), "Unknown stage '{}' in {}!!\nAvailable stages) {}\n".format(stage, confPath, ', '.join(rules.keys()))
+        for key in conf[stage]:
+            assert (key in rules[stage]), "Unknown rule '{}' for stage '{}' in {}\n".format(key, stage, confPath)
+            rules[stage][key] = conf[stage][key]
+
+    return rules
+
+
+"""
+#------------------------------------------------------------------------------
+# Size of an object in bytes
+# :: Example Code ::
+# objectSize('gs://cloud-storage-01/example1_DNA.bam')
+# objectSize('/local/full/path/example1_DNA.bam')
+#------------------------------------------------------------------------------
+"""
+def objectSize(path, gsutil='gsutil'):
+    if not path.startswith('gs://'):
+        return os.path.getsize(path)
+
+    process = subprocess.check_output([gsutil, 'du', path])
+    line = process.decode('utf-8', 'replace').strip().split('\n')[0]
+    return int(line.split()[0])
+
+
+"""
+#------------------------------------------------------------------------------
+# Sizes of many objects in bytes: {path: size}
+# - gs:// objects are listed by one 'gsutil du' per DU_CHUNK objects, with up to nProc calls at once
+# :: Example Code ::
+# objectSizes(['gs://cloud-storage-01/example1_DNA.bam', 'gs://cloud-storage-01/example2_DNA.bam'])
+#------------------------------------------------------------------------------
+"""
+def objectSizes(paths, nProc=DU_PROC, gsutil='gsutil'):
+    sizes = OrderedDict()
+    remote = []
+    for path in paths:
+        if path.startswith('gs://'):
+            remote.append(path)
+        else:
+            sizes[path] = os.path.getsize(path)
+
+    def du(chunk):
+        process = subprocess.check_output([gsutil, 'du'] + chunk)
+        listed = {}
+        for line in process.decode('utf-8', 'replace').strip().split('\n'):
+            if line.strip():
+                size, url = line.split(None, 1)
+                listed[url.strip()] = int(size)
+        return listed
+
+    chunks = [remote[i:i + DU_CHUNK] for i in range(0, len(remote), DU_CHUNK)]
+    if len(chunks) > 0:
+        with ThreadPoolExecutor(max_workers=max(1, min(nProc, len(chunks)))) as pool:
+            for listed in pool.map(du, chunks):
+                sizes.update(listed)
+
+    missing = [path for path in remote if path not in sizes]
+    assert (len(missing) == 0), "Size of {} object(s) was not listed by 'gsutil du'!!\nExample) {}\n".format(len(missing), missing[0] if missing else '')
+    return OrderedDict([(path, sizes[path]) for path in paths])
+
+
+"""
+#------------------------------------------------------------------------------
+# Resources of a stage for an input of 'sizeBytes'
+# :: Example Code ::
+# sizeStage('SortSam', 100 * sizing.GB)
+#   -> OrderedDict([('stage', 'SortSam'), ('inputGB', 100.0), ('cpu', 2), ('ram', 17), ('heap', 16), ('disk', 330)])
+#------------------------------------------------------------------------------
+"""
+def sizeStage(stage, sizeBytes, rules=None):
+    if rules is None:
+        rules = RULES
+
+    assert (stage in rules), "No sizing rule for stage '{}'!!\nAvailable stages) {}\n".format(stage, ', '.join(rules.keys()))
+    rule = rules[stage]
+    inputGB = sizeBytes / GB
+
+    ram = rule['ramBase'] + rule['ramPerGB'] * inputGB
+    ram = int(math.ceil(min(max(ram, rule['ramMin']), rule['ramMax'])))
+
+    heap = None
+    if rule['heapMargin'] is not None:
+        heap = max(1, ram - int(rule['heapMargin']))
+
+    disk = rule['diskBase'] + rule['diskMult'] * inputGB
+    disk = int(math.ceil(max(disk, rule['diskMin'])))
+
+    res = OrderedDict()
+    res['stage'] = stage
+    res['inputGB'] = round(inputGB, 3)
+    res['cpu'] = int(rule['cpu'])
+    res['ram'] = ram
+    res['heap'] = heap
+    res['disk'] = disk
+
+    return res
+
+
+"""
+#------------------------------------------------------------------------------
+# Resources of a fused job (dsub.FusedPrep)
+# - piped JVMs run at the same time: RAM and CPU are summed over the steps
+# - intermediate BAMs are not written, so disk is the largest step plus the input
+#------------------------------------------------------------------------------
+"""
+def sizeFused(steps, sizeBytes, rules=None):
+    sizes = [sizeStage(step, sizeBytes, rules) for step in steps]
+    piped = [size for size in sizes if size['stage'] != 'BuildBamIndex']
+
+    res = OrderedDict()
+    res['stage'] = 'FusedPrep'
+    res['inputGB'] = round(sizeBytes / GB, 3)
+    res['cpu'] = sum([size['cpu'] for size in piped]) if piped else 1
+    res['ram'] = max(sum([size['ram'] for size in piped]), max([size['ram'] for size in sizes]))
+    res['heap'] = OrderedDict([(size['stage'], size['heap']) for size in sizes])
+    res['disk'] = max([size['disk'] for size in sizes]) + int(math.ceil(sizeBytes / GB))
+
+    return res
+
+
+"""
+#------------------------------------------------------------------------------
+# Write the chosen resources of a job next to its script ('<scriptPath>.size.json')
+#------------------------------------------------------------------------------
+"""
+def writeSize(scriptPath, inFile, res):
+    rec = OrderedDict()
+    rec['inFile'] = inFile
+    rec.update(res)
+
+    with open("{}.size.json".format(scriptPath), 'w') as f:
+        json.dump(rec, f, indent=2)
+
+    return rec
@@ -0,0 +1,364 @@
+"""
+# Purpose     : Content-addressed cache of stage outputs
+# Descriptions:
+#  - A stage output is keyed on the checksum of its input object (MD5 or CRC32C from storage metadata),
+#    the stage name, the docker image and the command of the stage
+#  - Renamed inputs and samples sharing the same input bytes are found by their checksum,
+#    so the same work is not computed twice
+#  - dsub stages check the cache before submitting (submitStage(..., cache=StageCache(...)));
+#    on a hit the cached outputs are copied to the requested outputs and no VM is launched
+#  - On a miss the key is kept as PENDING; 'collect' turns PENDING keys into cache entries once
+#    the ledger (ledger.py) reports the job as SUCCESS and the outputs are verified
+#  - Entries are verified again on every hit (output missing or changed -> entry is dropped)
+#  - 'evict' and 'invalidate' remove entries; cached objects themselves are never deleted
+#
+# Start date  : Oct 17, 2026
+# Last update : Oct 17, 2026
+"""
+
+__author__ 		= "Jong Cheol Jeong"
+__copyright__ 	= "Copyright 2018, UK Cancer Research Informatics"
+__version__ 	= "1.0.0"
+__maintainer__ 	= "Jong Cheol Jeong"
+__email__ 		= "jjeong@kcr.uky.edu"
+
+
+import subprocess
+import threading
+import argparse
+import hashlib
+import sqlite3
+import base64
+import shutil
+import json
+import time
+import re
+import os
+import ledger
+from collections import OrderedDict
+
+
+PENDING = 'PENDING'
+VALID = 'VALID'
+
+#-- name of the main output of a stage in the 'outputs' of an entry
+OUTFILE = 'OUTFILE'
+
+
+"""
+#------------------------------------------------------------------------------
+# Size and checksum of an object
+# - gs:// objects : 'gsutil ls -L' metadata, MD5 if present (composite objects have CRC32C only)
+# - local files   : MD5 of the file, base64 encoded like gsutil
+# Returns {'size': <bytes>, 'checksum': 'md5:<base64>'} or None if the object does not exist
+# :: Example Code ::
+# objectInfo('gs://cloud-storage-01/example1_DNA.bam')
+#------------------------------------------------------------------------------
+"""
+def objectInfo(path):
+    if not path.startswith('gs://'):
+        if not os.path.isfile(path):
+            return None
+        md5 = hashlib.md5()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                md5.update(chunk)
+        return {'size': os.path.getsize(path), 'checksum': 'md5:{}'.format(base64.b64encode(md5.digest()).decode('ascii'))}
+
+    try:
+        process = subprocess.check_output(['gsutil', 'ls', '-L', path], stderr=subprocess.STDOUT)
+    except subprocess.CalledProcessError:
+        return None
+
+    hashes = {}
+    size = None
+    for line in process.decode('utf-8', 'replace').split('\n'):
+        line = line.strip()
+        m = re.match(r'Hash \((\w+)\):\s*(\S+)', line)
+        if m:
+            hashes[m.group(1).lower()] = m.group(2)
+        elif line.startswith('Content-Length:'):
+            size = int(line.split(':', 1)[1].strip())
+
+    if 'md5' in hashes:
+        return {'size': size, 'checksum': 'md5:{}'.format(hashes['md5'])}
+    if 'crc32c' in hashes:
+        return {'size': size, 'checksum': 'crc32c:{}'.format(hashes['crc32c'])}
+    return None
+
+
+"""
+#------------------------------------------------------------------------------
+# Copy an object - local to local is a hard link when possible
+#------------------------------------------------------------------------------
+"""
+def copyObject(src, dst):
+    if src == dst:
+        return dst
+
+    if not src.startswith('gs://') and not dst.startswith('gs://'):
+        dstDir = os.path.dirname(dst)
+        if dstDir and not os.path.isdir(dstDir):
+            os.makedirs(dstDir)
+        if os.path.exists(dst):
+            os.remove(dst)
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copyfile(src, dst)
+        return dst
+
+    subprocess.check_output(['gsutil', '-q', 'cp', src, dst], stderr=subprocess.STDOUT)
+    return dst
+
+
+"""
+#------------------------------------------------------------------------------
+# Command of a stage as used in the key
+# - JVM heap (-Xmx) depends on the machine size, not on the result, so it is left out
+#------------------------------------------------------------------------------
+"""
+def normalizeCmd(cmd):
+    cmd = re.sub(r'-Xmx\S+', '-Xmx', cmd or '')
+    return ' '.join(cmd.split())
+
+
+def cacheKey(checksum, stage, Image, cmd):
+    data = json.dumps([checksum, stage, Image, normalizeCmd(cmd)])
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+"""
+#------------------------------------------------------------------------------
+# Value returned by a stage function instead of the dsub output when the outputs were
+# taken from the cache
+#------------------------------------------------------------------------------
+"""
+class CacheHit(object):
+
+    def __init__(self, key, source, outputs):
+        self.key = key
+        self.source = source            # cached main output
+        self.outputs = outputs          # {name: requested output}
+
+    @property
+    def jobID(self):
+        return 'cache:{}'.format(self.key[:16])
+
+    def __str__(self):
+        return self.jobID
+
+
+"""
+#------------------------------------------------------------------------------
+# StageCache
+# :: Example Code ::
+# cache = StageCache('/local/full/path/cache.db')
+# dsub.CleanSam(inFile='gs://b1/x.bam', outFile='gs://b2/x.clean.bam', scriptPath='/tmp/dsub_000.sh', cache=cache)
+# cache.collect(ledger.Ledger('/tmp/ledger.db'))
+#------------------------------------------------------------------------------
+"""
+class StageCache(object):
+
+    def __init__(self, dbPath):
+        self.dbPath = dbPath
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(dbPath, timeout=60, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS entries (
+                                key TEXT PRIMARY KEY, stage TEXT, image TEXT, inChecksum TEXT, inFile TEXT,
+                                outputs TEXT, outInfo TEXT, state TEXT, created REAL, used REAL, hits INTEGER DEFAULT 0)''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS entries_stage ON entries (stage, state)')
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def entry(self, key):
+        with self.lock:
+            row = self.conn.execute('SELECT * FROM entries WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        row = dict(row)
+        row['outputs'] = json.loads(row['outputs'] or '{}', object_pairs_hook=OrderedDict)
+        row['outInfo'] = json.loads(row['outInfo'] or '{}')
+        return row
+
+    """
+    #--------------------------------------------------------------------------
+    # Look up the outputs of a stage for an input
+    # - hit  : cached outputs are verified, copied to outFile/extraOutputs and a CacheHit is returned
+    # - miss : the key is kept as PENDING for collect() and None is returned
+    #--------------------------------------------------------------------------
+    """
+    def check(self, stage, Image, cmd, inFile, outFile, extraOutputs=None):
+        info = objectInfo(inFile)
+        if info is None:
+            return None
+
+        key = cacheKey(info['checksum'], stage, Image, cmd)
+        outputs = OrderedDict([(OUTFILE, outFile)])
+        if extraOutputs is not None:
+            outputs.update(extraOutputs)
+
+        hit = self.fetch(key, outputs)
+        if hit is None:
+            self.expect(key, stage, Image, info['checksum'], inFile, outputs)
+        return hit
+
+    def fetch(self, key, outputs):
+        entry = self.entry(key)
+        if entry is None or entry['state'] != VALID:
+            return None
+
+        #-- every requested output must be cached and unchanged since it was recorded
+        for name in outputs:
+            src = entry['outputs'].get(name)
+            if src is None:
+                return None
+            if objectInfo(src) != entry['outInfo'].get(name):
+                self.invalidate(key=key)
+                return None
+
+        for name in outputs:
+            copyObject(entry['outputs'][name], outputs[name])
+
+        with self.lock:
+            self.conn.execute('UPDATE entries SET used = ?, hits = hits + 1 WHERE key = ?', (time.time(), key))
+            self.conn.commit()
+
+        return CacheHit(key, entry['outputs'][OUTFILE], outputs)
+
+    def expect(self, key, stage, Image, checksum, inFile, outputs):
+        now = time.time()
+        with self.lock:
+            self.conn.execute('''INSERT OR REPLACE INTO entries (key, stage, image, inChecksum, inFile, outputs, outInfo, state, created, used, hits)
+                                 SELECT ?, ?, ?, ?, ?, ?, NULL, ?, ?, ?, 0
+                                 WHERE NOT EXISTS (SELECT 1 FROM entries WHERE key = ? AND state = ?)''',
+                              (key, stage, Image, checksum, inFile, json.dumps(outputs), PENDING, now, now, key, VALID))
+            self.conn.commit()
+
+    """
+    #--------------------------------------------------------------------------
+    # Make cache entries of PENDING keys whose job is SUCCESS in the ledger
+    # - outputs are verified (exist, size and checksum recorded); failed jobs drop their key
+    # Returns the number of new entries
+    #--------------------------------------------------------------------------
+    """
+    def collect(self, db):
+        with self.lock:
+            rows = [dict(row) for row in self.conn.execute('SELECT key, stage, inFile, outputs FROM entries WHERE state = ?', (PENDING,))]
+
+        nNew = 0
+        for row in rows:
+            job = db.get(ledger.sampleName(row['inFile']), row['stage'])
+            if job is None:
+                continue
+
+            if job['state'] in ledger.RETRY_STATES:
+                self.invalidate(key=row['key'])
+                continue
+
+            if job['state'] != ledger.SUCCESS:
+                continue
+
+            outputs = json.loads(row['outputs'], object_pairs_hook=OrderedDict)
+            outInfo = dict([(name, objectInfo(outputs[name])) for name in outputs])
+            if any([info is None for info in outInfo.values()]):
+                self.invalidate(key=row['key'])
+                continue
+
+            with self.lock:
+                self.conn.execute('UPDATE entries SET outInfo = ?, state = ?, used = ? WHERE key = ?',
+                                  (json.dumps(outInfo), VALID, time.time(), row['key']))
+                self.conn.commit()
+            nNew += 1
+
+        return nNew
+
+    """
+    #--------------------------------------------------------------------------
+    # Remove entries
+    # - evict      : entries not used for 'days' days, then least recently used ones above 'maxEntries'
+    # - invalidate : entries matching the given key, stage and/or input file
+    # Returns the number of removed entries
+    #--------------------------------------------------------------------------
+    """
+    def evict(self, days=None, maxEntries=None):
+        n = 0
+        with self.lock:
+            if days is not None:
+                cur = self.conn.execute('DELETE FROM entries WHERE used < ?', (time.time() - days * 86400,))
+                n += cur.rowcount
+            if maxEntries is not None:
+                cur = self.conn.execute('''DELETE FROM entries WHERE key NOT IN
+                                           (SELECT key FROM entries ORDER BY used DESC LIMIT ?)''', (maxEntries,))
+                n += cur.rowcount
+            self.conn.commit()
+        return n
+
+    def invalidate(self, key=None, stage=None, inFile=None):
+        where = []
+        args = []
+        if key is not None:
+            where.append('key LIKE ?')
+            args.append('{}%'.format(key))
+        if stage is not None:
+            where.append('stage = ?')
+            args.append(stage)
+        if inFile is not None:
+            where.append('inFile = ?')
+            args.append(inFile)
+
+        assert (len(where) > 0), "key, stage or inFile must be given!!\n"
+
+        with self.lock:
+            cur = self.conn.execute('DELETE FROM entries WHERE {}'.format(' AND '.join(where)), args)
+            self.conn.commit()
+        return cur.rowcount
+
+    def rows(self, stage=None):
+        sql = 'SELECT * FROM entries'
+        args = []
+        if stage is not None:
+            sql += ' WHERE stage = ?'
+            args.append(stage)
+        with self.lock:
+            return [dict(row) for row in self.conn.execute(sql + ' ORDER BY used DESC', args)]
+
+
+"""
+#------------------------------------------------------------------------------
+# :: USAGE ::
+# >> python stageCache.py -d /output_dir/cache.db list
+# >> python stageCache.py -d /output_dir/cache.db collect -l /output_dir/cleanSAM/ledger.db
+# >> python stageCache.py -d /output_dir/cache.db evict --days 30 --max-entries 10000
+# >> python stageCache.py -d /output_dir/cache.db invalidate --stage CleanSam --input gs://cloud-storage-01/example1_DNA.bam
+#------------------------------------------------------------------------------
+"""
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", help='list, collect, evict or invalidate', choices=['list', 'collect', 'evict', 'invalidate'])
+    parser.add_argument("-d", "--cache", help='cache file (e.g., /output_dir/cache.db)', action='store', required=True)
+    parser.add_argument("-l", "--ledger", help='ledger file used by "collect"', action='store', default=None)
+    parser.add_argument("--stage", help='stage name (e.g., CleanSam)', action='store', default=None)
+    parser.add_argument("--key", help='key or key prefix to invalidate', action='store', default=None)
+    parser.add_argument("--input", help='input file to invalidate', action='store', default=None)
+    parser.add_argument("--days", help='evict entries not used for this many days', type=float, default=None)
+    parser.add_argument("--max-entries", help='evict least recently used entries above this number', type=int, default=None)
+
+    args = parser.parse_args()
+    cache = StageCache(args.cache)
+
+    if args.command == 'list':
+        for row in cache.rows(args.stage):
+            outputs = json.loads(row['outputs'] or '{}')
+            print("{}\t{}\t{}\t{}\t{}\t{}".format(row['key'][:16], row['stage'], row['state'], row['hits'], row['inFile'], outputs.get(OUTFILE, '')))
+    elif args.command == 'collect':
+        assert (not (args.ledger is None)), "Ledger file must be given!!\nExample) -l /output_dir/cleanSAM/ledger.db\n"
+        print("{} entries are added".format(cache.collect(ledger.Ledger(args.ledger))))
+    elif args.command == 'evict':
+        print("{} entries are removed".format(cache.evict(days=args.days, maxEntries=args.max_entries)))
+    else:
+        print("{} entries are removed".format(cache.invalidate(key=args.key, stage=args.stage, inFile=args.input)))
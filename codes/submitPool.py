@@ -0,0 +1,448 @@
+"""
+# Purpose     : To submit many dsub/gcloud jobs concurrently
+# Descriptions:
+#  - Codes contain a bounded worker pool shared by the per-stage driver scripts
+#  - Each submission runs in its own worker thread; an error on one item is
+#    captured and reported without aborting the remaining items
+#  - Submissions are recorded in the job ledger (ledger.py); '--resume' skips
+#    items already submitted or finished
+#  - '--cache' reuses outputs already computed for the same input bytes (stageCache.py)
+#  - '--rate/--burst/--concurrency/--quota' limit the dsub/gcloud calls per project and region (rateLimit.py)
+#  - '--place' runs each job in a zone next to its input bucket (placement.py)
+#
+# Start date  : Oct 17, 2026
+# Last update : Oct 17, 2026
+"""
+
+__author__ 		= "Jong Cheol Jeong"
+__copyright__ 	= "Copyright 2018, UK Cancer Research Informatics"
+__version__ 	= "1.0.0"
+__maintainer__ 	= "Jong Cheol Jeong"
+__email__ 		= "jjeong@kcr.uky.edu"
+
+
+import subprocess
+import threading
+import os
+import sizing
+import ledger
+import stageCache
+import rateLimit
+import placement
+import dsub
+import time
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+#-- default number of concurrent submissions
+#-- dsub/gcloud spend most of their time waiting on the API, so threads are enough
+NPROC = 8
+
+
+"""
+#------------------------------------------------------------------------------
+# Add the shared submission options to a driver's argparse parser
+# :: Example Code ::
+# addSubmitArgs(parser)
+#
+# - dsub : add options of dsub stages (--batch, --autosize, --sizeconf, --cache)
+# - rate limit options (--rate, --burst, --concurrency, --quota, --submit-retries) and
+#   placement options (--place, --regions, --cache-bucket) are added to every driver
+#------------------------------------------------------------------------------
+"""
+def addSubmitArgs(parser, dsub=True):
+    parser.add_argument("-n", "--nproc", help='number of jobs submitted concurrently [Default={}]'.format(NPROC), type=int, default=NPROC)
+    parser.add_argument("-l", "--ledger", help='job ledger file shared by runs [Default=<script directory>/ledger.db]', action='store', default=None)
+    parser.add_argument("-r", "--resume", help='skip items already submitted or finished in the ledger and submit failed ones again', action='store_true')
+    if dsub:
+        parser.add_argument("-b", "--batch", help='submit the whole list with a single "dsub --tasks" call', action='store_true')
+        parser.add_argument("-a", "--autosize", help='size CPU, RAM, JVM heap and disk of each job from its input size', action='store_true')
+        parser.add_argument("-c", "--sizeconf", help='JSON file overriding the sizing rules in sizing.py', action='store', default=None)
+        parser.add_argument("--cache", help='stage output cache file (e.g., /output_dir/cache.db) - outputs of identical inputs are copied instead of submitted', action='store', default=None)
+    addLimitArgs(parser)
+    addPlaceArgs(parser)
+    return parser
+
+
+"""
+#------------------------------------------------------------------------------
+# Submission rate limits (rateLimit.py)
+# :: Example Code ::
+# addLimitArgs(parser)
+# args = parser.parse_args()
+# configureLimits(args)         # before the first submission
+#------------------------------------------------------------------------------
+"""
+def addLimitArgs(parser):
+    parser.add_argument("--rate", help='dsub/gcloud calls per second in a project and region [Default={}]'.format(rateLimit.DEFAULTS['rate']), type=float, default=None)
+    parser.add_argument("--burst", help='dsub/gcloud calls sent at once after an idle period [Default={}]'.format(rateLimit.DEFAULTS['burst']), type=int, default=None)
+    parser.add_argument("--concurrency", help='dsub/gcloud calls running at the same time in a project and region [Default={}]'.format(rateLimit.DEFAULTS['concurrency']), type=int, default=None)
+    parser.add_argument("--quota", help='JSON file of limits per project or project/region (e.g., {"my-project-id/us-central1": {"rate": 2}})', action='store', default=None)
+    parser.add_argument("--submit-retries", help='retries of a dsub/gcloud call after quota errors or requests the server did not process [Default={}]'.format(rateLimit.RETRIES), type=int, default=rateLimit.RETRIES)
+    return parser
+
+
+def configureLimits(args):
+    return rateLimit.configure(rate=args.rate, burst=args.burst, concurrency=args.concurrency, quotas=rateLimit.loadQuotas(args.quota), retries=args.submit_retries)
+
+
+"""
+#------------------------------------------------------------------------------
+# Zone placement next to the input data (placement.py)
+# :: Example Code ::
+# addPlaceArgs(parser)
+# args = parser.parse_args()
+# place = openPlacement(args, db)       # None without '--place'
+# runPool(..., placement=place)
+#------------------------------------------------------------------------------
+"""
+def addPlaceArgs(parser):
+    parser.add_argument("--place", help='run each job in a zone of its input bucket location, avoiding zones with recent capacity failures', action='store_true')
+    parser.add_argument("--regions", help='comma separated compute regions allowed with --place (e.g., us-central1,us-east1)', action='store', default=None)
+    parser.add_argument("--cache-bucket", help='regional cache bucket, REGION=gs://bucket (repeatable) - inputs stored outside --regions are copied there first', action='append', default=[])
+    return parser
+
+
+def openPlacement(args, db=None):
+    if not args.place:
+        return None
+    regions = None if args.regions is None else [region.strip() for region in args.regions.split(',')]
+    return placement.Placement(db=db, regions=regions, cacheBuckets=placement.parseCacheBuckets(args.cache_bucket))
+
+
+"""
+#------------------------------------------------------------------------------
+# Keyword arguments given to every dsub stage function from the shared options
+# :: Example Code ::
+# options = stageOptions(args)
+# dsub.CleanSam(inFile=..., outFile=..., **options)
+#------------------------------------------------------------------------------
+"""
+def stageOptions(args):
+    options = {}
+
+    if args.autosize or args.sizeconf is not None:
+        options['autoSize'] = True
+        options['sizeRules'] = sizing.loadRules(args.sizeconf)
+
+    if getattr(args, 'cache', None) is not None:
+        options['cache'] = stageCache.StageCache(args.cache)
+
+    return options
+
+
+"""
+#------------------------------------------------------------------------------
+# Open the job ledger given by '--ledger' or '<scPath>/ledger.db'
+#------------------------------------------------------------------------------
+"""
+def openLedger(args, scPath):
+    dbPath = args.ledger
+    if dbPath is None:
+        dbPath = os.path.join(scPath, 'ledger.db')
+    return ledger.Ledger(dbPath)
+
+
+"""
+#------------------------------------------------------------------------------
+# Job ID from the value returned by a submission function
+# - dsub functions return the output of dsub, subGenPipe returns the operation ID
+#------------------------------------------------------------------------------
+"""
+def jobIDOf(res):
+    if isinstance(res, stageCache.CacheHit):
+        return res.jobID
+    if isinstance(res, bytes):
+        return dsub.parseJobID(res)
+    return str(res).strip()
+
+
+"""
+#------------------------------------------------------------------------------
+# Parameters of a job stored in the ledger
+# - sizing rules, cache and GenPipe templates are left out; resources of the job are read from '<scriptPath>.size.json'
+# - outputs other than outFile (extraOutputs, outBai of FusedPrep) are kept as 'extraOutputs' e.g.,
+#   {'OUTBAI': 'gs://b2/x.bam.bai'}, so watchOutputs.py waits for all of them
+#------------------------------------------------------------------------------
+"""
+def extraOutputsOf(job):
+    outputs = dict(job.get('extraOutputs') or {})
+    if job.get('outBai') is not None:
+        outputs['OUTBAI'] = job['outBai']
+    return outputs
+
+
+def jobParams(job):
+    params = dict([(key, job[key]) for key in job if key not in ('sizeRules', 'cache', 'templates', 'outBai')])
+    params['extraOutputs'] = extraOutputsOf(job)
+
+    sizePath = "{}.size.json".format(job.get('scriptPath'))
+    if job.get('scriptPath') is not None and os.path.exists(sizePath):
+        with open(sizePath) as f:
+            params['resources'] = json.load(f)
+
+    return params
+
+
+"""
+#------------------------------------------------------------------------------
+# Describe an error raised by a submission function in one line
+#------------------------------------------------------------------------------
+"""
+def errorMessage(err):
+    if isinstance(err, subprocess.CalledProcessError):
+        out = [text.decode('utf-8', 'replace') if isinstance(text, bytes) else text for text in (err.output, err.stderr) if text]
+        out = '\n'.join(out).strip().replace('\n', ' | ')
+        return "exit code {} : {}".format(err.returncode, out)
+
+    return "{}: {}".format(type(err).__name__, str(err).strip().replace('\n', ' | '))
+
+
+"""
+#------------------------------------------------------------------------------
+# Submit jobs with a bounded worker pool
+# :: Example Code ::
+# jobs = [dict(prjName='my-project-id', inFile='gs://b1/x.bam', outFile='gs://b2/x.clean.bam', scriptPath='/tmp/dsub_000.sh', Logs='gs://b2/log')]
+# summary = runPool(func=dsub.CleanSam, jobs=jobs, nProc=8)
+#
+# - func  : submission function (e.g., dsub.CleanSam) called as func(**job)
+# - jobs  : list of keyword argument dictionaries, one per item
+# - label : key of the job dictionary printed in the progress message
+# - outPath : if given, 'submitted.txt', 'failed.txt' and 'failed.log' are written in it
+# - db      : ledger.Ledger where each submission is recorded as (sample, stage)
+# - resume  : skip jobs whose sample is SUBMITTED, RUNNING or SUCCESS in the ledger
+# - runner  : 'dsub' or 'genomics' - recorded in the ledger for status polling
+# - placement : placement.Placement setting the zone (and prefetched inputs) of each job before it is submitted
+#
+# Returns dictionary with 'submitted' [(job, result)], 'failed' [(job, message)]
+# and 'skipped' [job] in the same order as 'jobs'
+#------------------------------------------------------------------------------
+"""
+def runPool(func=None, jobs=None, nProc=None, label='inFile', outPath=None, db=None, stage=None, resume=False, runner='dsub', placement=None):
+
+    if nProc is None:
+        nProc = NPROC
+
+    assert (not (func is None)), "Submission function must be given!!\nExample) dsub.CleanSam\n"
+    assert (not (jobs is None)), "List of jobs must be given!!\nExample) [dict(inFile='gs://<bucket>/xxxx.bam', ...)]\n"
+    assert (nProc > 0), "The number of concurrent submissions must be positive\n"
+    assert (db is None or stage is not None), "Stage name must be given with a ledger!!\nExample) CleanSam\n"
+
+    skipped = []
+    if resume and db is not None:
+        keep = db.resumeFilter(stage, [job[label] for job in jobs])
+        keepSet = set(keep)
+        skipped = [jobs[i] for i in range(len(jobs)) if i not in keepSet]
+        jobs = [jobs[i] for i in keep]
+        print("Resume: {} items are skipped (already submitted or finished)".format(len(skipped)))
+
+    nJobs = len(jobs)
+    results = [None] * nJobs
+    lock = threading.Lock()
+    count = [0]
+    start = time.time()
+
+    def submit(idx):
+        job = jobs[idx]
+        try:
+            if placement is not None:
+                job = placement.place(job)
+                jobs[idx] = job
+            return (True, func(**job))
+        except Exception as err:
+            msg = errorMessage(err)
+            if placement is not None:
+                placement.fail(job.get('Zones'), msg)
+            return (False, msg)
+
+    with ThreadPoolExecutor(max_workers=min(nProc, max(nJobs, 1))) as pool:
+        futures = {pool.submit(submit, i): i for i in range(nJobs)}
+        for future in as_completed(futures):
+            idx = futures[future]
+            ok, res = future.result()
+            results[idx] = (ok, res)
+
+            if db is not None:
+                record(db, stage, jobs[idx], ok, res, label, runner)
+
+            with lock:
+                count[0] += 1
+                state = 'submitted' if ok else 'FAILED ({})'.format(res)
+                if isinstance(res, stageCache.CacheHit):
+                    state = 'cached ({})'.format(res.source)
+                cmt = "[{}/{}] {} {}".format(count[0], nJobs, jobs[idx].get(label, idx), state)
+                print(cmt)
+
+    summary = {'submitted': [], 'failed': [], 'skipped': skipped, 'elapsed': time.time() - start}
+    for i in range(nJobs):
+        ok, res = results[i]
+        if ok:
+            summary['submitted'].append((jobs[i], res))
+        else:
+            summary['failed'].append((jobs[i], res))
+
+    if outPath is not None:
+        writeSummary(summary, outPath, label)
+
+    return summary
+
+
+"""
+#------------------------------------------------------------------------------
+# Record the result of one submission in the ledger
+# - sample : ledger sample of the row [Default=sample name of job[label]]
+# - values : other ledger columns of the row (e.g., attempts=2)
+#------------------------------------------------------------------------------
+"""
+def record(db, stage, job, ok, res, label='inFile', runner='dsub', sample=None, **values):
+    inFile = job.get(label, '')
+    row = dict(sample=ledger.sampleName(inFile) if sample is None else sample, stage=stage, inFile=inFile, outFile=job.get('outFile', job.get('GATK_OUT_DIR', job.get('outDir'))),
+               runner=runner, zone=job.get('Zones'), params=jobParams(job), **values)
+    if isinstance(res, stageCache.CacheHit):
+        row['jobID'] = res.jobID
+        row['state'] = ledger.SUCCESS
+        row['message'] = 'cached from {}'.format(res.source)
+    elif ok:
+        row['jobID'] = jobIDOf(res)
+        row['state'] = ledger.SUBMITTED
+    else:
+        row['state'] = ledger.SUBMIT_FAILED
+        row['message'] = res
+
+    db.recordMany([row])
+
+
+"""
+#------------------------------------------------------------------------------
+# Submit a list with a single 'dsub --tasks' call (dsub.submitTasks)
+# and record each task in the ledger
+# :: Example Code ::
+# runTasks(stage='CleanSam', prjName='my-project-id', inFiles=inBAM, outFiles=outBAM,
+#          scriptPath='/tmp/dsub_CleanSam.sh', Logs='gs://b2/log', db=ledger.Ledger('/tmp/ledger.db'), resume=True)
+#
+# - cache : stageCache.StageCache checked for each item; hits are copied and left out of the tasks
+# - placement : placement.Placement giving the zones of the region of the first input; inputs stored
+#               elsewhere are prefetched if a cache bucket is given
+#------------------------------------------------------------------------------
+"""
+def runTasks(stage=None, inFiles=None, outFiles=None, scriptPath=None, db=None, resume=False, extraOutputs=None, cache=None, placement=None, **kwargs):
+
+    if resume and db is not None:
+        keep = db.resumeFilter(stage, inFiles)
+        print("Resume: {} items are skipped (already submitted or finished)".format(len(inFiles) - len(keep)))
+        inFiles = [inFiles[i] for i in keep]
+        outFiles = [outFiles[i] for i in keep]
+        if extraOutputs is not None:
+            extraOutputs = dict([(key, [extraOutputs[key][i] for i in keep]) for key in extraOutputs])
+
+    if cache is not None:
+        keep = cacheFilter(cache, stage, inFiles, outFiles, extraOutputs, db, **kwargs)
+        inFiles = [inFiles[i] for i in keep]
+        outFiles = [outFiles[i] for i in keep]
+        if extraOutputs is not None:
+            extraOutputs = dict([(key, [extraOutputs[key][i] for i in keep]) for key in extraOutputs])
+
+    if len(inFiles) == 0:
+        print("Nothing to submit")
+        return None
+
+    taskFiles = inFiles
+    if placement is not None and kwargs.get('Zones') is None:
+        kwargs['Zones'], taskFiles = placement.placeMany(inFiles)
+        print("Zones: {}".format(' '.join(kwargs['Zones'])))
+
+    jobID = dsub.submitTasks(stage=stage, inFiles=taskFiles, outFiles=outFiles, scriptPath=scriptPath, extraOutputs=extraOutputs, **kwargs)
+    print("{} tasks are submitted as job {}".format(len(inFiles), jobID))
+    print("Job and task IDs are written in {}.jobs.txt".format(scriptPath))
+
+    if db is not None:
+        zone = kwargs.get('Zones')
+        if isinstance(zone, list):
+            zone = ','.join(zone)
+        params = jobParams(dict([(key, kwargs[key]) for key in kwargs if key not in ('cmd', 'size')], scriptPath=scriptPath))
+        rows = []
+        for i in range(len(inFiles)):
+            extras = dict([(key, extraOutputs[key][i]) for key in extraOutputs]) if extraOutputs is not None else {}
+            rows.append(dict(sample=ledger.sampleName(inFiles[i]), stage=stage, inFile=inFiles[i], outFile=outFiles[i], runner='dsub',
+                             jobID=jobID, taskID=str(i + 1), zone=zone, params=dict(params, extraOutputs=extras), state=ledger.SUBMITTED))
+        db.recordMany(rows)
+
+    return jobID
+
+
+"""
+#------------------------------------------------------------------------------
+# Check the cache for each item of runTasks() and return the indices of items to be submitted
+# - the command is the one submitTasks() would use; JVM heap is not part of the cache key
+#------------------------------------------------------------------------------
+"""
+def cacheFilter(cache, stage, inFiles, outFiles, extraOutputs=None, db=None, **kwargs):
+    Image = kwargs.get('Image') or dsub.STAGES[stage]['Image']
+    cmd = kwargs.get('cmd')
+    if cmd is None:
+        cmd = dsub.stageCmd(stage, **dict([(key, kwargs[key]) for key in kwargs if key != 'heap']))
+
+    keep = []
+    rows = []
+    for i in range(len(inFiles)):
+        extras = None
+        if extraOutputs is not None:
+            extras = dict([(key, extraOutputs[key][i]) for key in extraOutputs])
+
+        hit = cache.check(stage, Image, cmd, inFiles[i], outFiles[i], extras)
+        if hit is None:
+            keep.append(i)
+            continue
+
+        print("{} cached ({})".format(inFiles[i], hit.source))
+        rows.append(dict(sample=ledger.sampleName(inFiles[i]), stage=stage, inFile=inFiles[i], outFile=outFiles[i], runner='dsub',
+                         jobID=hit.jobID, state=ledger.SUCCESS, message='cached from {}'.format(hit.source)))
+
+    if db is not None and len(rows) > 0:
+        db.recordMany(rows)
+
+    print("Cache: {} items are copied from the cache".format(len(inFiles) - len(keep)))
+    return keep
+
+
+"""
+#------------------------------------------------------------------------------
+# Write submitted and failed items so that failed ones can be given again
+# with '-i failed.txt' - error messages are written in 'failed.log'
+#------------------------------------------------------------------------------
+"""
+def writeSummary(summary, outPath, label='inFile'):
+    with open('{}/submitted.txt'.format(outPath), 'w') as f:
+        for job, _ in summary['submitted']:
+            f.write("{}\n".format(job.get(label, '')))
+
+    with open('{}/failed.txt'.format(outPath), 'w') as f:
+        for job, _ in summary['failed']:
+            f.write("{}\n".format(job.get(label, '')))
+
+    with open('{}/failed.log'.format(outPath), 'w') as f:
+        for job, msg in summary['failed']:
+            f.write("{}\t{}\n".format(job.get(label, ''), msg))
+
+
+"""
+#------------------------------------------------------------------------------
+# Print a short summary of a runPool() call
+#------------------------------------------------------------------------------
+"""
+def printSummary(summary, label='inFile'):
+    nCache = len([res for job, res in summary['submitted'] if isinstance(res, stageCache.CacheHit)])
+    nSub = len(summary['submitted']) - nCache
+    nFail = len(summary['failed'])
+    print('\n')
+    print("Submitted : {}".format(nSub))
+    if nCache > 0:
+        print("Cached    : {}".format(nCache))
+    print("Failed    : {}".format(nFail))
+    if len(summary.get('skipped', [])) > 0:
+        print("Skipped   : {}".format(len(summary['skipped'])))
+    print("Elapsed   : {:.1f} sec".format(summary['elapsed']))
+    rateLimit.printStats()
+    for job, msg in summary['failed']:
+        print("\t - {} : {}".format(job.get(label, ''), msg))
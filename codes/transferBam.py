@@ -0,0 +1,392 @@
+"""
+# Purpose     : Copy BAM files from the source storage with their header fixed on the way
+# Descriptions:
+#  - Replaces 'rclone sync' into gs://gatk-bam followed by addPL.py (a second full copy in gs://vcf-to-bam-bam):
+#    each BAM is read once as a stream and written once to the destination
+#  - Only the BGZF blocks of the BAM header are rewritten (reheader.py, default: add PL:illumina to @RG
+#    lines without PL); all other compressed blocks are passed through untouched
+#  - MD5 of the destination object is computed while the data flows and compared with the MD5 of the
+#    uploaded object (gs://, rclone remotes); local destinations are checked by size
+#  - Sources    : gs://..., rclone remotes (e.g., OBJS:/my/BAMs/x.bam) or local files
+#    Destination: gs://..., rclone remote or a local directory (local stand-ins of both stores for testing)
+#  - Objects are transferred in parallel; failed transfers are retried and never leave a partial object
+#  - Written objects are recorded in a manifest (source, destination, bytes, MD5); with '--resume'
+#    objects whose destination still has the recorded MD5 are skipped
+#
+# Start date  : Oct 17, 2026
+# Last update : Oct 17, 2026
+"""
+
+__author__ 		= "Jong Cheol Jeong"
+__copyright__ 	= "Copyright 2018, UK Cancer Research Informatics"
+__version__ 	= "1.0.0"
+__maintainer__ 	= "Jong Cheol Jeong"
+__email__ 		= "jjeong@kcr.uky.edu"
+
+
+import subprocess
+import threading
+import argparse
+import hashlib
+import base64
+import time
+import sys
+import re
+import os
+import bgzf
+import gsList
+import reheader
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+NPROC = 8
+RETRIES = 3
+SUFFIX = 'head'
+
+#-- rclone remote path e.g., OBJS:/my/BAMs/x.bam (not gs://, not a local path)
+REMOTE = re.compile(r'^[A-Za-z0-9_.\- ]+:')
+
+
+def isRemote(path):
+    return not path.startswith('gs://') and REMOTE.match(path) is not None
+
+
+"""
+#------------------------------------------------------------------------------
+# Destination name of a source BAM: '<dstDir>/<name>.head.bam' (same as addPL.py)
+#------------------------------------------------------------------------------
+"""
+def destName(src, dstDir, suffix=SUFFIX):
+    nameList = src.rstrip('/').split('/')[-1].split('.')
+    if suffix:
+        name = "{}.{}.{}".format(nameList[0], suffix, nameList[-1])
+    else:
+        name = '.'.join(nameList)
+    return "{}/{}".format(dstDir.rstrip('/'), name)
+
+
+"""
+#------------------------------------------------------------------------------
+# File-like writer computing MD5 and size of everything written through it
+#------------------------------------------------------------------------------
+"""
+class HashingWriter(object):
+
+    def __init__(self, f):
+        self.f = f
+        self.md5 = hashlib.md5()
+        self.size = 0
+
+    def write(self, data):
+        self.md5.update(data)
+        self.size += len(data)
+        self.f.write(data)
+
+    def flush(self):
+        self.f.flush()
+
+    def checksum(self):
+        return 'md5:{}'.format(base64.b64encode(self.md5.digest()).decode('ascii'))
+
+
+#-- number of bytes read from the source
+class CountingReader(object):
+
+    def __init__(self, f):
+        self.f = f
+        self.size = 0
+
+    def read(self, n=-1):
+        data = self.f.read(n)
+        self.size += len(data)
+        return data
+
+
+"""
+#------------------------------------------------------------------------------
+# Source stream and destination sink
+# - openSource returns (stream, process)
+# - Sink.commit() finishes the object; Sink.abort() drops it (the upload process is killed
+#   so a truncated stream is never committed)
+#------------------------------------------------------------------------------
+"""
+def openSource(src, gsutil='gsutil', rclone='rclone'):
+    if src.startswith('gs://'):
+        cmd = [gsutil, '-q', 'cat', src]
+    elif isRemote(src):
+        cmd = [rclone, 'cat', src]
+    else:
+        return open(src, 'rb'), None
+
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return proc.stdout, proc
+
+
+def closeSource(stream, proc):
+    stream.close()
+    if proc is not None:
+        err = proc.stderr.read().decode('utf-8', 'replace').strip()
+        if proc.wait() != 0:
+            raise IOError("{} exited with {}: {}".format(proc.args[0], proc.returncode, err))
+
+
+class Sink(object):
+
+    def __init__(self, dst, gsutil='gsutil', rclone='rclone'):
+        self.dst = dst
+        self.proc = None
+        self.part = None
+
+        if dst.startswith('gs://'):
+            cmd = [gsutil, '-q', 'cp', '-', dst]
+        elif isRemote(dst):
+            cmd = [rclone, 'rcat', dst]
+        else:
+            cmd = None
+
+        if cmd is None:
+            dstDir = os.path.dirname(dst)
+            if dstDir and not os.path.isdir(dstDir):
+                try:
+                    os.makedirs(dstDir)
+                except OSError:
+                    pass
+            self.part = '{}.part'.format(dst)
+            self.f = open(self.part, 'wb')
+        else:
+            self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            self.f = self.proc.stdin
+
+    def commit(self):
+        self.f.close()
+        if self.proc is not None:
+            err = self.proc.stderr.read().decode('utf-8', 'replace').strip()
+            if self.proc.wait() != 0:
+                raise IOError("{} exited with {}: {}".format(self.proc.args[0], self.proc.returncode, err))
+        else:
+            os.rename(self.part, self.dst)
+
+    def abort(self):
+        if self.proc is not None:
+            self.proc.kill()
+            self.proc.wait()
+            try:
+                self.f.close()
+            except (IOError, OSError):
+                pass
+        else:
+            self.f.close()
+            if os.path.exists(self.part):
+                os.remove(self.part)
+
+
+"""
+#------------------------------------------------------------------------------
+# MD5 and size of a destination object ('md5:<base64>' as gsList.py), (None, None) if missing
+#------------------------------------------------------------------------------
+"""
+def destChecksum(dst, gsutil='gsutil', rclone='rclone', local=False):
+    if dst.startswith('gs://'):
+        try:
+            objects = gsList.GSBackend(gsutil).listObjects([dst])
+        except subprocess.CalledProcessError:
+            return None, None
+        if len(objects) == 0:
+            return None, None
+        return objects[0]['checksum'], objects[0]['size']
+
+    if isRemote(dst):
+        try:
+            out = subprocess.check_output([rclone, 'md5sum', dst], stderr=subprocess.PIPE).decode('utf-8').split()
+        except subprocess.CalledProcessError:
+            return None, None
+        if len(out) == 0 or len(out[0]) != 32:
+            return None, None
+        return 'md5:{}'.format(base64.b64encode(bytes.fromhex(out[0])).decode('ascii')), None
+
+    if not os.path.isfile(dst):
+        return None, None
+    return (gsList.fileChecksum(dst) if local else None), os.path.getsize(dst)
+
+
+"""
+#------------------------------------------------------------------------------
+# Transfer one BAM
+# :: Example Code ::
+# row = transfer('OBJS:/my/BAMs/x.bam', 'gs://vcf-to-bam-bam/x.head.bam', edit=reheader.tagRule('RG', 'PL', 'illumina'))
+#
+# Returns dictionary with 'source', 'destination', 'bytesIn', 'bytesOut' and 'md5'
+#------------------------------------------------------------------------------
+"""
+def transfer(src=None, dst=None, edit=None, level=bgzf.LEVEL, verify=True, gsutil='gsutil', rclone='rclone'):
+    assert (not (src is None)), "Source BAM must be given!!\nExample) OBJS:/my/BAMs/x.bam\n"
+    assert (not (dst is None)), "Destination BAM must be given!!\nExample) gs://vcf-to-bam-bam/x.head.bam\n"
+    assert (not (edit is None)), "Header edit must be given!!\nExample) reheader.tagRule('RG', 'PL', 'illumina')\n"
+
+    stream, proc = openSource(src, gsutil, rclone)
+    counted = CountingReader(stream)
+    sink = Sink(dst, gsutil, rclone)
+    out = HashingWriter(sink.f)
+    try:
+        reheader.reheader(counted, out, edit=edit, level=level)
+        closeSource(stream, proc)
+        sink.commit()
+    except BaseException:
+        sink.abort()
+        if proc is not None and proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        raise
+
+    md5 = out.checksum()
+    if verify:
+        remote, size = destChecksum(dst, gsutil, rclone)
+        if remote is not None and remote.startswith('md5:') and remote != md5:
+            raise IOError("checksum mismatch ({} != {})".format(remote, md5))
+        if size is not None and size != out.size:
+            raise IOError("size mismatch ({} != {} bytes)".format(size, out.size))
+
+    return OrderedDict([('source', src), ('destination', dst), ('bytesIn', counted.size), ('bytesOut', out.size), ('md5', md5)])
+
+
+"""
+#------------------------------------------------------------------------------
+# Manifest of transferred BAMs (tab separated, appended as objects finish)
+#------------------------------------------------------------------------------
+"""
+COLUMNS = ['source', 'destination', 'bytesIn', 'bytesOut', 'md5']
+
+
+def readManifest(path):
+    rows = OrderedDict()
+    if path is None or not os.path.isfile(path):
+        return rows
+    with open(path) as f:
+        for line in f:
+            cols = line.rstrip('\n').split('\t')
+            if len(cols) == len(COLUMNS) and cols[0] != COLUMNS[0]:
+                rows[cols[0]] = OrderedDict(zip(COLUMNS, cols))
+    return rows
+
+
+def appendManifest(path, row):
+    exists = os.path.isfile(path)
+    with open(path, 'a') as f:
+        if not exists:
+            f.write('\t'.join(COLUMNS) + '\n')
+        f.write('\t'.join([str(row[key]) for key in COLUMNS]) + '\n')
+
+
+"""
+#------------------------------------------------------------------------------
+# Transfer a list of BAMs in parallel
+# :: Example Code ::
+# summary = transferAll(['OBJS:/my/BAMs/x.bam', 'OBJS:/my/BAMs/y.bam'], 'gs://vcf-to-bam-bam',
+#                       edit=reheader.tagRule('RG', 'PL', 'illumina'), nProc=8, manifest='/output_dir/transfer.tsv')
+#
+# - suffix : destination names are '<name>.<suffix>.bam' ('' keeps the source name)
+# - resume : skip sources recorded in the manifest whose destination still has the recorded MD5
+# Returns dictionary with 'copied', 'skipped', 'failed' [(source, message)], 'bytes' and 'elapsed'
+#------------------------------------------------------------------------------
+"""
+def transferAll(sources=None, dstDir=None, edit=None, nProc=NPROC, suffix=SUFFIX, manifest=None, resume=False, retries=RETRIES,
+                level=bgzf.LEVEL, verify=True, gsutil='gsutil', rclone='rclone'):
+
+    assert (not (sources is None)), "List of source BAMs must be given!!\nExample) ['OBJS:/my/BAMs/x.bam']\n"
+    assert (not (dstDir is None)), "Destination must be given!!\nExample) gs://vcf-to-bam-bam\n"
+
+    start = time.time()
+    done = readManifest(manifest) if resume else OrderedDict()
+    summary = {'copied': [], 'skipped': [], 'failed': [], 'bytes': 0}
+    lock = threading.Lock()
+
+    def copy(src):
+        dst = destName(src, dstDir, suffix)
+        row = done.get(src)
+        if row is not None and row['destination'] == dst:
+            checksum, size = destChecksum(dst, gsutil, rclone, local=True)
+            if checksum == row['md5']:
+                return ('skipped', row)
+
+        for attempt in range(retries + 1):
+            try:
+                return ('copied', transfer(src, dst, edit=edit, level=level, verify=verify, gsutil=gsutil, rclone=rclone))
+            except (IOError, OSError, bgzf.BgzfError) as err:
+                if attempt == retries or isinstance(err, bgzf.BgzfError):
+                    raise
+                time.sleep(2 ** attempt)
+
+    nObj = len(sources)
+    count = 0
+    with ThreadPoolExecutor(max_workers=max(1, min(nProc, nObj))) as pool:
+        futures = dict([(pool.submit(copy, src), src) for src in sources])
+        for future in as_completed(futures):
+            src = futures[future]
+            count += 1
+            try:
+                state, row = future.result()
+                with lock:
+                    summary[state].append(src)
+                    if state == 'copied':
+                        summary['bytes'] += row['bytesOut']
+                        if manifest is not None:
+                            appendManifest(manifest, row)
+                msg = "{} -> {}".format(state, row['destination'])
+            except Exception as err:
+                summary['failed'].append((src, str(err)))
+                msg = 'FAILED ({})'.format(err)
+            print("[{}/{}] {} {}".format(count, nObj, src, msg))
+
+    summary['elapsed'] = time.time() - start
+    return summary
+
+
+"""
+#------------------------------------------------------------------------------
+# :: USAGE ::
+# >> python transferBam.py -i /output_dir/missing.txt -o gs://vcf-to-bam-bam -m /output_dir/transfer.tsv
+# >> python transferBam.py --src /local/objs -o /local/gs-bam -n 4                    # local stand-ins
+# >> python transferBam.py -i bams.txt -o gs://vcf-to-bam-bam --suffix '' --tag RG:CN:UKY --resume -m transfer.tsv
+#------------------------------------------------------------------------------
+"""
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--input", help='list of source BAMs (gs://, rclone remote e.g., OBJS:/my/BAMs/x.bam, or local files)', action='store', default=None)
+    parser.add_argument("--src", help='source directory (gs:// or local) whose BAMs are transferred, in place of --input', action='store', default=None)
+    parser.add_argument("-o", "--output", help='destination directory (gs://, rclone remote or local)', action='store', required=True)
+    parser.add_argument("-n", "--nproc", help='number of BAMs transferred at the same time [Default={}]'.format(NPROC), type=int, default=NPROC)
+    parser.add_argument("--suffix", help='destination names are <name>.<suffix>.bam, "" keeps the source name [Default={}]'.format(SUFFIX), type=str, default=SUFFIX)
+    parser.add_argument("-m", "--manifest", help='manifest of transferred BAMs (tab separated)', action='store', default=None)
+    parser.add_argument("-r", "--resume", help='skip BAMs in the manifest whose destination has the recorded MD5', action='store_true')
+    parser.add_argument("--retries", help='number of retries of a failed transfer [Default={}]'.format(RETRIES), type=int, default=RETRIES)
+    parser.add_argument("--no-verify", help='do not compare the MD5 with the uploaded object', action='store_true')
+    parser.add_argument("-L", "--level", help='compression level of the header blocks [Default={}]'.format(bgzf.LEVEL), type=int, default=bgzf.LEVEL)
+    parser.add_argument("--gsutil", help='gsutil executable [Default=gsutil]', action='store', default='gsutil')
+    parser.add_argument("--rclone", help='rclone executable [Default=rclone]', action='store', default='rclone')
+    reheader.addRuleArgs(parser, pl='illumina')
+
+    args = parser.parse_args()
+
+    assert ((args.input is None) != (args.src is None)), "Either --input or --src must be given!!\nExample) -i /output_dir/missing.txt\n"
+    assert (not (args.resume and args.manifest is None)), "'--resume' needs '--manifest'!!\n"
+
+    if args.input is not None:
+        with open(args.input) as f:
+            sources = [line.strip() for line in f if len(line.strip()) > 0]
+    else:
+        sources = gsList.listNames(args.src, suffix='bam', gsutil=args.gsutil)
+
+    summary = transferAll(sources, args.output, edit=reheader.chainRules(reheader.rulesOf(args)), nProc=args.nproc, suffix=args.suffix,
+                          manifest=args.manifest, resume=args.resume, retries=args.retries, level=args.level, verify=not args.no_verify,
+                          gsutil=args.gsutil, rclone=args.rclone)
+
+    print('\n')
+    print("Copied  : {} ({:.1f} MB)".format(len(summary['copied']), summary['bytes'] / 1024.0 / 1024.0))
+    print("Skipped : {}".format(len(summary['skipped'])))
+    print("Failed  : {}".format(len(summary['failed'])))
+    print("Elapsed : {:.1f} sec".format(summary['elapsed']))
+    for src, msg in summary['failed']:
+        print("\t - {} : {}".format(src, msg))
+
+    sys.exit(1 if len(summary['failed']) > 0 else 0)
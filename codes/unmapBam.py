@@ -2,9 +2,11 @@
 # Purpose     : unmapping BAM
 # Descriptions:
 #  - Codes contain functions to submit jobs via Google Cloud 'dsub'
+#  - '--readgroup' writes one uBAM per read group ('<output>/<sample>/<RG ID>.bam') and a manifest per sample
+#    ('<output>/<sample>.unmapped_bams.list'); the list of manifests ('unmapBAM.manifests.txt') is the input of runGenPipe.py
 #
 # Start date  : July 3, 2018
-# Last update : July 3, 2018
+# Last update : Oct 17, 2026
 """
 
 __author__ 		= "Jong Cheol Jeong"
@@ -15,6 +17,7 @@ __email__ 		= "jjeong@kcr.uky.edu"
 
 
 import dsub
+import submitPool
 import os
 import argparse
 
@@ -32,14 +35,17 @@ parser.add_argument("-i", "--input", help='list of file names in cloud storage t
 parser.add_argument("-o", "--output", help='output google storage directory i.e., GS Path (gs://your-bucket', action='store', required=True)
 parser.add_argument("-s", "--script", help='local directory to store dsub scripts', action='store', required=True)
 parser.add_argument("-p", "--project", help='Google project ID (e.g., my-project-name)', action='store', required=True)
+parser.add_argument("--readgroup", help='one uBAM per read group (RevertSam OUTPUT_BY_READGROUP) and a manifest of them per sample for runGenPipe.py', action='store_true')
+submitPool.addSubmitArgs(parser)
 
 args = parser.parse_args()
+assert (not (args.readgroup and args.batch)), "'--readgroup' cannot be used with '--batch'!!\n"
 
 listBAM = args.input
 tgPath  = args.output
 logPath = "{}/log".format(tgPath)
 scPath = args.script
-prjName = arg.project
+prjName = args.project
 
 
 try:
@@ -60,7 +66,10 @@ with open(listBAM, 'r') as f:
         inBAM.append(line.strip())
         pathList = line.strip().split('/')
         nameList = pathList[len(pathList)-1].split('.')
-        newName = "{}/{}.unmap.{}".format(tgPath, '.'.join(nameList[:(len(nameList)-1)]), nameList[len(nameList)-1])
+        if args.readgroup:
+            newName = dsub.manifestPath(tgPath, nameList[0])
+        else:
+            newName = "{}/{}.unmap.{}".format(tgPath, '.'.join(nameList[:(len(nameList)-1)]), nameList[len(nameList)-1])
         outBAM.append(newName)
 
 #-- check if the number of inputs and outputs are same
@@ -74,17 +83,38 @@ with open(mapBAM, 'w') as f:
         cmt = "{}\t{}\n".format(inBAM[i], outBAM[i])
         f.writelines(cmt)
 
+#-- manifests to be given to runGenPipe.py ('-i')
+if args.readgroup:
+    manifests = "{}/unmapBAM.manifests.txt".format('/'.join(mapBAM.split('/')[:-1]))
+    with open(manifests, 'w') as f:
+        for i in range(len(outBAM)):
+            f.write("{}\n".format(outBAM[i]))
+
 
 """
 #------------------------------------------------------------------------------
 # Submit jobs
 #------------------------------------------------------------------------------
 """
-for i in range(len(inBAM)):
-    ibam = inBAM[i]
-    obam = outBAM[i]
-    oScr = "{}/dsub_{}.sh".format(scPath, str(i).zfill(3))
-    cmt = "[{}/{}] {} is processing...".format(i + 1, len(inBAM), ibam)
-    print(cmt)
-    dsub.UnmapBam(prjName=prjName, inFile=ibam, outFile=obam, scriptPath=oScr, Logs=logPath)
-    print('\n')
+options = submitPool.stageOptions(args)
+db = submitPool.openLedger(args, scPath)
+submitPool.configureLimits(args)
+place = submitPool.openPlacement(args, db)
+
+if args.batch:
+    oScr = "{}/dsub_UnmapBam.sh".format(scPath)
+    submitPool.runTasks(stage='UnmapBam', prjName=prjName, inFiles=inBAM, outFiles=outBAM, scriptPath=oScr, Logs=logPath, **options, db=db, resume=args.resume, placement=place)
+else:
+    jobs = []
+    for i in range(len(inBAM)):
+        oScr = "{}/dsub_{}.sh".format(scPath, str(i).zfill(3))
+        if args.readgroup:
+            jobs.append(dict(prjName=prjName, inFile=inBAM[i], outDir=tgPath, scriptPath=oScr, Logs=logPath, **options))
+        else:
+            jobs.append(dict(prjName=prjName, inFile=inBAM[i], outFile=outBAM[i], scriptPath=oScr, Logs=logPath, **options))
+
+    if args.readgroup:
+        summary = submitPool.runPool(func=dsub.UnmapBamByRG, jobs=jobs, nProc=args.nproc, outPath=scPath, db=db, stage='UnmapBamByRG', resume=args.resume, placement=place)
+    else:
+        summary = submitPool.runPool(func=dsub.UnmapBam, jobs=jobs, nProc=args.nproc, outPath=scPath, db=db, stage='UnmapBam', resume=args.resume, placement=place)
+    submitPool.printSummary(summary)
@@ -0,0 +1,519 @@
+"""
+# Purpose     : Native BAM validator
+# Descriptions:
+#  - Replaces the manual 'ValidateSamFile MODE=SUMMARY' round trip used to decide CleanSam/FixMate
+#  - The BAM is split into byte ranges aligned to BGZF blocks and the ranges are decoded
+#    in a process pool, in one pass
+#  - The first record of a range is found by guessing a record start and checking that the
+#    following records chain correctly; the guess is checked against the end of the previous
+#    range and the range is decoded again from the right position if they disagree
+#  - Checks: mate flags/positions of both mates (mates are paired across ranges), MAPQ of unmapped
+#    reads, alignments past the end of the reference, read groups
+#  - Writes a summary in ValidateSamFile format and the stages needed to fix the errors
+#    (CleanSam, FixMate)
+#
+# Start date  : Oct 17, 2026
+# Last update : Oct 17, 2026
+"""
+
+__author__ 		= "Jong Cheol Jeong"
+__copyright__ 	= "Copyright 2018, UK Cancer Research Informatics"
+__version__ 	= "1.0.0"
+__maintainer__ 	= "Jong Cheol Jeong"
+__email__ 		= "jjeong@kcr.uky.edu"
+
+
+import subprocess
+import argparse
+import bisect
+import struct
+import os
+import bgzf
+import sizing
+import reheader
+import cmpFiles
+import bamTriage
+import copyResults
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+
+NPROC = os.cpu_count() or 4
+MIN_CHUNK = 4 * 1024 * 1024
+MAX_RECORD = 16 * 1024 * 1024
+CHAIN = 3
+
+RECORD = struct.Struct('<iiiBBHHHiiii')
+
+#-- error type -> severity (names of ValidateSamFile)
+SEVERITY = OrderedDict([
+    ('CIGAR_MAPS_OFF_REFERENCE', 'ERROR'),
+    ('INVALID_MAPPING_QUALITY', 'ERROR'),
+    ('INVALID_ALIGNMENT_START', 'ERROR'),
+    ('MATE_NOT_FOUND', 'ERROR'),
+    ('MISMATCH_FLAG_MATE_UNMAPPED', 'ERROR'),
+    ('MISMATCH_FLAG_MATE_NEG_STRAND', 'ERROR'),
+    ('MISMATCH_MATE_ALIGNMENT_START', 'ERROR'),
+    ('MISMATCH_MATE_REF_INDEX', 'ERROR'),
+    ('INVALID_FLAG_MATE_UNMAPPED', 'ERROR'),
+    ('READ_GROUP_NOT_FOUND', 'ERROR'),
+    ('RECORD_MISSING_READ_GROUP', 'WARNING'),
+])
+
+#-- stage fixing each error type
+FIXES = {
+    'CIGAR_MAPS_OFF_REFERENCE': 'CleanSam',
+    'INVALID_MAPPING_QUALITY': 'CleanSam',
+    'MISMATCH_FLAG_MATE_UNMAPPED': 'FixMate',
+    'MISMATCH_FLAG_MATE_NEG_STRAND': 'FixMate',
+    'MISMATCH_MATE_ALIGNMENT_START': 'FixMate',
+    'MISMATCH_MATE_REF_INDEX': 'FixMate',
+    'INVALID_FLAG_MATE_UNMAPPED': 'FixMate',
+}
+
+PAIRED, PROPER, UNMAP, MUNMAP, REVERSE, MREVERSE, SECONDARY, SUPPLEMENTARY = 0x1, 0x2, 0x4, 0x8, 0x10, 0x20, 0x100, 0x800
+
+
+"""
+#------------------------------------------------------------------------------
+# Read a byte range of a local file or gs:// object
+#------------------------------------------------------------------------------
+"""
+def readRange(path, start, n, gsutil='gsutil'):
+    if path.startswith('gs://'):
+        return subprocess.check_output([gsutil, '-q', 'cat', '-r', '{}-{}'.format(start, start + n - 1), path], stderr=subprocess.PIPE)
+    with open(path, 'rb') as f:
+        f.seek(start)
+        return f.read(n)
+
+
+"""
+#------------------------------------------------------------------------------
+# Offset of the first BGZF block starting at or after 'offset'
+# - a candidate header is accepted when the block after it also starts where BSIZE says
+#------------------------------------------------------------------------------
+"""
+def findBlock(path, offset, fileSize, gsutil='gsutil'):
+    if offset == 0:
+        return 0
+
+    window = readRange(path, offset, 3 * bgzf.MAX_BLOCK, gsutil)
+    pos = window.find(b'\x1f\x8b\x08\x04')
+    while pos >= 0:
+        head = window[pos:pos + bgzf.HEADER_SIZE]
+        try:
+            size = bgzf.blockSize(head)
+        except bgzf.BgzfError:
+            size = None
+
+        if size is not None:
+            after = offset + pos + size
+            if after >= fileSize or window[pos + size:pos + size + 4] == b'\x1f\x8b\x08\x04':
+                return offset + pos
+
+        pos = window.find(b'\x1f\x8b\x08\x04', pos + 1)
+
+    return fileSize
+
+
+"""
+#------------------------------------------------------------------------------
+# Position (block offset, offset in block) of the first record after the header
+#------------------------------------------------------------------------------
+"""
+def firstRecord(path, gsutil='gsutil'):
+    text, refs, rest = reheader.readHeader(bamTriage.RangeReader(path, gsutil=gsutil))
+    headLen = 8 + len(text) + len(refs)
+
+    reader = bamTriage.RangeReader(path, gsutil=gsutil)
+    coffset = 0
+    total = 0
+    while True:
+        raw = bgzf.readRaw(reader)
+        if not raw:
+            return text, refs, None
+        n = len(bgzf.inflate(raw))
+        if total + n > headLen:
+            return text, refs, (coffset, headLen - total)
+        total += n
+        coffset += len(raw)
+
+
+"""
+#------------------------------------------------------------------------------
+# Decompressed data of consecutive blocks with the block offset of each byte
+#------------------------------------------------------------------------------
+"""
+class BlockBuffer(object):
+
+    def __init__(self, stream, coffset):
+        self.stream = stream
+        self.next = coffset         # offset of the next block to read
+        self.data = bytearray()
+        self.base = 0               # position of data[0] in the decompressed stream
+        self.starts = []            # decompressed position of each loaded block
+        self.offsets = []           # block offset of each loaded block
+        self.eof = False
+
+    def load(self):
+        raw = bgzf.readRaw(self.stream)
+        if not raw:
+            self.eof = True
+            return False
+        self.starts.append(self.base + len(self.data))
+        self.offsets.append(self.next)
+        self.data.extend(bgzf.inflate(raw))
+        self.next += len(raw)
+        return True
+
+    #-- make at least n bytes available from decompressed position 'pos'
+    def ensure(self, pos, n):
+        while self.base + len(self.data) < pos + n:
+            if not self.load():
+                return False
+        return True
+
+    def get(self, pos, n):
+        i = pos - self.base
+        return self.data[i:i + n]
+
+    def voffset(self, pos):
+        i = bisect.bisect_right(self.starts, pos) - 1
+        return (self.offsets[i], pos - self.starts[i])
+
+    #-- forget data before 'pos' (keeps the block holding it)
+    def drop(self, pos):
+        i = bisect.bisect_right(self.starts, pos) - 1
+        if i <= 0:
+            return
+        cut = self.starts[i] - self.base
+        del self.data[:cut]
+        self.base = self.starts[i]
+        del self.starts[:i]
+        del self.offsets[:i]
+
+
+"""
+#------------------------------------------------------------------------------
+# Record checks
+#------------------------------------------------------------------------------
+"""
+def plausible(buf, pos, refLens):
+    if not buf.ensure(pos, 36):
+        return None
+    bs, refID, rpos, lrn, mapq, bin_, nc, flag, lseq, nref, npos, tlen = RECORD.unpack_from(buf.data, pos - buf.base)
+    nRef = len(refLens)
+    if bs < 32 or bs > MAX_RECORD or lrn < 2 or lseq < 0:
+        return False
+    if not (-1 <= refID < nRef) or not (-1 <= nref < nRef) or rpos < -1 or npos < -1:
+        return False
+    if refID >= 0 and rpos > refLens[refID]:
+        return False
+    if 32 + lrn + 4 * nc + (lseq + 1) // 2 + lseq > bs:
+        return False
+    if not buf.ensure(pos + 36, lrn):
+        return None
+    name = buf.get(pos + 36, lrn)
+    if name[-1] != 0 or any([c < 33 or c > 126 for c in name[:-1]]):
+        return False
+    return bs
+
+
+def guessStart(buf, pos, refLens):
+    buf.ensure(pos, 1)
+    while buf.ensure(pos, 36):
+        cur = pos
+        ok = True
+        for i in range(CHAIN):
+            bs = plausible(buf, cur, refLens)
+            if bs is None:
+                break           # end of the file - chain accepted so far
+            if bs is False:
+                ok = False
+                break
+            cur += 4 + bs
+        if ok:
+            return pos
+        pos += 1
+    return None
+
+
+def readGroup(rec, start):
+    pos = start
+    end = len(rec)
+    while pos + 3 <= end:
+        tag = rec[pos:pos + 2]
+        typ = rec[pos + 2:pos + 3]
+        pos += 3
+        if typ in (b'Z', b'H'):
+            stop = rec.index(b'\x00', pos)
+            if tag == b'RG':
+                return rec[pos:stop].decode('utf-8', 'replace')
+            pos = stop + 1
+        elif typ in (b'A', b'c', b'C'):
+            pos += 1
+        elif typ in (b's', b'S'):
+            pos += 2
+        elif typ in (b'i', b'I', b'f'):
+            pos += 4
+        elif typ == b'B':
+            sub = rec[pos:pos + 1]
+            count = struct.unpack_from('<i', rec, pos + 1)[0]
+            pos += 5 + count * {b'c': 1, b'C': 1, b's': 2, b'S': 2, b'i': 4, b'I': 4, b'f': 4}[sub]
+        else:
+            return None
+    return None
+
+
+def checkRecord(rec, refLens, rgIDs, errors):
+    bs, refID, pos, lrn, mapq, bin_, nc, flag, lseq, nref, npos, tlen = RECORD.unpack_from(rec, 0)
+
+    if flag & UNMAP:
+        if mapq != 0:
+            errors['INVALID_MAPPING_QUALITY'] += 1
+    else:
+        if refID < 0 or pos < 0:
+            errors['INVALID_ALIGNMENT_START'] += 1
+        elif nc > 0:
+            cigar = struct.unpack_from('<{}I'.format(nc), rec, 36 + lrn)
+            refLen = sum([op >> 4 for op in cigar if (op & 0xf) in (0, 2, 3, 7, 8)])
+            if pos + refLen > refLens[refID]:
+                errors['CIGAR_MAPS_OFF_REFERENCE'] += 1
+
+    if flag & PAIRED and not (flag & MUNMAP) and (nref < 0 or npos < 0):
+        errors['INVALID_FLAG_MATE_UNMAPPED'] += 1
+
+    rg = readGroup(rec, 36 + lrn + 4 * nc + (lseq + 1) // 2 + lseq)
+    if rg is None:
+        errors['RECORD_MISSING_READ_GROUP'] += 1
+    elif rgIDs is not None and rg not in rgIDs:
+        errors['READ_GROUP_NOT_FOUND'] += 1
+
+    if not (flag & PAIRED) or flag & (SECONDARY | SUPPLEMENTARY):
+        return None
+
+    name = bytes(rec[36:36 + lrn - 1])
+    return name, (flag, refID, pos, nref, npos)
+
+
+"""
+#------------------------------------------------------------------------------
+# Compare the mate fields of a pair of primary records
+#------------------------------------------------------------------------------
+"""
+def checkMates(a, b, errors):
+    for rec, mate in ((a, b), (b, a)):
+        flag, refID, pos, nref, npos = rec
+        mflag, mrefID, mpos = mate[0], mate[1], mate[2]
+        if bool(flag & MUNMAP) != bool(mflag & UNMAP):
+            errors['MISMATCH_FLAG_MATE_UNMAPPED'] += 1
+        if bool(flag & MREVERSE) != bool(mflag & REVERSE):
+            errors['MISMATCH_FLAG_MATE_NEG_STRAND'] += 1
+        if nref != mrefID:
+            errors['MISMATCH_MATE_REF_INDEX'] += 1
+        if npos != mpos:
+            errors['MISMATCH_MATE_ALIGNMENT_START'] += 1
+
+
+def pairMates(unpaired, name, rec, errors):
+    mate = unpaired.pop(name, None)
+    if mate is None:
+        unpaired[name] = rec
+    else:
+        checkMates(mate, rec, errors)
+
+
+"""
+#------------------------------------------------------------------------------
+# Validate the records starting in blocks [start, end)
+# - inner : offset of the first record in the block at 'start'; guessed if None
+# Returns dictionary with 'first' and 'next' (block offset, offset in block) of the first record
+# of the range and of the range after it, 'records', 'errors' and 'unpaired' mates
+#------------------------------------------------------------------------------
+"""
+def validateRange(path, start, end, refLens, rgIDs=None, inner=None, gsutil='gsutil'):
+    stream, proc = copyResults.openRange(path, start, gsutil)
+    buf = BlockBuffer(stream, start)
+    errors = Counter()
+    unpaired = {}
+    nRec = 0
+
+    try:
+        if inner is None:
+            pos = guessStart(buf, 0, refLens)
+        else:
+            pos = inner if buf.ensure(inner, 1) else None
+
+        first = buf.voffset(pos) if pos is not None else None
+        nextPos = None
+
+        while pos is not None and buf.ensure(pos, 4):
+            voff = buf.voffset(pos)
+            if voff[0] >= end:
+                nextPos = voff
+                break
+
+            bs = struct.unpack_from('<i', buf.data, pos - buf.base)[0]
+            if not buf.ensure(pos, 4 + bs):
+                errors['TRUNCATED_RECORD'] += 1
+                break
+
+            rec = buf.get(pos, 4 + bs)
+            mate = checkRecord(rec, refLens, rgIDs, errors)
+            if mate is not None:
+                pairMates(unpaired, mate[0], mate[1], errors)
+            nRec += 1
+
+            pos += 4 + bs
+            if nRec % 10000 == 0:
+                buf.drop(pos)
+    finally:
+        stream.close()
+        if proc is not None:
+            proc.kill()
+            proc.wait()
+
+    return {'start': start, 'first': first, 'next': nextPos, 'records': nRec, 'errors': errors, 'unpaired': unpaired}
+
+
+"""
+#------------------------------------------------------------------------------
+# Validate a BAM file with a process pool
+# :: Example Code ::
+# res = validate('/local/full/path/example1_DNA.bam', nProc=16)
+# print(summary(res['errors']))
+#------------------------------------------------------------------------------
+"""
+def validate(path, nProc=NPROC, chunks=None, gsutil='gsutil'):
+    text, refs, firstRec = firstRecord(path, gsutil)
+    info = bamTriage.parseHeader(text.decode('utf-8', 'replace'), refs)
+    refLens = [length for name, length in info['SQ']]
+    rgIDs = set([rg['ID'] for rg in info['RG']]) if len(info['RG']) > 0 else set()
+
+    errors = Counter()
+    if firstRec is None:
+        return {'records': 0, 'errors': errors, 'reruns': 0}
+
+    fileSize = sizing.objectSize(path, gsutil)
+    if chunks is None:
+        chunks = max(1, min(nProc * 4, (fileSize - firstRec[0]) // MIN_CHUNK))
+
+    #-- block aligned boundaries of the ranges
+    step = (fileSize - firstRec[0]) // chunks + 1
+    bounds = [firstRec[0]]
+    for i in range(1, chunks):
+        block = findBlock(path, firstRec[0] + i * step, fileSize, gsutil)
+        if block > bounds[-1] and block < fileSize:
+            bounds.append(block)
+    bounds.append(fileSize)
+
+    ranges = [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1)]
+    with ProcessPoolExecutor(max_workers=max(1, min(nProc, len(ranges)))) as pool:
+        futures = []
+        for i, (start, end) in enumerate(ranges):
+            inner = firstRec[1] if i == 0 else None
+            futures.append(pool.submit(validateRange, path, start, end, refLens, rgIDs, inner, gsutil))
+        results = [future.result() for future in futures]
+
+    #-- each range must start where the previous one stopped; decode it again otherwise
+    reruns = 0
+    for i in range(1, len(results)):
+        expected = results[i - 1]['next']
+        if results[i]['first'] == expected:
+            continue
+        reruns += 1
+        start, end = ranges[i]
+        if expected is None or expected[0] >= end:
+            results[i] = {'start': start, 'first': expected, 'next': expected, 'records': 0, 'errors': Counter(), 'unpaired': {}}
+        else:
+            results[i] = validateRange(path, expected[0], end, refLens, rgIDs, expected[1], gsutil)
+
+    unpaired = {}
+    nRec = 0
+    for res in results:
+        nRec += res['records']
+        errors.update(res['errors'])
+        for name in res['unpaired']:
+            pairMates(unpaired, name, res['unpaired'][name], errors)
+
+    #-- mates never found (mapped mates only, like ValidateSamFile)
+    for name in unpaired:
+        if not (unpaired[name][0] & MUNMAP) or unpaired[name][3] >= 0:
+            errors['MATE_NOT_FOUND'] += 1
+
+    return {'records': nRec, 'errors': errors, 'reruns': reruns}
+
+
+"""
+#------------------------------------------------------------------------------
+# Summary in ValidateSamFile (MODE=SUMMARY) format
+#------------------------------------------------------------------------------
+"""
+def summary(errors):
+    rows = [(SEVERITY.get(key, 'ERROR'), key, errors[key]) for key in errors if errors[key] > 0]
+    if len(rows) == 0:
+        return "No errors found\n"
+
+    rows.sort(key=lambda row: (row[0] != 'ERROR', row[1]))
+    lines = ["## HISTOGRAM\tjava.lang.String", "Error Type\tCount"]
+    lines.extend(["{}:{}\t{}".format(severity, key, count) for severity, key, count in rows])
+    return '\n'.join(lines) + '\n'
+
+
+def stagesFor(errors):
+    stages = set([FIXES[key] for key in errors if errors[key] > 0 and key in FIXES])
+    return [stage for stage in ['CleanSam', 'FixMate'] if stage in stages]
+
+
+"""
+#------------------------------------------------------------------------------
+# :: USAGE ::
+# >> python validateBam.py -i example1_DNA.bam -o /output_dir/validate
+# >> python validateBam.py -i bamList.txt -o /output_dir/validate -n 16
+# >> python fixMate.py -p <my-project-id> -i /output_dir/validate/FixMate.txt -o gs://vcf-to-bam-bam3 -s /output_dir/fixMate
+#
+# - writes '<sample>.summary.txt' (ValidateSamFile format), 'validate.tsv' and the BAMs needing
+#   each stage in 'CleanSam.txt' and 'FixMate.txt'
+#------------------------------------------------------------------------------
+"""
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--input", help='BAM file, list of BAM files, or a bucket/directory to list', action='store', required=True)
+    parser.add_argument("-o", "--output", help='output directory', action='store', required=True)
+    parser.add_argument("-n", "--nproc", help='number of processes [Default={}]'.format(NPROC), type=int, default=NPROC)
+    parser.add_argument("--gsutil", help='gsutil executable [Default=gsutil]', action='store', default='gsutil')
+
+    args = parser.parse_args()
+
+    try:
+        os.makedirs(args.output)
+    except OSError:
+        pass
+
+    if args.input.endswith('.bam'):
+        paths = [args.input]
+    else:
+        paths = list(cmpFiles.readNames(args.input, suffix='.bam'))
+
+    needs = OrderedDict([('CleanSam', []), ('FixMate', [])])
+    with open('{}/validate.tsv'.format(args.output), 'w') as ft:
+        ft.write("BAM\tRECORDS\tERRORS\tWARNINGS\tSTAGES\n")
+        for path in paths:
+            res = validate(path, nProc=args.nproc, gsutil=args.gsutil)
+            sample = path.split('/')[-1].split('.')[0]
+            with open('{}/{}.summary.txt'.format(args.output, sample), 'w') as f:
+                f.write(summary(res['errors']))
+
+            stages = stagesFor(res['errors'])
+            for stage in stages:
+                needs[stage].append(path)
+
+            nErr = sum([res['errors'][key] for key in res['errors'] if SEVERITY.get(key, 'ERROR') == 'ERROR'])
+            nWarn = sum([res['errors'][key] for key in res['errors'] if SEVERITY.get(key) == 'WARNING'])
+            ft.write("{}\t{}\t{}\t{}\t{}\n".format(path, res['records'], nErr, nWarn, ','.join(stages)))
+            print("{}\t{} records\t{} errors\t{} warnings\t{}".format(path, res['records'], nErr, nWarn, ','.join(stages) or '-'))
+
+    for stage in needs:
+        with open('{}/{}.txt'.format(args.output, stage), 'w') as f:
+            for path in needs[stage]:
+                f.write("{}\n".format(path))
@@ -0,0 +1,420 @@
+"""
+# Purpose     : Event-driven watcher of stage outputs
+# Descriptions:
+#  - Replaces periodic 'gsutil ls | grep' + cmpFiles.py to find finished outputs
+#  - Events come from:
+#       cloud storage   : Pub/Sub notifications of the bucket (OBJECT_FINALIZE), pulled with
+#                         'gcloud pubsub subscriptions pull' and acknowledged after they are handled
+#                         (gsutil notification create -t <topic> -f json -e OBJECT_FINALIZE gs://<bucket>)
+#       local directory : inotify (ctypes, Linux) on a directory tree standing in for a bucket;
+#                         files written in place (close after write) or renamed into it ('.part' -> name)
+#  - Each new output is verified: not empty (size given by the notification, looked up only when it
+#    is not given) and, for BGZF files (.bam, .vcf.gz, .tbi, ...), ends with the BGZF EOF block
+#    (last 28 bytes only)
+#  - Verified outputs fire the callbacks: a job ledger row with this output is marked SUCCESS once
+#    all of its outputs (outFile and extraOutputs e.g., the BAI of a BAM) are verified (pipeDag.py
+#    submits the next stage on its next round) and/or a command is run ('--exec')
+#  - No bucket listing is needed
+#
+# Start date  : Oct 17, 2026
+# Last update : Oct 17, 2026
+"""
+
+__author__ 		= "Jong Cheol Jeong"
+__copyright__ 	= "Copyright 2018, UK Cancer Research Informatics"
+__version__ 	= "1.0.0"
+__maintainer__ 	= "Jong Cheol Jeong"
+__email__ 		= "jjeong@kcr.uky.edu"
+
+
+import ctypes.util
+import subprocess
+import argparse
+import fnmatch
+import ctypes
+import select
+import struct
+import base64
+import shlex
+import json
+import time
+import os
+import bgzf
+import ledger
+import sizing
+from concurrent.futures import ThreadPoolExecutor
+
+
+NPROC = 8
+
+#-- files ending with the BGZF EOF block
+BGZF_SUFFIXES = ('.bam', '.vcf.gz', '.bcf', '.tbi', '.bgz')
+
+#-- inotify (linux/inotify.h)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+EVENT = struct.Struct('iIII')
+
+
+class WatchError(Exception):
+    pass
+
+
+"""
+#------------------------------------------------------------------------------
+# Local directory tree watched with inotify
+# - poll(timeout) returns [{'name', 'size', 'source', 'generation'}] of files closed after writing or moved into the tree
+# - directories created later are watched as well; files already in them are reported
+#------------------------------------------------------------------------------
+"""
+class InotifySource(object):
+
+    def __init__(self, root, existing=False):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise WatchError("inotify is not available")
+
+        self.libc = libc
+        self.fd = libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise WatchError("inotify_init1 failed: {}".format(os.strerror(ctypes.get_errno())))
+
+        self.dirs = {}
+        self.pending = []
+        self.addTree(root.rstrip('/'), report=existing)
+
+    def addWatch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, path.encode('utf-8'), IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE)
+        if wd < 0:
+            raise WatchError("cannot watch {}: {}".format(path, os.strerror(ctypes.get_errno())))
+        self.dirs[wd] = path
+
+    def addTree(self, root, report=False):
+        for dirPath, dirNames, fileNames in os.walk(root):
+            dirNames.sort()
+            self.addWatch(dirPath)
+            if report:
+                for name in sorted(fileNames):
+                    self.pending.append(self.event(os.path.join(dirPath, name)))
+
+    def event(self, path):
+        try:
+            generation = str(os.stat(path).st_mtime_ns)
+        except OSError:
+            generation = None
+        return {'name': path, 'size': None, 'source': 'inotify', 'generation': generation}
+
+    def poll(self, timeout=1.0):
+        events, self.pending = self.pending, []
+        if len(events) > 0:
+            timeout = 0
+
+        ready, w, x = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return events
+
+        data = os.read(self.fd, 64 * 1024)
+        pos = 0
+        while pos + EVENT.size <= len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, pos)
+            name = data[pos + EVENT.size:pos + EVENT.size + length].rstrip(b'\x00').decode('utf-8', 'replace')
+            pos += EVENT.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                raise WatchError("inotify queue overflow")
+            if mask & IN_IGNORED:
+                self.dirs.pop(wd, None)
+                continue
+            if wd not in self.dirs or not name:
+                continue
+
+            path = os.path.join(self.dirs[wd], name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self.addTree(path, report=True)
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                events.append(self.event(path))
+
+        #-- files of directories created meanwhile
+        events.extend(self.pending)
+        self.pending = []
+        return events
+
+    def ack(self, event):
+        pass
+
+    def close(self):
+        os.close(self.fd)
+
+
+"""
+#------------------------------------------------------------------------------
+# Pub/Sub subscription of cloud storage notifications
+# - poll(timeout) pulls up to 'maxMessages' messages; OBJECT_FINALIZE events are returned
+#   and other messages are acknowledged right away
+# - ack(event) acknowledges the message of an event after it was handled
+#------------------------------------------------------------------------------
+"""
+class PubSubSource(object):
+
+    def __init__(self, subscription, maxMessages=100, gcloud='gcloud'):
+        self.subscription = subscription
+        self.maxMessages = maxMessages
+        self.gcloud = gcloud
+
+    def pull(self):
+        command = [self.gcloud, 'pubsub', 'subscriptions', 'pull', self.subscription, '--limit', str(self.maxMessages), '--format=json']
+        out = subprocess.check_output(command, stderr=subprocess.PIPE).decode('utf-8', 'replace')
+        return json.loads(out) if out.strip() else []
+
+    def poll(self, timeout=1.0):
+        events = []
+        others = []
+        for rec in self.pull():
+            msg = rec.get('message', rec)
+            attrs = msg.get('attributes') or {}
+            ackID = rec.get('ackId')
+            if attrs.get('eventType') != 'OBJECT_FINALIZE':
+                others.append(ackID)
+                continue
+
+            size = None
+            try:
+                size = int(json.loads(base64.b64decode(msg.get('data') or '') or b'{}').get('size'))
+            except (ValueError, TypeError):
+                pass
+            events.append({'name': 'gs://{}/{}'.format(attrs.get('bucketId'), attrs.get('objectId')), 'size': size, 'source': 'pubsub',
+                           'generation': attrs.get('objectGeneration'), 'ackId': ackID})
+
+        self.acknowledge([ackID for ackID in others if ackID])
+        if len(events) == 0:
+            time.sleep(timeout)
+        return events
+
+    def acknowledge(self, ackIDs):
+        if len(ackIDs) > 0:
+            subprocess.check_output([self.gcloud, 'pubsub', 'subscriptions', 'ack', self.subscription, '--ack-ids', ','.join(ackIDs)], stderr=subprocess.PIPE)
+
+    def ack(self, event):
+        if event.get('ackId'):
+            self.acknowledge([event['ackId']])
+
+    def close(self):
+        pass
+
+
+"""
+#------------------------------------------------------------------------------
+# Verify an output
+# :: Example Code ::
+# verifyOutput('gs://b2/example1_DNA.sort.bam', size=1234567)   -> (True, None)
+#
+# - size : size announced by the notification; trusted, so only the 28-byte tail is read
+#          ('gsutil du' / stat when not given)
+# Returns (ok, message)
+#------------------------------------------------------------------------------
+"""
+def readTail(path, n, gsutil='gsutil'):
+    if path.startswith('gs://'):
+        return subprocess.check_output([gsutil, '-q', 'cat', '-r', '-{}'.format(n), path], stderr=subprocess.PIPE)
+
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - n))
+        return f.read()
+
+
+def verifyOutput(path, size=None, gsutil='gsutil'):
+    try:
+        actual = sizing.objectSize(path, gsutil) if size is None else size
+        if actual == 0:
+            return (False, "empty file")
+        if path.endswith(BGZF_SUFFIXES) and readTail(path, len(bgzf.EOF_BLOCK), gsutil) != bgzf.EOF_BLOCK:
+            return (False, "no BGZF EOF block (truncated)")
+    except (subprocess.CalledProcessError, OSError, ValueError, IndexError) as err:
+        return (False, "cannot read ({})".format(err))
+    return (True, None)
+
+
+"""
+#------------------------------------------------------------------------------
+# Callbacks called as callback(path, event) for each verified output
+# - ledgerCallback  : SUBMITTED/RUNNING ledger rows with this output are marked SUCCESS when their other
+#                     outputs (ledger.rowOutputs) are verified as well; otherwise the row is left to the
+#                     event of its last output
+# - commandCallback : run a shell command, '{path}' is replaced with the output path
+#------------------------------------------------------------------------------
+"""
+def ledgerCallback(db, gsutil='gsutil'):
+    def callback(path, event):
+        rows = db.byAnyOutput(path, ledger.ACTIVE_STATES)
+        for row in rows:
+            waiting = []
+            for other in ledger.rowOutputs(row):
+                if other != path and not verifyOutput(other, gsutil=gsutil)[0]:
+                    waiting.append(other)
+            if len(waiting) > 0:
+                print("{}\t{}\t{}\t{} (waiting for {})".format(time.strftime('%Y-%m-%d %H:%M:%S'), row['sample'], row['stage'], row['state'], ', '.join(waiting)))
+                continue
+            db.setState(ledger.SUCCESS, sample=row['sample'], stage=row['stage'], message='outputs arrived', commit=False)
+            print("{}\t{}\t{}\t{} -> {}".format(time.strftime('%Y-%m-%d %H:%M:%S'), row['sample'], row['stage'], row['state'], ledger.SUCCESS))
+        db.commit()
+    return callback
+
+
+def commandCallback(cmd):
+    def callback(path, event):
+        subprocess.check_call(cmd.replace('{path}', shlex.quote(path)), shell=True)
+    return callback
+
+
+"""
+#------------------------------------------------------------------------------
+# Watcher
+# :: Example Code ::
+# watcher = Watcher(InotifySource('/local/stand-in/bucket'), [ledgerCallback(ledger.Ledger('/output_dir/pipe/ledger.db'))], includes=['*.bam'])
+# watcher.run()
+#
+# - includes/excludes : glob patterns on the output path
+# - a verified output (path, size, generation) is handled once; rejected outputs are checked again
+#   when they are written again
+#------------------------------------------------------------------------------
+"""
+class Watcher(object):
+
+    def __init__(self, source, callbacks=None, includes=None, excludes=None, verify=True, nProc=NPROC, gsutil='gsutil'):
+        self.source = source
+        self.callbacks = [] if callbacks is None else callbacks
+        self.includes = includes
+        self.excludes = excludes
+        self.verify = verify
+        self.nProc = nProc
+        self.gsutil = gsutil
+        self.seen = set()
+        self.counts = {'verified': 0, 'rejected': 0, 'ignored': 0}
+
+    def selected(self, path):
+        if self.includes and not any([fnmatch.fnmatchcase(path, pat) for pat in self.includes]):
+            return False
+        if self.excludes and any([fnmatch.fnmatchcase(path, pat) for pat in self.excludes]):
+            return False
+        return not path.endswith('.part')
+
+    def check(self, event):
+        if not self.verify:
+            return (True, None)
+        return verifyOutput(event['name'], event.get('size'), self.gsutil)
+
+    """
+    #--------------------------------------------------------------------------
+    # Verify a batch of events in parallel and run the callbacks of the verified outputs
+    # Returns [(event, ok, message)]
+    #--------------------------------------------------------------------------
+    """
+    def handle(self, events):
+        todo = []
+        for event in events:
+            key = (event['name'], event.get('size'), event.get('generation'))
+            if key in self.seen or not self.selected(event['name']):
+                self.counts['ignored'] += 1
+                self.source.ack(event)
+                continue
+            todo.append(event)
+
+        if len(todo) == 0:
+            return []
+
+        with ThreadPoolExecutor(max_workers=max(1, min(self.nProc, len(todo)))) as pool:
+            checks = list(pool.map(self.check, todo))
+
+        results = []
+        for event, (ok, message) in zip(todo, checks):
+            path = event['name']
+            if ok:
+                self.seen.add((path, event.get('size'), event.get('generation')))
+                self.counts['verified'] += 1
+                print("{}\tVERIFIED\t{}".format(time.strftime('%Y-%m-%d %H:%M:%S'), path))
+                for callback in self.callbacks:
+                    try:
+                        callback(path, event)
+                    except Exception as err:
+                        print("{}\tCALLBACK FAILED\t{}\t{}".format(time.strftime('%Y-%m-%d %H:%M:%S'), path, err))
+            else:
+                self.counts['rejected'] += 1
+                print("{}\tREJECTED\t{}\t{}".format(time.strftime('%Y-%m-%d %H:%M:%S'), path, message))
+            self.source.ack(event)
+            results.append((event, ok, message))
+
+        return results
+
+    """
+    #--------------------------------------------------------------------------
+    # Handle events until 'idle' seconds pass without any event (forever if idle is None)
+    #--------------------------------------------------------------------------
+    """
+    def run(self, idle=None, timeout=1.0):
+        last = time.time()
+        while True:
+            events = self.source.poll(timeout)
+            if len(events) > 0:
+                self.handle(events)
+                last = time.time()
+            elif idle is not None and time.time() - last >= idle:
+                return self.counts
+
+
+"""
+#------------------------------------------------------------------------------
+# :: USAGE ::
+# >> python watchOutputs.py --subscription projects/my-project-id/subscriptions/vcf-to-bam-prep -l /output_dir/pipe/ledger.db -I '*.bam' -I '*.bai'
+# >> python watchOutputs.py --dir /local/stand-in/bucket -l ledger.db --exec 'python pipeDag.py ... --once'
+# >> python watchOutputs.py --dir /local/stand-in/bucket --existing --idle 30
+#------------------------------------------------------------------------------
+"""
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subscription", help='Pub/Sub subscription of the bucket notifications (e.g., projects/my-project-id/subscriptions/my-sub)', action='store', default=None)
+    parser.add_argument("--dir", help='local directory standing in for a bucket (inotify)', action='store', default=None)
+    parser.add_argument("--existing", help='also handle files already in --dir', action='store_true')
+    parser.add_argument("-l", "--ledger", help='job ledger - rows whose output arrived are marked SUCCESS', action='store', default=None)
+    parser.add_argument("--exec", help='shell command run for each verified output, {path} is replaced with its path', action='store', default=None)
+    parser.add_argument("-I", "--include", help='handle only outputs matching this glob (repeatable, e.g., "*.bam")', action='append', default=None)
+    parser.add_argument("-x", "--exclude", help='ignore outputs matching this glob (repeatable)', action='append', default=None)
+    parser.add_argument("--no-verify", help='do not check sizes and BGZF EOF blocks', action='store_true')
+    parser.add_argument("--idle", help='exit after this many seconds without events [Default=run forever]', type=float, default=None)
+    parser.add_argument("-n", "--nproc", help='number of outputs verified at the same time [Default={}]'.format(NPROC), type=int, default=NPROC)
+    parser.add_argument("--gcloud", help='gcloud executable [Default=gcloud]', action='store', default='gcloud')
+    parser.add_argument("--gsutil", help='gsutil executable [Default=gsutil]', action='store', default='gsutil')
+
+    args = parser.parse_args()
+
+    assert ((args.subscription is None) != (args.dir is None)), "Either --subscription or --dir must be given!!\nExample) --dir /local/stand-in/bucket\n"
+
+    callbacks = []
+    if args.ledger is not None:
+        callbacks.append(ledgerCallback(ledger.Ledger(args.ledger), gsutil=args.gsutil))
+    if args.exec is not None:
+        callbacks.append(commandCallback(args.exec))
+
+    if args.dir is not None:
+        source = InotifySource(args.dir, existing=args.existing)
+    else:
+        source = PubSubSource(args.subscription, gcloud=args.gcloud)
+
+    watcher = Watcher(source, callbacks, includes=args.include, excludes=args.exclude, verify=not args.no_verify, nProc=args.nproc, gsutil=args.gsutil)
+    try:
+        counts = watcher.run(idle=args.idle)
+    except KeyboardInterrupt:
+        counts = watcher.counts
+    finally:
+        source.close()
+
+    print('\n')
+    print("Verified : {}".format(counts['verified']))
+    print("Rejected : {}".format(counts['rejected']))
+    print("Ignored  : {}".format(counts['ignored']))
@@ -0,0 +1,145 @@
+"""
+# Purpose     : bamIndex.py builds the same BAI as 'samtools index'
+# Descriptions:
+#  - Coordinate-sorted BAMs are generated with bgzf.py (mapped reads with different CIGARs,
+#    placed unmapped reads and reads without coordinates)
+#  - The BAI of bamIndex.buildIndex and of samtools (the samtools executable, or pysam.index
+#    when samtools is not installed) are parsed and compared: bins and their chunks, pseudo-bin,
+#    linear index and count of reads without coordinates
+#  - htslib writes the bins in hash order and bamIndex in bin order, so the files are not compared
+#    byte-for-byte
+#  - Skipped when neither samtools nor pysam is available
+#  >> python -m pytest -q tests
+#
+# Start date  : Oct 17, 2026
+# Last update : Oct 17, 2026
+"""
+
+__author__ 		= "Jong Cheol Jeong"
+__copyright__ 	= "Copyright 2018, UK Cancer Research Informatics"
+__version__ 	= "1.0.0"
+__maintainer__ 	= "Jong Cheol Jeong"
+__email__ 		= "jjeong@kcr.uky.edu"
+
+
+import subprocess
+import shutil
+import random
+import struct
+import sys
+import os
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'codes'))
+import bgzf
+import bamIndex
+import reheader
+
+try:
+    import pysam
+except ImportError:
+    pysam = None
+
+SAMTOOLS = shutil.which('samtools')
+
+pytestmark = pytest.mark.skipif(SAMTOOLS is None and pysam is None, reason='samtools or pysam is needed')
+
+
+"""
+#------------------------------------------------------------------------------
+# Generated BAMs
+#------------------------------------------------------------------------------
+"""
+CIGARS = [[(100, 0)], [(50, 0), (2000, 3), (50, 0)], [(30, 4), (70, 0)], [(60, 0), (5, 2), (40, 0)], [(100, 0), (20000, 3), (1, 0)]]
+
+
+def bamRecord(name, refID, pos, cigar, flag=0):
+    rname = name.encode('utf-8') + b'\x00'
+    seqLen = sum([length for length, op in cigar if op in (0, 1, 4, 7, 8)]) if cigar else 100
+    refLen = sum([length for length, op in cigar if op in (0, 2, 3, 7, 8)])
+    b = bamIndex.reg2bin(pos, pos + refLen) if refID >= 0 else 4680
+    cig = b''.join([struct.pack('<I', length << 4 | op) for length, op in cigar])
+    seq = bytes([random.choice([0x11, 0x22, 0x44, 0x88]) for i in range((seqLen + 1) // 2)])
+    qual = bytes([30] * seqLen)
+    body = struct.pack('<iiBBHHHiiii', refID, pos, len(rname), 60, b, len(cigar), flag, seqLen, -1, -1, 0) + rname + cig + seq + qual
+    return struct.pack('<i', len(body)) + body
+
+
+def makeBam(path, nRec, nRef=3, span=2000000, nUnmapped=20, nNoCoor=10, seed=1):
+    random.seed(seed)
+    refs = [('chr{}'.format(i + 1), 200000000) for i in range(nRef)]
+    text = '@HD\tVN:1.6\tSO:coordinate\n' + ''.join(['@SQ\tSN:{}\tLN:{}\n'.format(name, length) for name, length in refs])
+
+    binRefs = struct.pack('<i', len(refs))
+    for name, length in refs:
+        binRefs += struct.pack('<i', len(name) + 1) + name.encode('utf-8') + b'\x00' + struct.pack('<i', length)
+
+    #-- the second reference has no reads; placed unmapped reads keep the position of their mate
+    reads = [(random.choice([0, 2]), random.randrange(span), random.choice(CIGARS), 0) for i in range(nRec)]
+    reads += [(random.choice([0, 2]), random.randrange(span), [], 0x4) for i in range(nUnmapped)]
+
+    writer = bgzf.BgzfWriter(open(path, 'wb'))
+    writer.write(reheader.headerBytes(text.encode('utf-8'), binRefs))
+    for i, (refID, pos, cigar, flag) in enumerate(sorted(reads)):
+        writer.write(bamRecord('r{}'.format(i), refID, pos, cigar, flag))
+    for i in range(nNoCoor):
+        writer.write(bamRecord('u{}'.format(i), -1, -1, [], 0x4))
+    writer.close()
+
+
+def samtoolsIndex(inPath, outPath):
+    if SAMTOOLS is not None:
+        subprocess.check_call([SAMTOOLS, 'index', '-b', inPath, outPath])
+    else:
+        pysam.index(inPath, outPath)
+
+
+#-- ([(bins, pseudo-bin, linear index)], reads without coordinates)
+def parseBai(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    assert data[:4] == bamIndex.BAI_MAGIC
+
+    nRef = struct.unpack_from('<i', data, 4)[0]
+    offset = 8
+    refs = []
+    for i in range(nRef):
+        nBin = struct.unpack_from('<i', data, offset)[0]
+        offset += 4
+        bins = {}
+        for j in range(nBin):
+            b, nChunk = struct.unpack_from('<Ii', data, offset)
+            offset += 8
+            bins[b] = list(struct.unpack_from('<{}Q'.format(2 * nChunk), data, offset))
+            offset += 16 * nChunk
+        pseudo = bins.pop(bamIndex.PSEUDO_BIN, None)
+        nIntv = struct.unpack_from('<i', data, offset)[0]
+        offset += 4
+        refs.append((bins, pseudo, list(struct.unpack_from('<{}Q'.format(nIntv), data, offset))))
+        offset += 8 * nIntv
+    return refs, struct.unpack_from('<Q', data, offset)[0]
+
+
+"""
+#------------------------------------------------------------------------------
+# Tests
+#------------------------------------------------------------------------------
+"""
+@pytest.mark.parametrize('nRec, span', [(2000, 2000000), (20000, 2000000), (100000, 20000000), (50000, 200000)],
+                         ids=['small', 'merged-bins', 'sparse', 'dense'])
+def test_same_as_samtools(tmp_path, nRec, span):
+    inPath = str(tmp_path / 'in.bam')
+    makeBam(inPath, nRec, span=span)
+
+    outPath = str(tmp_path / 'ours.bai')
+    bamIndex.buildIndex(inPath, outPath, threads=2)
+    refPath = str(tmp_path / 'ref.bai')
+    samtoolsIndex(inPath, refPath)
+
+    ours, ref = parseBai(outPath), parseBai(refPath)
+    assert ours[1] == ref[1] == 10
+    assert len(ours[0]) == len(ref[0]) == 3
+    for tid in range(3):
+        assert ours[0][tid][1] == ref[0][tid][1]
+        assert ours[0][tid][2] == ref[0][tid][2]
+        assert ours[0][tid][0] == ref[0][tid][0]
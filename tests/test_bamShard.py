@@ -0,0 +1,175 @@
+"""
+# Purpose     : bamShard.py scatter/gather gives back the records of the input BAM
+# Descriptions:
+#  - BAMs are generated with bgzf.py: coordinate sorted (mapped reads on several references, placed
+#    unmapped reads and reads without coordinates) and queryname sorted pairs
+#  - coord : shards hold disjoint coordinate ranges; gathered, they give the input records in the
+#            same order and the BAI written in the same pass is the one of bamIndex.buildIndex
+#  - name  : mates stay in the same shard; the k-way merge gives the input records in the order of
+#            the SO header tag
+#  >> python -m pytest -q tests
+#
+# Start date  : Oct 17, 2026
+# Last update : Oct 17, 2026
+"""
+
+__author__ 		= "Jong Cheol Jeong"
+__copyright__ 	= "Copyright 2018, UK Cancer Research Informatics"
+__version__ 	= "1.0.0"
+__maintainer__ 	= "Jong Cheol Jeong"
+__email__ 		= "jjeong@kcr.uky.edu"
+
+
+import random
+import struct
+import sys
+import os
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'codes'))
+import bgzf
+import bamIndex
+import bamShard
+import reheader
+
+
+"""
+#------------------------------------------------------------------------------
+# Generated BAMs
+#------------------------------------------------------------------------------
+"""
+REFS = [('chr1', 2000000), ('chr2', 500000), ('chr3', 1000000)]
+
+
+def bamRecord(name, refID, pos, flag=0, seqLen=100):
+    rname = name.encode('utf-8') + b'\x00'
+    mapped = not (flag & 0x4)
+    cigar = struct.pack('<I', seqLen << 4) if mapped else b''
+    b = bamIndex.reg2bin(pos, pos + seqLen) if refID >= 0 else 4680
+    seq = bytes([random.choice([0x11, 0x22, 0x44, 0x88]) for i in range((seqLen + 1) // 2)])
+    qual = bytes([30] * seqLen)
+    body = struct.pack('<iiBBHHHiiii', refID, pos, len(rname), 60, b, len(cigar) // 4, flag, seqLen, -1, -1, 0) + rname + cigar + seq + qual
+    return struct.pack('<i', len(body)) + body
+
+
+def writeBam(path, order, records):
+    text = '@HD\tVN:1.6\tSO:{}\n'.format(order) + ''.join(['@SQ\tSN:{}\tLN:{}\n'.format(name, length) for name, length in REFS])
+    binRefs = struct.pack('<i', len(REFS))
+    for name, length in REFS:
+        binRefs += struct.pack('<i', len(name) + 1) + name.encode('utf-8') + b'\x00' + struct.pack('<i', length)
+
+    writer = bgzf.BgzfWriter(open(path, 'wb'))
+    writer.write(reheader.headerBytes(text.encode('utf-8'), binRefs))
+    writer.flush()
+    for rec in records:
+        writer.write(rec)
+    writer.close()
+
+
+def makeCoordBam(path, nRec=20000, nUnmapped=50, nNoCoor=30, seed=1):
+    random.seed(seed)
+    reads = [(random.randrange(len(REFS)), 0) for i in range(nRec)] + [(random.randrange(len(REFS)), 0x4) for i in range(nUnmapped)]
+    reads = sorted([(refID, random.randrange(REFS[refID][1] - 100), flag) for refID, flag in reads])
+    records = [bamRecord('r{:06d}'.format(i), refID, pos, flag) for i, (refID, pos, flag) in enumerate(reads)]
+    records += [bamRecord('u{:06d}'.format(i), -1, -1, 0x4) for i in range(nNoCoor)]
+    writeBam(path, 'coordinate', records)
+
+
+def makeNameBam(path, nPair=5000, seed=1):
+    random.seed(seed)
+    records = []
+    for i in range(nPair):
+        refID = random.randrange(len(REFS))
+        pos = random.randrange(REFS[refID][1] - 1000)
+        records.append(bamRecord('p{:06d}'.format(i), refID, pos, 0x1 | 0x40))
+        records.append(bamRecord('p{:06d}'.format(i), refID, pos + random.randrange(500), 0x1 | 0x80 | 0x10))
+    writeBam(path, 'queryname', records)
+
+
+def readBam(path):
+    reader = bgzf.BgzfReader(open(path, 'rb'), threads=1)
+    try:
+        header, text, refs = bamShard.readHeader(reader)
+        return text, list(bamShard.readRecords(reader))
+    finally:
+        reader.close()
+
+
+def readName(rec):
+    return rec[36:36 + rec[12] - 1]
+
+
+"""
+#------------------------------------------------------------------------------
+# Tests
+#------------------------------------------------------------------------------
+"""
+@pytest.mark.parametrize('n', [1, 4, 7])
+def test_coord_scatter_gather(tmp_path, n):
+    inPath = str(tmp_path / 'in.bam')
+    makeCoordBam(inPath)
+    text, records = readBam(inPath)
+
+    paths, counts = bamShard.scatter(inPath, str(tmp_path / 'shards'), n=n, mode='coord')
+    assert len(paths) == n and sum(counts) == len(records)
+
+    #-- shards are disjoint ranges in shard order; reads without coordinates are in the last one
+    shards = [readBam(path)[1] for path in paths]
+    assert [len(recs) for recs in shards] == counts
+    assert [rec for recs in shards for rec in recs] == records
+    assert all([struct.unpack_from('<i', rec, 4)[0] == -1 for rec in records[-30:]]) and shards[-1][-30:] == records[-30:]
+
+    outPath = str(tmp_path / 'out.bam')
+    indexPath = str(tmp_path / 'out.bam.bai')
+    assert bamShard.gather(paths, outPath, indexPath=indexPath, mode='coord') == len(records)
+    outText, outRecords = readBam(outPath)
+    assert outText == text and outRecords == records
+
+    refPath = str(tmp_path / 'ref.bai')
+    bamIndex.buildIndex(outPath, refPath)
+    with open(indexPath, 'rb') as f, open(refPath, 'rb') as g:
+        assert f.read() == g.read()
+
+
+@pytest.mark.parametrize('n', [1, 3, 8])
+def test_name_scatter_gather(tmp_path, n):
+    inPath = str(tmp_path / 'in.bam')
+    makeNameBam(inPath)
+    text, records = readBam(inPath)
+
+    paths, counts = bamShard.scatter(inPath, str(tmp_path / 'shards'), n=n, mode='name')
+    assert sum(counts) == len(records)
+
+    #-- both mates of a pair in one shard, in input order
+    shards = [readBam(path)[1] for path in paths]
+    names = [set([readName(rec) for rec in recs]) for recs in shards]
+    assert sum([len(s) for s in names]) == len(set([readName(rec) for rec in records]))
+    for recs, shardNames in zip(shards, names):
+        assert recs == [rec for rec in records if readName(rec) in shardNames]
+
+    outPath = str(tmp_path / 'out.bam')
+    assert bamShard.gather(paths, outPath, mode='name') == len(records)
+    outText, outRecords = readBam(outPath)
+    assert outText == text and outRecords == records
+
+
+def test_name_gather_of_coordinate_shards(tmp_path):
+    inPath = str(tmp_path / 'in.bam')
+    makeCoordBam(inPath, nRec=5000)
+    text, records = readBam(inPath)
+
+    paths, counts = bamShard.scatter(inPath, str(tmp_path / 'shards'), n=4, mode='name')
+    outPath = str(tmp_path / 'out.bam')
+    indexPath = str(tmp_path / 'out.bam.bai')
+    assert bamShard.gather(paths, outPath, indexPath=indexPath, mode='name') == len(records)
+
+    #-- merged in coordinate order, same records
+    outRecords = readBam(outPath)[1]
+    assert sorted(outRecords) == sorted(records)
+    keys = [bamShard.coordKey(rec) for rec in outRecords]
+    assert keys == sorted(keys)
+
+    refPath = str(tmp_path / 'ref.bai')
+    bamIndex.buildIndex(outPath, refPath)
+    with open(indexPath, 'rb') as f, open(refPath, 'rb') as g:
+        assert f.read() == g.read()
@@ -0,0 +1,48 @@
+"""
+# Purpose     : dsub.groupUnmapped groups uBAMs into samples without losing any of them
+# Descriptions:
+#  - stem and regex keys give one group per sample with all of its uBAMs
+#  - none gives one group per uBAM named by its file name; equal file names are rejected
+#  >> python -m pytest -q tests
+#
+# Start date  : Oct 17, 2026
+# Last update : Oct 17, 2026
+"""
+
+__author__ 		= "Jong Cheol Jeong"
+__copyright__ 	= "Copyright 2018, UK Cancer Research Informatics"
+__version__ 	= "1.0.0"
+__maintainer__ 	= "Jong Cheol Jeong"
+__email__ 		= "jjeong@kcr.uky.edu"
+
+
+import sys
+import os
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'codes'))
+import dsub
+
+
+UBAMS = ['gs://b1/S1.L001.unmapped.bam', 'gs://b1/S1.L002.unmapped.bam', 'gs://b1/S2.L001.unmapped.bam']
+
+
+def test_stem():
+    groups = dsub.groupUnmapped(UBAMS, key='stem')
+    assert list(groups.items()) == [('S1', UBAMS[:2]), ('S2', UBAMS[2:])]
+
+
+def test_regex():
+    inFiles = ['gs://b1/S1_L001.bam', 'gs://b1/S1_L002.bam', 'gs://b1/S2_L001.bam']
+    groups = dsub.groupUnmapped(inFiles, key='regex', pattern=r'^(.+?)_L\d+')
+    assert list(groups.items()) == [('S1', inFiles[:2]), ('S2', inFiles[2:])]
+
+
+def test_none_keeps_every_ubam():
+    groups = dsub.groupUnmapped(UBAMS, key='none')
+    assert list(groups.items()) == [('S1.L001.unmapped', UBAMS[:1]), ('S1.L002.unmapped', UBAMS[1:2]), ('S2.L001.unmapped', UBAMS[2:])]
+
+
+def test_none_rejects_equal_file_names():
+    with pytest.raises(AssertionError):
+        dsub.groupUnmapped(['gs://b1/S1.unmapped.bam', 'gs://b2/S1.unmapped.bam'], key='none')
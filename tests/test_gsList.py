@@ -0,0 +1,211 @@
+"""
+# Purpose     : gsList.py keeps its cache up to date and lists again only what changed
+# Descriptions:
+#  - Local directories stand in for a bucket (LocalBackend) and for the bucket behind a fake gsutil
+#    (GSBackend); the fake answers 'ls -l' and 'ls -L' from the directory and logs its calls
+#  - Objects added, rewritten or removed in a prefix right after a listing are found on the next
+#    refresh; unchanged prefixes are not listed again and checksums ('ls -L') are fetched only for
+#    changed objects
+#  >> python -m pytest -q tests
+#
+# Start date  : Oct 17, 2026
+# Last update : Oct 17, 2026
+"""
+
+__author__ 		= "Jong Cheol Jeong"
+__copyright__ 	= "Copyright 2018, UK Cancer Research Informatics"
+__version__ 	= "1.0.0"
+__maintainer__ 	= "Jong Cheol Jeong"
+__email__ 		= "jjeong@kcr.uky.edu"
+
+
+import shutil
+import sys
+import os
+import pytest
+
+CODES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'codes')
+sys.path.insert(0, CODES)
+import gsList
+
+
+"""
+#------------------------------------------------------------------------------
+# Fake gsutil - gs://r is the directory in $FAKE_BUCKET, calls are appended to $FAKE_LOG
+#------------------------------------------------------------------------------
+"""
+FAKE_GSUTIL = r'''#!{python}
+import glob, time, sys, os
+sys.path.insert(0, {codes!r})
+import gsList
+B = os.environ['FAKE_BUCKET']
+args = sys.argv[1:]
+with open(os.environ['FAKE_LOG'], 'a') as f:
+    f.write(' '.join(args) + '\n')
+
+def local(url):
+    return B + url[len('gs://r'):]
+
+def url(path):
+    return 'gs://r' + path[len(B):]
+
+def expand(pattern):
+    if pattern.endswith('**'):
+        return [p for p in sorted(glob.glob(local(pattern[:-2]) + '**', recursive=True)) if os.path.isfile(p)]
+    if pattern.endswith('/*'):
+        return sorted(glob.glob(local(pattern)))
+    if pattern.endswith('/'):
+        return sorted([os.path.join(local(pattern), n) for n in os.listdir(local(pattern))])
+    if not os.path.exists(local(pattern)):
+        sys.stderr.write('CommandException: One or more URLs matched no objects.\n')
+        sys.exit(1)
+    return [local(pattern)]
+
+if args[:2] == ['ls', '-l']:
+    for p in expand(args[2]):
+        if os.path.isdir(p):
+            print('                                 {{}}/'.format(url(p)))
+        else:
+            st = os.stat(p)
+            print('{{:>10}}  {{}}  {{}}'.format(st.st_size, time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(st.st_mtime)), url(p)))
+    print('TOTAL: n objects, m bytes')
+elif args[:2] == ['ls', '-L']:
+    for pattern in args[2:]:
+        for p in expand(pattern):
+            if os.path.isdir(p):
+                print('{{}}/:'.format(url(p)))
+                continue
+            st = os.stat(p)
+            print('{{}}:\n    Content-Length:    {{}}\n    Generation:    {{}}\n    Hash (md5):    {{}}'.format(
+                  url(p), st.st_size, st.st_mtime_ns, gsList.fileChecksum(p).split(':', 1)[1]))
+'''
+
+
+def write(path, data):
+    dirPath = os.path.dirname(path)
+    if not os.path.isdir(dirPath):
+        os.makedirs(dirPath)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def makeTree(root):
+    for sample in ('S1', 'S2', 'S3'):
+        write(os.path.join(root, sample, 'x.bam'), b'a' * 10)
+        write(os.path.join(root, sample, 'sub', 'x.bam.bai'), b'b' * 5)
+    for i in range(3):
+        write(os.path.join(root, 'top{}.bam'.format(i)), b'c' * (i + 1))
+
+
+@pytest.fixture
+def fakeGs(tmp_path, monkeypatch):
+    bucket = str(tmp_path / 'bucket')
+    log = str(tmp_path / 'calls.log')
+    gsutil = str(tmp_path / 'gsutil')
+    with open(gsutil, 'w') as f:
+        f.write(FAKE_GSUTIL.format(python=sys.executable, codes=CODES))
+    os.chmod(gsutil, 0o755)
+    monkeypatch.setenv('FAKE_BUCKET', bucket)
+    monkeypatch.setenv('FAKE_LOG', log)
+
+    def calls():
+        if not os.path.exists(log):
+            return []
+        with open(log) as f:
+            lines = f.read().splitlines()
+        os.remove(log)
+        return lines
+
+    return bucket, gsutil, calls
+
+
+"""
+#------------------------------------------------------------------------------
+# Local directory backend
+#------------------------------------------------------------------------------
+"""
+def test_local_refresh_lists_only_changed_prefixes(tmp_path):
+    root = str(tmp_path / 'bucket')
+    makeTree(root)
+    listing = gsList.Listing(str(tmp_path / 'cache.db'))
+
+    assert len(listing.names(root)) == 9
+    assert listing.refresh(root) == 0
+
+    #-- changed within a second of the last listing
+    write(os.path.join(root, 'S2', 'sub', 'new.bam'), b'd')
+    write(os.path.join(root, 'S1', 'x.bam'), b'a' * 20)
+    shutil.rmtree(os.path.join(root, 'S3'))
+    write(os.path.join(root, 'top9.bam'), b'e')
+    assert listing.refresh(root) == 3
+
+    rows = dict([(row['name'][len(root) + 1:], row) for row in listing.select(root, refresh=False)])
+    assert sorted(rows) == ['S1/sub/x.bam.bai', 'S1/x.bam', 'S2/sub/new.bam', 'S2/sub/x.bam.bai', 'S2/x.bam',
+                            'top0.bam', 'top1.bam', 'top2.bam', 'top9.bam']
+    assert rows['S1/x.bam']['size'] == 20
+    assert listing.refresh(root) == 0
+    assert listing.names(root, suffix='.bai', pattern='S2/*') == [os.path.join(root, 'S2', 'sub', 'x.bam.bai')]
+
+
+def test_local_checksums_reused(tmp_path):
+    root = str(tmp_path / 'bucket')
+    makeTree(root)
+    listing = gsList.Listing(str(tmp_path / 'cache.db'), checksum=True)
+
+    rows = listing.select(root)
+    assert all([row['checksum'] == gsList.fileChecksum(row['name']) for row in rows])
+
+    write(os.path.join(root, 'S1', 'x.bam'), b'z' * 10)
+    rows = dict([(row['name'], row) for row in listing.select(root)])
+    assert rows[os.path.join(root, 'S1', 'x.bam')]['checksum'] == gsList.fileChecksum(os.path.join(root, 'S1', 'x.bam'))
+
+
+"""
+#------------------------------------------------------------------------------
+# Cloud storage backend with the fake gsutil
+#------------------------------------------------------------------------------
+"""
+def test_gs_refresh_fetches_checksums_of_changed_objects(tmp_path, fakeGs):
+    bucket, gsutil, calls = fakeGs
+    makeTree(bucket)
+    listing = gsList.Listing(str(tmp_path / 'cache.db'), gsutil=gsutil)
+
+    rows = listing.select('gs://r')
+    assert len(rows) == 9
+    assert all([row['checksum'] and row['checksum'].startswith('md5:') for row in rows])
+    assert sorted([call for call in calls() if call.startswith('ls -L')]) == ['ls -L gs://r/*', 'ls -L gs://r/S1/**', 'ls -L gs://r/S2/**',
+                                                                             'ls -L gs://r/S3/**']
+
+    #-- nothing changed: one 'ls -l' per prefix and for the first level, no 'ls -L'
+    assert listing.refresh('gs://r') == 0
+    assert sorted(calls()) == ['ls -l gs://r/', 'ls -l gs://r/S1/**', 'ls -l gs://r/S2/**', 'ls -l gs://r/S3/**']
+
+    #-- added and rewritten right after the listing
+    write(os.path.join(bucket, 'S2', 'sub', 'new.bam'), b'd')
+    write(os.path.join(bucket, 'S1', 'x.bam'), b'a' * 20)
+    os.remove(os.path.join(bucket, 'S3', 'sub', 'x.bam.bai'))
+    write(os.path.join(bucket, 'top9.bam'), b'e')
+    assert listing.refresh('gs://r') == 4
+    assert sorted([call for call in calls() if call.startswith('ls -L')]) == ['ls -L gs://r/S1/x.bam', 'ls -L gs://r/S2/sub/new.bam', 'ls -L gs://r/top9.bam']
+
+    rows = dict([(row['name'], row) for row in listing.select('gs://r', refresh=False)])
+    assert len(rows) == 10 and 'gs://r/S3/sub/x.bam.bai' not in rows
+    assert rows['gs://r/S1/x.bam']['size'] == 20
+    assert rows['gs://r/S1/x.bam']['checksum'] == gsList.fileChecksum(os.path.join(bucket, 'S1', 'x.bam'))
+
+
+def test_gs_flat_bucket_listed_with_one_wildcard(tmp_path, fakeGs, monkeypatch):
+    bucket, gsutil, calls = fakeGs
+    monkeypatch.setattr(gsList, 'CHUNK', 20)
+    for i in range(50):
+        write(os.path.join(bucket, 's{:03d}.bam'.format(i)), b'x' * (i + 1))
+    write(os.path.join(bucket, 'dir', 'y.bam'), b'y')
+    listing = gsList.Listing(str(tmp_path / 'cache.db'), gsutil=gsutil)
+
+    rows = listing.select('gs://r')
+    assert len(rows) == 51
+    assert sorted([call for call in calls() if call.startswith('ls -L')]) == ['ls -L gs://r/*', 'ls -L gs://r/dir/**']
+
+    write(os.path.join(bucket, 's100.bam'), b'n')
+    assert len(listing.names('gs://r', suffix='bam')) == 52
+    assert [call for call in calls() if call.startswith('ls -L')] == ['ls -L gs://r/s100.bam']
@@ -0,0 +1,157 @@
+"""
+# Purpose     : pollStatus.Poller moves ledger rows through the states reported by dstat and gcloud
+# Descriptions:
+#  - A fake dstat answers from a JSON file of records per job ID (tasks included) and a fake gcloud
+#    from a JSON file of operations; both log their calls
+#  - Sweeps are checked for their transitions, the ledger states, batching of job IDs per dstat
+#    call and retries of a failed query
+#  >> python -m pytest -q tests
+#
+# Start date  : Oct 17, 2026
+# Last update : Oct 17, 2026
+"""
+
+__author__ 		= "Jong Cheol Jeong"
+__copyright__ 	= "Copyright 2018, UK Cancer Research Informatics"
+__version__ 	= "1.0.0"
+__maintainer__ 	= "Jong Cheol Jeong"
+__email__ 		= "jjeong@kcr.uky.edu"
+
+
+import json
+import sys
+import os
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'codes'))
+import ledger
+import pollStatus
+
+
+"""
+#------------------------------------------------------------------------------
+# Fake dstat and gcloud
+# - $FAKE_STATES: {"jobs": {jobID: [dstat records]}, "operations": {opID: operation}, "fail": n}
+#   the first 'fail' calls exit with 1
+#------------------------------------------------------------------------------
+"""
+FAKE = r'''#!{python}
+import json, sys, os
+args = sys.argv[1:]
+with open(os.environ['FAKE_LOG'], 'a') as f:
+    f.write(' '.join(args) + '\n')
+with open(os.environ['FAKE_STATES']) as f:
+    states = json.load(f)
+if states.get('fail', 0) > 0:
+    states['fail'] -= 1
+    with open(os.environ['FAKE_STATES'], 'w') as f:
+        json.dump(states, f)
+    sys.stderr.write('UNAVAILABLE\n')
+    sys.exit(1)
+if args[0] == '--project':
+    jobIDs = args[args.index('--jobs') + 1:args.index('--status')]
+    print(json.dumps([rec for jobID in jobIDs for rec in states['jobs'].get(jobID, [])]))
+else:
+    print(json.dumps(states['operations'][args[4]]))
+'''
+
+
+@pytest.fixture
+def fake(tmp_path, monkeypatch):
+    path = str(tmp_path / 'fake')
+    with open(path, 'w') as f:
+        f.write(FAKE.format(python=sys.executable))
+    os.chmod(path, 0o755)
+    log = str(tmp_path / 'calls.log')
+    statePath = str(tmp_path / 'states.json')
+    monkeypatch.setenv('FAKE_LOG', log)
+    monkeypatch.setenv('FAKE_STATES', statePath)
+
+    def setStates(jobs, operations=None, fail=0):
+        with open(statePath, 'w') as f:
+            json.dump({'jobs': jobs, 'operations': operations or {}, 'fail': fail}, f)
+
+    def calls():
+        if not os.path.exists(log):
+            return []
+        with open(log) as f:
+            lines = f.read().splitlines()
+        os.remove(log)
+        return lines
+
+    return path, setStates, calls
+
+
+def dstatRecord(jobID, status, taskID=None, message=None):
+    return {'job-id': jobID, 'task-id': taskID, 'status': status, 'status-message': message}
+
+
+def makeLedger(path):
+    db = ledger.Ledger(path)
+    params = {'prjName': 'my-project'}
+    db.record(sample='S1', stage='CleanSam', jobID='job-1', runner='dsub', params=params)
+    db.record(sample='S2', stage='CleanSam', jobID='job-2', runner='dsub', params=params)
+    db.record(sample='S3', stage='CleanSam', jobID='job-3', taskID='1', runner='dsub', params=params)
+    db.record(sample='S4', stage='CleanSam', jobID='job-3', taskID='2', runner='dsub', params=params)
+    db.record(sample='S5', stage='GATK', jobID='op-1', runner='genomics')
+    return db
+
+
+"""
+#------------------------------------------------------------------------------
+# Tests
+#------------------------------------------------------------------------------
+"""
+def test_sweep_transitions(tmp_path, fake):
+    exe, setStates, calls = fake
+    db = makeLedger(str(tmp_path / 'ledger.db'))
+    poller = pollStatus.Poller(db, batchSize=2, dstat=exe, gcloud=exe, retries=0)
+
+    setStates({'job-1': [dstatRecord('job-1', 'RUNNING')],
+               'job-2': [dstatRecord('job-2', 'RUNNING')],
+               'job-3': [dstatRecord('job-3', 'SUCCESS', 1), dstatRecord('job-3', 'RUNNING', 2)]},
+              {'op-1': {'done': False}})
+    transitions = poller.sweep()
+    assert sorted([(row['sample'], old, new) for row, old, new, message in transitions]) == [
+        ('S1', 'SUBMITTED', 'RUNNING'), ('S2', 'SUBMITTED', 'RUNNING'), ('S3', 'SUBMITTED', 'SUCCESS'), ('S4', 'SUBMITTED', 'RUNNING'),
+        ('S5', 'SUBMITTED', 'RUNNING')]
+
+    #-- unique job IDs of one project in batches of 2, one describe per operation
+    log = calls()
+    assert sorted([call.split(' --jobs ')[1].split(' --status')[0] for call in log if call.startswith('--project my-project')]) == ['job-1 job-2', 'job-3']
+    assert [call for call in log if not call.startswith('--project')] == ['alpha genomics operations describe op-1 --format=json']
+    assert poller.errors == []
+
+    #-- unchanged states are not transitions
+    assert poller.sweep() == []
+    calls()
+
+    setStates({'job-1': [dstatRecord('job-1', 'SUCCESS')],
+               'job-2': [dstatRecord('job-2', 'FAILURE', message='exit status 1')],
+               'job-3': [dstatRecord('job-3', 'SUCCESS', 1), dstatRecord('job-3', 'CANCELED', 2)]},
+              {'op-1': {'done': True, 'error': {'message': 'preempted'}}})
+    transitions = poller.sweep()
+    assert sorted([(row['sample'], old, new, message) for row, old, new, message in transitions]) == [
+        ('S1', 'RUNNING', 'SUCCESS', None), ('S2', 'RUNNING', 'FAILURE', 'exit status 1'), ('S4', 'RUNNING', 'CANCELED', None),
+        ('S5', 'RUNNING', 'FAILURE', 'preempted')]
+
+    #-- S3 is finished, so only job-1, job-2 and job-3 (for S4) were queried
+    assert sorted([call.split(' --jobs ')[1].split(' --status')[0] for call in calls() if call.startswith('--project')]) == ['job-1 job-2', 'job-3']
+    assert db.get('S2', 'CleanSam')['message'] == 'exit status 1'
+    assert poller.table[('S3', 'CleanSam')] == 'SUCCESS'
+    assert db.outstanding() == [] and poller.sweep() == []
+
+
+def test_failed_query_retried(tmp_path, fake):
+    exe, setStates, calls = fake
+    db = ledger.Ledger(str(tmp_path / 'ledger.db'))
+    db.record(sample='S1', stage='CleanSam', jobID='job-1', runner='dsub')
+    setStates({'job-1': [dstatRecord('job-1', 'SUCCESS')]}, fail=2)
+
+    poller = pollStatus.Poller(db, project='my-project', dstat=exe, retries=1, backoff=0.01)
+    assert poller.sweep() == []
+    assert len(poller.errors) == 1 and 'UNAVAILABLE' in poller.errors[0]
+
+    poller = pollStatus.Poller(db, project='my-project', dstat=exe, retries=1, backoff=0.01)
+    assert [(row['sample'], new) for row, old, new, message in poller.sweep()] == [('S1', 'SUCCESS')]
+    assert len(calls()) == 3
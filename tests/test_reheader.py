@@ -0,0 +1,134 @@
+"""
+# Purpose     : reheader.py gives the same BAM as 'samtools reheader -P'
+# Descriptions:
+#  - BAMs are generated with bgzf.py: header in its own block, records sharing the last header
+#    block, and a header larger than one block
+#  - The header is edited with reheader.tagRule and the same text is given to samtools
+#    (the samtools executable, or pysam.samtools when samtools is not installed)
+#  - samtools copies the EOF block of the input and writes its own EOF block when it closes the
+#    output; apart from that extra EOF block the outputs are identical byte-for-byte
+#  - Skipped when neither samtools nor pysam is available
+#  >> python -m pytest -q tests
+#
+# Start date  : Oct 17, 2026
+# Last update : Oct 17, 2026
+"""
+
+__author__ 		= "Jong Cheol Jeong"
+__copyright__ 	= "Copyright 2018, UK Cancer Research Informatics"
+__version__ 	= "1.0.0"
+__maintainer__ 	= "Jong Cheol Jeong"
+__email__ 		= "jjeong@kcr.uky.edu"
+
+
+import subprocess
+import shutil
+import random
+import struct
+import sys
+import os
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'codes'))
+import bgzf
+import reheader
+
+try:
+    import pysam
+except ImportError:
+    pysam = None
+
+SAMTOOLS = shutil.which('samtools')
+
+pytestmark = pytest.mark.skipif(SAMTOOLS is None and pysam is None, reason='samtools or pysam is needed')
+
+
+"""
+#------------------------------------------------------------------------------
+# Generated BAMs
+#------------------------------------------------------------------------------
+"""
+def bamRecord(name, refID, pos, seqLen=100):
+    rname = name.encode('utf-8') + b'\x00'
+    cigar = struct.pack('<I', seqLen << 4)
+    seq = bytes([random.choice([0x11, 0x22, 0x44, 0x88]) for i in range((seqLen + 1) // 2)])
+    qual = bytes([30] * seqLen)
+    body = struct.pack('<iiBBHHHiiii', refID, pos, len(rname), 60, 4680, 1, 0, seqLen, -1, -1, 0) + rname + cigar + seq + qual + b'RGZrg1\x00'
+    return struct.pack('<i', len(body)) + body
+
+
+def makeBam(path, nRec=3000, nRef=2, shareBlock=False, seed=1):
+    random.seed(seed)
+    refs = [('chr{}'.format(i + 1), 200000000) for i in range(nRef)]
+    text = '@HD\tVN:1.6\tSO:coordinate\n' + ''.join(['@SQ\tSN:{}\tLN:{}\n'.format(name, length) for name, length in refs])
+    text += '@RG\tID:rg1\tSM:S1\tLB:lib1\n'
+
+    binRefs = struct.pack('<i', len(refs))
+    for name, length in refs:
+        binRefs += struct.pack('<i', len(name) + 1) + name.encode('utf-8') + b'\x00' + struct.pack('<i', length)
+
+    writer = bgzf.BgzfWriter(open(path, 'wb'))
+    writer.write(reheader.headerBytes(text.encode('utf-8'), binRefs))
+    if not shareBlock:
+        writer.flush()
+    for refID, pos in sorted([(random.randrange(nRef), random.randrange(1000000)) for i in range(nRec)]):
+        writer.write(bamRecord('r{}'.format(pos), refID, pos))
+    writer.close()
+
+
+def samtoolsReheader(samPath, inPath, outPath):
+    if SAMTOOLS is not None:
+        with open(outPath, 'wb') as f:
+            subprocess.check_call([SAMTOOLS, 'reheader', '-P', samPath, inPath], stdout=f)
+    else:
+        pysam.samtools.reheader('-P', samPath, inPath, save_stdout=outPath)
+
+
+"""
+#------------------------------------------------------------------------------
+# Tests
+#------------------------------------------------------------------------------
+"""
+@pytest.mark.parametrize('nRef, shareBlock', [(2, False), (2, True), (3000, False), (3000, True)],
+                         ids=['own-block', 'shared-block', 'multi-block', 'multi-block-shared'])
+def test_same_as_samtools(tmp_path, nRef, shareBlock):
+    inPath = str(tmp_path / 'in.bam')
+    makeBam(inPath, nRef=nRef, shareBlock=shareBlock)
+
+    outPath = str(tmp_path / 'out.bam')
+    with open(inPath, 'rb') as fin, open(outPath, 'wb') as fout:
+        oldText, newText = reheader.reheader(fin, fout, edit=reheader.tagRule('RG', 'PL', 'illumina'))
+    assert '\tPL:illumina' in newText and newText != oldText
+
+    samPath = str(tmp_path / 'new.sam')
+    with open(samPath, 'w') as f:
+        f.write(newText)
+    refPath = str(tmp_path / 'ref.bam')
+    samtoolsReheader(samPath, inPath, refPath)
+
+    with open(outPath, 'rb') as f:
+        out = f.read()
+    with open(refPath, 'rb') as f:
+        ref = f.read()
+    assert ref.endswith(bgzf.EOF_BLOCK * 2)
+    assert out == ref[:-len(bgzf.EOF_BLOCK)]
+
+
+def test_records_copied_without_recompression(tmp_path):
+    inPath = str(tmp_path / 'in.bam')
+    makeBam(inPath)
+
+    outPath = str(tmp_path / 'out.bam')
+    with open(inPath, 'rb') as fin, open(outPath, 'wb') as fout:
+        reheader.reheader(fin, fout, edit=reheader.tagRule('RG', 'SM', 'S2', overwrite=True))
+
+    with open(inPath, 'rb') as f:
+        inBlocks = list(bgzf.rawBlocks(f))
+    with open(outPath, 'rb') as f:
+        outBlocks = list(bgzf.rawBlocks(f))
+    assert inBlocks[1:] == outBlocks[1:]
+
+    if pysam is not None:
+        with pysam.AlignmentFile(outPath, 'rb') as bam:
+            assert bam.header.to_dict()['RG'][0]['SM'] == 'S2'
+            assert sum([1 for read in bam]) == 3000
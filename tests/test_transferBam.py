@@ -0,0 +1,136 @@
+"""
+# Purpose     : transferBam.transferAll copies local BAMs with their header fixed and resumes from its manifest
+# Descriptions:
+#  - BAMs are generated with bgzf.py and copied local -> local (the local stand-ins of both stores)
+#  - Copies get PL:illumina in @RG and the same records as the source; the manifest records the MD5
+#    of each destination
+#  - '--resume' skips BAMs whose destination still has the recorded MD5 and copies again those that
+#    were changed or removed; a failed copy leaves neither a destination nor a '.part' file
+#  >> python -m pytest -q tests
+#
+# Start date  : Oct 17, 2026
+# Last update : Oct 17, 2026
+"""
+
+__author__ 		= "Jong Cheol Jeong"
+__copyright__ 	= "Copyright 2018, UK Cancer Research Informatics"
+__version__ 	= "1.0.0"
+__maintainer__ 	= "Jong Cheol Jeong"
+__email__ 		= "jjeong@kcr.uky.edu"
+
+
+import random
+import struct
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'codes'))
+import bgzf
+import gsList
+import reheader
+import transferBam
+
+
+"""
+#------------------------------------------------------------------------------
+# Generated BAMs
+#------------------------------------------------------------------------------
+"""
+def bamRecord(name, refID, pos, seqLen=100):
+    rname = name.encode('utf-8') + b'\x00'
+    cigar = struct.pack('<I', seqLen << 4)
+    seq = bytes([random.choice([0x11, 0x22, 0x44, 0x88]) for i in range((seqLen + 1) // 2)])
+    qual = bytes([30] * seqLen)
+    body = struct.pack('<iiBBHHHiiii', refID, pos, len(rname), 60, 4680, 1, 0, seqLen, -1, -1, 0) + rname + cigar + seq + qual
+    return struct.pack('<i', len(body)) + body
+
+
+def makeBam(path, sample, nRec=2000, seed=1):
+    random.seed(seed)
+    text = '@HD\tVN:1.6\tSO:coordinate\n@SQ\tSN:chr1\tLN:200000000\n@RG\tID:rg1\tSM:{}\tLB:lib1\n'.format(sample)
+    binRefs = struct.pack('<i', 1) + struct.pack('<i', 5) + b'chr1\x00' + struct.pack('<i', 200000000)
+
+    writer = bgzf.BgzfWriter(open(path, 'wb'))
+    writer.write(reheader.headerBytes(text.encode('utf-8'), binRefs))
+    writer.flush()
+    for pos in sorted([random.randrange(1000000) for i in range(nRec)]):
+        writer.write(bamRecord('r{}'.format(pos), 0, pos))
+    writer.close()
+
+
+#-- (header text, decompressed records)
+def readBam(path):
+    with open(path, 'rb') as f:
+        text, refs, rest = reheader.readHeader(f)
+    with open(path, 'rb') as f:
+        data = b''.join(bgzf.dataBlocks(f))
+    return text.decode('utf-8'), data[len(reheader.headerBytes(text, refs)):]
+
+
+def transferAll(sources, dstDir, manifest, resume):
+    return transferBam.transferAll(sources, dstDir, edit=reheader.tagRule('RG', 'PL', 'illumina'), nProc=2, manifest=manifest,
+                                   resume=resume, retries=0)
+
+
+"""
+#------------------------------------------------------------------------------
+# Tests
+#------------------------------------------------------------------------------
+"""
+def test_transfer_and_resume(tmp_path):
+    srcDir = str(tmp_path / 'objs')
+    dstDir = str(tmp_path / 'gs-bam')
+    manifest = str(tmp_path / 'transfer.tsv')
+    os.makedirs(srcDir)
+    sources = []
+    for i, sample in enumerate(['S1', 'S2', 'S3']):
+        sources.append(os.path.join(srcDir, '{}.bam'.format(sample)))
+        makeBam(sources[-1], sample, seed=i)
+
+    summary = transferAll(sources, dstDir, manifest, resume=True)
+    assert sorted(summary['copied']) == sources and summary['skipped'] == [] and summary['failed'] == []
+    assert sorted(os.listdir(dstDir)) == ['S1.head.bam', 'S2.head.bam', 'S3.head.bam']
+
+    rows = transferBam.readManifest(manifest)
+    for src in sources:
+        dst = transferBam.destName(src, dstDir)
+        text, records = readBam(dst)
+        srcText, srcRecords = readBam(src)
+        assert text == srcText.replace('LB:lib1\n', 'LB:lib1\tPL:illumina\n')
+        assert records == srcRecords
+        assert rows[src]['destination'] == dst and rows[src]['md5'] == gsList.fileChecksum(dst)
+
+    #-- nothing changed: every BAM is skipped and no destination is rewritten
+    mtimes = dict([(name, os.stat(os.path.join(dstDir, name)).st_mtime_ns) for name in os.listdir(dstDir)])
+    summary = transferAll(sources, dstDir, manifest, resume=True)
+    assert summary['copied'] == [] and sorted(summary['skipped']) == sources
+    assert dict([(name, os.stat(os.path.join(dstDir, name)).st_mtime_ns) for name in os.listdir(dstDir)]) == mtimes
+
+    #-- a truncated and a removed destination are copied again
+    with open(os.path.join(dstDir, 'S1.head.bam'), 'r+b') as f:
+        f.truncate(100)
+    os.remove(os.path.join(dstDir, 'S2.head.bam'))
+    summary = transferAll(sources, dstDir, manifest, resume=True)
+    assert sorted(summary['copied']) == sources[:2] and summary['skipped'] == sources[2:]
+    assert readBam(os.path.join(dstDir, 'S1.head.bam'))[1] == readBam(sources[0])[1]
+
+    #-- without --resume everything is copied
+    summary = transferAll(sources, dstDir, manifest, resume=False)
+    assert sorted(summary['copied']) == sources
+
+
+def test_failed_transfer_leaves_nothing(tmp_path):
+    srcDir = str(tmp_path / 'objs')
+    dstDir = str(tmp_path / 'gs-bam')
+    manifest = str(tmp_path / 'transfer.tsv')
+    os.makedirs(srcDir)
+    good = os.path.join(srcDir, 'S1.bam')
+    bad = os.path.join(srcDir, 'S2.bam')
+    makeBam(good, 'S1')
+    with open(bad, 'wb') as f:
+        f.write(b'not a BAM file' * 100)
+
+    summary = transferAll([good, bad], dstDir, manifest, resume=True)
+    assert summary['copied'] == [good] and [src for src, msg in summary['failed']] == [bad]
+    assert os.listdir(dstDir) == ['S1.head.bam']
+    assert list(transferBam.readManifest(manifest).keys()) == [good]
@@ -0,0 +1,120 @@
+"""
+# Purpose     : validateBam.py finds the same errors however the BAM is split into ranges
+# Descriptions:
+#  - A coordinate-sorted BAM is generated with bgzf.py: read pairs (some with a wrong mate strand
+#    flag or mate position), placed unmapped reads with a MAPQ and reads without a read group
+#  - validate() is run with several 'chunks' values, so mates and records are split across ranges;
+#    summary() and stagesFor() must give the known errors and stages every time
+#  >> python -m pytest -q tests
+#
+# Start date  : Oct 17, 2026
+# Last update : Oct 17, 2026
+"""
+
+__author__ 		= "Jong Cheol Jeong"
+__copyright__ 	= "Copyright 2018, UK Cancer Research Informatics"
+__version__ 	= "1.0.0"
+__maintainer__ 	= "Jong Cheol Jeong"
+__email__ 		= "jjeong@kcr.uky.edu"
+
+
+import random
+import struct
+import sys
+import os
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'codes'))
+import bgzf
+import reheader
+import validateBam
+from validateBam import PAIRED, UNMAP, REVERSE, MREVERSE
+
+
+"""
+#------------------------------------------------------------------------------
+# Generated BAM
+#------------------------------------------------------------------------------
+"""
+REF_LEN = 10000000
+N_PAIR = 8000
+N_NEG_STRAND = 7        # first mate does not flag its reverse mate as reverse
+N_MATE_START = 5        # first mate points one base past its mate
+N_MAPQ = 11             # placed unmapped reads with MAPQ 60
+N_NO_RG = 13            # unpaired mapped reads without RG
+
+
+def bamRecord(name, pos, flag=0, mapq=60, npos=-1, rg=True, seqLen=100):
+    rname = name.encode('utf-8') + b'\x00'
+    cigar = b'' if flag & UNMAP else struct.pack('<I', seqLen << 4)
+    seq = bytes([random.choice([0x11, 0x22, 0x44, 0x88]) for i in range((seqLen + 1) // 2)])
+    qual = bytes([30] * seqLen)
+    aux = b'RGZrg1\x00' if rg else b''
+    nref = 0 if npos >= 0 else -1
+    body = struct.pack('<iiBBHHHiiii', 0, pos, len(rname), mapq, 4680, len(cigar) // 4, flag, seqLen, nref, npos, 0) + rname + cigar + seq + qual + aux
+    return struct.pack('<i', len(body)) + body
+
+
+def makeBam(path, errors=True, seed=1):
+    random.seed(seed)
+    reads = []
+    bad = list(range(N_PAIR))
+    random.shuffle(bad)
+    negStrand = set(bad[:N_NEG_STRAND]) if errors else set()
+    mateStart = set(bad[N_NEG_STRAND:N_NEG_STRAND + N_MATE_START]) if errors else set()
+
+    for i in range(N_PAIR):
+        pos = random.randrange(REF_LEN - 2000)
+        mpos = pos + random.randrange(1, 1000)
+        name = 'p{:06d}'.format(i)
+        flag1 = PAIRED | 0x40 | (0 if i in negStrand else MREVERSE)
+        reads.append((pos, name, flag1, 60, mpos + (1 if i in mateStart else 0), True))
+        reads.append((mpos, name, PAIRED | 0x80 | REVERSE, 60, pos, True))
+
+    if errors:
+        reads += [(random.randrange(REF_LEN), 'u{:04d}'.format(i), UNMAP, 60, -1, True) for i in range(N_MAPQ)]
+        reads += [(random.randrange(REF_LEN), 'n{:04d}'.format(i), 0, 60, -1, False) for i in range(N_NO_RG)]
+
+    text = '@HD\tVN:1.6\tSO:coordinate\n@SQ\tSN:chr1\tLN:{}\n@RG\tID:rg1\tSM:S1\tLB:lib1\tPL:illumina\n'.format(REF_LEN)
+    binRefs = struct.pack('<i', 1) + struct.pack('<i', 5) + b'chr1\x00' + struct.pack('<i', REF_LEN)
+    writer = bgzf.BgzfWriter(open(path, 'wb'))
+    writer.write(reheader.headerBytes(text.encode('utf-8'), binRefs))
+    for pos, name, flag, mapq, npos, rg in sorted(reads):
+        writer.write(bamRecord(name, pos, flag, mapq, npos, rg))
+    writer.close()
+    return len(reads)
+
+
+EXPECTED = ("## HISTOGRAM\tjava.lang.String\n"
+            "Error Type\tCount\n"
+            "ERROR:INVALID_MAPPING_QUALITY\t{}\n"
+            "ERROR:MISMATCH_FLAG_MATE_NEG_STRAND\t{}\n"
+            "ERROR:MISMATCH_MATE_ALIGNMENT_START\t{}\n"
+            "WARNING:RECORD_MISSING_READ_GROUP\t{}\n").format(N_MAPQ, N_NEG_STRAND, N_MATE_START, N_NO_RG)
+
+
+"""
+#------------------------------------------------------------------------------
+# Tests
+#------------------------------------------------------------------------------
+"""
+@pytest.mark.parametrize('chunks', [1, 3, 8, 25])
+def test_known_errors(tmp_path, chunks):
+    path = str(tmp_path / 'S1.bam')
+    nRec = makeBam(path)
+
+    res = validateBam.validate(path, nProc=2, chunks=chunks)
+    assert res['records'] == nRec
+    assert validateBam.summary(res['errors']) == EXPECTED
+    assert validateBam.stagesFor(res['errors']) == ['CleanSam', 'FixMate']
+
+
+@pytest.mark.parametrize('chunks', [1, 6])
+def test_clean_bam(tmp_path, chunks):
+    path = str(tmp_path / 'S1.bam')
+    nRec = makeBam(path, errors=False)
+
+    res = validateBam.validate(path, nProc=2, chunks=chunks)
+    assert res['records'] == nRec
+    assert validateBam.summary(res['errors']) == "No errors found\n"
+    assert validateBam.stagesFor(res['errors']) == []
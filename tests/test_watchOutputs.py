@@ -0,0 +1,122 @@
+"""
+# Purpose     : watchOutputs.py marks a ledger row SUCCESS when all of its outputs arrive in a watched directory
+# Descriptions:
+#  - A local directory stands in for the bucket (InotifySource); outputs are written in '<name>.part'
+#    and renamed, as a download or an upload would
+#  - The '.part' files are ignored, a truncated BAM (no BGZF EOF block) is rejected, and the row waits
+#    for its BAI (extraOutputs) before it is marked SUCCESS
+#  - A gs:// output with the size of its notification is verified with one 28-byte ranged read
+#    (fake gsutil), without 'gsutil du'
+#  - Skipped where inotify is not available
+#  >> python -m pytest -q tests
+#
+# Start date  : Oct 17, 2026
+# Last update : Oct 17, 2026
+"""
+
+__author__ 		= "Jong Cheol Jeong"
+__copyright__ 	= "Copyright 2018, UK Cancer Research Informatics"
+__version__ 	= "1.0.0"
+__maintainer__ 	= "Jong Cheol Jeong"
+__email__ 		= "jjeong@kcr.uky.edu"
+
+
+import time
+import sys
+import os
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'codes'))
+import bgzf
+import ledger
+import watchOutputs
+
+
+def inotifySource(root):
+    try:
+        return watchOutputs.InotifySource(root)
+    except (watchOutputs.WatchError, OSError, AttributeError) as err:
+        pytest.skip('inotify is not available ({})'.format(err))
+
+
+#-- write '<path>.part' and rename it to 'path'
+def writeRenamed(path, data):
+    with open(path + '.part', 'wb') as f:
+        f.write(data)
+    os.rename(path + '.part', path)
+
+
+#-- handle the events of the next poll(s) until one of 'path' arrives
+def handleUntil(watcher, path, timeout=5.0):
+    results = []
+    end = time.time() + timeout
+    while time.time() < end:
+        results.extend(watcher.handle(watcher.source.poll(0.2)))
+        if any([event['name'] == path for event, ok, message in results]):
+            return results
+    raise AssertionError("no event of {}".format(path))
+
+
+def test_part_rename_marks_success(tmp_path):
+    root = str(tmp_path / 'bucket')
+    os.makedirs(os.path.join(root, 'S1'))
+    bam = os.path.join(root, 'S1', 'S1.sort.bam')
+    bai = bam + '.bai'
+
+    db = ledger.Ledger(str(tmp_path / 'ledger.db'))
+    db.record(sample='S1', stage='SortSam', outFile=bam, params={'extraOutputs': {'bai': bai}}, state=ledger.RUNNING)
+
+    source = inotifySource(root)
+    watcher = watchOutputs.Watcher(source, [watchOutputs.ledgerCallback(db)])
+    try:
+        block = bgzf.deflate(b'BAM\x01' + b'\x00' * 1000)
+
+        #-- truncated: rejected, the row is not touched
+        writeRenamed(bam, block)
+        results = handleUntil(watcher, bam)
+        assert [(event['name'], ok) for event, ok, message in results] == [(bam, False)]
+        assert watcher.counts['ignored'] >= 1
+        assert db.get('S1', 'SortSam')['state'] == ledger.RUNNING
+
+        #-- complete BAM: verified, the row waits for its BAI
+        writeRenamed(bam, block + bgzf.EOF_BLOCK)
+        results = handleUntil(watcher, bam)
+        assert [(event['name'], ok) for event, ok, message in results] == [(bam, True)]
+        assert db.get('S1', 'SortSam')['state'] == ledger.RUNNING
+
+        writeRenamed(bai, b'BAI\x01' + b'\x00' * 100)
+        results = handleUntil(watcher, bai)
+        assert [(event['name'], ok) for event, ok, message in results] == [(bai, True)]
+        row = db.get('S1', 'SortSam')
+        assert row['state'] == ledger.SUCCESS and row['message'] == 'outputs arrived'
+        assert watcher.counts['verified'] == 2 and watcher.counts['rejected'] == 1
+    finally:
+        source.close()
+
+
+FAKE_GSUTIL = r'''#!{python}
+import sys, os
+sys.path.insert(0, {codes!r})
+import bgzf
+with open(os.environ['FAKE_LOG'], 'a') as f:
+    f.write(' '.join(sys.argv[1:]) + '\n')
+if sys.argv[1:4] == ['-q', 'cat', '-r']:
+    sys.stdout.buffer.write(bgzf.EOF_BLOCK)
+else:
+    sys.exit(1)
+'''
+
+
+def test_notification_size_trusted(tmp_path, monkeypatch):
+    gsutil = str(tmp_path / 'gsutil')
+    log = str(tmp_path / 'calls.log')
+    codes = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'codes')
+    with open(gsutil, 'w') as f:
+        f.write(FAKE_GSUTIL.format(python=sys.executable, codes=codes))
+    os.chmod(gsutil, 0o755)
+    monkeypatch.setenv('FAKE_LOG', log)
+
+    assert watchOutputs.verifyOutput('gs://b2/S1.sort.bam', size=123456, gsutil=gsutil) == (True, None)
+    assert watchOutputs.verifyOutput('gs://b2/S2.sort.bam', size=0, gsutil=gsutil) == (False, 'empty file')
+    with open(log) as f:
+        assert f.read().splitlines() == ['-q cat -r -28 gs://b2/S1.sort.bam']